@@ -4,33 +4,21 @@ Main entry point for the Python backend API
 Merged from Chatbot-E-commerce-Assistance-bot
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
+import json
+import logging
 import os
+from functools import wraps
 from dotenv import load_dotenv
 
-# Import modules from different services
-from chatbot.chatbot_engine import ChatbotEngine
-from chatbot.enhanced_chatbot_engine import EnhancedChatbotEngine
-from nlp.egyptian_nlp import EgyptianNLP
-from nlp.egyptian_intent_handler import EgyptianIntentHandler
-from integrations.facebook_leads_integration import FacebookLeadsIntegration
-from integrations.whatsapp_handler import WhatsAppHandler
-from integrations.social_media_integration import SocialMediaIntegration
-from services.recommendation_engine import RecommendationEngine
-from services.order_tracker import OrderTracker
-from services.order_collection_system import OrderCollectionSystem
-from services.speech_to_text import SpeechToText
-from services.faq_system import FAQSystem
-from database.database_handler import DatabaseHandler
-from database.user_management import UserManagement
-from database.sync_products import sync_products
+from api.services import process_chat, services, start_background_workers
+from database.user_management import DuplicateUserError, HasherBusy
+from integrations.signatures import verify_meta_signature
 from utils.config import Config
-from utils.logging_setup import setup_logging
-from utils.notification import NotificationService
-from utils.analytics import Analytics
-from utils.monitoring import Monitoring
+from utils.logging_setup import log_context, new_request_id, setup_logging
+from utils.rate_limit import retry_after_header
 
 load_dotenv()
 
@@ -45,25 +33,87 @@ app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'default-secret-key')
 jwt = JWTManager(app)
 
 # Setup logging
-logger = setup_logging()
-
-# Initialize services
-chatbot_engine = EnhancedChatbotEngine()
-egyptian_nlp = EgyptianNLP()
-intent_handler = EgyptianIntentHandler()
-recommendation_engine = RecommendationEngine()
-order_tracker = OrderTracker()
-faq_system = FAQSystem()
-db_handler = DatabaseHandler()
-user_management = UserManagement()
-notification_service = NotificationService()
-analytics = Analytics()
-monitoring = Monitoring()
-
-# Social media integrations
-facebook_integration = FacebookLeadsIntegration()
-whatsapp_handler = WhatsAppHandler()
-social_media = SocialMediaIntegration()
+setup_logging()
+logger = logging.getLogger(__name__)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_token = services.get('monitoring').request_started(request.endpoint or 'unknown')
+    # Records logged while handling the request carry its ID
+    g.request_id = request.headers.get('X-Request-ID') or new_request_id()
+    g.log_context = log_context(request_id=g.request_id, endpoint=request.endpoint)
+    g.log_context.__enter__()
+
+@app.before_request
+def enforce_rate_limits():
+    limiter = services.get('rate_limiter')
+    if not limiter.applies(request.path):
+        return None
+    body = request.get_json(silent=True) if request.is_json else None
+    user_id = (
+        request.args.get('user_id')
+        or request.headers.get('X-User-ID')
+        or (body.get('user_id') if isinstance(body, dict) else None)
+    )
+    ip = limiter.client_ip(
+        request.remote_addr, request.headers.get('X-Forwarded-For'), request.headers.get('X-Real-IP')
+    )
+    allowed, retry_after, remaining, limit = limiter.check(user_id, ip)
+    g.rate_limit = (remaining, limit)
+    if not allowed:
+        response = jsonify({'success': False, 'error': 'Too many requests', 'retry_after': round(retry_after, 3)})
+        response.status_code = 429
+        response.headers['Retry-After'] = retry_after_header(retry_after)
+        return response
+    return None
+
+@app.after_request
+def record_response_status(response):
+    g.status_code = response.status_code
+    response.headers['X-Request-ID'] = g.request_id
+    rate_limit = g.pop('rate_limit', None)
+    if rate_limit is not None:
+        response.headers['X-RateLimit-Remaining'] = str(rate_limit[0])
+        response.headers['X-RateLimit-Limit'] = str(rate_limit[1])
+    return response
+
+def coalesced(view):
+    """
+    Share one computation between identical concurrent requests (same
+    method, path, query and body), e.g. clients polling the same order.
+    Only for read-only JSON routes: the response is rebuilt per request.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.method, request.full_path, request.get_data())
+        
+        ran = []
+        
+        def compute():
+            ran.append(True)
+            response = app.make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, response.headers.get('Content-Type')
+        
+        body, status, content_type = services.get('single_flight').do(key, compute)
+        if not ran:
+            services.get('monitoring').inc('bww_coalesced_requests_total', endpoint=request.endpoint)
+        return Response(body, status=status, content_type=content_type)
+    return wrapper
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    # Runs after streamed responses finish; status 500 if no response was made
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        services.get('monitoring').request_finished(token, g.pop('status_code', 500))
+    context = g.pop('log_context', None)
+    if context is not None:
+        context.__exit__(None, None, None)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics, summed over all workers"""
+    return Response(services.get('monitoring').render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -86,37 +136,14 @@ def chat():
     """Process chat messages"""
     try:
         data = request.get_json()
-        message = data.get('message', '')
-        user_id = data.get('user_id', '')
-        language = data.get('language', 'ar')  # Arabic by default
-        
-        # Process Egyptian dialect
-        processed_message = egyptian_nlp.process(message)
-        intent = intent_handler.detect_intent(processed_message)
-        
-        # Get chatbot response
-        response = chatbot_engine.generate_response(
-            message=processed_message,
-            user_id=user_id,
-            intent=intent,
-            language=language
-        )
-        
-        # Log analytics
-        analytics.track_message(user_id, message, response)
-        
-        return jsonify({
-            'success': True,
-            'response': response,
-            'intent': intent,
-            'language': language
-        })
+        return jsonify(process_chat(data))
     except Exception as e:
-        logger.error(f"Error processing chat: {str(e)}")
-        monitoring.log_error('chat', str(e))
+        logger.error("Error processing chat: %s", e)
+        services.get('monitoring').log_error('chat', str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/products/recommend', methods=['POST'])
+@coalesced
 def recommend_products():
     """Get product recommendations"""
     try:
@@ -124,7 +151,7 @@ def recommend_products():
         user_id = data.get('user_id', '')
         preferences = data.get('preferences', {})
         
-        recommendations = recommendation_engine.get_recommendations(
+        recommendations = services.get('recommendation_engine').get_recommendations(
             user_id=user_id,
             preferences=preferences
         )
@@ -134,19 +161,67 @@ def recommend_products():
             'recommendations': recommendations
         })
     except Exception as e:
-        logger.error(f"Error getting recommendations: {str(e)}")
+        logger.error("Error getting recommendations: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/products/search', methods=['GET'])
+@coalesced
+def search_products():
+    """Search the catalog: ?q= in Arabic, dialect or English, &limit="""
+    try:
+        query = request.args.get('q', '')
+        if not query.strip():
+            return jsonify({'success': False, 'error': 'Query required'}), 400
+        limit = min(request.args.get('limit', 10, type=int), 50)
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'products': services.get('product_search').search(query, limit=limit)
+        })
+    except Exception as e:
+        logger.error("Error searching products: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/products/suggest', methods=['GET'])
+@coalesced
+def suggest_products():
+    """Autocomplete product names for a partially typed ?q="""
+    try:
+        query = request.args.get('q', '')
+        limit = min(request.args.get('limit', 8, type=int), 20)
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'suggestions': services.get('product_search').suggest(query, limit=limit) if query.strip() else []
+        })
+    except Exception as e:
+        logger.error("Error suggesting products: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/orders/track', methods=['GET'])
+@coalesced
 def track_order():
-    """Track order status"""
+    """Track order status, or list a user's orders with ?user_id="""
     try:
         order_id = request.args.get('order_id', '')
+        user_id = request.args.get('user_id', '')
+        tracker = services.get('order_tracker')
+        
+        if user_id and not order_id:
+            return jsonify({
+                'success': True,
+                'user_id': user_id,
+                'orders': tracker.orders_for_user(user_id)
+            })
         
         if not order_id:
             return jsonify({'success': False, 'error': 'Order ID required'}), 400
         
-        status = order_tracker.track(order_id)
+        status = tracker.track(order_id)
+        if status is None:
+            return jsonify({'success': False, 'error': 'Order not found'}), 404
         
         return jsonify({
             'success': True,
@@ -154,17 +229,67 @@ def track_order():
             'status': status
         })
     except Exception as e:
-        logger.error(f"Error tracking order: {str(e)}")
+        logger.error("Error tracking order: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/orders/track/batch', methods=['POST'])
+@coalesced
+def track_orders_batch():
+    """Track up to ORDER_TRACKER_MAX_BATCH orders in one call"""
+    try:
+        data = request.get_json() or {}
+        order_ids = data.get('order_ids', [])
+        
+        if not isinstance(order_ids, list) or not order_ids:
+            return jsonify({'success': False, 'error': 'order_ids list required'}), 400
+        
+        try:
+            statuses = services.get('order_tracker').track_many(order_ids)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        return jsonify({
+            'success': True,
+            'orders': statuses
+        })
+    except Exception as e:
+        logger.error("Error tracking orders: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/orders/events', methods=['POST'])
+def order_events():
+    """Order events from the order service; keeps the tracker index current"""
+    # Signed like Meta webhooks (X-Hub-Signature-256); without a secret
+    # anyone could rewrite order statuses, so the endpoint stays closed
+    secret = os.getenv('ORDER_EVENTS_SECRET', '')
+    if not secret:
+        logger.warning("Rejected order events: ORDER_EVENTS_SECRET is not set")
+        return jsonify({'success': False, 'error': 'Order events are not configured'}), 503
+    if not verify_meta_signature(request, secret):
+        return jsonify({'success': False, 'error': 'Invalid signature'}), 401
+    try:
+        # One event, {"events": [...]}, or a bare list of events
+        data = request.get_json(silent=True)
+        events = data.get('events', [data]) if isinstance(data, dict) else data
+        if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+            return jsonify({'success': False, 'error': 'Expected an event object or a list of events'}), 400
+        applied = services.get('order_tracker').apply_events(events)
+        return jsonify({'success': True, 'applied': applied})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error("Error applying order events: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/faq', methods=['POST'])
+@coalesced
 def get_faq():
     """Get FAQ answers"""
     try:
         data = request.get_json()
         question = data.get('question', '')
         
-        answer = faq_system.get_answer(question)
+        answer = services.get('faq_system').get_answer(question)
         
         return jsonify({
             'success': True,
@@ -172,7 +297,7 @@ def get_faq():
             'answer': answer
         })
     except Exception as e:
-        logger.error(f"Error processing FAQ: {str(e)}")
+        logger.error("Error processing FAQ: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/speech-to-text', methods=['POST'])
@@ -184,9 +309,30 @@ def speech_to_text():
         
         audio_file = request.files['audio']
         language = request.form.get('language', 'ar-EG')
+        speech_service = services.get('speech_to_text')
         
-        speech_service = SpeechToText()
-        text = speech_service.transcribe(audio_file, language)
+        # stream=true returns one JSON line per transcribed segment as
+        # soon as it is ready, then a final line with the full text
+        if request.form.get('stream', 'false').lower() == 'true':
+            def partials():
+                texts = []
+                try:
+                    for part in speech_service.transcribe_stream(audio_file.stream, language):
+                        texts.append(part['text'])
+                        yield json.dumps(part, ensure_ascii=False) + '\n'
+                except Exception as e:
+                    logger.error("Error in speech-to-text stream: %s", e)
+                    yield json.dumps({'success': False, 'error': str(e)}) + '\n'
+                    return
+                yield json.dumps({
+                    'final': True,
+                    'text': ' '.join(t for t in texts if t),
+                    'language': language
+                }, ensure_ascii=False) + '\n'
+            
+            return Response(stream_with_context(partials()), mimetype='application/x-ndjson')
+        
+        text = speech_service.transcribe(audio_file.stream, language)
         
         return jsonify({
             'success': True,
@@ -194,7 +340,7 @@ def speech_to_text():
             'language': language
         })
     except Exception as e:
-        logger.error(f"Error in speech-to-text: {str(e)}")
+        logger.error("Error in speech-to-text: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/webhook/facebook', methods=['GET', 'POST'])
@@ -202,43 +348,88 @@ def facebook_webhook():
     """Facebook Messenger webhook"""
     if request.method == 'GET':
         # Verification
-        return facebook_integration.verify_webhook(request)
+        return services.get('facebook_integration').verify_webhook(request)
     else:
         # Process incoming message
-        return facebook_integration.process_message(request)
+        return services.get('facebook_integration').process_message(request)
 
 @app.route('/api/webhook/whatsapp', methods=['POST'])
 def whatsapp_webhook():
     """WhatsApp webhook"""
-    return whatsapp_handler.process_message(request)
+    return services.get('whatsapp_handler').process_message(request)
 
 @app.route('/api/products/sync', methods=['POST'])
 def sync_products_route():
-    """Sync products from external sources"""
+    """Start a background product sync; poll its status URL for progress"""
     try:
-        result = sync_products()
+        job_id = services.get('product_sync').start()
         return jsonify({
             'success': True,
-            'result': result
-        })
+            'job_id': job_id,
+            'status_url': f'/api/products/sync/{job_id}'
+        }), 202
     except Exception as e:
-        logger.error(f"Error syncing products: {str(e)}")
+        logger.error("Error syncing products: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/products/sync/<job_id>', methods=['GET'])
+def sync_products_status(job_id):
+    """Product sync job status and progress"""
+    job = services.get('product_sync').get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Sync job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
 @app.route('/api/users', methods=['POST'])
 def create_user():
     """Create new user"""
     try:
-        data = request.get_json()
-        user = user_management.create_user(data)
+        data = request.get_json(silent=True)
+        user = services.get('user_management').create_user(data)
         return jsonify({
             'success': True,
             'user': user
-        })
+        }), 201
+    except DuplicateUserError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except HasherBusy as e:
+        return _busy(e)
     except Exception as e:
-        logger.error(f"Error creating user: {str(e)}")
+        logger.error("Error creating user: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/users/login', methods=['POST'])
+def login_user():
+    """Exchange email and password for an access token"""
+    data = request.get_json(silent=True) or {}
+    try:
+        session = services.get('user_management').login(data.get('email'), data.get('password'))
+    except HasherBusy as e:
+        return _busy(e)
+    except Exception as e:
+        logger.error("Error logging in: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if session is None:
+        return jsonify({'success': False, 'error': 'Invalid email or password'}), 401
+    return jsonify({'success': True, **session})
+
+@app.route('/api/users/me', methods=['GET'])
+def current_user():
+    """Profile of the user behind the Bearer token"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    user = services.get('user_management').authenticate(token) if scheme.lower() == 'bearer' and token else None
+    if user is None:
+        return jsonify({'success': False, 'error': 'Invalid or expired token'}), 401
+    return jsonify({'success': True, 'user': user})
+
+def _busy(error):
+    """503 for a saturated password pool; clients retry after a second"""
+    response = jsonify({'success': False, 'error': str(error)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @app.route('/api/analytics/report', methods=['GET'])
 def get_analytics():
     """Get analytics report"""
@@ -246,14 +437,16 @@ def get_analytics():
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
-        report = analytics.get_report(start_date, end_date)
+        report = services.get('analytics').get_report(start_date, end_date)
         
         return jsonify({
             'success': True,
             'report': report
         })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Error getting analytics: {str(e)}")
+        logger.error("Error getting analytics: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.errorhandler(404)
@@ -267,4 +460,5 @@ def internal_error(error):
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     debug = os.getenv('FLASK_ENV', 'production') == 'development'
+    start_background_workers()
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,278 @@
+"""
+ASGI Application
+Async entry point for the chat and webhook routes
+
+Serves /api/chat, /api/webhook/facebook, /api/webhook/whatsapp and /metrics
+with the same request and response contracts as the Flask app. CPU-bound NLP runs in
+a bounded thread (or process) pool and blocking integration calls in a
+separate I/O pool, so a slow downstream call never stalls the event loop.
+With the process pool only the stateless NLP step leaves this process;
+sessions, order state, caches and analytics stay here.
+
+Run with: uvicorn api.asgi:app --workers 4
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from api.services import analyze_message, process_chat, services, start_background_workers
+from utils.logging_setup import log_context, new_request_id, setup_logging
+from utils.rate_limit import retry_after_header
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = int(os.getenv('ASGI_MAX_BODY_BYTES', 1024 * 1024))
+
+
+class Headers(dict):
+    """Case-insensitive header lookup, like werkzeug's Headers"""
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return super().get(name.lower(), default)
+
+
+class WebhookRequest:
+    """Minimal stand-in for the Flask request the integrations expect"""
+
+    def __init__(self, method: str, query_string: bytes, headers: List[Tuple[bytes, bytes]], body: bytes):
+        self.method = method
+        self.args = dict(parse_qsl(query_string.decode('latin-1')))
+        self.headers = Headers(
+            (name.decode('latin-1').lower(), value.decode('latin-1')) for name, value in headers
+        )
+        self.data = body
+
+    def get_data(self) -> bytes:
+        return self.data
+
+    def get_json(self, silent: bool = False) -> Any:
+        try:
+            return json.loads(self.data or b'null')
+        except ValueError:
+            if silent:
+                return None
+            raise
+
+
+class ASGIApp:
+    """Dependency-free ASGI application for the latency-sensitive routes"""
+
+    def __init__(self, cpu_executor: Optional[Executor] = None, io_executor: Optional[Executor] = None):
+        workers = int(os.getenv('ASGI_CPU_WORKERS', os.cpu_count() or 4))
+        self.cpu_executor = cpu_executor or _cpu_executor_from_env(workers)
+        self.io_executor = io_executor or ThreadPoolExecutor(
+            max_workers=int(os.getenv('ASGI_IO_WORKERS', 32)),
+            thread_name_prefix='asgi-io',
+        )
+        # Bound queued CPU work so a burst waits here instead of piling up
+        # inside the executor's unbounded queue
+        self._cpu_slots: Optional[asyncio.Semaphore] = None
+        self._cpu_limit = workers * 2
+
+        self.routes = {
+            ('POST', '/api/chat'): self.chat,
+            ('GET', '/api/webhook/facebook'): self.facebook_verify,
+            ('POST', '/api/webhook/facebook'): self.facebook_message,
+            ('POST', '/api/webhook/whatsapp'): self.whatsapp_message,
+            ('GET', '/metrics'): self.metrics,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        handler = self.routes.get((scope['method'], scope['path']))
+        if handler is None:
+            known_path = any(path == scope['path'] for _, path in self.routes)
+            if known_path and scope['method'] == 'OPTIONS':
+                # CORS preflight, matching flask_cors on /api/*
+                await _send(send, b'', 204, b'text/plain', [
+                    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+                    (b'access-control-allow-headers', b'*'),
+                ])
+            elif known_path:
+                await _send_json(send, {'error': 'Method not allowed'}, 405)
+            else:
+                await _send_json(send, {'error': 'Not found'}, 404)
+            return
+
+        body = await _read_body(receive)
+        if body is None:
+            await _send_json(send, {'error': 'Request body too large'}, 413)
+            return
+
+        request = WebhookRequest(scope['method'], scope.get('query_string', b''), scope.get('headers', []), body)
+        request_id = request.headers.get('x-request-id') or new_request_id()
+        headers = [(b'x-request-id', request_id.encode('latin-1'))]
+        limiter = services.get('rate_limiter')
+        if limiter.applies(scope['path']):
+            allowed, retry_after, remaining, limit = self.check_rate_limit(limiter, scope, request)
+            headers += [(b'x-ratelimit-remaining', str(remaining).encode()), (b'x-ratelimit-limit', str(limit).encode())]
+            if not allowed:
+                handler = None
+                headers.append((b'retry-after', retry_after_header(retry_after).encode()))
+                payload, status = {'success': False, 'error': 'Too many requests',
+                                   'retry_after': round(retry_after, 3)}, 429
+
+        monitoring = services.get('monitoring')
+        monitoring.add_gauge('bww_http_requests_in_flight', 1, endpoint=scope['path'])
+        started = time.perf_counter()
+        with log_context(request_id=request_id, endpoint=scope['path']):
+            try:
+                if handler is not None:
+                    payload, status = await handler(request)
+            except Exception:
+                logger.exception("Unhandled error in %s", scope['path'])
+                payload, status = {'error': 'Internal server error'}, 500
+            finally:
+                monitoring.add_gauge('bww_http_requests_in_flight', -1, endpoint=scope['path'])
+        monitoring.observe('bww_http_request_seconds', time.perf_counter() - started,
+                           endpoint=scope['path'], status=status)
+        await _send_response(send, payload, status, headers)
+
+    # Routes ---------------------------------------------------------------
+
+    async def chat(self, request: WebhookRequest):
+        try:
+            data = request.get_json()
+            if isinstance(self.cpu_executor, ProcessPoolExecutor):
+                # The pipeline runs here, handing only NLP to the pool
+                async with self._cpu_bound():
+                    result = await self.run_io(process_chat, data, self._analyze_in_pool)
+            else:
+                result = await self.run_cpu(process_chat, data)
+            return result, 200
+        except Exception as e:
+            logger.error("Error processing chat: %s", e)
+            services.get('monitoring').log_error('chat', str(e))
+            return {'success': False, 'error': str(e)}, 500
+
+    async def metrics(self, request: WebhookRequest):
+        return services.get('monitoring').render().encode(), 200
+
+    async def facebook_verify(self, request: WebhookRequest):
+        return await self.run_io(services.get('facebook_integration').verify_webhook, request)
+
+    async def facebook_message(self, request: WebhookRequest):
+        return await self.run_io(services.get('facebook_integration').process_message, request)
+
+    async def whatsapp_message(self, request: WebhookRequest):
+        return await self.run_io(services.get('whatsapp_handler').process_message, request)
+
+    def check_rate_limit(self, limiter, scope, request: WebhookRequest):
+        body = request.get_json(silent=True)
+        user_id = (
+            request.args.get('user_id')
+            or request.headers.get('x-user-id')
+            or (body.get('user_id') if isinstance(body, dict) else None)
+        )
+        client = scope.get('client') or (None, None)
+        ip = limiter.client_ip(client[0], request.headers.get('x-forwarded-for'), request.headers.get('x-real-ip'))
+        return limiter.check(user_id, ip)
+
+    # Executors ------------------------------------------------------------
+
+    async def run_cpu(self, fn, *args):
+        """Run CPU-bound work in the bounded pool"""
+        async with self._cpu_bound():
+            loop = asyncio.get_running_loop()
+            if isinstance(self.cpu_executor, ThreadPoolExecutor):
+                # Keep the request's log context in the worker thread
+                return await loop.run_in_executor(self.cpu_executor, contextvars.copy_context().run, fn, *args)
+            return await loop.run_in_executor(self.cpu_executor, fn, *args)
+
+    def _cpu_bound(self) -> asyncio.Semaphore:
+        if self._cpu_slots is None:
+            self._cpu_slots = asyncio.Semaphore(self._cpu_limit)
+        return self._cpu_slots
+
+    def _analyze_in_pool(self, message: str):
+        return self.cpu_executor.submit(analyze_message, message).result()
+
+    async def run_io(self, fn, *args):
+        """Run a blocking I/O call without holding the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_executor, contextvars.copy_context().run, fn, *args)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_background_workers()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.cpu_executor.shutdown(wait=False, cancel_futures=True)
+                self.io_executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def _cpu_executor_from_env(workers: int) -> Executor:
+    """ASGI_EXECUTOR=process runs NLP (analyze_message) in worker processes instead of threads"""
+    if os.getenv('ASGI_EXECUTOR', 'thread') == 'process':
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='asgi-cpu')
+
+
+async def _read_body(receive) -> Optional[bytes]:
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def _send_response(send, payload: Any, status: int, extra_headers: List = ()):
+    """
+    Render integration results the way Flask does: dicts as JSON, str as
+    HTML; bytes are the Prometheus text of /metrics
+    """
+    if isinstance(payload, (dict, list)):
+        await _send_json(send, payload, status, extra_headers)
+    elif isinstance(payload, bytes):
+        await _send(send, payload, status, b'text/plain; version=0.0.4', extra_headers)
+    else:
+        await _send(send, str(payload).encode(), status, b'text/html; charset=utf-8', extra_headers)
+
+
+async def _send_json(send, payload: Dict, status: int, extra_headers: List = ()):
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    await _send(send, body, status, b'application/json', extra_headers)
+
+
+async def _send(send, body: bytes, status: int, content_type: bytes, extra_headers: List = ()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type),
+            (b'content-length', str(len(body)).encode()),
+            (b'access-control-allow-origin', b'*'),
+            *extra_headers,
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+app = ASGIApp()
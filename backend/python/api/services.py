@@ -0,0 +1,208 @@
+"""
+API Services
+Service registry and request pipelines shared by the Flask (api.app) and
+ASGI (api.asgi) entry points
+"""
+
+import multiprocessing
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from utils.logging_setup import log_context
+from utils.service_registry import ServiceRegistry, import_string
+
+load_dotenv()
+
+# Services are built on first use; module paths keep heavy imports
+# (models, SDK clients) out of worker startup
+services = ServiceRegistry()
+services.register('egyptian_nlp', 'nlp.egyptian_nlp:EgyptianNLP')
+services.register('intent_handler', lambda: import_string('nlp.egyptian_intent_handler:EgyptianIntentHandler')(
+    services.get('egyptian_nlp'), product_search=services.get('product_search')
+))
+services.register('response_cache', 'chatbot.response_cache:response_cache_from_env')
+services.register('chatbot_engine', lambda: import_string('chatbot.enhanced_chatbot_engine:EnhancedChatbotEngine')(
+    response_cache=services.get('response_cache'), product_search=services.get('product_search')
+))
+services.register('recommendation_engine', 'services.recommendation_engine:recommendation_engine_from_env')
+services.register('order_tracker', lambda: import_string('services.order_tracker:order_tracker_from_env')(
+    db=services.get('db_handler')
+))
+services.register('order_collection', lambda: import_string('services.order_collection_system:order_collection_from_env')(
+    nlp=services.get('egyptian_nlp'),
+    product_search=services.get('product_search'),
+    on_complete=submit_order,
+    monitoring=services.get('monitoring'),
+))
+services.register('faq_system', lambda: import_string('services.faq_system:FAQSystem')(
+    cache=services.get('response_cache'), nlp=services.get('egyptian_nlp')
+))
+services.register('speech_to_text', 'services.speech_to_text:speech_to_text_from_env')
+services.register('product_sync', 'database.sync_products:product_sync_from_env')
+services.register('product_search', lambda: import_string('services.product_search:product_search_from_env')(
+    nlp=services.get('egyptian_nlp'), product_sync=services.get('product_sync')
+))
+services.register('db_handler', 'database.database_handler:database_handler_from_env')
+services.register('user_management', lambda: import_string('database.user_management:user_management_from_env')(
+    db=services.get('db_handler')
+))
+services.register('notification_service', lambda: import_string('utils.notification:notification_service_from_env')(
+    monitoring=services.get('monitoring')
+))
+services.register('analytics', 'utils.analytics:analytics_from_env')
+services.register('monitoring', 'utils.monitoring:monitoring_from_env')
+
+# Social media integrations: webhooks are acknowledged once queued and
+# answered by the webhook queue's workers
+services.register('webhook_queue', lambda: import_string('integrations.webhook_queue:webhook_queue_from_env')({
+    'facebook': lambda event: services.get('facebook_integration').handle_message(event),
+    'whatsapp': lambda message: services.get('whatsapp_handler').handle_message(message),
+}))
+services.register('rate_limiter', lambda: import_string('utils.rate_limit:rate_limiter_from_env')(
+    monitoring=services.get('monitoring')
+))
+services.register('single_flight', 'utils.rate_limit:SingleFlight')
+services.register('facebook_integration', lambda: import_string(
+    'integrations.facebook_leads_integration:FacebookLeadsIntegration'
+)(
+    queue=services.get('webhook_queue'),
+    chat_handler=process_chat,
+    notifier=services.get('notification_service'),
+    limiter=services.get('rate_limiter'),
+))
+services.register('whatsapp_handler', lambda: import_string(
+    'integrations.whatsapp_handler:WhatsAppHandler'
+)(
+    queue=services.get('webhook_queue'),
+    chat_handler=process_chat,
+    notifier=services.get('notification_service'),
+    limiter=services.get('rate_limiter'),
+))
+services.register('social_media', 'integrations.social_media_integration:SocialMediaIntegration')
+
+
+# With gunicorn --preload, build everything once in the master so the
+# workers share model weights and tables copy-on-write; not in pool
+# processes, which import this module only for analyze_message
+if os.getenv('PRELOAD_SERVICES', 'false').lower() == 'true' and multiprocessing.parent_process() is None:
+    services.warmup()
+
+
+def start_background_workers():
+    """
+    Start this process's background workers; call once a server worker has
+    booted (never in a preloading master: threads do not survive fork).
+    Webhook jobs persisted before a restart are picked up right away.
+    """
+    services.get('webhook_queue').start()
+
+
+def analyze_message(message: str) -> Tuple[str, Optional[str]]:
+    """
+    The stateless step of process_chat: the normalized message and its
+    intent. Safe to run in a process pool; it builds only EgyptianNLP, whose
+    intent matcher is what EgyptianIntentHandler.detect_intent consults.
+    """
+    processed = services.get('egyptian_nlp').process(message)
+    return processed, services.get('egyptian_nlp').intent_matcher.best(processed) if processed else None
+
+
+def process_chat(data: Dict, analyze: Optional[Callable[[str], Tuple[str, Optional[str]]]] = None) -> Dict:
+    """
+    Run a chat message through NLP, intent detection and the chatbot.
+
+    ``analyze`` replaces the NLP and intent stages (e.g. analyze_message in
+    a process pool); sessions, order state, caches and analytics always
+    stay in the calling process.
+    """
+    started = time.perf_counter()
+    monitoring = services.get('monitoring')
+    message = data.get('message', '')
+    user_id = data.get('user_id', '')
+    language = data.get('language', 'ar')  # Arabic by default
+    channel = data.get('channel', 'web')
+    
+    with log_context(user_id=user_id, channel=channel) as context:
+        # An open order answers first, from the raw message, without the
+        # NLP and intent stages
+        orders = services.get('order_collection') if user_id else None
+        with monitoring.stage('order'):
+            response = orders.handle(user_id, message) if orders is not None else None
+        if response is not None:
+            intent = 'place_order'
+        else:
+            if analyze is not None:
+                with monitoring.stage('nlp'):
+                    processed_message, intent = analyze(message)
+            else:
+                # Process Egyptian dialect; intent detection is deterministic, so it
+                # is memoized on the normalized message
+                with monitoring.stage('nlp'):
+                    processed_message = services.get('egyptian_nlp').process(message)
+                with monitoring.stage('intent'):
+                    intent = services.get('response_cache').get_or_set(
+                        'intent', processed_message,
+                        compute=lambda: services.get('intent_handler').detect_intent(processed_message),
+                    )
+            # A request to order opens the order flow; questions that only
+            # mention buying go on to the chatbot
+            if orders is not None:
+                with monitoring.stage('order'):
+                    response = orders.start(user_id, message)
+                if response is not None:
+                    intent = 'place_order'
+
+        if response is None:
+            # Get chatbot response
+            with monitoring.stage('generate'):
+                response = services.get('chatbot_engine').generate_response(
+                    message=processed_message,
+                    user_id=user_id,
+                    intent=intent,
+                    language=language
+                )
+        context['intent'] = intent
+    
+        # Log analytics (buffered; written by a background thread)
+        with monitoring.stage('analytics'):
+            services.get('analytics').track_message(
+                user_id, message, response,
+                intent=intent,
+                channel=channel,
+                language=language,
+                latency_ms=(time.perf_counter() - started) * 1000,
+            )
+        monitoring.inc('bww_chat_messages_total', intent=intent or 'unknown', channel=channel)
+    
+    return {
+        'success': True,
+        'response': response,
+        'intent': intent,
+        'language': language
+    }
+
+
+def submit_order(order: Dict):
+    """
+    Save an order collected over chat where the Node backend reads orders
+    (ObjectId keys and references) and make it trackable right away
+    """
+    from database.database_handler import to_object_id
+
+    document = {key: value for key, value in order.items() if key != 'order_id'}
+    document['userId'] = to_object_id(str(order['userId']))
+    document['items'] = [
+        dict(item, productId=to_object_id(str(item['productId'])) if item.get('productId') else None)
+        for item in order['items']
+    ]
+    services.get('db_handler').update('orders', order['order_id'], document, upsert=True)
+    services.get('order_tracker').apply_event({
+        'order_id': order['order_id'],
+        'status': order['status'],
+        'user_id': order['userId'],
+        'total': order['total'],
+        'timestamp': order['createdAt'],
+    })
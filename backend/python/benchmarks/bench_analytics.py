@@ -0,0 +1,99 @@
+"""
+Analytics Benchmark
+Per-call cost of track_message against writing each event synchronously,
+flush throughput, and month-report latency from rollups versus scanning
+the raw event columns, over millions of events
+
+Usage: python -m benchmarks.bench_analytics [--events N] [--days N]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+
+import numpy as np
+
+from utils.analytics import Analytics
+
+INTENTS = ['greeting', 'product_inquiry', 'order_status', 'complaint', 'price_inquiry',
+           'availability', 'payment', 'shipping', 'return', 'farewell', None]
+CHANNELS = ['web', 'whatsapp', 'facebook', 'mobile']
+
+
+def per_call(label, calls, fn):
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {elapsed / calls * 1e6:>8.2f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=3_000_000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--calls', type=int, default=500_000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as root:
+        # Hot path: the flusher thread is running while requests record events
+        analytics = Analytics(root=os.path.join(root, 'live'), capacity=args.calls + 1, flush_interval=0.5)
+        per_call('track_message', args.calls, lambda i: analytics.track_message(
+            f'user-{i % 5000}', 'عايز أعرف سعر القميص', 'السعر 250 جنيه',
+            intent=INTENTS[i % len(INTENTS)], channel=CHANNELS[i % 4], latency_ms=12.5,
+        ))
+        with open(os.path.join(root, 'events.jsonl'), 'a', encoding='utf-8') as f:
+            def write_line(i):
+                f.write(json.dumps({'ts': time.time(), 'user_id': f'user-{i % 5000}', 'intent': INTENTS[i % 11],
+                                    'channel': CHANNELS[i % 4], 'latency_ms': 12.5}) + '\n')
+                f.flush()
+            per_call('synchronous JSON line per event', args.calls // 10, write_line)
+        time.sleep(1.0)
+        analytics.flush()
+        print(f"dropped {analytics.dropped}, flushed {analytics.flushed} in {analytics.flushes} flushes")
+
+        # A month of history, flushed in chronological batches
+        store = Analytics(root=os.path.join(root, 'month'), capacity=args.events + 1)
+        first = date(2026, 9, 1)
+        start_ts = datetime.combine(first, dt_time(), store.tz).timestamp()
+        ts = np.sort(np.random.default_rng(1).uniform(start_ts, start_ts + args.days * 86400, args.events))
+        users = [f'user-{rng.randrange(200_000)}' for _ in range(10_000)]
+        start = time.perf_counter()
+        batch = 100_000
+        for offset in range(0, args.events, batch):
+            for i in range(offset, min(offset + batch, args.events)):
+                store._buffer.append((ts[i], users[i % 10_000], INTENTS[i % 11], CHANNELS[i % 4], 'ar', 20, 40, 12.5))
+            store.flush()
+        elapsed = time.perf_counter() - start
+        print(f"{'buffer + flush':<36} {args.events / elapsed:>8.0f} events/s ({args.events} events, {args.days} days)")
+
+        last = (first + timedelta(days=args.days - 1)).isoformat()
+        times = []
+        for _ in range(50):
+            start = time.perf_counter()
+            report = store.get_report(first.isoformat(), last)
+            times.append(time.perf_counter() - start)
+        print(f"{'month report, first (cold)':<36} {times[0] * 1000:>8.2f} ms")
+        print(f"{'month report, p50 (warm)':<36} {statistics.median(times[1:]) * 1000:>8.2f} ms")
+        print(f"  {report['total_messages']} messages, ~{report['unique_users']} users, "
+              f"{len(report['by_intent'])} intents")
+
+        start = time.perf_counter()
+        total = 0
+        by_intent = np.zeros(len(INTENTS), dtype=np.int64)
+        for day in range(args.days):
+            columns = store.events((first + timedelta(days=day)).isoformat())
+            total += len(columns['ts'])
+            by_intent += np.bincount(columns['intent'], minlength=len(INTENTS))[:len(INTENTS)]
+        print(f"{'month report, raw column scan':<36} {(time.perf_counter() - start) * 1000:>8.2f} ms "
+              f"({total} events)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Batch Classification Benchmark
+Messages per second of the offline classifier over a synthetic transcript
+export, for a single-process loop and the process pool at several worker
+counts and chunk sizes, with peak memory of the parent and workers
+
+Usage: python -m benchmarks.bench_batch_classify [--messages N] [--workers 1,2,4]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from nlp import batch_classify
+from nlp.egyptian_intent_handler import EgyptianIntentHandler
+from nlp.egyptian_nlp import EgyptianNLP
+from nlp.batch_classify import BatchClassifier
+
+TEMPLATES = [
+    'السلام عليكم', 'ازيك عامل ايه', 'عايز اعرف سعر القميص ده', 'فين طلبي رقم #{n}',
+    'الاوردر {n} اتأخر ليه', 'عندكم مقاس {size} في الجاكيت', 'بكام البنطلون الجينز',
+    'المنتج وصل بايظ وعايز ارجعه', 'ممكن الدفع عند الاستلام', 'الشحن لاسكندرية بكام',
+    'ميرسي جدا', 'عاوز جزمة رياضي مقاس {size} بحد اقصى {n} جنيه', 'الخدمة وحشة جدا',
+    'في خصم على الشنط', 'امتى الطلب يوصل', 'عايز اغير العنوان بتاع الاوردر {n}',
+]
+
+
+def write_export(path, messages):
+    rng = random.Random(7)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(messages):
+            text = rng.choice(TEMPLATES).format(n=rng.randrange(100, 99_999), size=rng.randrange(36, 46))
+            f.write(json.dumps({'id': f'm{i}', 'user_id': f'u{i % 3000}', 'message': text},
+                               ensure_ascii=False) + '\n')
+
+
+def run(path, workers, chunk_size):
+    # Each run starts cold, as a fresh CLI process would
+    batch_classify._memo.clear()
+    classifier = BatchClassifier(workers=workers, chunk_size=chunk_size)
+    with open(path, encoding='utf-8') as source, open(os.devnull, 'w') as sink:
+        for block in classifier.run(source):
+            sink.write(block)
+    return classifier
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--workers', default=','.join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})))
+    parser.add_argument('--chunk-sizes', default='100,1000')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'chats.jsonl')
+        write_export(path, args.messages)
+        print(f"{args.messages} messages, {os.path.getsize(path) / 1e6:.1f} MB, {os.cpu_count()} CPUs")
+
+        # Naive baseline: a single-threaded loop writing one result per message
+        nlp = EgyptianNLP()
+        intents = EgyptianIntentHandler(nlp)
+        count = min(args.messages, 50_000)
+        start = time.perf_counter()
+        with open(path, encoding='utf-8') as source, open(os.devnull, 'w') as sink:
+            for line in itertools.islice(source, count):
+                row = json.loads(line)
+                sink.write(json.dumps({
+                    'id': row['id'],
+                    'intent': intents.detect_intent(nlp.process(row['message'])),
+                    'entities': nlp.extract_entities(row['message']),
+                }, ensure_ascii=False) + '\n')
+        print(f"{'single loop':<28} {count / (time.perf_counter() - start):>9.0f} msgs/s")
+
+        baseline = None
+        for workers in (int(n) for n in args.workers.split(',')):
+            for chunk_size in (int(n) for n in args.chunk_sizes.split(',')):
+                parent_cpu = time.process_time()
+                children = resource.getrusage(resource.RUSAGE_CHILDREN)
+                classifier = run(path, workers, chunk_size)
+                parent_cpu = time.process_time() - parent_cpu
+                after = resource.getrusage(resource.RUSAGE_CHILDREN)
+                worker_cpu = (after.ru_utime + after.ru_stime) - (children.ru_utime + children.ru_stime)
+                baseline = baseline or classifier.rate
+                line = f"{f'{workers} workers, chunks of {chunk_size}':<28} {classifier.rate:>9.0f} msgs/s " \
+                       f"({classifier.rate / baseline:.2f}x)"
+                if workers > 1:
+                    # The parent's share is the serial part that bounds the speedup
+                    messages = classifier.counts['messages']
+                    line += f"  parent {parent_cpu / messages * 1e6:.1f} us/msg, " \
+                            f"workers {worker_cpu / messages * 1e6:.1f} us/msg, " \
+                            f"ceiling ~{(parent_cpu + worker_cpu) / parent_cpu:.0f}x"
+                print(line)
+        print(f"intents: {dict(classifier.intents.most_common(5))}")
+
+        # Peak RSS of a full CLI run, which streams input and output
+        child = subprocess.run(
+            [sys.executable, '-m', 'nlp.batch_classify', path, os.devnull, '--progress', '0'],
+            capture_output=True, text=True,
+        )
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        print(f"CLI run: peak RSS {usage.ru_maxrss / 1024:.0f} MB (largest process); "
+              f"{child.stderr.strip()[:160]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Database Handler Benchmark
+Hot-document reads from concurrent threads against a fake MongoDB with
+simulated round-trip latency: one query per ID, batched $in reads, and
+batched reads behind the read-through cache; reports pool metrics
+
+Usage: python -m benchmarks.bench_database_handler [--threads N] [--latency-ms MS]
+"""
+
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from database.database_handler import DatabaseHandler, EntityCache
+from utils.fake_mongo import FakeMongoClient
+from utils.fake_redis import FakeRedis
+
+
+def run(handler, requests, threads, read):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(partial(read, handler), requests))
+    return time.perf_counter() - start
+
+
+def per_id(handler, ids):
+    coll = handler.collection('products')
+    return [coll.find_one({'_id': id_}) for id_ in ids]
+
+
+def batched(handler, ids):
+    return handler.get_many('products', ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=20_000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--ids-per-request', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--latency-ms', type=float, default=1.0)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    # 80% of reads hit the 1000 hottest products
+    hot = [f'p{i}' for i in range(1000)]
+    every = [f'p{i}' for i in range(args.products)]
+    requests = [
+        [rng.choice(hot) if rng.random() < 0.8 else rng.choice(every) for _ in range(args.ids_per_request)]
+        for _ in range(args.requests)
+    ]
+
+    print(f"{args.requests} requests x {args.ids_per_request} ids, {args.threads} threads, "
+          f"pool {args.pool_size}, {args.latency_ms} ms round trip")
+    print(f"{'mode':<26} {'req/s':>8} {'round trips':>12} {'avg wait ms':>12} {'max in use':>11} {'hit rate':>9}")
+
+    modes = [
+        ('query per id', per_id, None, ()),
+        ('batched $in', batched, None, ()),
+        ('batched + local cache', batched, EntityCache(), ('products',)),
+        ('batched + redis cache', batched, EntityCache(FakeRedis()), ('products',)),
+    ]
+    for name, read, cache, cached in modes:
+        handler = DatabaseHandler(
+            cache=cache or EntityCache(),
+            cached_collections=cached,
+            max_pool_size=args.pool_size,
+            client_factory=partial(FakeMongoClient, latency=args.latency_ms / 1000),
+        )
+        handler.bulk_upsert('products', ({'_id': id_, 'price': i} for i, id_ in enumerate(every)))
+        client = handler.client
+        client.round_trips = 0
+        before = handler.stats()['pool']
+
+        elapsed = run(handler, requests, args.threads, read)
+        stats = handler.stats()
+        pool = stats['pool']
+        checkouts = pool['checkouts'] - before['checkouts']
+        wait_ms = (pool['wait_seconds_total'] - before['wait_seconds_total']) / checkouts * 1000
+        print(f"{name:<26} {args.requests / elapsed:>8.0f} {client.round_trips:>12} "
+              f"{wait_ms:>12.2f} {pool['max_in_use']:>11} "
+              f"{stats['cache']['hit_rate'] if cached else 0.0:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
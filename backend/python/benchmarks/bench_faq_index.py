@@ -0,0 +1,104 @@
+"""
+FAQ Retrieval Benchmark
+Latency and recall of the FAQ index (BM25 and dense modes) against a linear
+scan, plus build, save and memory-mapped load times
+
+Usage: python -m benchmarks.bench_faq_index [--entries N] [--queries N]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.corpus import generate_faq
+from nlp.egyptian_nlp import EgyptianNLP
+from services.faq_index import FAQIndex, HashingEmbedder
+
+
+def linear_scan(normalized_questions, nlp, query):
+    """Token-overlap scan over every question, the no-index baseline"""
+    terms = set(nlp.process(query).split())
+    best, best_score = None, 0
+    for i, question in enumerate(normalized_questions):
+        score = len(terms & question)
+        if score > best_score:
+            best, best_score = i, score
+    return [] if best is None else [{'id': str(best)}]
+
+
+def measure(search, queries, expected):
+    latencies, hits_at_1, hits_at_5 = [], 0, 0
+    for query, target in zip(queries, expected):
+        start = time.perf_counter()
+        results = search(query)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        ids = [result['id'] for result in results]
+        hits_at_1 += ids[:1] == [target]
+        hits_at_5 += target in ids[:5]
+    latencies.sort()
+    return {
+        'p50': statistics.median(latencies),
+        'p99': latencies[int(len(latencies) * 0.99) - 1],
+        'recall@1': hits_at_1 / len(queries),
+        'recall@5': hits_at_5 / len(queries),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    nlp = EgyptianNLP()
+    entries, queries = generate_faq(args.entries)
+    queries, expected = queries[:args.queries], [entry['id'] for entry in entries[:args.queries]]
+    print(f"entries: {len(entries)}  queries: {len(queries)}")
+
+    start = time.perf_counter()
+    index = FAQIndex(nlp.process, HashingEmbedder())
+    index.add_many(entries)
+    print(f"build: {(time.perf_counter() - start) * 1000:.0f} ms, {len(index.vocab)} terms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, 'faq_index')
+        start = time.perf_counter()
+        index.save(directory)
+        print(f"save: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        start = time.perf_counter()
+        index = FAQIndex.load(directory, nlp.process, HashingEmbedder())
+        print(f"mmap load: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        normalized = [set(nlp.process(entry['question']).split()) for entry in entries]
+        runs = {
+            'linear scan': lambda q: linear_scan(normalized, nlp, q),
+            'bm25': lambda q: index.search(q, k=5),
+            'dense': lambda q: index.search(q, k=5, mode='dense'),
+        }
+
+        print(f"\n{'mode':<12} {'p50 us':>8} {'p99 us':>8} {'recall@1':>9} {'recall@5':>9}")
+        for name, search in runs.items():
+            result = measure(search, queries, expected)
+            print(f"{name:<12} {result['p50']:>8.1f} {result['p99']:>8.1f} "
+                  f"{result['recall@1']:>9.3f} {result['recall@5']:>9.3f}")
+
+        # Incremental updates go to the in-memory segment on top of the
+        # memory-mapped one
+        start = time.perf_counter()
+        for i in range(100):
+            index.remove(str(i))
+            index.add(f'new-{i}', entries[i]['question'], entries[i]['answer'])
+        update = (time.perf_counter() - start) / 200 * 1e6
+        result = measure(lambda q: index.search(q, k=5), queries[:100], [f'new-{i}' for i in range(100)])
+        print(f"\nadd/remove: {update:.1f} us/op, bm25 recall@1 on re-added entries: {result['recall@1']:.3f}")
+
+        start = time.perf_counter()
+        index.compact()
+        print(f"compact: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Intent Detection Benchmark
+Compares the previous sequential per-intent regex scan with IntentMatcher's
+single trie-shaped regex (nlp.trie_regex) as the number of intents and
+keywords grows
+
+Usage: python -m benchmarks.bench_intent_matcher [--messages N]
+"""
+
+import argparse
+import random
+import re
+import time
+
+from benchmarks.corpus import generate_messages
+from nlp.egyptian_nlp import EgyptianNLP
+from nlp.intent_matcher import INTENT_KEYWORDS, IntentMatcher
+
+
+ARABIC_LETTERS = 'ابتثجحخدذرزسشصضطظعغفقكلمنهوي'
+
+
+def synthetic_keywords(intents: int, per_intent: int, seed: int = 7):
+    """Real keyword tables padded with random keywords up to ``intents``"""
+    rng = random.Random(seed)
+    table = {intent: list(words) for intent, words in INTENT_KEYWORDS.items()}
+    while len(table) < intents:
+        table[f'intent_{len(table)}'] = [
+            ''.join(rng.choice(ARABIC_LETTERS) for _ in range(rng.randint(4, 7)))
+            for _ in range(per_intent)
+        ]
+    return table
+
+
+def legacy_detect(patterns, text):
+    """Previous EgyptianIntentHandler.detect_intent: first regex hit wins"""
+    text = text.lower()
+    for intent, pattern in patterns.items():
+        if re.search(pattern, text, re.IGNORECASE):
+            return intent
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=20_000)
+    args = parser.parse_args()
+
+    nlp = EgyptianNLP()
+    messages = nlp.process_many(generate_messages(args.messages))
+    print(f"messages: {len(messages)}")
+    print(f"{'intents':>8} {'keywords':>9} {'legacy us/msg':>14} {'matcher us/msg':>15}")
+
+    for intents in (10, 100, 500):
+        table = synthetic_keywords(intents, per_intent=10)
+        patterns = {intent: '(' + '|'.join(words) + ')' for intent, words in table.items()}
+        matcher = IntentMatcher(table, normalizer=nlp.process, fold=nlp._normalize_arabic)
+
+        start = time.perf_counter()
+        for message in messages:
+            legacy_detect(patterns, message)
+        legacy = (time.perf_counter() - start) / len(messages) * 1e6
+
+        start = time.perf_counter()
+        for message in messages:
+            matcher.best(message)
+        combined = (time.perf_counter() - start) / len(messages) * 1e6
+
+        keywords = sum(len(words) for words in table.values())
+        print(f"{intents:>8} {keywords:>9} {legacy:>14.2f} {combined:>15.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Logging Benchmark
+Request-thread cost per log call during a burst of errors written to a
+slow sink: the previous basicConfig setup with eager f-strings, JSON
+records written synchronously, and the queue handler with and without the
+repeated-error rate limit
+
+Usage: python -m benchmarks.bench_logging [--errors N] [--threads N] [--sink-latency S]
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from utils.logging_setup import (
+    ContextFilter, JsonFormatter, RateLimitFilter, flush_logging, log_context, logging_stats, setup_logging,
+)
+
+
+class OrderError(Exception):
+    pass
+
+
+def burst(logger, errors, threads, eager):
+    """Log ``errors`` errors from ``threads`` request threads; per-call times"""
+    per_thread = errors // threads
+    times = [[] for _ in range(threads)]
+
+    def request_thread(n):
+        samples = times[n]
+        for i in range(per_thread):
+            e = OrderError(f'order {n * per_thread + i} not found')
+            with log_context(request_id=f'{n:04x}{i:08x}', user_id=f'user-{i % 500}', intent='order_status'):
+                start = time.perf_counter()
+                if eager:
+                    logger.error(f"Error tracking order: {str(e)}")
+                else:
+                    logger.error("Error tracking order: %s", e)
+                samples.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=request_thread, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - start
+    return [t for samples in times for t in samples], wall
+
+
+def report(label, samples, wall):
+    samples.sort()
+    p99 = samples[int(len(samples) * 0.99)]
+    print(f"{label:<34} mean {statistics.fmean(samples) * 1e6:>7.1f} us  p99 {p99 * 1e6:>7.1f} us  "
+          f"burst {wall * 1000:>7.1f} ms")
+
+
+class SlowStream:
+    """A log sink whose writes block, like a full stderr pipe or a busy disk"""
+
+    def __init__(self, stream, latency):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--errors', type=int, default=10_000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--sink-latency', type=float, default=0.0001, help='seconds per write')
+    args = parser.parse_args()
+
+    logger = logging.getLogger('api.app')
+    with tempfile.TemporaryDirectory() as directory, open(os.path.join(directory, 'app.log'), 'w') as out:
+        sink = SlowStream(out, args.sink_latency)
+
+        # Previous setup: formatted and written on the request thread
+        logging.basicConfig(level=logging.INFO, stream=sink, force=True)
+        report('basicConfig, eager f-string', *burst(logger, args.errors, args.threads, eager=True))
+
+        # Same JSON records, but formatted and written on the request thread
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(ContextFilter())
+        logging.basicConfig(level=logging.INFO, handlers=[handler], force=True)
+        report('synchronous JSON handler', *burst(logger, args.errors, args.threads, eager=False))
+
+        setup_logging(level='info', fmt='json', stream=sink,
+                      queue_size=args.errors, rate_limit=RateLimitFilter(burst=args.errors))
+        samples, wall = burst(logger, args.errors, args.threads, eager=False)
+        start = time.perf_counter()
+        flush_logging()
+        report('queue + JSON, no throttling', samples, wall)
+        print(f"  listener drained the rest in {(time.perf_counter() - start) * 1000:.1f} ms, {logging_stats()}")
+
+        setup_logging(level='info', fmt='json', stream=sink, queue_size=args.errors)
+        report('queue + JSON + rate limit', *burst(logger, args.errors, args.threads, eager=False))
+        flush_logging()
+        print(f"  {logging_stats()}")
+
+        setup_logging(level='info', fmt='json', stream=sink, queue_size=1000,
+                      rate_limit=RateLimitFilter(burst=args.errors))
+        report('queue of 1000, no throttling', *burst(logger, args.errors, args.threads, eager=False))
+        flush_logging()
+        print(f"  {logging_stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Monitoring Benchmark
+Per-call overhead of stage timers, counters and request tracking (with the
+slow-request profiler running), and /metrics render time when aggregating
+snapshot files from several workers
+
+Usage: python -m benchmarks.bench_monitoring [--calls N] [--workers N]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from utils.monitoring import Monitoring
+
+
+def per_call(label, calls, fn):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / calls * 1e9:>8.0f} ns/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=200_000)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        monitoring = Monitoring(directory=directory, slow_ms=100)
+
+        def nothing():
+            pass
+
+        def stage():
+            with monitoring.stage('nlp'):
+                pass
+
+        timed = monitoring.stage('intent')(nothing)
+
+        def request():
+            monitoring.request_finished(monitoring.request_started('chat'))
+
+        per_call('empty call (baseline)', args.calls, nothing)
+        per_call('with monitoring.stage()', args.calls, stage)
+        per_call('@monitoring.stage() decorated call', args.calls, timed)
+        per_call('monitoring.inc() with two labels', args.calls,
+                 lambda: monitoring.inc('bww_chat_messages_total', intent='greeting', channel='web'))
+        per_call('request_started + request_finished', args.calls, request)
+
+        # Other workers' snapshots, as written by their snapshot threads
+        snapshot = monitoring._snapshot()
+        for pid in range(1, args.workers):
+            with open(os.path.join(directory, f'{10_000_000 + pid}.json'), 'w') as f:
+                json.dump(dict(snapshot, pid=10_000_000 + pid), f)
+        start = time.perf_counter()
+        for _ in range(100):
+            text = monitoring.render()
+        elapsed = (time.perf_counter() - start) / 100
+        print(f"{'render /metrics, ' + str(args.workers) + ' workers':<40} {elapsed * 1000:>8.2f} ms "
+              f"({len(text.splitlines())} lines)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+EgyptianNLP.process Benchmark
+Compares the compiled single-pass normalizer with the previous
+regex + word-by-word implementation
+
+Usage: python -m benchmarks.bench_nlp_process [--messages N]
+"""
+
+import argparse
+import re
+import time
+
+from benchmarks.corpus import generate_messages
+from nlp.egyptian_nlp import EgyptianNLP
+
+
+def legacy_process(nlp: EgyptianNLP, text: str) -> str:
+    """Previous EgyptianNLP.process implementation, kept for comparison"""
+    if not text:
+        return ""
+    text = text.strip()
+    text = re.sub(r'\s+', ' ', text)
+    words = [nlp.dialect_mappings.get(word, word) for word in text.split()]
+    text = ' '.join(words)
+    text = re.sub('[إأٱآا]', 'ا', text)
+    text = re.sub('ة', 'ه', text)
+    text = re.sub(r'[\u064B-\u065F]', '', text)
+    return text
+
+
+def _timed(label: str, fn, messages):
+    start = time.perf_counter()
+    fn(messages)
+    elapsed = time.perf_counter() - start
+    per_msg = elapsed / len(messages) * 1e6
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms  {per_msg:7.2f} us/msg")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=100_000)
+    args = parser.parse_args()
+
+    nlp = EgyptianNLP()
+    messages = generate_messages(args.messages)
+    print(f"messages: {len(messages)}")
+
+    legacy = _timed('legacy (regex, per word)', lambda ms: [legacy_process(nlp, m) for m in ms], messages)
+    single = _timed('process (per message)', lambda ms: [nlp.process(m) for m in ms], messages)
+    batch = _timed('process_many (batch)', nlp.process_many, messages)
+
+    print(f"speedup process:      {legacy / single:5.2f}x")
+    print(f"speedup process_many: {legacy / batch:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Notifications Benchmark
+Delivery throughput of the asynchronous dispatcher against a local fake of
+the WhatsApp, Messenger and Twilio APIs with per-channel rate limits,
+latency and injected failures, compared with sending one message at a time
+over a synchronous client
+
+Usage: python -m benchmarks.bench_notifications [--messages N] [--latency S]
+"""
+
+import argparse
+import time
+from collections import Counter
+
+import httpx
+
+from utils.fake_notification_server import FakeNotificationServer
+from utils.notification import MessengerProvider, NotificationService, TwilioSMSProvider, WhatsAppProvider
+
+# Provider-side limits (messages per second) and what the client is set to
+LIMITS = {'whatsapp': 200, 'messenger': 300, 'sms': 50}
+CLIENT_RATES = {'whatsapp': 180, 'messenger': 270, 'sms': 45}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=300, help='messages per channel')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--failure-rate', type=float, default=0.05)
+    args = parser.parse_args()
+
+    # Baseline: one blocking request per message, no batching
+    server = FakeNotificationServer(rates=LIMITS, latency=args.latency, failure_rate=args.failure_rate)
+    url = server.start()
+    count = min(args.messages, 100)
+    with httpx.Client(base_url=url) as client:
+        start = time.perf_counter()
+        for i in range(count):
+            client.post('/123/messages', json={'messaging_product': 'whatsapp', 'to': str(i),
+                                               'type': 'text', 'text': {'body': 'طلبك اتشحن'}})
+        elapsed = time.perf_counter() - start
+    server.stop()
+    print(f"{'sequential, whatsapp':<28} {count / elapsed:>8.1f} msgs/s ({count} messages)")
+
+    server = FakeNotificationServer(rates=LIMITS, latency=args.latency, failure_rate=args.failure_rate)
+    url = server.start()
+    service = NotificationService([
+        WhatsAppProvider('123', 'token', base_url=url, rate=CLIENT_RATES['whatsapp'], concurrency=10),
+        MessengerProvider('page-token', base_url=url, rate=CLIENT_RATES['messenger'], concurrency=4),
+        TwilioSMSProvider('AC1', 'secret', '+20100', base_url=url, rate=CLIENT_RATES['sms'], concurrency=5),
+    ], backoff_base=0.05)
+
+    started_at = time.time()
+    start = time.perf_counter()
+    ids = service.send_many([{'text': 'طلبك اتشحن', 'recipient': f'{channel}:{i}', 'update': True}
+                             for i in range(args.messages) for channel in ('whatsapp', 'facebook', 'sms')])
+    queued = time.perf_counter() - start
+    results = service.wait(ids, timeout=120)
+    elapsed = time.perf_counter() - start
+    server.stop()
+
+    print(f"{'send_many (caller blocked)':<28} {queued * 1000:>8.2f} ms for {len(ids)} messages")
+    finished = Counter((record['channel'], record['status']) for record in results.values())
+    for channel in LIMITS:
+        sent = finished[(channel, 'sent')]
+        took = max(r['finished_at'] for r in results.values() if r['channel'] == channel) - started_at
+        print(f"{'dispatcher, ' + channel:<28} {sent / took:>8.1f} msgs/s  sent {sent}, "
+              f"failed {finished[(channel, 'failed')]}, 429s {server.rejected.get(channel, 0)}, "
+              f"peak {server.max_per_second(channel)}/s (limit {LIMITS[channel]}/s)")
+    stats = service.stats()
+    print(f"{len(ids)} messages in {elapsed:.2f}s, {stats['requests']} HTTP requests, "
+          f"{stats['retries']} retries, {sum(server.failed.values())} injected failures")
+
+
+if __name__ == '__main__':
+    main()
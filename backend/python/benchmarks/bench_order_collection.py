@@ -0,0 +1,168 @@
+"""
+Order Collection Benchmark
+Turns per second of the order flow with 100k concurrent open sessions,
+for each state store (memory only, SQLite, Redis via FakeRedis), against
+re-parsing each user's conversation on every turn; then the cost of
+resuming every session from the store after a restart, the serialized
+state size, the memory held per open session, and what a chat message
+from a user without an open order costs with and without the open-order
+marker when workers share the store
+
+Usage: python -m benchmarks.bench_order_collection [--sessions N] [--turns N]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.corpus import CITIES, PRODUCTS
+from nlp.egyptian_nlp import EgyptianNLP
+from services.order_collection_system import (
+    OpenOrderMarker, OrderCollectionSystem, OrderSession, RedisOrderStateStore, SQLiteOrderStateStore,
+)
+from utils.fake_redis import FakeRedis
+
+SIZES = ['L', 'XL', 'مقاس 42', 'ميديم', 'سمول']
+QUANTITIES = ['2', '3 قطع', 'اتنين', 'واحدة']
+PAYMENTS = ['كاش', 'فودافون كاش', 'انستاباي', 'فيزا']
+
+
+def answer(state, rng):
+    """A user's reply to the question asked in ``state``; confirmations loop back"""
+    if state == 0:
+        return rng.choice(PRODUCTS)
+    if state == 1:
+        return rng.choice(SIZES)
+    if state == 2:
+        return rng.choice(QUANTITIES)
+    if state == 3:
+        return rng.choice(CITIES)
+    if state == 4:
+        return f'مدينة نصر شارع {rng.randrange(1, 300)} عمارة {rng.randrange(1, 40)}'
+    if state == 5:
+        return rng.choice(PAYMENTS)
+    # At confirmation, edit the address so the session stays open
+    return 'غير العنوان'
+
+
+def open_sessions(system, count, rng):
+    start = time.perf_counter()
+    for n in range(count):
+        system.start(f'user-{n}', f'عايز اطلب {rng.choice(PRODUCTS)}')
+    return time.perf_counter() - start
+
+
+def run_turns(system, sessions, turns, rng):
+    users = [f'user-{rng.randrange(sessions)}' for _ in range(turns)]
+    start = time.perf_counter()
+    for user_id in users:
+        system.handle(user_id, answer(system._sessions[user_id].state, rng))
+    return time.perf_counter() - start
+
+
+def reparse_turns(nlp, sessions, turns, rng):
+    """Reference: rebuild each user's state from their whole history every turn"""
+    system = OrderCollectionSystem(nlp=nlp)
+    slots = len(system.flow.slots)
+    histories = {}
+    users = [f'user-{rng.randrange(sessions)}' for _ in range(turns)]
+    start = time.perf_counter()
+    for user_id in users:
+        history = histories.setdefault(user_id, [f'عايز اطلب {rng.choice(PRODUCTS)}'])
+        session = OrderSession(slots)
+        for message in history:
+            system._fill(session, message, message, system.flow.next_state[session.mask], overwrite=False)
+            session.state = system.flow.next_state[session.mask]
+        history.append(answer(session.state, rng))
+        if session.state >= system.flow.confirm:
+            del history[1:]
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sessions', type=int, default=100_000)
+    parser.add_argument('--turns', type=int, default=100_000)
+    args = parser.parse_args()
+
+    nlp = EgyptianNLP()
+    tmp = tempfile.mkdtemp(prefix='bench-orders-')
+    stores = [
+        ('memory', lambda: None),
+        ('sqlite', lambda: SQLiteOrderStateStore(os.path.join(tmp, 'order_sessions.sqlite3'))),
+        ('redis (FakeRedis)', lambda: RedisOrderStateStore(FakeRedis())),
+    ]
+    print(f"{args.sessions} open sessions, {args.turns} turns on random users")
+
+    for label, make_store in stores:
+        rng = random.Random(23)
+        store = make_store()
+        system = OrderCollectionSystem(nlp=nlp, store=store, max_sessions=args.sessions)
+        if label == 'memory':
+            # Traced, so this row's open rate is understated
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+        opened = open_sessions(system, args.sessions, rng)
+        if label == 'memory':
+            held = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+        elapsed = run_turns(system, args.sessions, args.turns, rng)
+        print(f"  {label:<18} open {args.sessions / opened:8.0f} sessions/s   "
+              f"turns {args.turns / elapsed:8.0f}/s  ({elapsed / args.turns * 1e6:6.1f} us/turn)")
+        if label == 'memory':
+            print(f"  {'':<18} memory per open session {held / args.sessions:6.0f} bytes")
+            blobs = [session.dumps() for session in list(system._sessions.values())[:10_000]]
+            print(f"  {'':<18} serialized state {sum(len(b.encode()) for b in blobs) / len(blobs):6.0f} bytes/session")
+        else:
+            # A restarted worker: every session is resumed from the store once
+            restarted = OrderCollectionSystem(nlp=nlp, store=store, max_sessions=args.sessions)
+            users = [f'user-{n}' for n in range(args.sessions)]
+            start = time.perf_counter()
+            for user_id in users:
+                restarted._session(user_id, time.time())
+            resumed = time.perf_counter() - start
+            print(f"  {'':<18} resume after restart {resumed / args.sessions * 1e6:6.1f} us/session, "
+                  f"{restarted.stats()['store_loads']} loaded")
+        print(f"  {'':<18} {system.stats()}")
+
+    # Workers sharing the SQLite store without local copies: every message
+    # of a user without an open order checks for one
+    path = os.path.join(tmp, 'order_sessions.sqlite3')
+    store = SQLiteOrderStateStore(path)
+    idle = [f'idle-{n}' for n in range(args.turns)]
+    for label, marker in (('store read', None), ('open-order marker', OpenOrderMarker(path + '-open', seed=store.items))):
+        system = OrderCollectionSystem(nlp=nlp, store=store, local_cache=False, marker=marker)
+        start = time.perf_counter()
+        for user_id in idle:
+            system.handle(user_id, 'السلام عليكم')
+        elapsed = time.perf_counter() - start
+        print(f"  {'no open order':<18} {label:<18} {elapsed / len(idle) * 1e6:6.1f} us/message, "
+              f"{system.stats()['store_skips']} store reads skipped")
+    rng = random.Random(23)
+    system = OrderCollectionSystem(nlp=nlp, store=store, local_cache=False, marker=marker)
+    sessions = min(args.sessions, 20_000)
+    for n in range(sessions):
+        system.start(f'user-{n}', f'عايز اطلب {rng.choice(PRODUCTS)}')
+    users = [f'user-{rng.randrange(sessions)}' for _ in range(min(args.turns, 20_000))]
+    start = time.perf_counter()
+    for user_id in users:
+        # Each turn reads the shared store, as a worker without sticky routing does
+        system.handle(user_id, answer(OrderSession.loads(store.get(user_id), len(system.flow.slots)).state, rng))
+    elapsed = time.perf_counter() - start
+    print(f"  {'shared sqlite':<18} turns {len(users) / elapsed:8.0f}/s  ({elapsed / len(users) * 1e6:6.1f} us/turn, "
+          f"no local copies; includes the benchmark's own read)")
+
+    turns = min(args.turns, 20_000)
+    # About ten turns per user, so histories reach the confirmation step
+    elapsed = reparse_turns(nlp, turns // 10, turns, random.Random(23))
+    print(f"  {'re-parse history':<18} turns {turns / elapsed:8.0f}/s  ({elapsed / turns * 1e6:6.1f} us/turn, reference)")
+
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Order Tracker Benchmark
+Looking up order statuses one query per order against the database versus
+the in-memory tracker, single and batched, both in-process and through
+the Flask endpoints; the database is a fake with simulated round-trip
+latency
+
+Usage: python -m benchmarks.bench_order_tracker [--orders N] [--batch N] [--latency-ms MS]
+"""
+
+import argparse
+import random
+import statistics
+import time
+from functools import partial
+
+from database.database_handler import DatabaseHandler, EntityCache
+from services.order_tracker import OrderTracker
+from utils.fake_mongo import FakeMongoClient
+
+STATUSES = ['pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']
+
+
+def measure(label, lookups, per_call, fn):
+    """Time each call of ``fn`` over ``lookups`` (lists of order IDs)"""
+    times = []
+    for ids in lookups:
+        start = time.perf_counter()
+        fn(ids)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    orders = sum(len(ids) for ids in lookups)
+    print(f"{label:<34} {statistics.median(times) * 1000:>9.3f} "
+          f"{times[int(len(times) * 0.99)] * 1000:>9.3f} "
+          f"{sum(times) / orders * 1e6:>12.1f} {per_call:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=50_000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=1.0)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    db = DatabaseHandler(
+        cache=EntityCache(),
+        cached_collections=(),
+        client_factory=partial(FakeMongoClient, latency=args.latency_ms / 1000),
+    )
+    db.bulk_upsert('orders', (
+        {'_id': f'ord-{i:06d}', 'userId': f'user-{i % 5000}', 'status': rng.choice(STATUSES),
+         'total': rng.randint(100, 5000), 'createdAt': time.time() - rng.randint(0, 86400 * 30)}
+        for i in range(args.orders)
+    ))
+    tracker = OrderTracker(db=db, ttl_seconds=3600, max_batch=max(args.batch, 100))
+
+    # Support queues keep asking about the same few hundred in-flight orders
+    hot = [f'ord-{i:06d}' for i in rng.sample(range(args.orders), 500)]
+    singles = [[rng.choice(hot)] for _ in range(args.lookups)]
+    batches = [rng.sample(hot, args.batch) for _ in range(args.lookups // 10)]
+
+    print(f"{args.orders} orders, {args.latency_ms} ms database round trip, batches of {args.batch}")
+    print(f"{'mode':<34} {'p50 ms':>9} {'p99 ms':>9} {'us / order':>12} {'ids':>6}")
+
+    coll = db.collection('orders')
+    measure('db query per order', singles, 1, lambda ids: coll.find_one({'_id': ids[0]}))
+    measure('db query per order, batch', batches, args.batch,
+            lambda ids: [coll.find_one({'_id': id_}) for id_ in ids])
+
+    queries = db.stats()['pool']['checkouts']
+    measure('tracker, cold batch', batches[:1], args.batch, tracker.track_many)
+    for start in range(0, len(hot), tracker.max_batch):
+        tracker.track_many(hot[start:start + tracker.max_batch])
+    measure('tracker single', singles, 1, lambda ids: tracker.track(ids[0]))
+    measure('tracker batch', batches, args.batch, tracker.track_many)
+
+    # Status changes arrive as events and never touch the database
+    events = [{'order_id': rng.choice(hot), 'status': rng.choice(STATUSES), 'timestamp': time.time() + i}
+              for i in range(50_000)]
+    start = time.perf_counter()
+    tracker.apply_events(events)
+    elapsed = time.perf_counter() - start
+    print(f"{'apply events':<34} {len(events) / elapsed:>9.0f} events/s")
+    print(f"database queries by the tracker: {db.stats()['pool']['checkouts'] - queries}, "
+          f"hit rate {tracker.stats()['hit_rate']:.3f}")
+
+    # The same lookups through the HTTP endpoints
+    from api.app import app
+    from api.services import services
+
+    services.register('order_tracker', lambda: tracker)
+    client = app.test_client()
+    measure('GET /api/orders/track', singles, 1,
+            lambda ids: client.get('/api/orders/track', query_string={'order_id': ids[0]}))
+    measure('POST /api/orders/track/batch', batches, args.batch,
+            lambda ids: client.post('/api/orders/track/batch', json={'order_ids': ids}))
+    measure(f'{args.batch} x GET /api/orders/track', batches[:20], args.batch,
+            lambda ids: [client.get('/api/orders/track', query_string={'order_id': id_}) for id_ in ids])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Product Search Benchmark
+Query latency and recall@10 of the product search index on a generated
+Arabic catalog, for clean queries, dialect phrasing, spelling variants and
+typos, plus autocomplete latency, build time and incremental updates,
+against a substring scan of the catalog
+
+Usage: python -m benchmarks.bench_product_search [--products N] [--queries N]
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from nlp.egyptian_nlp import ARABIC_FOLD_TABLE
+from services.product_search import ProductSearchIndex
+
+TYPES = [
+    ('تيشيرت', 'T-Shirt', 'ملابس رجالي'), ('قميص', 'Shirt', 'ملابس رجالي'), ('بنطلون', 'Pants', 'ملابس رجالي'),
+    ('فستان', 'Dress', 'ملابس حريمي'), ('بلوزة', 'Blouse', 'ملابس حريمي'), ('جيبة', 'Skirt', 'ملابس حريمي'),
+    ('جاكيت', 'Jacket', 'ملابس خروج'), ('بالطو', 'Coat', 'ملابس خروج'), ('شنطة', 'Bag', 'حقائب'),
+    ('محفظة', 'Wallet', 'إكسسوارات'), ('حزام', 'Belt', 'إكسسوارات'), ('كوتشي', 'Sneakers', 'أحذية'),
+    ('صندل', 'Sandal', 'أحذية'), ('بيجامة', 'Pajama', 'ملابس بيت'), ('ترينج', 'Tracksuit', 'ملابس رياضية'),
+    ('شراب', 'Socks', 'ملابس داخلية'), ('طاقية', 'Cap', 'إكسسوارات'), ('نضارة شمس', 'Sunglasses', 'إكسسوارات'),
+]
+MATERIALS = [('قطن', 'Cotton'), ('جلد', 'Leather'), ('كتان', 'Linen'), ('جينز', 'Denim'), ('صوف', 'Wool'),
+             ('شيفون', 'Chiffon'), ('بوليستر', 'Polyester'), ('ستان', 'Satin')]
+COLORS = [('أسود', 'Black'), ('أبيض', 'White'), ('أحمر', 'Red'), ('أزرق', 'Blue'), ('أخضر', 'Green'),
+          ('رمادي', 'Grey'), ('بيج', 'Beige'), ('كحلي', 'Navy'), ('بني', 'Brown'), ('وردي', 'Pink')]
+STYLES = ['كلاسيك', 'سبور', 'كاجوال', 'صيفي', 'شتوي', 'واسع', 'سليم فيت', 'أوفر سايز', 'مطبوع', 'سادة']
+BRANDS = ['النيل', 'كايرو', 'فرعون', 'الأهرام', 'دلتا', 'سيوة', 'مرسى', 'الزمالك', 'المعادي', 'الصعيد',
+          'أسوان', 'الفيوم', 'طنطا', 'المنصورة', 'بورسعيد', 'دمياط', 'رشيد', 'سيناء', 'الواحات', 'النوبة']
+FILLERS = ['عايز', 'عاوز', 'محتاج', 'عندكم', 'فيه', 'بكام', 'ممكن']
+VARIANTS = {'ة': 'ه', 'أ': 'ا', 'ي': 'ى', 'ه': 'ة'}
+
+
+def make_catalog(count, rng):
+    products = []
+    for i in range(count):
+        kind, kind_en, category = rng.choice(TYPES)
+        material, material_en = rng.choice(MATERIALS)
+        color, color_en = rng.choice(COLORS)
+        style = rng.choice(STYLES)
+        brand = f'{rng.choice(BRANDS)} {rng.randrange(1, 40)}'
+        products.append({
+            'id': f'sku-{i}',
+            'nameAr': f'{kind} {material} {color} {style} - {brand}',
+            'name': f'{color_en} {material_en} {kind_en}',
+            'category': category,
+            'descriptionAr': f'{kind} {style} من {material} بجودة عالية',
+            'price': rng.randrange(99, 3000),
+            'stock': rng.randrange(0, 50),
+        })
+    return products
+
+
+def typo(word, rng):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    edit = rng.randrange(3)
+    if edit == 0:
+        return word[:i] + word[i + 1:]
+    if edit == 1:
+        return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+    return word[:i] + rng.choice('ابتسمنرلوي') + word[i + 1:]
+
+
+def variant(word):
+    return ''.join(VARIANTS.get(ch, ch) for ch in word)
+
+
+def make_queries(products, count, rng):
+    """``(kind, query, words a relevant product's name must contain)``"""
+    queries = []
+    for n in range(count):
+        product = rng.choice(products)
+        words = product['nameAr'].replace(' - ', ' ').split()
+        picked = [words[0], words[1], words[2]]
+        kind = ('clean', 'dialect', 'variant', 'typo')[n % 4]
+        if kind == 'dialect':
+            text = f"{rng.choice(FILLERS)} {' '.join(picked)} {rng.choice(['بكام', 'لو سمحت', 'مقاس لارج'])}"
+        elif kind == 'variant':
+            text = ' '.join(variant(word) for word in picked)
+        elif kind == 'typo':
+            target = rng.randrange(len(picked))
+            text = ' '.join(typo(word, rng) if i == target else word for i, word in enumerate(picked))
+        else:
+            text = ' '.join(picked)
+        queries.append((kind, text, picked))
+    return queries
+
+
+def fold(text):
+    return text.translate(ARABIC_FOLD_TABLE)
+
+
+def relevant(hit, words):
+    name = fold(hit['nameAr'])
+    return all(fold(word) in name for word in words)
+
+
+def latency_line(label, times):
+    times = sorted(times)
+    return (f"{label:<26} p50 {statistics.median(times) * 1e6:>7.0f} us  "
+            f"p99 {times[int(len(times) * 0.99)] * 1e6:>7.0f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=50_000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    products = make_catalog(args.products, rng)
+    index = ProductSearchIndex()
+    start = time.perf_counter()
+    index.upsert_many(products)
+    print(f"built index of {len(index)} products in {time.perf_counter() - start:.2f}s: {index.stats()}")
+
+    queries = make_queries(products, args.queries, rng)
+    for _ in range(2):
+        for _, text, _ in queries[:200]:
+            index.search(text)
+    by_kind = {}
+    for kind, text, words in queries:
+        start = time.perf_counter()
+        hits = index.search(text)
+        elapsed = time.perf_counter() - start
+        times, found = by_kind.setdefault(kind, ([], []))
+        times.append(elapsed)
+        found.append(any(relevant(hit, words) for hit in hits))
+    all_times = []
+    for kind, (times, found) in by_kind.items():
+        all_times.extend(times)
+        print(f"{latency_line(kind + ' queries', times)}  recall@10 {sum(found) / len(found):.3f}")
+    print(latency_line('all queries', all_times))
+
+    times = []
+    for _, text, _ in queries[:1000]:
+        partial = text.split()[0][:3]
+        start = time.perf_counter()
+        index.suggest(partial)
+        times.append(time.perf_counter() - start)
+    print(latency_line('autocomplete, 3 letters', times))
+
+    # Baseline: scan every product name for every query word
+    names = [fold(product['nameAr']) for product in products]
+    times = []
+    for _, text, words in queries[:50]:
+        start = time.perf_counter()
+        folded = [fold(word) for word in words]
+        [i for i, name in enumerate(names) if all(word in name for word in folded)][:10]
+        times.append(time.perf_counter() - start)
+    print(latency_line('substring scan (baseline)', times))
+
+    changed = [dict(product, stock=0, price=product['price'] + 10) for product in rng.sample(products, 1000)]
+    start = time.perf_counter()
+    index.upsert_many(changed)
+    print(f"{'upsert 1000 changed products':<26} {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Product Sync Benchmark
+Full, no-change and 1%-change syncs of a 100k-product catalog into SQLite,
+an interrupted-and-resumed run, and a per-record upsert baseline
+
+Usage: python -m benchmarks.bench_product_sync [--products N]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.corpus import CATEGORIES_AR, PRODUCTS
+from database.sync_products import IterableSource, ProductSync, SQLiteProductStore
+
+
+def catalog(count: int, seed: int = 42):
+    rng = random.Random(seed)
+    return [
+        {
+            'id': f'sku-{i:06d}',
+            'name': f'Product {i}',
+            'nameAr': f'{rng.choice(PRODUCTS)} موديل {i}',
+            'description': 'Cotton, regular fit',
+            'price': rng.randint(50, 3000),
+            'category': rng.choice(CATEGORIES_AR),
+            'images': [f'https://cdn.example.com/{i}/{j}.jpg' for j in range(3)],
+            'stock': rng.randint(0, 100),
+        }
+        for i in range(count)
+    ]
+
+
+class InterruptedSource(IterableSource):
+    """Fails after ``fail_after`` records, like a dropped connection"""
+
+    def __init__(self, records, fail_after, **kwargs):
+        super().__init__(records, **kwargs)
+        self.fail_after = fail_after
+
+    def pages(self, cursor=None):
+        for page, next_cursor in super().pages(cursor):
+            if next_cursor > self.fail_after:
+                raise ConnectionError("source went away")
+            yield page, next_cursor
+
+
+def per_record_baseline(path, products):
+    """Upsert and commit one product at a time, no change detection"""
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('CREATE TABLE products (id TEXT PRIMARY KEY, data TEXT NOT NULL)')
+    for product in products:
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO products (id, data) VALUES (?, ?)',
+                         (product['id'], json.dumps(product, ensure_ascii=False)))
+    conn.close()
+
+
+def timed(label, products, fn):
+    start = time.perf_counter()
+    stats = fn()
+    elapsed = time.perf_counter() - start
+    detail = ''
+    if stats:
+        detail = (f"inserted {stats['inserted']:>6} updated {stats['updated']:>5} "
+                  f"unchanged {stats['unchanged']:>6}")
+    print(f"{label:<34} {elapsed:>7.2f} s {len(products) / elapsed:>9.0f} rec/s  {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    products = catalog(args.products)
+    with tempfile.TemporaryDirectory() as directory:
+        timed('per-record upsert baseline', products,
+              lambda: per_record_baseline(os.path.join(directory, 'baseline.sqlite3'), products))
+
+        store = SQLiteProductStore(os.path.join(directory, 'products.sqlite3'))
+        source = IterableSource(products, page_size=args.page_size)
+        timed('initial sync', products, lambda: ProductSync(source, store).run())
+        timed('re-sync, nothing changed', products, lambda: ProductSync(source, store).run())
+
+        changed = [dict(p) for p in products]
+        for product in random.Random(1).sample(changed, len(changed) // 100):
+            product['price'] += 10
+        timed('re-sync, 1% changed', products,
+              lambda: ProductSync(IterableSource(changed, page_size=args.page_size), store).run())
+
+        # Interrupted halfway: the second run resumes from the checkpoint
+        store = SQLiteProductStore(os.path.join(directory, 'resume.sqlite3'))
+        half = len(products) // 2
+        start = time.perf_counter()
+        try:
+            ProductSync(InterruptedSource(products, half, page_size=args.page_size), store).run()
+        except ConnectionError:
+            pass
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        stats = ProductSync(IterableSource(products, page_size=args.page_size), store).run()
+        second = time.perf_counter() - start
+        print(f"{'interrupted at 50% + resume':<34} {first:>7.2f} s + {second:.2f} s, "
+              f"resumed={stats['resumed']}, stored {store.count()} products")
+
+
+if __name__ == '__main__':
+    main()
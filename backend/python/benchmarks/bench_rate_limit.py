@@ -0,0 +1,187 @@
+"""
+Rate Limit Load Test
+Serves the Flask app in-process and runs an abusive client (many threads,
+one user, one IP, no pauses) against /api/chat next to well-behaved users,
+with the limiter off and on, reporting what each side gets served; then
+polls one order from many clients with and without request coalescing,
+counting tracker lookups. Also times the limiter itself per request
+
+Usage: python -m benchmarks.bench_rate_limit [--seconds S] [--abusers N] [--users N]
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from werkzeug.serving import make_server
+
+from benchmarks.corpus import generate_messages
+from utils.fake_redis import FakeRedis
+from utils.rate_limit import LocalRateLimitStore, RateLimiter, RedisRateLimitStore, SingleFlight
+
+
+class SlowTracker:
+    """Order lookups that take ``latency`` seconds, like a remote orders API"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def track(self, order_id):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return {'order_id': order_id, 'status': 'shipped'}
+
+
+class NoCoalescing:
+    def do(self, key, fn):
+        return fn()
+
+
+def drive(port, path, make_request, threads, seconds, pause=0.0):
+    """``threads`` clients calling ``make_request(i) -> (method, body, headers)``"""
+    statuses = Counter()
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def client(n):
+        local = []
+        codes = Counter()
+        i = 0
+        while time.monotonic() < stop_at:
+            method, body, headers = make_request(n, i)
+            start = time.perf_counter()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            try:
+                conn.request(method, path(n, i), body, headers)
+                response = conn.getresponse()
+                response.read()
+                codes[response.status] += 1
+                if response.status == 200:
+                    local.append(time.perf_counter() - start)
+            except OSError:
+                codes['error'] += 1
+            finally:
+                conn.close()
+            i += 1
+            if pause:
+                time.sleep(pause)
+        with lock:
+            statuses.update(codes)
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=client, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return statuses, sorted(latencies)
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else float('nan')
+
+
+def abuse_scenario(port, args, messages):
+    results = {}
+
+    def abuser():
+        def request(n, i):
+            body = json.dumps({'message': messages[i % len(messages)], 'user_id': 'abuser'})
+            return 'POST', body, {'Content-Type': 'application/json', 'X-Forwarded-For': '203.0.113.66'}
+        results['abuser'] = drive(port, lambda n, i: '/api/chat', request, args.abusers, args.seconds)
+
+    def users():
+        def request(n, i):
+            body = json.dumps({'message': messages[(n * 7 + i) % len(messages)], 'user_id': f'user-{n}'})
+            return 'POST', body, {'Content-Type': 'application/json', 'X-Forwarded-For': f'198.51.100.{n}'}
+        results['users'] = drive(port, lambda n, i: '/api/chat', request, args.users, args.seconds, pause=0.5)
+
+    threads = [threading.Thread(target=abuser), threading.Thread(target=users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def poll_scenario(port, args):
+    def request(n, i):
+        return 'GET', None, {'X-Forwarded-For': f'198.51.100.{n}'}
+    return drive(port, lambda n, i: f'/api/orders/track?order_id=ORD-{i // 20}', request,
+                 args.pollers, args.seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=8)
+    parser.add_argument('--abusers', type=int, default=8, help='threads of the abusive client')
+    parser.add_argument('--users', type=int, default=8, help='well-behaved users, 2 requests/s each')
+    parser.add_argument('--pollers', type=int, default=32, help='clients polling the same orders')
+    parser.add_argument('--tracker-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    analytics_dir = tempfile.mkdtemp(prefix='bench-analytics-')
+    os.environ.setdefault('ANALYTICS_PATH', analytics_dir)
+    from api.app import app
+    from api.services import services
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    messages = generate_messages(1000)
+    monitoring = services.get('monitoring')
+
+    # Per-request cost of the limiter alone (IP + user bucket)
+    stores = (('local store', LocalRateLimitStore()), ('redis store (FakeRedis)', RedisRateLimitStore(FakeRedis())))
+    for label, store in stores:
+        limiter = RateLimiter(store=store, user_rate=1e9, user_burst=10**9, ip_rate=1e9, ip_burst=10**9)
+        count = 20_000
+        start = time.perf_counter()
+        for i in range(count):
+            limiter.check(f'user-{i % 1000}', f'10.0.{i % 50}.1')
+        print(f"limiter check, {label:<24} {(time.perf_counter() - start) / count * 1e6:6.1f} us/request")
+
+    for enabled in (False, True):
+        services.register('rate_limiter', lambda: RateLimiter(trust_proxy=True, enabled=enabled, monitoring=monitoring))
+        results = abuse_scenario(port, args, messages)
+        print(f"\nrate limiting {'on' if enabled else 'off'} ({args.seconds:g}s):")
+        statuses, latencies = results['abuser']
+        print(f"  abuser, {args.abusers} threads: {statuses[200] / args.seconds:7.1f} served/s, "
+              f"{statuses[429] / args.seconds:7.1f} rejected/s, {dict(statuses)}")
+        statuses, latencies = results['users']
+        print(f"  {args.users} users at 2 req/s:  {statuses[200] / args.seconds:7.1f} served/s, "
+              f"p50 {percentile(latencies, 0.5):6.1f} ms  p99 {percentile(latencies, 0.99):6.1f} ms  {dict(statuses)}")
+        if enabled:
+            print(f"  limiter: {services.get('rate_limiter').stats()}")
+
+    services.register('rate_limiter', lambda: RateLimiter(enabled=False))
+    for coalescing in (False, True):
+        tracker = SlowTracker(args.tracker_latency)
+        services.register('order_tracker', lambda: tracker)
+        services.register('single_flight', SingleFlight if coalescing else NoCoalescing)
+        statuses, latencies = poll_scenario(port, args)
+        print(f"\n{args.pollers} clients polling one order, coalescing {'on' if coalescing else 'off'}: "
+              f"{statuses[200] / args.seconds:7.1f} req/s, {tracker.calls} tracker lookups "
+              f"({tracker.calls / max(1, statuses[200]):.2f} per request), "
+              f"p50 {percentile(latencies, 0.5):6.1f} ms  p99 {percentile(latencies, 0.99):6.1f} ms")
+        if coalescing:
+            print(f"  single flight: {services.get('single_flight').stats()}")
+
+    server.shutdown()
+    shutil.rmtree(analytics_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
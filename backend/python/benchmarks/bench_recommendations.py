@@ -0,0 +1,128 @@
+"""
+Recommendation Benchmark
+Offline build, snapshot load and per-user / batch query latency of the
+item-item recommendation engine, against computing co-occurrences from raw
+interactions on every request
+
+Usage: python -m benchmarks.bench_recommendations [--items N] [--interactions N]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from services.recommendation_engine import RecommendationEngine
+
+
+CATEGORIES = [f'category-{i}' for i in range(40)]
+
+
+def synthetic_data(n_items: int, n_interactions: int, n_users: int, seed: int = 42):
+    """Users who mostly browse one or two categories, Zipf-popular items"""
+    rng = np.random.default_rng(seed)
+    category = rng.integers(0, len(CATEGORIES), n_items)
+    items = [
+        {'id': f'p{i}', 'price': float(rng.integers(50, 2000)), 'category': CATEGORIES[c],
+         'stock': int(rng.integers(0, 20))}
+        for i, c in enumerate(category)
+    ]
+
+    by_category = [np.flatnonzero(category == c) for c in range(len(CATEGORIES))]
+    favorite = rng.integers(0, len(CATEGORIES), n_users)
+    users = rng.integers(0, n_users, n_interactions)
+    # 80% of interactions in the user's favorite category
+    in_favorite = rng.random(n_interactions) < 0.8
+    cats = np.where(in_favorite, favorite[users], rng.integers(0, len(CATEGORIES), n_interactions))
+    ranks = rng.zipf(1.3, n_interactions)
+
+    interactions = []
+    for user, cat, rank in zip(users.tolist(), cats.tolist(), ranks.tolist()):
+        pool = by_category[cat]
+        interactions.append((f'u{user}', f'p{pool[(rank - 1) % len(pool)]}', 1.0))
+    return items, interactions
+
+
+def on_the_fly(item_users, user_items, engine, user_id, limit=10):
+    """Co-occurrence counted from raw interactions per request"""
+    items, _ = engine._history(user_id)
+    if not len(items):
+        return []
+    neighbors = np.concatenate([item_users[i] for i in items])
+    co_items = np.concatenate([user_items[u] for u in np.unique(neighbors)])
+    counts = np.bincount(co_items, minlength=len(engine.item_ids))
+    counts[items] = 0
+    return np.argsort(-counts)[:limit]
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=100_000)
+    parser.add_argument('--interactions', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    items, interactions = synthetic_data(args.items, args.interactions, args.users)
+    print(f"data: {args.items} items, {len(interactions)} interactions "
+          f"({time.perf_counter() - start:.1f} s to generate)")
+
+    start = time.perf_counter()
+    engine = RecommendationEngine.build(interactions, items, neighbors=50)
+    print(f"build: {time.perf_counter() - start:.1f} s, {len(engine.sim_data)} similarities")
+
+    rng = np.random.default_rng(7)
+    user_ids = [f'u{u}' for u in rng.integers(0, args.users, args.queries)]
+    preferences = {'max_price': 1000, 'in_stock': True}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, 'recommender')
+        start = time.perf_counter()
+        engine.save(directory)
+        print(f"save: {time.perf_counter() - start:.2f} s")
+        start = time.perf_counter()
+        engine = RecommendationEngine.load(directory)
+        print(f"mmap load: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        hist = engine.hist_indptr
+        user_items = [np.asarray(engine.hist_items[hist[u]:hist[u + 1]]) for u in range(len(hist) - 1)]
+        item_users = [[] for _ in engine.item_ids]
+        for u, row in enumerate(user_items):
+            for item in row.tolist():
+                item_users[item].append(u)
+        item_users = [np.asarray(users, dtype=np.int64) for users in item_users]
+
+        print(f"\n{'query':<28} {'p50 ms':>8} {'p99 ms':>8} {'users/s':>9}")
+        runs = {
+            'on-the-fly co-occurrence': lambda u: on_the_fly(item_users, user_items, engine, u),
+            'engine': lambda u: engine.get_recommendations(u, {}),
+            'engine + preferences': lambda u: engine.get_recommendations(u, preferences),
+        }
+        for name, query in runs.items():
+            latencies = []
+            for user_id in user_ids:
+                t = time.perf_counter()
+                query(user_id)
+                latencies.append((time.perf_counter() - t) * 1000)
+            p50, p99 = percentiles(latencies)
+            print(f"{name:<28} {p50:>8.3f} {p99:>8.3f} {len(user_ids) / (sum(latencies) / 1000):>9.0f}")
+
+        for batch_size in (64, 512):
+            start = time.perf_counter()
+            for i in range(0, len(user_ids), batch_size):
+                engine.get_recommendations_batch(user_ids[i:i + batch_size], preferences)
+            elapsed = time.perf_counter() - start
+            print(f"{f'batch of {batch_size} + preferences':<28} {'':>8} {'':>8} {len(user_ids) / elapsed:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
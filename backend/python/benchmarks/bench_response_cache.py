@@ -0,0 +1,71 @@
+"""
+Response Cache Benchmark
+Replays a chat log with a skewed (Zipf-like) distribution of repeated
+questions through the /api/chat pipeline, with the response cache
+disabled and enabled, and reports per-message latency and hit rate
+
+Usage: python -m benchmarks.bench_response_cache [--messages N]
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.corpus import generate_messages
+
+
+def replay_log(count: int, distinct: int = 2000, seed: int = 3):
+    """``count`` messages drawn from ``distinct`` ones with a 1/rank skew"""
+    pool = generate_messages(distinct, seed=seed)
+    weights = [1 / (rank + 1) for rank in range(len(pool))]
+    rng = random.Random(seed)
+    return rng.choices(pool, weights=weights, k=count)
+
+
+def run(count: int):
+    from api.services import process_chat, services
+
+    log = replay_log(count)
+    for message in log[:100]:  # build services outside the timed loop
+        process_chat({'message': message, 'user_id': 'warmup'})
+
+    start = time.perf_counter()
+    for i, message in enumerate(log):
+        process_chat({'message': message, 'user_id': f'user-{i % 500}'})
+    elapsed = time.perf_counter() - start
+
+    stats = services.get('response_cache').stats()
+    print(json.dumps({'us_per_msg': elapsed / count * 1e6, 'hit_rate': stats['hit_rate']}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=50_000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run(args.messages)
+        return
+
+    results = {}
+    for label, size in (('no cache', '0'), ('cache', '10000')):
+        env = dict(os.environ, RESPONSE_CACHE_SIZE=size)
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_response_cache', '--child', '--messages', str(args.messages)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        results[label] = json.loads(output.strip().splitlines()[-1])
+        print(f"{label:<9} {results[label]['us_per_msg']:7.2f} us/msg  "
+              f"hit rate {results[label]['hit_rate']:.1%}")
+
+    saved = results['no cache']['us_per_msg'] - results['cache']['us_per_msg']
+    print(f"saved     {saved:7.2f} us/msg")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Serving Load Test
+Starts the Flask app (gunicorn, sync workers) and the ASGI app (uvicorn)
+locally and drives /api/chat with concurrent keep-alive clients, reporting
+requests per second and p50/p99 latency for each
+
+Usage: python -m benchmarks.bench_serving [--workers N] [--clients N] [--seconds S]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.corpus import generate_messages
+
+
+SERVERS = {
+    'flask': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+        '--workers', str(workers), '--log-level', 'warning', 'api.app:app',
+    ],
+    'asgi': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', 'api.asgi:app', '--host', '127.0.0.1',
+        '--port', str(port), '--workers', str(workers), '--log-level', 'warning',
+    ],
+}
+
+
+def server_env(tmp: str) -> dict:
+    """Measure the server, not the rate limiter, and keep its files out of the tree"""
+    return dict(
+        os.environ,
+        RATE_LIMIT_ENABLED='false',
+        ANALYTICS_PATH=os.path.join(tmp, 'analytics'),
+        PRODUCT_DB_PATH=os.path.join(tmp, 'products.sqlite3'),
+        ORDER_STATE_PATH=os.path.join(tmp, 'order_sessions.sqlite3'),
+        WEBHOOK_QUEUE_PATH=os.path.join(tmp, 'webhook_queue.sqlite3'),
+    )
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def load(port: int, clients: int, seconds: float, messages):
+    """Run ``clients`` keep-alive clients for ``seconds``; return latencies"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        i = offset
+        while time.monotonic() < stop_at:
+            body = json.dumps({'message': messages[i % len(messages)], 'user_id': f'user-{offset}'})
+            start = time.perf_counter()
+            try:
+                conn.request('POST', '/api/chat', body, {'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise RuntimeError(response.status)
+                local.append(time.perf_counter() - start)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            i += clients
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--server', choices=sorted(SERVERS), action='append')
+    args = parser.parse_args()
+
+    messages = generate_messages(1000)
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    for name in args.server or ['flask', 'asgi']:
+        port = free_port()
+        with tempfile.TemporaryDirectory() as tmp:
+            process = subprocess.Popen(SERVERS[name](port, args.workers), cwd=cwd, env=server_env(tmp))
+            try:
+                wait_for_port(port)
+                load(port, args.clients, 1, messages)  # warm up every worker
+                latencies, errors = load(port, args.clients, args.seconds, messages)
+            finally:
+                process.terminate()
+                process.wait()
+
+        if not latencies:
+            print(f"{name:<6} no successful requests ({errors} errors)")
+            continue
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        print(f"{name:<6} {len(latencies) / args.seconds:8.1f} req/s  "
+              f"p50 {p50:6.2f} ms  p99 {p99:6.2f} ms  errors {errors}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Speech-to-Text Benchmark
+Real-time factor (processing time / audio duration) and time to first
+partial transcript against audio length, for the old per-request,
+whole-file recognition and the pooled, segmented pipeline
+
+Uses FakeRecognizer with simulated model setup and CPU-bound decoding.
+Parallel speedup needs as many free cores as --processes.
+
+Usage: python -m benchmarks.bench_speech_to_text [--processes N] [--setup S] [--cpu-factor F]
+"""
+
+import argparse
+import io
+import os
+import time
+import wave
+
+import numpy as np
+
+
+def synthetic_speech(seconds: float, sample_rate: int = 16000, seed: int = 0) -> bytes:
+    """WAV bytes of voiced bursts (0.8-3 s) separated by low-level pauses"""
+    rng = np.random.default_rng(seed)
+    parts, total = [], 0.0
+    while total < seconds:
+        voiced, pause = rng.uniform(0.8, 3.0), rng.uniform(0.35, 0.8)
+        n = int(voiced * sample_rate)
+        tone = np.sin(np.arange(n) * 2 * np.pi * rng.uniform(120, 300) / sample_rate)
+        parts.append((tone * 8000 * (0.5 + rng.random(n) * 0.5)).astype(np.int16))
+        parts.append(rng.normal(0, 30, int(pause * sample_rate)).astype(np.int16))
+        total += voiced + pause
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.concatenate(parts).tobytes())
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--setup', type=float, default=0.5, help="Simulated recognizer setup seconds")
+    parser.add_argument('--cpu-factor', type=float, default=0.2, help="CPU seconds per audio second")
+    args = parser.parse_args()
+
+    # Read by FakeRecognizer, including in the spawned pool processes
+    os.environ['STT_FAKE_SETUP_SECONDS'] = str(args.setup)
+    os.environ['STT_FAKE_CPU_FACTOR'] = str(args.cpu_factor)
+
+    from services.speech_to_text import FakeRecognizer, RecognizerPool, SpeechToText, iter_pcm
+
+    pooled = SpeechToText(pool=RecognizerPool('fake', processes=args.processes))
+    # Build the pool (and its recognizers) once, as the first request would
+    pooled.transcribe(io.BytesIO(synthetic_speech(2)), 'ar-EG')
+
+    print(f"processes: {args.processes}  setup: {args.setup}s  cpu factor: {args.cpu_factor}")
+    print(f"{'audio s':>8} {'segments':>9} {'old RTF':>8} {'old first s':>12} "
+          f"{'pool RTF':>9} {'pool first s':>13}")
+
+    for seconds in (10, 30, 60, 120):
+        audio = synthetic_speech(seconds, seed=seconds)
+        duration = (len(audio) - 44) / 2 / 16000
+
+        # Before: new recognizer per request, whole upload buffered and
+        # recognized in one call
+        start = time.perf_counter()
+        recognizer = FakeRecognizer()
+        pcm = np.concatenate(list(iter_pcm(io.BytesIO(audio)))).tobytes()
+        recognizer(pcm, 16000, 'ar-EG')
+        old = time.perf_counter() - start
+
+        start = time.perf_counter()
+        first = None
+        segments = 0
+        for _ in pooled.transcribe_stream(io.BytesIO(audio), 'ar-EG'):
+            if first is None:
+                first = time.perf_counter() - start
+            segments += 1
+        new = time.perf_counter() - start
+
+        print(f"{duration:>8.1f} {segments:>9} {old / duration:>8.3f} {old:>12.2f} "
+              f"{new / duration:>9.3f} {first:>13.2f}")
+
+    pooled.pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
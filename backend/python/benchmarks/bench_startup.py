@@ -0,0 +1,72 @@
+"""
+API Startup Benchmark
+Reports app import time and, per service, import time, construction time
+and RSS growth, each measured in a fresh interpreter
+
+Usage: python -m benchmarks.bench_startup [--service NAME ...]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+
+PROBE = '''
+import json, sys, time
+from utils.service_registry import current_rss
+rss_before = current_rss()
+start = time.perf_counter()
+from api.app import services
+result = {"app_import_seconds": time.perf_counter() - start,
+          "app_rss_bytes": current_rss(), "app_rss_delta_bytes": current_rss() - rss_before}
+name = sys.argv[1]
+if name == "--names":
+    result["names"] = services.names
+elif name == "--warmup":
+    start = time.perf_counter()
+    services.warmup()
+    result["warmup_seconds"] = time.perf_counter() - start
+    result["rss_bytes"] = current_rss()
+else:
+    services.get(name)
+    result.update(services.timings[name])
+print(json.dumps(result))
+'''
+
+
+def probe(arg: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, arg],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--service', action='append', help='only measure these services')
+    args = parser.parse_args()
+
+    baseline = probe('--names')
+    print(f"app import: {baseline['app_import_seconds'] * 1000:8.1f} ms  "
+          f"rss {baseline['app_rss_bytes'] / 2**20:7.1f} MiB")
+    print(f"{'service':<24} {'import ms':>10} {'init ms':>10} {'rss +MiB':>10}")
+
+    for name in args.service or baseline['names']:
+        try:
+            timing = probe(name)
+        except subprocess.CalledProcessError as e:
+            print(f"{name:<24} failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{name:<24} {timing['import_seconds'] * 1000:>10.1f} "
+              f"{timing['init_seconds'] * 1000:>10.1f} "
+              f"{timing['rss_delta_bytes'] / 2**20:>10.2f}")
+
+    warm = probe('--warmup')
+    print(f"warmup all: {warm['warmup_seconds'] * 1000:8.1f} ms  "
+          f"rss {warm['rss_bytes'] / 2**20:7.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+User Management Benchmark
+Logins per second from concurrent clients against in-memory and file
+SQLite stores, with bcrypt run inline on the request threads and in the
+bounded process pool; signups per second with and without batched
+inserts; token authentication with and without the profile cache; and
+how a login burst past the pool's capacity is shed
+
+Usage: python -m benchmarks.bench_user_management [--users N] [--logins N] [--clients N] [--rounds N]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from database.user_management import (
+    HasherBusy, PasswordHasher, SQLiteUserStore, UserManagement, check_password, hash_password,
+)
+
+
+# Long enough for HS256 without PyJWT's short-key warning
+SECRET = 'bench-user-management-secret-0123456789'
+
+
+class InlineHasher(PasswordHasher):
+    """bcrypt on the calling thread, as a plain implementation would do it"""
+
+    def _run(self, fn, *args):
+        return fn(*args)
+
+
+class NoHashing(InlineHasher):
+    """Times the inserts alone"""
+
+    def hash(self, password):
+        return 'not-hashed'
+
+
+class RoundTrip:
+    """A store whose calls also wait ``latency`` seconds, like a remote database"""
+
+    def __init__(self, store, latency):
+        self.store = store
+        self.latency = latency
+
+    def __len__(self):
+        return len(self.store)
+
+    def insert_many(self, users):
+        time.sleep(self.latency)
+        return self.store.insert_many(users)
+
+    def get(self, user_id):
+        time.sleep(self.latency)
+        return self.store.get(user_id)
+
+    def find_by_email(self, email):
+        time.sleep(self.latency)
+        return self.store.find_by_email(email)
+
+
+def concurrently(clients, count, fn):
+    """Run ``fn(i)`` for i in range(count) from ``clients`` threads; (seconds, errors)"""
+    next_index = iter(range(count))
+    lock = threading.Lock()
+    errors = []
+
+    def client():
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            try:
+                fn(i)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--logins', type=int, default=400)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=10, help='bcrypt cost (production default 12)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    hashed = hash_password('warm-up-password', args.rounds)
+    check_password('warm-up-password', hashed)
+    print(f"bcrypt cost {args.rounds}: {(time.perf_counter() - start) / 2 * 1000:.0f} ms per hash on this CPU "
+          f"({os.cpu_count()} CPUs), {args.clients} clients")
+
+    tmp = tempfile.mkdtemp(prefix='bench-users-')
+    password = 'correct horse battery'
+    try:
+        for store_label, make_store in (
+            ('in-memory SQLite', lambda: SQLiteUserStore(':memory:')),
+            ('SQLite file', lambda: SQLiteUserStore(os.path.join(tmp, f'users-{time.monotonic_ns()}.sqlite3'))),
+        ):
+            for hasher_label, hasher in (
+                ('inline', InlineHasher(rounds=args.rounds)),
+                (f'process pool x{args.workers}', PasswordHasher(workers=args.workers, rounds=args.rounds,
+                                                                 max_pending=args.clients * 2)),
+            ):
+                users = UserManagement(store=make_store(), hasher=hasher, secret=SECRET)
+                # Warm the pool up so process start-up is not timed
+                hasher.hash(password)
+                elapsed, errors = concurrently(args.clients, args.users, lambda i: users.create_user(
+                    {'name': f'User {i}', 'email': f'user{i}@example.com', 'password': password}
+                ))
+                signups = args.users / elapsed
+                elapsed, errors = concurrently(args.clients, args.logins, lambda i: users.login(
+                    f'user{i % args.users}@example.com', password
+                ))
+                print(f"{store_label:<17} {hasher_label:<17} signups {signups:6.1f}/s   "
+                      f"logins {args.logins / elapsed:6.1f}/s   errors {len(errors)}   "
+                      f"insert batches avg {users.inserts.stats()['avg_batch_size']:.1f} users")
+                users.close()
+
+        # Inserts alone: one write per signup against batches of concurrent
+        # signups, locally and with a database round trip per insert
+        print()
+        for latency in (0.0, 0.001):
+            for batch_size in (1, 100):
+                store = SQLiteUserStore(os.path.join(tmp, f'inserts-{latency}-{batch_size}.sqlite3'))
+                if latency:
+                    store = RoundTrip(store, latency)
+                users = UserManagement(store=store, hasher=NoHashing(), secret=SECRET, batch_size=batch_size)
+                count = 5000
+                elapsed, errors = concurrently(args.clients, count, lambda i: users.create_user(
+                    {'email': f'user{i}@example.com', 'password': password}
+                ))
+                if errors:
+                    raise RuntimeError(f"{len(errors)} of {count} signups failed, e.g. {errors[0]!r}")
+                print(f"inserts only, SQLite file + {latency * 1000:.0f} ms round trip, batch {batch_size:>3}: "
+                      f"{count / elapsed:8.0f} users/s, avg batch {users.inserts.stats()['avg_batch_size']:.1f}")
+
+        # Authenticated requests: decode the JWT, then the profile
+        print()
+        store = SQLiteUserStore(os.path.join(tmp, 'auth.sqlite3'))
+        for label, ttl in (('no profile cache', 0), ('profile cache 30s', 30)):
+            users = UserManagement(store=store, hasher=InlineHasher(rounds=4), secret=SECRET, profile_ttl=ttl)
+            if not len(store):
+                for i in range(1000):
+                    users.create_user({'email': f'user{i}@example.com', 'password': password})
+            tokens = [users.login(f'user{i}@example.com', password)['access_token'] for i in range(1000)]
+            count = 20_000
+            start = time.perf_counter()
+            for i in range(count):
+                users.authenticate(tokens[i % len(tokens)])
+            elapsed = time.perf_counter() - start
+            stats = users.stats()
+            print(f"authenticate, {label:<18} {elapsed / count * 1e6:6.1f} us/request, "
+                  f"store reads {stats['profile_misses']} (hit rate {stats['profile_hit_rate']:.3f})")
+
+        # A burst far past the pool's capacity is shed instead of queued
+        print()
+        hasher = PasswordHasher(workers=args.workers, rounds=args.rounds, max_pending=args.workers * 4)
+        users = UserManagement(store=SQLiteUserStore(':memory:'), hasher=hasher, secret=SECRET)
+        users.create_user({'email': 'burst@example.com', 'password': password})
+        burst = args.clients * 8
+        latencies = []
+
+        def login(i):
+            start = time.perf_counter()
+            users.login('burst@example.com', password)
+            latencies.append(time.perf_counter() - start)
+
+        elapsed, errors = concurrently(burst, burst, login)
+        busy = sum(isinstance(e, HasherBusy) for e in errors)
+        latencies.sort()
+        print(f"burst of {burst} logins, max_pending {hasher.max_pending}: {len(latencies)} served "
+              f"(p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0:.0f} ms), "
+              f"{busy} answered 503 at once, {len(errors) - busy} other errors")
+        users.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Synthetic Chat Corpus
+Deterministic Egyptian-dialect chat messages for offline benchmarks
+"""
+
+import random
+from typing import List
+
+
+OPENERS = [
+    'السلام عليكم', 'ازيك', 'عامل ايه', 'صباح الخير', 'مساء الخير', 'أهلا', '',
+]
+
+BODIES = [
+    'عايز هدوم للعيد',
+    'محتاج حاجة حلوة للشغل',
+    'بكام التيشيرت ده',
+    'بقد ايه الفستان الأحمر',
+    'الطلب بتاعي فين',
+    'الأوردر رقم #12345 وصل فين',
+    'الشحنة متأخرة ليه',
+    'عندكم مقاس لارج',
+    'المنتج ده متوفر ولا لأ',
+    'في مشكلة في الطلب',
+    'الجزمة جت غلط وانا زعلان',
+    'ينفع الدفع فودافون كاش',
+    'الدفع كاش عند الاستلام ممكن',
+    'التوصيل لاسكندرية بياخد قد ايه',
+    'الشحن مجاني ولا لأ',
+    'عايز استبدال المقاس',
+    'ازاي اعمل ارجاع للمنتج',
+    'ممكن اعرف سعر الشنطة',
+    'امتى يوصل الأوردر',
+    'ايوه تمام',
+]
+
+CLOSERS = [
+    'شكرا', 'مع السلامة', 'ربنا يخليك', 'يا سلام', 'تمام كده', '', '',
+]
+
+
+def generate_messages(count: int, seed: int = 42) -> List[str]:
+    """Generate ``count`` synthetic chat messages"""
+    rng = random.Random(seed)
+    messages = []
+
+    for _ in range(count):
+        parts = [rng.choice(OPENERS), rng.choice(BODIES), rng.choice(CLOSERS)]
+        # Sprinkle diacritics and extra whitespace like real user input
+        if rng.random() < 0.1:
+            parts[1] = parts[1].replace('ا', 'اَ', 1)
+        messages.append('  '.join(p for p in parts if p))
+
+    return messages
+
+
+PRODUCTS = [
+    'القميص', 'البنطلون', 'الفستان', 'الجاكيت', 'التيشيرت', 'الجزمة', 'الشنطة',
+    'البلوزة', 'الجيبة', 'البدلة', 'الكوتشي', 'الساعة', 'النضارة', 'الطرحة',
+    'الشورت', 'البيجامة', 'الكارديجان', 'الهودي', 'الصندل', 'الحزام',
+]
+
+CATEGORIES_AR = ['رجالي', 'حريمي', 'أطفال', 'أحذية', 'شنط', 'إكسسوارات', 'رياضي', 'ملابس بيت']
+
+COLORS = ['الأحمر', 'الأزرق', 'الأسود', 'الأبيض', 'الأخضر', 'البيج', 'الرمادي', 'الكحلي']
+
+CITIES = [
+    'القاهرة', 'الجيزة', 'الإسكندرية', 'المنصورة', 'طنطا', 'أسيوط', 'سوهاج',
+    'الأقصر', 'أسوان', 'بورسعيد', 'السويس', 'الإسماعيلية', 'دمياط', 'الفيوم',
+    'بني سويف', 'المنيا', 'قنا', 'الزقازيق', 'شبين الكوم', 'كفر الشيخ',
+]
+
+PAYMENTS = ['فودافون كاش', 'فيزا', 'ماستركارد', 'انستاباي', 'فوري', 'الدفع عند الاستلام']
+
+# (standard question, Egyptian-dialect paraphrase); the dialect words are
+# the ones EgyptianNLP maps back to the standard form
+FAQ_TEMPLATES = [
+    ('بكم {product} {color}', 'بكام {product} {color}'),
+    ('متى يصل {product} {color} إلى {city}', 'امتى يوصل {product} {color} {city}'),
+    ('أين طلب {product} {color}', 'فين طلب {product} {color}'),
+    ('هل يمكن الدفع {payment} عند شراء {product}', 'ينفع ادفع {payment} لو اشتريت {product}'),
+    ('أريد استبدال مقاس {product} {color}', 'عايز استبدال مقاس {product} {color}'),
+    ('كيف أرجع {product} بعد الشحن إلى {city}', 'ازاي ارجع {product} بعد الشحن {city}'),
+    ('لماذا تأخر شحن {product} إلى {city}', 'ليه اتأخر شحن {product} {city}'),
+    ('هل {product} {color} متوفر في فرع {city}', 'هو {product} {color} متوفر فرع {city}'),
+]
+
+
+def generate_faq(count: int, seed: int = 42):
+    """
+    Generate ``count`` FAQ entries and one dialect query per entry.
+
+    Returns ``(entries, queries)`` where entries are ``{id, question,
+    answer}`` dicts and ``queries[i]`` paraphrases ``entries[i]`` in dialect,
+    sometimes with a dropped word or spelling variants.
+    """
+    rng = random.Random(seed)
+    entries, queries, seen = [], [], set()
+
+    while len(entries) < count:
+        question, paraphrase = rng.choice(FAQ_TEMPLATES)
+        slots = {
+            'product': rng.choice(PRODUCTS),
+            'color': rng.choice(COLORS),
+            'city': rng.choice(CITIES),
+            'payment': rng.choice(PAYMENTS),
+        }
+        question = question.format(**slots)
+        if question in seen:
+            continue
+        seen.add(question)
+
+        query = paraphrase.format(**slots).split()
+        if rng.random() < 0.2 and len(query) > 3:
+            del query[rng.randrange(1, len(query))]
+        query = ' '.join(query)
+        if rng.random() < 0.3:
+            query = query.replace('أ', 'ا').replace('إ', 'ا').replace('ة', 'ه')
+        if rng.random() < 0.3:
+            query = 'لو سمحت ' + query + ' ؟'
+
+        entries.append({
+            'id': str(len(entries)),
+            'question': question,
+            'answer': f"إجابة السؤال رقم {len(entries)}",
+        })
+        queries.append(query)
+
+    return entries, queries
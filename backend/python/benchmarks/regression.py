@@ -0,0 +1,394 @@
+"""
+Performance Regression Suite
+Replays the synthetic chat corpus through each pipeline component and
+through /api/chat on the Flask test client, recording per-stage throughput,
+p50/p99 latency (the best of --repeat passes, which other load on the
+machine can only make worse) and peak memory. Results are compared against
+a JSON baseline and the run exits with status 1 when a stage regresses past
+its threshold, which is widened to twice the run-to-run spread measured for
+that stage; a stage that fails is measured once more before it counts, so
+noise alone does not fail the gate. Runs offline on CPU: every store is in-process or in a temporary
+directory. tests/test_performance_regression.py runs the same gate under
+pytest.
+
+Baselines are machine-specific and are not committed: record one with
+--save on the machine that runs the gate (e.g. the CI runner, with
+REGRESSION_BASELINE pointing at a cached path). A baseline from another
+machine is reported but not compared.
+
+Usage: python -m benchmarks.regression [--messages N] [--repeat N] [--memory-messages N]
+                                       [--threshold F] [--baseline PATH] [--save] [--stages a,b]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.corpus import CITIES, PRODUCTS, generate_messages
+
+DEFAULT_BASELINE = os.getenv(
+    'REGRESSION_BASELINE', os.path.join(os.path.dirname(__file__), 'baselines', 'regression.json')
+)
+BASELINE_VERSION = 3
+# Memory changes smaller than this are noise whatever the ratio
+MIN_MEMORY_DELTA_KIB = 64
+# A slowdown counts only past this multiple of the measured run-to-run spread
+NOISE_FACTOR = 2.0
+# Stages past their thresholds are measured this many more times before failing
+CONFIRM_RUNS = 1
+MEMORY_MESSAGES = 1000
+THRESHOLD = 0.25
+P99_THRESHOLD = 0.5
+MEMORY_THRESHOLD = 0.25
+
+
+# Stages: name -> setup(messages, tmp) returning (fn, items) ---------------------
+
+def nlp_process(messages, tmp):
+    from nlp.egyptian_nlp import EgyptianNLP
+    return EgyptianNLP().process, messages
+
+
+def nlp_extract_entities(messages, tmp):
+    from nlp.egyptian_nlp import EgyptianNLP
+    return EgyptianNLP().extract_entities, messages
+
+
+def intent_detect(messages, tmp):
+    from nlp.egyptian_intent_handler import EgyptianIntentHandler
+    from nlp.egyptian_nlp import EgyptianNLP
+    nlp = EgyptianNLP()
+    return EgyptianIntentHandler(nlp).detect_intent, [nlp.process(m) for m in messages]
+
+
+def chatbot_generate(messages, tmp):
+    from chatbot.enhanced_chatbot_engine import EnhancedChatbotEngine
+    from chatbot.response_cache import ResponseCache
+    from chatbot.session_store import LocalSessionStore
+    from nlp.egyptian_intent_handler import EgyptianIntentHandler
+    from nlp.egyptian_nlp import EgyptianNLP
+    nlp = EgyptianNLP()
+    intents = EgyptianIntentHandler(nlp)
+    engine = EnhancedChatbotEngine(session_store=LocalSessionStore(), response_cache=ResponseCache())
+    items = []
+    for i, message in enumerate(messages):
+        processed = nlp.process(message)
+        items.append((processed, f'user-{i % 500}', intents.detect_intent(processed)))
+    return lambda item: engine.generate_response(item[0], item[1], item[2]), items
+
+
+def orders_turn(messages, tmp):
+    from nlp.egyptian_nlp import EgyptianNLP
+    from services.order_collection_system import OrderCollectionSystem
+    system = OrderCollectionSystem(nlp=EgyptianNLP())
+    rng = random.Random(3)
+    script = ['عايز اطلب {product}', 'XL', '2', '{city}', 'مدينة نصر شارع {n} عمارة 4', 'فودافون كاش',
+              'غير العنوان', 'شارع التحرير {n} الدور التالت', 'لا', 'الدفع كاش']
+    # Conversations interleaved across users, as they arrive in production
+    users = max(1, len(messages) // len(script))
+    items = []
+    for turn in range(len(script)):
+        for user in range(users):
+            text = script[turn].format(product=PRODUCTS[user % len(PRODUCTS)], city=CITIES[user % len(CITIES)],
+                                       n=rng.randrange(1, 200))
+            items.append((f'user-{user}', text))
+    # As in process_chat: the open order first, then a request to start one
+    return lambda item: system.handle(*item) or system.start(*item), items[:len(messages)]
+
+
+def product_search(messages, tmp):
+    from benchmarks.bench_product_search import make_catalog, make_queries
+    from services.product_search import ProductSearchIndex
+    rng = random.Random(11)
+    catalog = make_catalog(5000, rng)
+    index = ProductSearchIndex()
+    index.upsert_many(catalog)
+    queries = [text for _, text, _ in make_queries(catalog, min(len(messages), 2000), rng)]
+    return index.search, (queries * (len(messages) // len(queries) + 1))[:len(messages)]
+
+
+def api_chat(messages, tmp):
+    # Everything the app would reach over the network or on disk stays local
+    os.environ.update({
+        'ANALYTICS_PATH': os.path.join(tmp, 'analytics'),
+        'PRODUCT_DB_PATH': os.path.join(tmp, 'products.sqlite3'),
+        'WEBHOOK_QUEUE_PATH': ':memory:',
+        'ORDER_STATE_STORE': 'memory',
+        'SESSION_STORE': 'local',
+        'RATE_LIMIT_ENABLED': 'false',
+        'MONITORING_DIR': '',
+        'MONITORING_SLOW_REQUEST_MS': '0',
+        'PRODUCT_SYNC_SOURCE': '',
+        'CHATBOT_USE_MODEL': 'false',
+    })
+    import logging
+    from api.app import app
+    logging.getLogger().setLevel(logging.WARNING)
+    client = app.test_client()
+    items = [{'message': m, 'user_id': f'user-{i % 500}'} for i, m in enumerate(messages)]
+
+    def post(body):
+        response = client.post('/api/chat', json=body)
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/chat returned {response.status_code}: {response.get_data(as_text=True)}")
+    return post, items
+
+
+STAGES = {
+    'nlp.process': nlp_process,
+    'nlp.extract_entities': nlp_extract_entities,
+    'intent.detect': intent_detect,
+    'chatbot.generate': chatbot_generate,
+    'orders.turn': orders_turn,
+    'product_search.search': product_search,
+    'api.chat': api_chat,
+}
+
+
+# Measurement ------------------------------------------------------------------
+
+def measure(fn, items, repeat, memory_items):
+    """
+    The best of ``repeat`` timed passes, their spread (max - min over the
+    best, for throughput/p50 and for p99), then one traced pass for peak
+    memory
+    """
+    for item in items[:200]:
+        fn(item)
+    runs = []
+    for _ in range(repeat):
+        latencies = []
+        clock = time.perf_counter
+        started = clock()
+        for item in items:
+            start = clock()
+            fn(item)
+            latencies.append(clock() - start)
+        elapsed = clock() - started
+        latencies.sort()
+        runs.append({
+            'throughput': len(items) / elapsed,
+            'p50_us': latencies[len(latencies) // 2] * 1e6,
+            'p99_us': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6,
+        })
+    result = {
+        'throughput': max(run['throughput'] for run in runs),
+        'p50_us': min(run['p50_us'] for run in runs),
+        'p99_us': min(run['p99_us'] for run in runs),
+    }
+    spread = {metric: (max(run[metric] for run in runs) - min(run[metric] for run in runs)) / result[metric]
+              for metric in result}
+    result['noise'] = max(spread['throughput'], spread['p50_us'])
+    result['p99_noise'] = spread['p99_us']
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for item in items[:memory_items]:
+        fn(item)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    result['peak_kib'] = max(0.0, peak / 1024)
+    return {key: round(value, 3 if 'noise' in key else 2) for key, value in result.items()}
+
+
+def run(names: List[str], messages: int, repeat: int, memory_messages: int) -> Dict[str, Dict]:
+    """Measure ``names`` stages over a corpus of ``messages``"""
+    corpus = generate_messages(messages)
+    tmp = tempfile.mkdtemp(prefix='bench-regression-')
+    # Stages such as api.chat configure the app through the environment
+    environ = dict(os.environ)
+    results = {}
+    try:
+        for name in names:
+            fn, items = STAGES[name](corpus, tmp)
+            results[name] = measure(fn, items, repeat, memory_messages)
+    finally:
+        if 'api.chat' in names and 'api.services' in sys.modules:
+            # Write the app's buffered analytics before their directory goes
+            sys.modules['api.services'].services.get('analytics').flush()
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.environ.clear()
+        os.environ.update(environ)
+    return results
+
+
+def check(baseline: Dict, names: List[str], confirm_runs: int = CONFIRM_RUNS,
+          **thresholds) -> Tuple[Dict[str, Dict], List[Tuple]]:
+    """
+    Run ``names`` with the baseline's settings and compare; stages past
+    their thresholds are measured again (up to ``confirm_runs`` times),
+    keeping the better result, before they count as regressions
+    """
+    settings = (baseline['messages'], baseline.get('repeat', 5), baseline['memory_messages'])
+    results = run(names, *settings)
+    regressions = compare(results, baseline, **thresholds)
+    for _ in range(confirm_runs):
+        if not regressions:
+            break
+        again = run(sorted({regression[0] for regression in regressions}), *settings)
+        for stage, current in again.items():
+            results[stage] = _better(results[stage], current)
+        regressions = compare(results, baseline, **thresholds)
+    return results, regressions
+
+
+def _better(first: Dict, second: Dict) -> Dict:
+    return {
+        'throughput': max(first['throughput'], second['throughput']),
+        'p50_us': min(first['p50_us'], second['p50_us']),
+        'p99_us': min(first['p99_us'], second['p99_us']),
+        'peak_kib': min(first['peak_kib'], second['peak_kib']),
+        'noise': max(first['noise'], second['noise']),
+        'p99_noise': max(first['p99_noise'], second['p99_noise']),
+    }
+
+
+def load_baseline(path: str) -> Optional[Dict]:
+    """The baseline at ``path`` if it exists and was recorded on this machine"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('version') != BASELINE_VERSION or baseline.get('machine') != machine():
+        return None
+    return baseline
+
+
+def save_baseline(path: str, results: Dict[str, Dict], messages: int, repeat: int, memory_messages: int):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': BASELINE_VERSION,
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'machine': machine(),
+            'messages': messages,
+            'repeat': repeat,
+            'memory_messages': memory_messages,
+            'stages': results,
+        }, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(results, baseline, threshold=THRESHOLD, p99_threshold=P99_THRESHOLD,
+            memory_threshold=MEMORY_THRESHOLD) -> List[Tuple[str, str, float, float, float, float]]:
+    """``[(stage, metric, baseline, current, change, allowed)]`` past their thresholds"""
+    regressions = []
+    for stage, current in results.items():
+        before = baseline.get('stages', {}).get(stage)
+        if not before:
+            continue
+        # The noisier of the two runs sets how much change is noise
+        noise = NOISE_FACTOR * max(before['noise'], current['noise'])
+        p99_noise = NOISE_FACTOR * max(before['p99_noise'], current['p99_noise'])
+        checks = (
+            # (metric, change where positive is worse, allowed)
+            ('throughput', before['throughput'] / max(current['throughput'], 1e-9) - 1, max(threshold, noise)),
+            ('p50_us', current['p50_us'] / max(before['p50_us'], 1e-9) - 1, max(threshold, noise)),
+            ('p99_us', current['p99_us'] / max(before['p99_us'], 1e-9) - 1, max(p99_threshold, p99_noise)),
+        )
+        for metric, change, allowed in checks:
+            if change > allowed:
+                regressions.append((stage, metric, before[metric], current[metric], change, allowed))
+        grown = current['peak_kib'] - before['peak_kib']
+        if grown > MIN_MEMORY_DELTA_KIB and grown / max(before['peak_kib'], 1e-9) > memory_threshold:
+            regressions.append((stage, 'peak_kib', before['peak_kib'], current['peak_kib'],
+                                grown / max(before['peak_kib'], 1e-9), memory_threshold))
+    return regressions
+
+
+def report(results, baseline):
+    stages = baseline.get('stages', {}) if baseline else {}
+    print(f"{'stage':<24} {'msgs/s':>10} {'p50 us':>9} {'p99 us':>9} {'peak KiB':>10} {'noise':>6}   vs baseline")
+    for stage, current in results.items():
+        line = (f"{stage:<24} {current['throughput']:>10.0f} {current['p50_us']:>9.1f} "
+                f"{current['p99_us']:>9.1f} {current['peak_kib']:>10.0f} {current['noise'] * 100:>5.0f}%")
+        before = stages.get(stage)
+        if before:
+            line += (f"   {_change(before['throughput'], current['throughput'])} msgs/s"
+                     f", {_change(before['p50_us'], current['p50_us'])} p50"
+                     f", {_change(before['p99_us'], current['p99_us'])} p99"
+                     f", {_change(before['peak_kib'], current['peak_kib'])} mem")
+        print(line)
+
+
+def _change(before, current):
+    return f"{(current / before - 1) * 100:+.0f}%" if before else 'n/a'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=5000, help='corpus messages replayed per stage')
+    parser.add_argument('--repeat', type=int, default=5, help='timed passes per stage; the best is compared')
+    parser.add_argument('--memory-messages', type=int, default=MEMORY_MESSAGES, help='messages in the traced pass')
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma-separated subset of stages')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='defaults to $REGRESSION_BASELINE')
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='allowed slowdown of throughput and p50 (0.25 = 25%%), or twice the noise if higher')
+    parser.add_argument('--p99-threshold', type=float, default=P99_THRESHOLD, help='allowed p99 slowdown')
+    parser.add_argument('--memory-threshold', type=float, default=MEMORY_THRESHOLD, help='allowed peak memory growth')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.stages.split(',') if name.strip()]
+    unknown = [name for name in names if name not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)} (known: {', '.join(STAGES)})")
+
+    baseline = load_baseline(args.baseline)
+    settings = (args.messages, args.repeat, args.memory_messages)
+    comparable = baseline is not None and settings == (
+        baseline['messages'], baseline.get('repeat', 5), baseline['memory_messages']
+    )
+
+    if args.save:
+        results = run(names, *settings)
+        report(results, baseline if comparable else None)
+        if comparable:
+            # Stages not run this time keep their recorded numbers
+            results = dict(baseline['stages'], **results)
+        save_baseline(args.baseline, results, *settings)
+        print(f"\nbaseline saved to {args.baseline}")
+        return 0
+
+    if not comparable:
+        report(run(names, *settings), None)
+        if baseline is None:
+            print(f"\nno baseline for this machine ({machine()}) at {args.baseline}; record one here with --save")
+        else:
+            print(f"\nbaseline recorded with --messages {baseline['messages']} --repeat {baseline.get('repeat', 5)} "
+                  f"--memory-messages {baseline['memory_messages']}; not compared")
+        return 0
+
+    results, regressions = check(baseline, names, threshold=args.threshold, p99_threshold=args.p99_threshold,
+                                 memory_threshold=args.memory_threshold)
+    report(results, baseline)
+    if not regressions:
+        print("\nno regressions")
+        return 0
+    print(f"\n{len(regressions)} regression(s):")
+    for stage, metric, before, current, change, allowed in regressions:
+        print(f"  {stage:<24} {metric:<11} {before:>10.1f} -> {current:>10.1f}  "
+              f"({change * 100:+.0f}% worse, {allowed * 100:.0f}% allowed)")
+    return 1
+
+
+def machine():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': f'{platform.system()}-{platform.machine()}',
+        'cpus': os.cpu_count(),
+    }
+
+
+if __name__ == '__main__':
+    sys.exit(main())
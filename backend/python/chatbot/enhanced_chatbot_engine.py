@@ -5,9 +5,13 @@ Supports Egyptian Arabic dialect and multiple intents
 """
 
 import os
+import threading
+import time
 from typing import Dict, List, Optional
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch
+
+from chatbot.inference_batcher import MicroBatcher, TransformerGenerator, batcher_from_env
+from chatbot.response_cache import ResponseCache, cacheable, response_cache_from_env
+from chatbot.session_store import SessionStore, create_session_store
 
 
 class EnhancedChatbotEngine:
@@ -21,10 +25,27 @@ class EnhancedChatbotEngine:
     - Order tracking
     """
     
-    def __init__(self):
+    def __init__(
+        self,
+        session_store: Optional[SessionStore] = None,
+        response_cache: Optional[ResponseCache] = None,
+        product_search=None,
+    ):
         self.model_name = os.getenv('CHATBOT_MODEL', 'aubmindlab/bert-base-arabertv2')
-        self.conversation_history = {}
+        self.use_model = os.getenv('CHATBOT_USE_MODEL', 'false').lower() == 'true'
+        # transformers/torch are only imported when a model is first needed
+        self._model = None
+        self._tokenizer = None
+        self._model_lock = threading.RLock()
+        self._batcher: Optional[MicroBatcher] = None
+        self.model_timeout = float(os.getenv('CHATBOT_MODEL_TIMEOUT', 10))
         self.max_history = 10
+        # Bounded, evicting per-user history (local or shared via Redis)
+        self.sessions = session_store or create_session_store(max_history=self.max_history)
+        # Replies of @cacheable handlers, keyed on intent and normalized message
+        self.response_cache = response_cache or response_cache_from_env()
+        # Catalog search (services.product_search) for product and price questions
+        self.product_search = product_search
         
         # Intent response templates
         self.response_templates = {
@@ -40,6 +61,51 @@ class EnhancedChatbotEngine:
             'farewell': self._handle_farewell,
         }
         
+    @property
+    def model(self):
+        """Causal LM, loaded on first access"""
+        if self._model is None:
+            self.load_model()
+        return self._model
+    
+    @property
+    def tokenizer(self):
+        """Tokenizer matching ``model``, loaded on first access"""
+        if self._tokenizer is None:
+            self.load_model()
+        return self._tokenizer
+    
+    def load_model(self):
+        """Load the tokenizer and model weights (once per process)"""
+        with self._model_lock:
+            if self._model is not None:
+                return
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+            
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModelForCausalLM.from_pretrained(self.model_name)
+            model.eval()
+            self._model = model
+    
+    @property
+    def batcher(self) -> MicroBatcher:
+        """Micro-batcher that runs concurrent model requests as one batch"""
+        if self._batcher is None:
+            with self._model_lock:
+                if self._batcher is None:
+                    generator = TransformerGenerator(
+                        self.model,
+                        self.tokenizer,
+                        max_new_tokens=int(os.getenv('CHATBOT_MAX_NEW_TOKENS', 48)),
+                    )
+                    self._batcher = batcher_from_env(generator)
+        return self._batcher
+    
+    def warmup(self):
+        """Load model weights ahead of time (pre-fork warmup)"""
+        if self.use_model:
+            self.load_model()
+    
     def generate_response(
         self,
         message: str,
@@ -55,7 +121,14 @@ class EnhancedChatbotEngine:
         
         # Get response based on intent
         if intent and intent in self.response_templates:
-            response = self.response_templates[intent](message, user_id, context)
+            handler = self.response_templates[intent]
+            if getattr(handler, 'cacheable', False) and context is None:
+                response = self.response_cache.get_or_set(
+                    'chat', intent, language, message,
+                    compute=lambda: handler(message, user_id, context),
+                )
+            else:
+                response = handler(message, user_id, context)
         else:
             response = self._generate_default_response(message, user_id, language)
         
@@ -64,6 +137,23 @@ class EnhancedChatbotEngine:
         
         return response
     
+    def set_template(self, intent: str, handler):
+        """Register or replace an intent handler, invalidating cached replies"""
+        self.response_templates[intent] = handler
+        self.response_cache.invalidate('chat')
+    
+    def _find_products(self, message: str, limit: int = 3) -> str:
+        """Catalog matches for the message as reply lines (not cached: prices and stock change)"""
+        if self.product_search is None:
+            return ''
+        lines = []
+        for product in self.product_search.search(message, limit=limit):
+            name = product.get('nameAr') or product.get('name')
+            price = f" - {product['price']} جنيه" if product.get('price') is not None else ''
+            stock = ' (غير متوفر حالياً)' if product.get('stock') == 0 else ''
+            lines.append(f"• {name}{price}{stock}")
+        return '\n'.join(lines)
+    
     def _handle_greeting(self, message: str, user_id: str, context: Dict = None) -> str:
         """Handle greeting intents"""
         greetings = [
@@ -76,32 +166,44 @@ class EnhancedChatbotEngine:
     
     def _handle_product_inquiry(self, message: str, user_id: str, context: Dict = None) -> str:
         """Handle product inquiry intents"""
+        found = self._find_products(message)
+        if found:
+            return "لقيتلك المنتجات دي:\n" + found
         return "عندنا مجموعة كبيرة من المنتجات. عايز تعرف عن منتج معين؟ قولي عايز إيه وهقولك كل حاجة عنه."
     
+    @cacheable
     def _handle_order_status(self, message: str, user_id: str, context: Dict = None) -> str:
         """Handle order status intents"""
         return "عشان أتابع طلبك، ممكن تديني رقم الطلب؟ أو لو عارف الإيميل اللي سجلت بيه، هقدر أجيب كل طلباتك."
     
+    @cacheable
     def _handle_complaint(self, message: str, user_id: str, context: Dict = None) -> str:
         """Handle complaint intents"""
         return "أنا آسف جداً للمشكلة اللي حصلت. ممكن تقولي تفاصيل المشكلة عشان أقدر أساعدك؟ راحتك وسعادتك مهمة جداً بالنسبالنا."
     
     def _handle_price_inquiry(self, message: str, user_id: str, context: Dict = None) -> str:
         """Handle price inquiry intents"""
+        found = self._find_products(message)
+        if found:
+            return "دي أسعار المنتجات اللي تقصدها:\n" + found
         return "أسعارنا تنافسية جداً! قولي على المنتج اللي عايز تعرف سعره وهقولك كل التفاصيل والعروض المتاحة."
     
+    @cacheable
     def _handle_availability(self, message: str, user_id: str, context: Dict = None) -> str:
         """Handle availability intents"""
         return "عشان أتأكد من توفر المنتج، ممكن تقولي اسمه أو رقمه؟ وهشوف ليك المخزون فوراً."
     
+    @cacheable
     def _handle_payment(self, message: str, user_id: str, context: Dict = None) -> str:
         """Handle payment intents"""
         return "عندنا طرق دفع كتير: نقدي عند الاستلام، فيزا، فودافون كاش، وإنستاباي. أي طريقة تريحك؟"
     
+    @cacheable
     def _handle_shipping(self, message: str, user_id: str, context: Dict = None) -> str:
         """Handle shipping intents"""
         return "التوصيل بيكون خلال 2-5 أيام حسب المحافظة. التوصيل مجاني للطلبات فوق 500 جنيه. عايز تعرف المدة لمحافظة معينة؟"
     
+    @cacheable
     def _handle_return(self, message: str, user_id: str, context: Dict = None) -> str:
         """Handle return intents"""
         return "عندك 14 يوم من تاريخ الاستلام للإرجاع أو الاستبدال. المنتج لازم يكون بحالته الأصلية. محتاج تفاصيل أكتر؟"
@@ -118,28 +220,37 @@ class EnhancedChatbotEngine:
     
     def _generate_default_response(self, message: str, user_id: str, language: str) -> str:
         """Generate default response when no intent is matched"""
+        if self.use_model:
+            try:
+                response = self.batcher(self._build_prompt(user_id), timeout=self.model_timeout)
+                if response:
+                    return response
+            except (RuntimeError, TimeoutError):
+                # Overloaded or slow model: fall back to the template reply
+                pass
         return "معلش مفهمتش قصدك بالظبط. ممكن توضح أكتر؟ أو ممكن تسأل عن: المنتجات، الأسعار، التوصيل، أو الطلبات."
     
+    def _build_prompt(self, user_id: str) -> str:
+        """Build a model prompt from the recent conversation"""
+        turns = [
+            f"{entry['sender']}: {entry['message']}"
+            for entry in self.sessions.get(user_id)
+        ]
+        turns.append('bot:')
+        return '\n'.join(turns)
+    
     def _update_history(self, user_id: str, message: str, sender: str):
         """Update conversation history"""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-        
-        self.conversation_history[user_id].append({
+        self.sessions.append(user_id, {
             'sender': sender,
             'message': message,
-            'timestamp': None  # Add proper timestamp
+            'timestamp': time.time()
         })
-        
-        # Keep only last N messages
-        if len(self.conversation_history[user_id]) > self.max_history:
-            self.conversation_history[user_id] = self.conversation_history[user_id][-self.max_history:]
     
     def get_conversation_history(self, user_id: str) -> List[Dict]:
         """Get conversation history for a user"""
-        return self.conversation_history.get(user_id, [])
+        return self.sessions.get(user_id)
     
     def clear_history(self, user_id: str):
         """Clear conversation history for a user"""
-        if user_id in self.conversation_history:
-            del self.conversation_history[user_id]
+        self.sessions.clear(user_id)
@@ -0,0 +1,210 @@
+"""
+Inference Batcher
+Dynamic micro-batching of concurrent model requests
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+
+class MicroBatcher:
+    """
+    Collect concurrent requests into batches for a single model call.
+
+    Callers ``submit`` one item and get a Future back. A background thread
+    takes the first queued item, keeps collecting until ``max_batch_size``
+    items are queued or ``max_wait_ms`` has passed since that first item
+    (items queued by then still join, so ``max_wait_ms=0`` batches whatever
+    piled up during the previous call), then calls ``run_batch(items)``
+    once and resolves each caller's Future with its own result.
+    ``run_batch`` must return one result per item, in order; if it raises,
+    every Future in that batch gets the exception.
+
+    The worker thread is started lazily and restarted after ``fork``, so a
+    batcher built in a preloaded gunicorn master works in every worker.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10,
+        max_queue_size: int = 1024,
+        name: str = 'inference',
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        self.name = name
+
+        self._queue: 'queue.Queue' = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self.batch_seconds = 0.0
+        self.batch_size_counts: Dict[int, int] = {}
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item; raises RuntimeError when the queue is full"""
+        self._ensure_worker()
+        future: Future = Future()
+        try:
+            self._queue.put_nowait((item, future))
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            raise RuntimeError(f"{self.name} queue is full ({self.max_queue_size} pending)")
+
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return future
+
+    def __call__(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """Submit an item and wait for its result"""
+        return self.submit(item).result(timeout)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict:
+        """Queue depth and batch-size metrics"""
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'batches': self.batches,
+                'items': self.items,
+                'rejected': self.rejected,
+                'avg_batch_size': self.items / self.batches if self.batches else 0.0,
+                'avg_batch_seconds': self.batch_seconds / self.batches if self.batches else 0.0,
+                'batch_size_counts': dict(self.batch_size_counts),
+            }
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                # Queue and locks inherited from the parent are not usable
+                self._queue = queue.Queue(maxsize=self.max_queue_size)
+            self._pid = pid
+            self._thread = threading.Thread(
+                target=self._worker, name=f'{self.name}-batcher', daemon=True
+            )
+            self._thread.start()
+
+    def _worker(self):
+        q = self._queue
+        while True:
+            batch = [q.get()]
+            deadline = time.monotonic() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(q.get(timeout=remaining))
+                    else:
+                        # Past the deadline, still take what is already queued
+                        batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._run(batch)
+
+    def _run(self, batch: List):
+        items = [item for item, _ in batch]
+        start = time.perf_counter()
+        try:
+            results = self.run_batch(items)
+            if len(results) != len(items):
+                raise RuntimeError(
+                    f"{self.name} batch returned {len(results)} results for {len(items)} items"
+                )
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        elapsed = time.perf_counter() - start
+
+        with self._stats_lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.batch_seconds += elapsed
+            size = len(batch)
+            self.batch_size_counts[size] = self.batch_size_counts.get(size, 0) + 1
+
+
+class TransformerGenerator:
+    """
+    Padded batch generation with a causal LM.
+
+    Prompts are left-padded (so generated tokens line up at the end of every
+    row) and, past ``max_input_tokens``, truncated from the left, so a long
+    history loses its oldest turns rather than the latest ones and the
+    trailing cue. The model runs once per batch under ``torch.inference_mode``.
+    """
+
+    def __init__(self, model, tokenizer, max_new_tokens: int = 48, max_input_tokens: int = 256):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.max_input_tokens = max_input_tokens
+
+        tokenizer.padding_side = 'left'
+        tokenizer.truncation_side = 'left'
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+    def __call__(self, prompts: List[str]) -> List[str]:
+        import torch
+
+        inputs = self.tokenizer(
+            prompts,
+            return_tensors='pt',
+            padding=True,
+            truncation=True,
+            max_length=self.max_input_tokens,
+        )
+        with torch.inference_mode():
+            output = self.model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=False,
+                pad_token_id=self.tokenizer.pad_token_id,
+            )
+
+        new_tokens = output[:, inputs['input_ids'].shape[1]:]
+        return [
+            text.strip()
+            for text in self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+        ]
+
+
+def batcher_from_env(run_batch: Callable[[List[Any]], List[Any]], name: str = 'chatbot') -> MicroBatcher:
+    """Build a MicroBatcher configured by the CHATBOT_BATCH_* variables"""
+    return MicroBatcher(
+        run_batch,
+        max_batch_size=int(os.getenv('CHATBOT_BATCH_SIZE', 8)),
+        max_wait_ms=float(os.getenv('CHATBOT_BATCH_WAIT_MS', 10)),
+        max_queue_size=int(os.getenv('CHATBOT_BATCH_QUEUE_SIZE', 1024)),
+        name=name,
+    )
@@ -0,0 +1,122 @@
+"""
+Response Cache
+Size-bounded LRU + TTL cache for deterministic chatbot and FAQ answers
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+
+_MISSING = object()
+
+
+def cacheable(handler: Callable) -> Callable:
+    """Mark an intent handler whose reply depends only on intent and message"""
+    handler.cacheable = True
+    return handler
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache with per-entry TTL and namespace invalidation.
+
+    Keys are ``(namespace, *parts)`` tuples. ``invalidate(namespace)`` bumps
+    the namespace generation, which is part of every stored key, so all old
+    entries of that namespace miss immediately and age out of the LRU
+    without an O(n) sweep. ``get_or_set`` stores under the generation it
+    looked up, so a value computed across an invalidation is never served
+    as current. ``max_entries=0`` disables caching.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        # Bumped by invalidate(), so keys taken before a full clear never match again
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, namespace: str, *parts: Hashable, default: Any = None) -> Any:
+        return self._get(self._key(namespace, parts), default)
+
+    def set(self, namespace: str, *parts: Hashable, value: Any):
+        self._set(self._key(namespace, parts), value)
+
+    def get_or_set(self, namespace: str, *parts: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached value, computing and storing it on a miss"""
+        key = self._key(namespace, parts)
+        value = self._get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self._set(key, value)
+        return value
+
+    def _key(self, namespace: str, parts: tuple) -> tuple:
+        with self._lock:
+            return (namespace, self._epoch, self._generations.get(namespace, 0)) + parts
+
+    def _get(self, key: tuple, default: Any) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _set(self, key: tuple, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, namespace: str = None):
+        """Drop every entry of ``namespace`` (or everything)"""
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+                self._generations.clear()
+                self._epoch += 1
+            else:
+                self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+def response_cache_from_env() -> ResponseCache:
+    """Build a ResponseCache configured by the RESPONSE_CACHE_* variables"""
+    return ResponseCache(
+        max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', 10000)),
+        ttl_seconds=float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 600)),
+    )
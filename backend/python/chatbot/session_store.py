@@ -0,0 +1,285 @@
+"""
+Conversation Session Store
+Bounded per-user conversation history with LRU and idle-TTL eviction
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Dict, List
+
+
+class SessionStore(ABC):
+    """
+    Interface for conversation history backends.
+
+    Every backend keeps at most ``max_history`` messages per user and
+    reports ``hits`` and ``misses`` through ``stats()``, plus its own
+    eviction counters.
+    """
+
+    def __init__(self, max_history: int = 10):
+        self.max_history = max_history
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def append(self, user_id: str, entry: Dict):
+        """Append a message to a user's history"""
+
+    @abstractmethod
+    def get(self, user_id: str) -> List[Dict]:
+        """Return a user's history, oldest first (empty if unknown)"""
+
+    @abstractmethod
+    def clear(self, user_id: str):
+        """Drop a user's history"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of users with a history"""
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters"""
+        return {
+            'backend': type(self).__name__,
+            'users': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class _Session:
+    """One user's ring buffer plus bookkeeping for eviction"""
+
+    __slots__ = ('messages', 'last_access', 'size')
+
+    def __init__(self, max_history: int):
+        self.messages = deque(maxlen=max_history)
+        self.last_access = 0.0
+        self.size = 0
+
+
+class LocalSessionStore(SessionStore):
+    """
+    In-process store for a single worker.
+
+    Users are kept in an OrderedDict in access order, so the least recently
+    used (and therefore the longest idle) users are always at the front:
+    LRU, idle-TTL and memory-cap eviction all pop from there in O(1).
+    Each user's messages live in a ``deque(maxlen=max_history)``, which
+    drops the oldest message on append instead of re-slicing a list.
+    """
+
+    def __init__(
+        self,
+        max_history: int = 10,
+        max_users: int = 10000,
+        ttl_seconds: float = 3600,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        super().__init__(max_history)
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self.ttl_evictions = 0
+        self.lru_evictions = 0
+        self.memory_evictions = 0
+        self._sessions: 'OrderedDict[str, _Session]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def append(self, user_id: str, entry: Dict):
+        now = time.monotonic()
+        entry_size = _entry_size(entry)
+
+        with self._lock:
+            self._evict_expired(now)
+
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = self._sessions[user_id] = _Session(self.max_history)
+            else:
+                self._sessions.move_to_end(user_id)
+
+            messages = session.messages
+            if len(messages) == messages.maxlen:
+                # The deque drops the oldest entry on append
+                dropped = _entry_size(messages[0])
+                session.size -= dropped
+                self._bytes -= dropped
+            messages.append(entry)
+            session.size += entry_size
+            session.last_access = now
+            self._bytes += entry_size
+
+            self._evict_over_capacity(keep=user_id)
+
+    def get(self, user_id: str) -> List[Dict]:
+        now = time.monotonic()
+
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                self.misses += 1
+                return []
+            if now - session.last_access > self.ttl_seconds:
+                self._drop(user_id)
+                self.ttl_evictions += 1
+                self.evictions += 1
+                self.misses += 1
+                return []
+
+            self._sessions.move_to_end(user_id)
+            session.last_access = now
+            self.hits += 1
+            return list(session.messages)
+
+    def clear(self, user_id: str):
+        with self._lock:
+            if user_id in self._sessions:
+                self._drop(user_id)
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats.update({
+            'bytes': self._bytes,
+            'evictions': self.evictions,
+            'ttl_evictions': self.ttl_evictions,
+            'lru_evictions': self.lru_evictions,
+            'memory_evictions': self.memory_evictions,
+        })
+        return stats
+
+    def _drop(self, user_id: str):
+        session = self._sessions.pop(user_id)
+        self._bytes -= session.size
+
+    def _evict_expired(self, now: float):
+        sessions = self._sessions
+        while sessions:
+            user_id, session = next(iter(sessions.items()))
+            if now - session.last_access <= self.ttl_seconds:
+                break
+            self._drop(user_id)
+            self.ttl_evictions += 1
+            self.evictions += 1
+
+    def _evict_over_capacity(self, keep: str):
+        sessions = self._sessions
+        while len(sessions) > self.max_users or self._bytes > self.max_bytes:
+            user_id = next(iter(sessions))
+            if user_id == keep:
+                break
+            if len(sessions) > self.max_users:
+                self.lru_evictions += 1
+            else:
+                self.memory_evictions += 1
+            self._drop(user_id)
+            self.evictions += 1
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Shared store so every gunicorn worker sees the same conversation.
+
+    Each user is a Redis list trimmed to ``max_history`` and expiring after
+    ``ttl_seconds`` of inactivity; cross-user LRU and the memory cap are
+    delegated to the server's ``maxmemory`` / ``maxmemory-policy`` settings,
+    so the only eviction counted here is ``trimmed``: messages dropped by
+    the trim, known from the list length RPUSH returns. Counters are per
+    worker. ``client`` may be any redis-py compatible
+    client, e.g. ``utils.fake_redis.FakeRedis`` in tests.
+
+    The user count comes from a sorted set of user IDs scored by their last
+    append, so ``len()`` never scans the keyspace. It counts users active
+    within ``ttl_seconds``; lists the server evicts early under
+    ``maxmemory`` are still counted until they go idle, so it is an upper
+    bound.
+    """
+
+    def __init__(self, client, max_history: int = 10, ttl_seconds: float = 3600, prefix: str = 'bww:chat:'):
+        super().__init__(max_history)
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        # Outside the per-user key space, so no user ID can collide with it
+        self.index = prefix.rstrip(':') + '-users'
+        self.trimmed = 0
+
+    def __len__(self) -> int:
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self.index, 0, time.time() - self.ttl_seconds)
+        pipe.zcard(self.index)
+        return pipe.execute()[1]
+
+    def append(self, user_id: str, entry: Dict):
+        key = self.prefix + user_id
+        pipe = self.client.pipeline()
+        pipe.rpush(key, json.dumps(entry, ensure_ascii=False))
+        pipe.ltrim(key, -self.max_history, -1)
+        pipe.expire(key, int(self.ttl_seconds))
+        pipe.zadd(self.index, {user_id: time.time()})
+        pipe.expire(self.index, int(self.ttl_seconds))
+        length = pipe.execute()[0]
+        if length > self.max_history:
+            self.trimmed += length - self.max_history
+
+    def get(self, user_id: str) -> List[Dict]:
+        raw = self.client.lrange(self.prefix + user_id, 0, -1)
+        if not raw:
+            self.misses += 1
+            return []
+        self.hits += 1
+        return [json.loads(item) for item in raw]
+
+    def clear(self, user_id: str):
+        pipe = self.client.pipeline()
+        pipe.delete(self.prefix + user_id)
+        pipe.zrem(self.index, user_id)
+        pipe.execute()
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats['trimmed'] = self.trimmed
+        return stats
+
+
+def create_session_store(max_history: int = 10, client=None) -> SessionStore:
+    """
+    Build the session store selected by the environment.
+
+    ``SESSION_STORE=redis`` shares history across workers through
+    ``REDIS_URL``; the default ``local`` keeps it in-process.
+    """
+    ttl_seconds = float(os.getenv('SESSION_TTL_SECONDS', 3600))
+    backend = os.getenv('SESSION_STORE', 'local')
+
+    if client is not None or backend == 'redis':
+        if client is None:
+            import redis
+            from utils.config import Config
+            client = redis.Redis.from_url(Config.REDIS_URL)
+        return RedisSessionStore(client, max_history=max_history, ttl_seconds=ttl_seconds)
+
+    return LocalSessionStore(
+        max_history=max_history,
+        max_users=int(os.getenv('SESSION_MAX_USERS', 10000)),
+        ttl_seconds=ttl_seconds,
+        max_bytes=int(os.getenv('SESSION_MAX_BYTES', 64 * 1024 * 1024)),
+    )
+
+
+def _entry_size(entry: Dict) -> int:
+    """Approximate memory footprint of a history entry"""
+    return sys.getsizeof(entry) + sum(
+        sys.getsizeof(value) for value in entry.values()
+    )
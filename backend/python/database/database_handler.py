@@ -1,5 +1,398 @@
-"""Database Handler"""
+"""
+Database Handler
+Shared, fork-safe MongoDB connection pool with bulk helpers and a
+read-through cache for hot product and order documents
+"""
+
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from utils.config import Config
+
+try:
+    from pymongo.monitoring import ConnectionPoolListener
+except ImportError:  # pymongo is only needed for a real server
+    ConnectionPoolListener = object
+
+
+class PoolMetrics(ConnectionPoolListener):
+    """
+    pymongo connection-pool listener recording connections in use and the
+    time spent waiting for a free connection. Registered on the client via
+    ``event_listeners``; the fake client reports the same events.
+    """
 
-class DatabaseHandler:
     def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.in_use = 0
+        self.max_in_use = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = time.perf_counter() - getattr(self._local, 'started', time.perf_counter())
+        with self._lock:
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    # Remaining pool events are not tracked
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
         pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'in_use': self.in_use,
+                'max_in_use': self.max_in_use,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'wait_seconds_total': self.wait_seconds,
+                'wait_seconds_avg': self.wait_seconds / self.checkouts if self.checkouts else 0.0,
+                'wait_seconds_max': self.max_wait_seconds,
+            }
+
+
+class EntityCache:
+    """
+    Per-document cache for hot collections, keyed by collection and ID.
+
+    With a Redis client (or FakeRedis) the cache is shared by every worker,
+    so an invalidation after a write is seen everywhere. Without one, each
+    process keeps its own LRU; other workers then see a write only once
+    their copy expires, so keep ``ttl_seconds`` short in that mode.
+    """
+
+    def __init__(self, client=None, ttl_seconds: float = 60, max_entries: int = 50000, prefix: str = 'db'):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self._local: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_many(self, collection: str, ids: List[str]) -> Dict[str, Dict]:
+        keys = [self._key(collection, id_) for id_ in ids]
+        found = {}
+        if self.client is not None:
+            for id_, raw in zip(ids, self.client.mget(keys)):
+                if raw is not None:
+                    found[id_] = _loads(raw)
+        else:
+            now = time.monotonic()
+            with self._lock:
+                for id_, key in zip(ids, keys):
+                    entry = self._local.get(key)
+                    if entry is not None and entry[1] > now:
+                        self._local.move_to_end(key)
+                        found[id_] = entry[0]
+            # Callers get their own copies, so mutating a result cannot
+            # corrupt the cached document
+            found = copy.deepcopy(found)
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(ids) - len(found)
+        return found
+
+    def set_many(self, collection: str, docs: Dict[str, Dict]):
+        if not docs:
+            return
+        if self.client is not None:
+            pipeline = self.client.pipeline(transaction=False)
+            for id_, doc in docs.items():
+                pipeline.set(self._key(collection, id_), _dumps(doc), ex=int(self.ttl_seconds))
+            pipeline.execute()
+            return
+        expires = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for id_, doc in docs.items():
+                key = self._key(collection, id_)
+                self._local[key] = (copy.deepcopy(doc), expires)
+                self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def invalidate(self, collection: str, ids: Iterable[str]):
+        keys = [self._key(collection, id_) for id_ in ids]
+        if not keys:
+            return
+        if self.client is not None:
+            self.client.delete(*keys)
+        else:
+            with self._lock:
+                for key in keys:
+                    self._local.pop(key, None)
+        with self._lock:
+            self.invalidations += len(keys)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'backend': 'redis' if self.client is not None else 'local',
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'invalidations': self.invalidations,
+        }
+
+    def _key(self, collection: str, id_: str) -> str:
+        return f'{self.prefix}:{collection}:{id_}'
+
+
+def _dumps(doc: Dict) -> str:
+    try:
+        from bson import json_util
+        return json_util.dumps(doc)
+    except ImportError:
+        return json.dumps(doc, default=str)
+
+
+def _loads(raw) -> Dict:
+    if isinstance(raw, bytes):
+        raw = raw.decode()
+    try:
+        from bson import json_util
+        return json_util.loads(raw)
+    except ImportError:
+        return json.loads(raw)
+
+
+class DatabaseHandler:
+    """
+    One MongoDB client per process, shared by every service.
+
+    pymongo's ``MongoClient`` is a thread-safe connection pool but must not
+    be used across ``fork``, so the client is created lazily and recreated
+    when the process ID changes (gunicorn ``--preload`` builds this object
+    in the master). Reads by ID go through ``EntityCache`` for the
+    collections in ``cached_collections``; every write helper invalidates
+    the documents it touched.
+
+    ``client_factory`` replaces ``pymongo.MongoClient``, e.g. with
+    ``utils.fake_mongo.FakeMongoClient`` in tests.
+    """
+
+    def __init__(
+        self,
+        uri: Optional[str] = None,
+        cache: Optional[EntityCache] = None,
+        cached_collections: Iterable[str] = ('products', 'orders'),
+        max_pool_size: int = 50,
+        wait_queue_timeout_ms: int = 2000,
+        batch_size: int = 1000,
+        client_factory: Optional[Callable[..., Any]] = None,
+    ):
+        self.uri = uri or Config.DATABASE_URI
+        self.cache = cache if cache is not None else EntityCache()
+        self.cached_collections = set(cached_collections)
+        self.max_pool_size = max_pool_size
+        self.wait_queue_timeout_ms = wait_queue_timeout_ms
+        self.batch_size = batch_size
+        self.metrics = PoolMetrics()
+
+        self._client = None
+        self._client_pid = None
+        self._client_factory = client_factory
+        self._lock = threading.Lock()
+
+    # Connection ------------------------------------------------------------
+
+    @property
+    def client(self):
+        pid = os.getpid()
+        if self._client is not None and self._client_pid == pid:
+            return self._client
+        with self._lock:
+            if self._client is None or self._client_pid != pid:
+                factory = self._client_factory
+                if factory is None:
+                    from pymongo import MongoClient as factory
+                # Counters inherited from the parent describe its pool
+                self.metrics = PoolMetrics()
+                self._client = factory(
+                    self.uri,
+                    maxPoolSize=self.max_pool_size,
+                    waitQueueTimeoutMS=self.wait_queue_timeout_ms,
+                    event_listeners=[self.metrics],
+                    connect=False,
+                )
+                self._client_pid = pid
+        return self._client
+
+    @property
+    def db(self):
+        return self.client.get_default_database()
+
+    def collection(self, name: str):
+        return self.db[name]
+
+    def close(self):
+        if self._client is not None and self._client_pid == os.getpid():
+            self._client.close()
+        self._client = None
+
+    # Reads -----------------------------------------------------------------
+
+    def get(self, collection: str, id_: Any) -> Optional[Dict]:
+        return self.get_many(collection, [id_]).get(str(id_))
+
+    def get_many(self, collection: str, ids: Iterable[Any], projection: Optional[Dict] = None) -> Dict[str, Dict]:
+        """
+        Documents by ID as ``{str(id): doc}``; missing IDs are left out.
+
+        Cached collections are served from the cache first and only the
+        misses are fetched, in ``$in`` batches of ``batch_size``. Projected
+        reads bypass the cache.
+        """
+        keys = list(dict.fromkeys(str(id_) for id_ in ids))
+        use_cache = projection is None and collection in self.cached_collections
+        found = self.cache.get_many(collection, keys) if use_cache else {}
+
+        missing = [key for key in keys if key not in found]
+        fetched = {}
+        coll = self.collection(collection)
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            query = {'_id': {'$in': [to_object_id(key) for key in chunk]}}
+            for doc in coll.find(query, projection):
+                fetched[str(doc['_id'])] = doc
+
+        if use_cache:
+            self.cache.set_many(collection, fetched)
+        found.update(fetched)
+        return found
+
+    # Writes ----------------------------------------------------------------
+
+    def bulk_upsert(self, collection: str, docs: Iterable[Dict], key: str = '_id') -> Dict:
+        """Replace-or-insert documents matched on ``key`` in unordered batches"""
+        from pymongo import ReplaceOne
+
+        totals = {'matched': 0, 'modified': 0, 'upserted': 0}
+        coll = self.collection(collection)
+        batch, ids, keys = [], [], []
+
+        def flush():
+            if keys and collection in self.cached_collections:
+                # Cache entries are keyed by _id: find the documents the
+                # batch will replace by ``key`` before it does
+                ids.extend(doc['_id'] for doc in coll.find({key: {'$in': keys}}, {'_id': 1}))
+            result = coll.bulk_write(batch, ordered=False)
+            totals['matched'] += result.matched_count
+            totals['modified'] += result.modified_count
+            totals['upserted'] += result.upserted_count
+            self._invalidate(collection, ids)
+            batch.clear()
+            ids.clear()
+            keys.clear()
+
+        for doc in docs:
+            batch.append(ReplaceOne({key: doc[key]}, doc, upsert=True))
+            if '_id' in doc:
+                ids.append(doc['_id'])
+            if key != '_id':
+                keys.append(doc[key])
+            if len(batch) >= self.batch_size:
+                flush()
+        if batch:
+            flush()
+        return totals
+
+    def update(self, collection: str, id_: Any, changes: Dict, upsert: bool = False) -> bool:
+        """``$set`` fields on one document; returns True if it was found or created"""
+        result = self.collection(collection).update_one(
+            {'_id': to_object_id(str(id_))}, {'$set': changes}, upsert=upsert
+        )
+        self._invalidate(collection, [id_])
+        return bool(result.matched_count or result.upserted_id is not None)
+
+    def delete_many(self, collection: str, ids: Iterable[Any]) -> int:
+        ids = [str(id_) for id_ in ids]
+        deleted = 0
+        coll = self.collection(collection)
+        for start in range(0, len(ids), self.batch_size):
+            chunk = ids[start:start + self.batch_size]
+            deleted += coll.delete_many({'_id': {'$in': [to_object_id(i) for i in chunk]}}).deleted_count
+        self._invalidate(collection, ids)
+        return deleted
+
+    def _invalidate(self, collection: str, ids: Iterable[Any]):
+        if collection in self.cached_collections:
+            self.cache.invalidate(collection, [str(id_) for id_ in ids])
+
+    # Metrics ---------------------------------------------------------------
+
+    def stats(self) -> Dict:
+        return {
+            'pool': dict(self.metrics.stats(), max_pool_size=self.max_pool_size),
+            'cache': self.cache.stats(),
+        }
+
+
+def to_object_id(value: str):
+    """Documents written by the Node backend use ObjectId keys"""
+    try:
+        from bson import ObjectId
+    except ImportError:
+        return value
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
+
+def database_handler_from_env() -> DatabaseHandler:
+    """Handler configured by DATABASE_URI, REDIS_URL and the DB_* variables"""
+    cache_client = None
+    if os.getenv('DB_CACHE', 'local') == 'redis':
+        import redis
+        cache_client = redis.Redis.from_url(
+            Config.REDIS_URL, max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+        )
+    cached = os.getenv('DB_CACHED_COLLECTIONS', 'products,orders')
+    return DatabaseHandler(
+        cache=EntityCache(cache_client, ttl_seconds=float(os.getenv('DB_CACHE_TTL_SECONDS', 60))),
+        cached_collections=[c for c in cached.split(',') if c] if os.getenv('DB_CACHE') != 'none' else (),
+        max_pool_size=int(os.getenv('DB_MAX_POOL_SIZE', 50)),
+        wait_queue_timeout_ms=int(os.getenv('DB_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+    )
@@ -1,6 +1,486 @@
-"""User Management"""
+"""
+User Management
+Customer accounts: bcrypt password hashing in a bounded worker pool,
+batched inserts, JWT access tokens and a short-TTL cache of the profiles
+behind them
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import jwt
+
+from chatbot.inference_batcher import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+# Fields returned to clients; the password hash never leaves this module
+PUBLIC_FIELDS = ('id', 'name', 'email', 'phone', 'role', 'createdAt')
+MIN_PASSWORD_LENGTH = 8
+# bcrypt ignores everything past 72 bytes, so longer passwords are refused
+MAX_PASSWORD_BYTES = 72
+_EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+class DuplicateUserError(ValueError):
+    """An account with this email already exists"""
+
+
+class HasherBusy(RuntimeError):
+    """Every hashing slot is taken; the client should retry shortly"""
+
+
+# Run in the pool's workers, so they must stay importable module functions
+
+def hash_password(password: str, rounds: int) -> str:
+    import bcrypt
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def check_password(password: str, hashed: str) -> bool:
+    import bcrypt
+    try:
+        return bcrypt.checkpw(password.encode(), hashed.encode())
+    except ValueError:
+        # Not a bcrypt hash
+        return False
+
+
+class PasswordHasher:
+    """
+    bcrypt hashing and verification off the request thread.
+
+    Each hash costs tens to hundreds of milliseconds of CPU by design, so
+    it runs in a pool of ``workers`` processes (``executor='thread'`` also
+    works, since bcrypt releases the GIL). At most ``max_pending`` jobs are
+    queued or running; past that, calls fail at once with ``HasherBusy``
+    rather than queueing seconds of work behind a signup spike. The pool is
+    created on first use and again after ``fork``.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        rounds: int = 12,
+        executor: str = 'process',
+        max_pending: Optional[int] = None,
+        timeout: float = 10.0,
+    ):
+        self.workers = workers or os.cpu_count() or 2
+        self.rounds = rounds
+        self.executor_kind = executor
+        self.max_pending = max_pending or self.workers * 4
+        self.timeout = timeout
+
+        self._executor: Optional[Executor] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._dummy: Optional[str] = None
+        self._stats = {'hashed': 0, 'verified': 0, 'rejected': 0, 'seconds': 0.0}
+
+    def hash(self, password: str) -> str:
+        return self._run(hash_password, password, self.rounds)
+
+    def verify(self, password: str, hashed: Optional[str]) -> bool:
+        """Check ``password``; a missing hash costs as much as a wrong password"""
+        if not hashed:
+            # Unknown accounts take as long as known ones, so response times
+            # do not tell which emails are registered
+            if self._dummy is None:
+                self._dummy = self.hash(secrets.token_hex(16))
+            self._run(check_password, password, self._dummy)
+            return False
+        return self._run(check_password, password, hashed)
+
+    def _run(self, fn: Callable, *args) -> Any:
+        if not self._slots.acquire(blocking=False):
+            self._stats['rejected'] += 1
+            raise HasherBusy(f"Password hashing is at capacity ({self.max_pending} pending)")
+        start = time.perf_counter()
+        pool = self._pool()
+        try:
+            future = pool.submit(fn, *args)
+        except Exception as e:
+            self._slots.release()
+            if isinstance(e, BrokenProcessPool):
+                self._discard(pool)
+            raise
+        # The slot is held until the job finishes, even if the caller gives up
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result = future.result(self.timeout)
+        except BrokenProcessPool:
+            self._discard(pool)
+            raise
+        self._stats['hashed' if fn is hash_password else 'verified'] += 1
+        self._stats['seconds'] += time.perf_counter() - start
+        return result
+
+    def _pool(self) -> Executor:
+        pid = os.getpid()
+        if self._executor is not None and self._pid == pid:
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != pid:
+                if self.executor_kind == 'process':
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password')
+                self._pid = pid
+        return self._executor
+
+    def _discard(self, pool: Executor):
+        """Drop a pool whose worker died, so the next call starts a fresh one"""
+        logger.warning("Password hashing pool broke; restarting it")
+        with self._lock:
+            if self._executor is pool:
+                self._executor = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def stats(self) -> Dict:
+        jobs = self._stats['hashed'] + self._stats['verified']
+        return {
+            'executor': self.executor_kind,
+            'workers': self.workers,
+            'rounds': self.rounds,
+            'max_pending': self.max_pending,
+            'hashed': self._stats['hashed'],
+            'verified': self._stats['verified'],
+            'rejected': self._stats['rejected'],
+            'avg_ms': self._stats['seconds'] / jobs * 1000 if jobs else 0.0,
+        }
+
+
+# Stores ----------------------------------------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class SQLiteUserStore:
+    """Users in a local SQLite file, for development, tests and benchmarks"""
+
+    def __init__(self, path: str = 'users.sqlite3'):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def insert_many(self, users: List[Dict]) -> List[bool]:
+        """Insert in one transaction; False for each user whose email is taken"""
+        rows = [(user['id'], user['email'], json.dumps(user, default=_isoformat), time.time()) for user in users]
+        with self._lock:
+            conn = self._connection()
+            conn.executemany('INSERT OR IGNORE INTO users (id, email, data, created_at) VALUES (?, ?, ?, ?)', rows)
+            conn.commit()
+            placeholders = ','.join('?' * len(rows))
+            stored = dict(conn.execute(
+                f'SELECT email, id FROM users WHERE email IN ({placeholders})', [row[1] for row in rows]
+            ).fetchall())
+        return [stored.get(user['email']) == user['id'] for user in users]
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        return self._one('SELECT data FROM users WHERE id = ?', user_id)
+
+    def find_by_email(self, email: str) -> Optional[Dict]:
+        return self._one('SELECT data FROM users WHERE email = ?', email)
+
+    def _one(self, query: str, value: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._connection().execute(query, (value,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _connection(self) -> sqlite3.Connection:
+        # A connection inherited across fork must not be reused
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            if self.path != ':memory:':
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+
+class MongoUserStore:
+    """
+    The users collection shared with the Node backend (``DatabaseHandler``).
+    Email uniqueness relies on the collection's unique index on ``email``;
+    ``createdAt`` is stored as a BSON date, like the Node ``User`` model's.
+    """
+
+    def __init__(self, db, collection: str = 'users'):
+        self.db = db
+        self.collection_name = collection
+
+    def insert_many(self, users: List[Dict]) -> List[bool]:
+        from pymongo.errors import BulkWriteError
+        from database.database_handler import to_object_id
+        docs = []
+        for user in users:
+            doc = {key: value for key, value in user.items() if key != 'id'}
+            doc['_id'] = to_object_id(user['id'])
+            docs.append(doc)
+        inserted = [True] * len(docs)
+        try:
+            self.db.collection(self.collection_name).insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                if error.get('code') != 11000:
+                    raise
+                inserted[error['index']] = False
+        return inserted
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        from database.database_handler import to_object_id
+        return self._user(self.db.collection(self.collection_name).find_one({'_id': to_object_id(user_id)}))
+
+    def find_by_email(self, email: str) -> Optional[Dict]:
+        return self._user(self.db.collection(self.collection_name).find_one({'email': email}))
+
+    @staticmethod
+    def _user(doc: Optional[Dict]) -> Optional[Dict]:
+        if doc is None:
+            return None
+        doc = dict(doc)
+        doc['id'] = str(doc.pop('_id'))
+        return doc
+
+
+# Accounts --------------------------------------------------------------------
 
 class UserManagement:
-    def create_user(self, data):
-        """Create new user"""
-        return {"id": "1", "name": data.get("name")}
+    """
+    Signup, login and token authentication.
+
+    Passwords are hashed and checked in ``hasher``'s pool, so request
+    threads only wait on it. New users are written in batches: signups
+    that arrive while an insert is running (or within ``batch_wait_ms``)
+    share the next one. Access tokens are
+    HS256 JWTs with the claims Flask-JWT-Extended expects, so
+    ``@jwt_required`` routes accept them too. ``authenticate`` serves the
+    profile behind a token from an LRU cache for ``profile_ttl`` seconds,
+    so authenticated requests do not query the store each time; a changed
+    profile is seen after at most that long (or at once via ``invalidate``).
+    """
+
+    def __init__(
+        self,
+        store=None,
+        hasher: Optional[PasswordHasher] = None,
+        secret: Optional[str] = None,
+        token_ttl: float = 3600,
+        profile_ttl: float = 30,
+        max_profiles: int = 50_000,
+        batch_size: int = 100,
+        batch_wait_ms: float = 0,
+    ):
+        self.store = store if store is not None else SQLiteUserStore(':memory:')
+        self.hasher = hasher or PasswordHasher()
+        self.secret = secret or os.getenv('JWT_SECRET_KEY', 'default-secret-key')
+        self.token_ttl = token_ttl
+        self.profile_ttl = profile_ttl
+        self.max_profiles = max_profiles
+        self.inserts = MicroBatcher(
+            self.store.insert_many, max_batch_size=batch_size, max_wait_ms=batch_wait_ms,
+            max_queue_size=batch_size * 20, name='user-insert',
+        )
+
+        self._profiles: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'signups': 0, 'logins': 0, 'failed_logins': 0, 'profile_hits': 0, 'profile_misses': 0}
+
+    def create_user(self, data: Dict) -> Dict:
+        """Register an account and return its public profile"""
+        if not isinstance(data, dict):
+            raise ValueError("User data must be an object")
+        email = str(data.get('email') or '').strip().lower()
+        password = data.get('password')
+        if not _EMAIL.match(email):
+            raise ValueError("A valid email is required")
+        _check_password_rules(password)
+
+        user = {
+            'id': secrets.token_hex(12),  # a valid ObjectId, like the Node backend's
+            'name': str(data.get('name') or '').strip(),
+            'email': email,
+            'phone': str(data.get('phone') or '').strip(),
+            'role': 'customer',
+            'createdAt': datetime.now(timezone.utc),
+        }
+        # A taken email is refused before it costs a hashing slot; the
+        # insert still catches two signups racing for the same one
+        if self.store.find_by_email(email) is not None:
+            raise DuplicateUserError(f"An account with {email} already exists")
+        user['password'] = self.hasher.hash(password)
+        if not self.inserts(user, timeout=self.hasher.timeout):
+            raise DuplicateUserError(f"An account with {email} already exists")
+        self._stats['signups'] += 1
+        return _public(user)
+
+    def login(self, email: str, password: str) -> Optional[Dict]:
+        """An access token and profile, or None for a wrong email or password"""
+        email = str(email or '').strip().lower()
+        user = self.store.find_by_email(email) if email else None
+        if not isinstance(password, str) or not self.hasher.verify(password, user and user.get('password')):
+            self._stats['failed_logins'] += 1
+            return None
+        self._stats['logins'] += 1
+        profile = _public(user)
+        self._remember(profile)
+        return {
+            'access_token': self.issue_token(profile['id']),
+            'token_type': 'Bearer',
+            'expires_in': int(self.token_ttl),
+            'user': profile,
+        }
+
+    def issue_token(self, user_id: str) -> str:
+        now = int(time.time())
+        return jwt.encode({
+            'sub': str(user_id),
+            'type': 'access',
+            'fresh': False,
+            'jti': uuid.uuid4().hex,
+            'iat': now,
+            'nbf': now,
+            'exp': now + int(self.token_ttl),
+        }, self.secret, algorithm='HS256')
+
+    def authenticate(self, token: str) -> Optional[Dict]:
+        """The profile of a valid access token's user, or None"""
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            return None
+        if claims.get('type', 'access') != 'access' or not claims.get('sub'):
+            return None
+        return self.get_user(claims['sub'])
+
+    def get_user(self, user_id: str) -> Optional[Dict]:
+        """Public profile, cached for ``profile_ttl`` seconds"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._profiles.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._profiles.move_to_end(user_id)
+                self._stats['profile_hits'] += 1
+                return entry[1]
+        self._stats['profile_misses'] += 1
+        user = self.store.get(user_id)
+        if user is None:
+            return None
+        profile = _public(user)
+        self._remember(profile)
+        return profile
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+
+    def _remember(self, profile: Dict):
+        with self._lock:
+            self._profiles[profile['id']] = (time.monotonic() + self.profile_ttl, profile)
+            self._profiles.move_to_end(profile['id'])
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def close(self):
+        self.hasher.close()
+
+    def stats(self) -> Dict:
+        lookups = self._stats['profile_hits'] + self._stats['profile_misses']
+        return dict(
+            self._stats,
+            cached_profiles=len(self._profiles),
+            profile_hit_rate=self._stats['profile_hits'] / lookups if lookups else 0.0,
+            store=type(self.store).__name__,
+            hasher=self.hasher.stats(),
+            inserts=self.inserts.stats(),
+        )
+
+
+def _check_password_rules(password: Any):
+    if not isinstance(password, str) or len(password) < MIN_PASSWORD_LENGTH:
+        raise ValueError(f"Password must be at least {MIN_PASSWORD_LENGTH} characters")
+    if len(password.encode()) > MAX_PASSWORD_BYTES:
+        raise ValueError(f"Password must be at most {MAX_PASSWORD_BYTES} bytes")
+
+
+def _public(user: Dict) -> Dict:
+    profile = {field: user.get(field) for field in PUBLIC_FIELDS}
+    if isinstance(profile['createdAt'], datetime):
+        profile['createdAt'] = _isoformat(profile['createdAt'])
+    return profile
+
+
+def _isoformat(value: Any) -> str:
+    """ISO 8601 for datetimes; pymongo returns naive datetimes in UTC"""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return str(value)
+
+
+def user_management_from_env(db=None) -> UserManagement:
+    """
+    Accounts configured by the USER_* variables.
+
+    ``USER_STORE=mongo`` (the default) uses the users collection shared
+    with the Node backend through ``db``; ``sqlite`` a local file at
+    ``USER_DB_PATH``.
+    """
+    if os.getenv('USER_STORE', 'mongo') == 'sqlite' or db is None:
+        store = SQLiteUserStore(os.getenv('USER_DB_PATH', 'users.sqlite3'))
+    else:
+        store = MongoUserStore(db)
+    workers = int(os.getenv('USER_HASH_WORKERS', 0)) or None
+    hasher = PasswordHasher(
+        workers=workers,
+        rounds=int(os.getenv('USER_BCRYPT_ROUNDS', 12)),
+        executor=os.getenv('USER_HASH_EXECUTOR', 'process'),
+        max_pending=int(os.getenv('USER_HASH_MAX_PENDING', 0)) or None,
+    )
+    return UserManagement(
+        store=store,
+        hasher=hasher,
+        token_ttl=float(os.getenv('USER_TOKEN_TTL_SECONDS', 3600)),
+        profile_ttl=float(os.getenv('USER_PROFILE_TTL_SECONDS', 30)),
+        max_profiles=int(os.getenv('USER_PROFILE_CACHE_SIZE', 50_000)),
+        batch_size=int(os.getenv('USER_INSERT_BATCH_SIZE', 100)),
+        batch_wait_ms=float(os.getenv('USER_INSERT_WAIT_MS', 0)),
+    )
@@ -0,0 +1,16 @@
+"""
+Gunicorn Configuration
+Picked up automatically from the working directory
+"""
+
+import os
+
+# PRELOAD_SERVICES=true imports the app (and warms up every service) in the
+# master before forking, so workers share model weights copy-on-write
+preload_app = os.getenv('PRELOAD_SERVICES', 'false').lower() == 'true'
+
+
+def post_worker_init(worker):
+    # Background threads start in each worker, after the app is loaded
+    from api.services import start_background_workers
+    start_background_workers()
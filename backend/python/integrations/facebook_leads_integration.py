@@ -1,13 +1,82 @@
 """Facebook Leads Integration"""
 
+import logging
+import os
+
+from integrations.signatures import verify_meta_signature
+
+logger = logging.getLogger(__name__)
+
+
 class FacebookLeadsIntegration:
-    def __init__(self):
-        pass
+    def __init__(self, queue=None, chat_handler=None, notifier=None, limiter=None):
+        # With a queue, webhook POSTs are acknowledged as soon as their
+        # messages are queued and handle_message runs on a queue worker
+        self.queue = queue
+        self.chat_handler = chat_handler
+        # Replies go out through the notification dispatcher when it has
+        # a provider for this channel; on a queue worker the job finishes
+        # only once the reply was sent, and a retry resends the saved reply
+        self.notifier = notifier
+        self.delivery_timeout = float(os.getenv('WEBHOOK_DELIVERY_TIMEOUT', 300))
+        # Per-sender limit (utils.rate_limit); over-limit messages are
+        # acknowledged but dropped, since Meta retries anything else
+        self.limiter = limiter
+        self.app_secret = os.getenv('FACEBOOK_APP_SECRET', '')
     
     def verify_webhook(self, request):
         """Verify Facebook webhook"""
         return "OK", 200
     
     def process_message(self, request):
-        """Process Facebook message"""
+        """Validate a Messenger webhook and queue its messages"""
+        if not verify_meta_signature(request, self.app_secret):
+            return {"status": "error", "error": "Invalid signature"}, 403
+        
+        payload = request.get_json(silent=True) or {}
+        for entry in payload.get('entry', []):
+            for event in entry.get('messaging', []):
+                message = event.get('message') or {}
+                sender = (event.get('sender') or {}).get('id')
+                if not sender or 'mid' not in message:
+                    continue
+                user_id = f'facebook:{sender}'
+                # Redeliveries are dropped before they cost the sender a token
+                if self.queue is not None and self.queue.seen(message['mid']):
+                    continue
+                if self.limiter is not None and not self.limiter.allow_user(user_id):
+                    logger.debug("Dropping message from rate-limited sender %s", user_id)
+                    continue
+                if self.queue is not None:
+                    self.queue.enqueue('facebook', message['mid'], user_id, event)
+                else:
+                    self.handle_message(event)
+        
         return {"status": "success"}, 200
+    
+    def handle_message(self, event):
+        """Answer one Messenger message event"""
+        text = (event.get('message') or {}).get('text')
+        if not text or self.chat_handler is None:
+            return
+        
+        sender = event['sender']['id']
+        # A retried job resends the reply its first attempt computed: the
+        # chat pipeline (order flow, history, analytics) runs once per message
+        message_id = event['message'].get('mid')
+        reply = self.queue.saved_reply(message_id) if self.queue is not None and message_id else None
+        if reply is None:
+            reply = self.chat_handler({
+                'message': text, 'user_id': f'facebook:{sender}', 'channel': 'facebook'
+            })['response']
+            if self.queue is not None and message_id:
+                self.queue.save_reply(message_id, reply)
+        delivery_id = self.send_message(sender, reply)
+        if delivery_id is not None and self.queue is not None:
+            self.notifier.confirm(delivery_id, timeout=self.delivery_timeout)
+    
+    def send_message(self, recipient_id, text):
+        """Send a reply through the Messenger Send API"""
+        if self.notifier is not None and self.notifier.supports('messenger'):
+            return self.notifier.send(text, recipient_id, channel='messenger')
+        logger.debug("Messenger reply to %s: %s", recipient_id, text)
@@ -0,0 +1,20 @@
+"""Meta Webhook Signatures"""
+
+import hashlib
+import hmac
+
+
+def verify_meta_signature(request, app_secret: str) -> bool:
+    """
+    Check the X-Hub-Signature-256 header Meta sends with Messenger and
+    WhatsApp webhooks. Always passes when no app secret is configured.
+    """
+    if not app_secret:
+        return True
+
+    header = request.headers.get('X-Hub-Signature-256', '')
+    if not header.startswith('sha256='):
+        return False
+
+    expected = hmac.new(app_secret.encode(), request.get_data(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(header[len('sha256='):], expected)
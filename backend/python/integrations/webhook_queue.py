@@ -0,0 +1,447 @@
+"""
+Webhook Ingest Queue
+Durable queue that lets webhook routes acknowledge immediately while a
+worker pool processes messages in the background
+"""
+
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    user_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    last_error TEXT,
+    is_head INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_key, status, seq);
+CREATE INDEX IF NOT EXISTS jobs_head ON jobs (is_head, seq);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS seen (
+    message_id TEXT PRIMARY KEY,
+    seen_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS replies (
+    message_id TEXT PRIMARY KEY,
+    reply TEXT NOT NULL,
+    saved_at REAL NOT NULL
+);
+"""
+
+# Only the oldest unfinished job of each user is flagged ``is_head``, so the
+# claim walks one row per active user instead of every queued message
+_CLAIM = """
+SELECT seq, message_id, source, user_key, payload, attempts, enqueued_at
+FROM jobs
+WHERE is_head = 1
+  AND ((status = 'pending' AND available_at <= :now)
+       OR (status = 'inflight' AND lease_until < :now))
+ORDER BY seq
+LIMIT 1
+"""
+
+_HAS_ACTIVE = """
+SELECT 1 FROM jobs
+WHERE user_key = ? AND status IN ('pending', 'inflight')
+LIMIT 1
+"""
+
+_PROMOTE_NEXT = """
+UPDATE jobs SET is_head = 1
+WHERE seq = (SELECT MIN(seq) FROM jobs WHERE user_key = ? AND status = 'pending')
+"""
+
+
+class WebhookQueue:
+    """
+    SQLite-backed ingest queue with per-user ordering.
+
+    ``enqueue`` is a single insert (plus a dedup check on the platform
+    message ID) so webhook routes can return 200 within milliseconds.
+    Worker threads claim jobs with a lease, renewed while the handler
+    runs, so a slow handler is not claimed a second time; a job is claimed
+    again only when its worker died. A user's next message is only
+    claimed after the previous one finished or went to the dead-letter
+    list, so replies are never reordered. Failed jobs are retried with
+    exponential backoff and jitter, and move to the dead-letter list after
+    ``max_attempts``. Handlers can ``save_reply`` what they computed, so a
+    retry only resends it.
+
+    ``path=':memory:'`` keeps everything in memory for tests. A file path
+    survives restarts and can be shared by several gunicorn workers: leases
+    make sure each job is processed by one worker at a time. Call
+    ``start()`` when a worker process boots, so jobs persisted before a
+    restart are processed without waiting for a new webhook.
+    """
+
+    def __init__(
+        self,
+        handlers: Dict[str, Callable[[Dict], Any]],
+        path: str = ':memory:',
+        workers: int = 4,
+        max_attempts: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 300.0,
+        lease_seconds: float = 60.0,
+        dedup_seconds: float = 86400.0,
+        poll_interval: float = 0.5,
+    ):
+        self.handlers = handlers
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease_seconds = lease_seconds
+        self.dedup_seconds = dedup_seconds
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(threading.Lock())
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = None
+        self._last_prune = time.monotonic()
+        self._threads: List[threading.Thread] = []
+        self._pid = None
+        self._stopping = False
+        self._stopped = threading.Event()
+        # Jobs this process is running, whose leases it keeps renewing
+        self._inflight: Set[int] = set()
+
+        self.enqueued = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.retries = 0
+        self.dead_lettered = 0
+        self.last_lag_seconds = 0.0
+
+    # Producer side --------------------------------------------------------
+
+    def enqueue(self, source: str, message_id: str, user_key: str, payload: Dict) -> bool:
+        """Queue a message; returns False if this message ID was already seen"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO seen (message_id, seen_at) VALUES (?, ?)',
+                    (message_id, now),
+                )
+                if cursor.rowcount == 0:
+                    self.duplicates += 1
+                    return False
+                is_head = conn.execute(_HAS_ACTIVE, (user_key,)).fetchone() is None
+                conn.execute(
+                    'INSERT INTO jobs (message_id, source, user_key, payload, enqueued_at, available_at, is_head) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (message_id, source, user_key, json.dumps(payload, ensure_ascii=False), now, now, int(is_head)),
+                )
+            self.enqueued += 1
+
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return True
+
+    def seen(self, message_id: str) -> bool:
+        """Whether this message ID was already queued (a redelivery); counted as a duplicate"""
+        with self._lock:
+            found = self._connection().execute(
+                'SELECT 1 FROM seen WHERE message_id = ?', (message_id,)
+            ).fetchone() is not None
+            if found:
+                self.duplicates += 1
+        return found
+
+    # Replies ---------------------------------------------------------------
+
+    def save_reply(self, message_id: str, reply: Any):
+        """
+        Keep a job's computed reply until the job completes, so a retry
+        resends it instead of running the (stateful) chat pipeline again
+        """
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO replies (message_id, reply, saved_at) VALUES (?, ?, ?)',
+                    (message_id, json.dumps(reply, ensure_ascii=False), time.time()),
+                )
+
+    def saved_reply(self, message_id: str) -> Optional[Any]:
+        """The reply an earlier attempt of this message computed, or None"""
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT reply FROM replies WHERE message_id = ?', (message_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Worker side ----------------------------------------------------------
+
+    def start(self):
+        """Start the worker threads (once per process)"""
+        pid = os.getpid()
+        if self._pid == pid and self._threads:
+            return
+        with self._lock:
+            if self._pid == pid and self._threads:
+                return
+            self._pid = pid
+            self._stopping = False
+            self._stopped.clear()
+            self._inflight = set()
+            self._threads = [
+                threading.Thread(target=self._worker, name=f'webhook-worker-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            self._threads.append(threading.Thread(target=self._renew_leases, name='webhook-leases', daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Ask workers to exit after their current job"""
+        self._stopping = True
+        self._stopped.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_pending(self, limit: Optional[int] = None) -> int:
+        """Process due jobs on the calling thread (tests, CLI); returns count"""
+        done = 0
+        while limit is None or done < limit:
+            job = self._claim()
+            if job is None:
+                break
+            self._process(job)
+            done += 1
+        return done
+
+    def _worker(self):
+        while not self._stopping:
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                logger.exception("Webhook queue claim failed")
+                job = None
+            if job is None:
+                if time.monotonic() - self._last_prune > 3600:
+                    self._last_prune = time.monotonic()
+                    self.prune_seen()
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            self._process(job)
+
+    def _renew_leases(self):
+        """Extend the leases of running jobs every third of the lease"""
+        while not self._stopped.wait(self.lease_seconds / 3):
+            with self._lock:
+                if not self._inflight:
+                    continue
+                seqs = sorted(self._inflight)
+                try:
+                    conn = self._connection()
+                    with conn:
+                        conn.execute(
+                            "UPDATE jobs SET lease_until = ? WHERE status = 'inflight' AND seq IN (%s)"
+                            % ','.join('?' * len(seqs)),
+                            (time.time() + self.lease_seconds, *seqs),
+                        )
+                except sqlite3.Error:
+                    logger.exception("Webhook queue lease renewal failed")
+
+    def _claim(self) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                row = conn.execute(_CLAIM, {'now': now}).fetchone()
+                if row is None:
+                    return None
+                seq, message_id, source, user_key, payload, attempts, enqueued_at = row
+                # Guarded update: another process sharing the file may have
+                # claimed the same row between our SELECT and UPDATE
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = 'inflight', lease_until = ?, attempts = attempts + 1 "
+                    "WHERE seq = ? AND (status = 'pending' OR lease_until < ?)",
+                    (now + self.lease_seconds, seq, now),
+                )
+                if cursor.rowcount != 1:
+                    return None
+            self._inflight.add(seq)
+        return {
+            'seq': seq,
+            'message_id': message_id,
+            'source': source,
+            'user_key': user_key,
+            'payload': json.loads(payload),
+            'attempts': attempts + 1,
+            'enqueued_at': enqueued_at,
+        }
+
+    def _process(self, job: Dict):
+        handler = self.handlers.get(job['source'])
+        try:
+            if handler is None:
+                raise KeyError(f"No handler for webhook source: {job['source']}")
+            handler(job['payload'])
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self._complete(job)
+
+    def _complete(self, job: Dict):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('DELETE FROM jobs WHERE seq = ?', (job['seq'],))
+                conn.execute('DELETE FROM replies WHERE message_id = ?', (job['message_id'],))
+                conn.execute(_PROMOTE_NEXT, (job['user_key'],))
+            self._inflight.discard(job['seq'])
+            self.processed += 1
+            self.last_lag_seconds = time.time() - job['enqueued_at']
+
+    def _fail(self, job: Dict, error: Exception):
+        now = time.time()
+        with self._lock:
+            self._inflight.discard(job['seq'])
+            conn = self._connection()
+            with conn:
+                if job['attempts'] >= self.max_attempts:
+                    logger.error("Webhook %s dead-lettered after %d attempts: %s",
+                                 job['message_id'], job['attempts'], error)
+                    conn.execute(
+                        "UPDATE jobs SET status = 'dead', is_head = 0, lease_until = NULL, last_error = ? "
+                        "WHERE seq = ?",
+                        (repr(error), job['seq']),
+                    )
+                    conn.execute(_PROMOTE_NEXT, (job['user_key'],))
+                    self.dead_lettered += 1
+                else:
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** (job['attempts'] - 1))
+                    delay *= random.uniform(0.5, 1.0)
+                    conn.execute(
+                        "UPDATE jobs SET status = 'pending', lease_until = NULL, available_at = ?, "
+                        "last_error = ? WHERE seq = ?",
+                        (now + delay, repr(error), job['seq']),
+                    )
+                    self.retries += 1
+
+    # Dead letters and metrics --------------------------------------------
+
+    def dead_letters(self, limit: int = 100) -> List[Dict]:
+        """Return dead-lettered jobs, oldest first"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT seq, message_id, source, user_key, payload, attempts, last_error "
+                "FROM jobs WHERE status = 'dead' ORDER BY seq LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {
+                'seq': seq,
+                'message_id': message_id,
+                'source': source,
+                'user_key': user_key,
+                'payload': json.loads(payload),
+                'attempts': attempts,
+                'last_error': last_error,
+            }
+            for seq, message_id, source, user_key, payload, attempts, last_error in rows
+        ]
+
+    def requeue_dead(self, seq: int) -> bool:
+        """Give a dead-lettered job a fresh set of attempts"""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                row = conn.execute("SELECT user_key FROM jobs WHERE seq = ? AND status = 'dead'", (seq,)).fetchone()
+                if row is None:
+                    return False
+                # Runs next if the user has nothing else queued, otherwise
+                # after the user's current head completes
+                is_head = conn.execute(_HAS_ACTIVE, (row[0],)).fetchone() is None
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = 'pending', attempts = 0, available_at = ?, is_head = ? "
+                    "WHERE seq = ?",
+                    (time.time(), int(is_head), seq),
+                )
+        with self._wakeup:
+            self._wakeup.notify()
+        return cursor.rowcount == 1
+
+    def prune_seen(self) -> int:
+        """Forget message IDs (and unsent replies) older than the dedup window"""
+        cutoff = time.time() - self.dedup_seconds
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                cursor = conn.execute('DELETE FROM seen WHERE seen_at < ?', (cutoff,))
+                conn.execute('DELETE FROM replies WHERE saved_at < ?', (cutoff,))
+        return cursor.rowcount
+
+    def stats(self) -> Dict:
+        """Queue depth, lag and outcome counters"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            oldest = conn.execute(
+                "SELECT MIN(enqueued_at) FROM jobs WHERE status IN ('pending', 'inflight')"
+            ).fetchone()[0]
+        return {
+            'pending': counts.get('pending', 0),
+            'inflight': counts.get('inflight', 0),
+            'dead': counts.get('dead', 0),
+            'enqueued': self.enqueued,
+            'duplicates': self.duplicates,
+            'processed': self.processed,
+            'retries': self.retries,
+            'dead_lettered': self.dead_lettered,
+            'lag_seconds': now - oldest if oldest is not None else 0.0,
+            'last_lag_seconds': self.last_lag_seconds,
+        }
+
+    def _connection(self) -> sqlite3.Connection:
+        # A connection inherited across fork must not be reused
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            if self.path != ':memory:':
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+
+def webhook_queue_from_env(handlers: Dict[str, Callable[[Dict], Any]]) -> WebhookQueue:
+    """Build the queue configured by the WEBHOOK_QUEUE_* variables"""
+    return WebhookQueue(
+        handlers,
+        path=os.getenv('WEBHOOK_QUEUE_PATH', 'webhook_queue.sqlite3'),
+        workers=int(os.getenv('WEBHOOK_QUEUE_WORKERS', 4)),
+        max_attempts=int(os.getenv('WEBHOOK_QUEUE_MAX_ATTEMPTS', 5)),
+        backoff_base=float(os.getenv('WEBHOOK_QUEUE_BACKOFF_SECONDS', 1.0)),
+        lease_seconds=float(os.getenv('WEBHOOK_QUEUE_LEASE_SECONDS', 60.0)),
+    )
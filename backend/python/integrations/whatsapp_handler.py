@@ -1,9 +1,75 @@
 """WhatsApp Handler"""
 
+import logging
+import os
+
+from integrations.signatures import verify_meta_signature
+
+logger = logging.getLogger(__name__)
+
+
 class WhatsAppHandler:
-    def __init__(self):
-        pass
+    def __init__(self, queue=None, chat_handler=None, notifier=None, limiter=None):
+        # With a queue, webhook POSTs are acknowledged as soon as their
+        # messages are queued and handle_message runs on a queue worker
+        self.queue = queue
+        self.chat_handler = chat_handler
+        # Replies go out through the notification dispatcher when it has
+        # a provider for this channel; on a queue worker the job finishes
+        # only once the reply was sent, and a retry resends the saved reply
+        self.notifier = notifier
+        self.delivery_timeout = float(os.getenv('WEBHOOK_DELIVERY_TIMEOUT', 300))
+        # Per-sender limit (utils.rate_limit); over-limit messages are
+        # acknowledged but dropped, since Meta retries anything else
+        self.limiter = limiter
+        self.app_secret = os.getenv('WHATSAPP_APP_SECRET', os.getenv('FACEBOOK_APP_SECRET', ''))
     
     def process_message(self, request):
-        """Process WhatsApp message"""
+        """Validate a WhatsApp webhook and queue its messages"""
+        if not verify_meta_signature(request, self.app_secret):
+            return {"status": "error", "error": "Invalid signature"}, 403
+        
+        payload = request.get_json(silent=True) or {}
+        for entry in payload.get('entry', []):
+            for change in entry.get('changes', []):
+                for message in (change.get('value') or {}).get('messages', []):
+                    if 'id' not in message or 'from' not in message:
+                        continue
+                    user_id = f"whatsapp:{message['from']}"
+                    # Redeliveries are dropped before they cost the sender a token
+                    if self.queue is not None and self.queue.seen(message['id']):
+                        continue
+                    if self.limiter is not None and not self.limiter.allow_user(user_id):
+                        logger.debug("Dropping message from rate-limited sender %s", user_id)
+                        continue
+                    if self.queue is not None:
+                        self.queue.enqueue('whatsapp', message['id'], user_id, message)
+                    else:
+                        self.handle_message(message)
+        
         return {"status": "success"}, 200
+    
+    def handle_message(self, message):
+        """Answer one WhatsApp message"""
+        text = (message.get('text') or {}).get('body')
+        if not text or self.chat_handler is None:
+            return
+        
+        # A retried job resends the reply its first attempt computed: the
+        # chat pipeline (order flow, history, analytics) runs once per message
+        reply = self.queue.saved_reply(message['id']) if self.queue is not None else None
+        if reply is None:
+            reply = self.chat_handler({
+                'message': text, 'user_id': f"whatsapp:{message['from']}", 'channel': 'whatsapp'
+            })['response']
+            if self.queue is not None:
+                self.queue.save_reply(message['id'], reply)
+        delivery_id = self.send_message(message['from'], reply)
+        if delivery_id is not None and self.queue is not None:
+            self.notifier.confirm(delivery_id, timeout=self.delivery_timeout)
+    
+    def send_message(self, phone_number, text):
+        """Send a reply through the WhatsApp Cloud API"""
+        if self.notifier is not None and self.notifier.supports('whatsapp'):
+            return self.notifier.send(text, phone_number, channel='whatsapp')
+        logger.debug("WhatsApp reply to %s: %s", phone_number, text)
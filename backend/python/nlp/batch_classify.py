@@ -0,0 +1,226 @@
+"""
+Batch Classification
+Offline re-run of EgyptianNLP.process and intent detection over exported
+chat transcripts (JSONL or CSV), fanned out over a process pool in chunks,
+streaming one result line per message plus aggregate counts
+"""
+
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+# Per-worker state, built once by _init_worker
+_nlp = None
+_intents = None
+_memo: Dict[str, Tuple] = {}
+MEMO_SIZE = 50_000
+
+
+def _init_worker():
+    global _nlp, _intents
+    from nlp.egyptian_intent_handler import EgyptianIntentHandler
+    from nlp.egyptian_nlp import EgyptianNLP
+
+    _nlp = EgyptianNLP()
+    _intents = EgyptianIntentHandler(_nlp)
+    _memo.clear()
+
+
+def classify(text: str) -> Tuple[Optional[str], Dict[str, List[str]]]:
+    """
+    ``(intent, entities)`` for one message, as process_chat would detect
+    them, keeping only non-empty entity lists. Repeated texts (greetings,
+    "thanks") are answered from a per-process memo.
+    """
+    if _nlp is None:
+        _init_worker()
+    result = _memo.get(text)
+    if result is None:
+        entities = {kind: found for kind, found in _nlp.extract_entities(text).items() if found}
+        result = (_intents.detect_intent(_nlp.process(text)), entities)
+        if len(_memo) >= MEMO_SIZE:
+            _memo.clear()
+        _memo[text] = result
+    return result
+
+
+def classify_chunk(items: List, start: int, fields: Tuple) -> Tuple[str, Dict]:
+    """
+    Classify one chunk of raw input: JSONL lines, or CSV rows when
+    ``fields`` gives column indexes. Parsing and serialization happen here
+    in the worker, so the parent only moves text. Returns the chunk's
+    output lines and its counts.
+    """
+    kind, text_field, id_field = fields
+    lines = []
+    counts = Counter()
+    intents = Counter()
+    entity_counts = Counter()
+    for position, item in enumerate(items, start):
+        if kind == 'csv':
+            text = item[text_field] if text_field < len(item) else ''
+            message_id = item[id_field] if id_field is not None and id_field < len(item) else ''
+        else:
+            if not item.strip():
+                continue
+            try:
+                row = json.loads(item)
+            except ValueError:
+                row = None
+            if not isinstance(row, dict):
+                # Undecodable, or valid JSON that is not an object
+                counts['invalid'] += 1
+                continue
+            text = row.get(text_field)
+            text = '' if text is None else str(text)
+            message_id = row.get(id_field)
+        intent, entities = classify(text)
+        counts['messages'] += 1
+        if not text:
+            counts['empty'] += 1
+        elif intent is None:
+            counts['unclassified'] += 1
+        intents[intent or 'none'] += 1
+        for entity, found in entities.items():
+            entity_counts[entity] += len(found)
+        lines.append(json.dumps({'id': str(message_id or position), 'intent': intent, 'entities': entities},
+                                ensure_ascii=False))
+    lines.append('')
+    return '\n'.join(lines), {'counts': counts, 'intents': intents, 'entities': entity_counts}
+
+
+class BatchClassifier:
+    """
+    Streams a JSONL or CSV export through ``classify_chunk`` on ``workers``
+    processes (in-process when 1) and yields JSONL output blocks in input
+    order. Only ``workers * inflight`` chunks are pending at any time, so
+    memory stays flat however long the input is.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 1000, inflight: int = 2,
+                 text_field: str = 'message', id_field: str = 'id', executor: Optional[Executor] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.inflight = inflight
+        self.text_field = text_field
+        self.id_field = id_field
+        self.executor = executor
+        self.counts: Counter = Counter()
+        self.intents: Counter = Counter()
+        self.entities: Counter = Counter()
+        self.started = None
+
+    def run(self, source: TextIO, fmt: str = 'jsonl') -> Iterator[str]:
+        """Yield output blocks of ``{id, intent, entities}`` lines"""
+        self.started = time.perf_counter()
+        chunks = self._chunks(source, fmt)
+        if self.workers == 1 and self.executor is None:
+            for args in chunks:
+                yield self._collect(classify_chunk(*args))
+            return
+
+        executor = self.executor or ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        pending = deque()
+        try:
+            for args in chunks:
+                pending.append(executor.submit(classify_chunk, *args))
+                if len(pending) >= self.workers * self.inflight:
+                    yield self._collect(pending.popleft().result())
+            while pending:
+                yield self._collect(pending.popleft().result())
+        finally:
+            if self.executor is None:
+                executor.shutdown(cancel_futures=True)
+
+    def _chunks(self, source: TextIO, fmt: str) -> Iterator[Tuple[List, int, Tuple]]:
+        if fmt == 'csv':
+            reader = csv.reader(source)
+            header = next(reader, [])
+            if self.text_field not in header:
+                raise ValueError(f"CSV has no {self.text_field!r} column")
+            fields = ('csv', header.index(self.text_field),
+                      header.index(self.id_field) if self.id_field in header else None)
+            rows = reader
+        else:
+            fields = ('jsonl', self.text_field, self.id_field)
+            rows = source
+        start = 0
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk, start, fields
+            start += len(chunk)
+
+    def _collect(self, result: Tuple[str, Dict]) -> str:
+        output, stats = result
+        self.counts.update(stats['counts'])
+        self.intents.update(stats['intents'])
+        self.entities.update(stats['entities'])
+        return output
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started if self.started else 0
+        return self.counts['messages'] / elapsed if elapsed else 0.0
+
+    def summary(self) -> Dict:
+        return {
+            'messages': self.counts['messages'],
+            'empty': self.counts['empty'],
+            'unclassified': self.counts['unclassified'],
+            'invalid': self.counts['invalid'],
+            'messages_per_second': round(self.rate, 1),
+            'workers': self.workers,
+            'intents': dict(self.intents.most_common()),
+            'entities': dict(self.entities.most_common()),
+        }
+
+
+def _open(path: str, mode: str) -> TextIO:
+    if path == '-':
+        stream = sys.stdin if mode == 'r' else sys.stdout
+        return io.TextIOWrapper(stream.buffer, encoding='utf-8', newline='' if mode == 'r' else None)
+    return open(path, mode, encoding='utf-8', newline='' if mode == 'r' else None)
+
+
+if __name__ == '__main__':
+    # python -m nlp.batch_classify chats.jsonl intents.jsonl --workers 8 --summary summary.json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Classify exported chat messages offline")
+    parser.add_argument('input', help="JSONL or CSV file of messages ('-' for stdin)")
+    parser.add_argument('output', help="JSONL file of {id, intent, entities} ('-' for stdout)")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="Input format (default: from the extension)")
+    parser.add_argument('--text-field', default='message')
+    parser.add_argument('--id-field', default='id', help="Messages without one are numbered by position")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=1000, help="Messages per task sent to a worker")
+    parser.add_argument('--summary', help="Also write the aggregate counts to this JSON file")
+    parser.add_argument('--progress', type=float, default=10.0, help="Seconds between progress lines (0: off)")
+    args = parser.parse_args()
+
+    fmt = args.format or ('csv' if args.input.endswith('.csv') else 'jsonl')
+    classifier = BatchClassifier(workers=args.workers, chunk_size=args.chunk_size,
+                                 text_field=args.text_field, id_field=args.id_field)
+    last_report = time.perf_counter()
+    with _open(args.input, 'r') as source, _open(args.output, 'w') as sink:
+        for block in classifier.run(source, fmt):
+            sink.write(block)
+            if args.progress and time.perf_counter() - last_report >= args.progress:
+                last_report = time.perf_counter()
+                print(f"{classifier.counts['messages']} messages, {classifier.rate:.0f} msgs/s",
+                      file=sys.stderr, flush=True)
+
+    summary = classifier.summary()
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
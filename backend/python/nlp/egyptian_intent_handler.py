@@ -3,75 +3,61 @@ Egyptian Intent Handler
 Detects user intents from Egyptian Arabic messages
 """
 
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import re
 
+from nlp.egyptian_nlp import EgyptianNLP
+from nlp.intent_matcher import INTENT_KEYWORDS
+
 
 class EgyptianIntentHandler:
     """Handle intent detection for Egyptian Arabic"""
     
-    def __init__(self):
-        self.intent_patterns = {
-            'greeting': [
-                r'(السلام|مرحبا|أهلا|صباح|مساء|ازيك|عامل|ايه|إيه)',
-            ],
-            'product_inquiry': [
-                r'(عايز|محتاج|عاوز|بدور على|ابحث عن|منتج|حاجة)',
-            ],
-            'order_status': [
-                r'(طلب|أوردر|شحنة|وين|فين|وصل|متى يصل)',
-            ],
-            'price_inquiry': [
-                r'(سعر|بكام|كام|تمن|ثمن|قد ايه)',
-            ],
-            'availability': [
-                r'(متوفر|موجود|عندكم|في المخزون)',
-            ],
-            'complaint': [
-                r'(مشكلة|شكوى|غلط|خطأ|زعلان|مش راضي)',
-            ],
-            'payment': [
-                r'(دفع|الدفع|كاش|فيزا|فودافون كاش|انستاباي)',
-            ],
-            'shipping': [
-                r'(توصيل|شحن|التوصيل|الشحن|يوصل|متى يصل)',
-            ],
-            'return': [
-                r'(ارجاع|استرجاع|استبدال|رجوع)',
-            ],
-            'farewell': [
-                r'(شكرا|مع السلامة|باي|وداعا|تمام كده)',
-            ],
-        }
+    def __init__(self, nlp: Optional[EgyptianNLP] = None, product_search=None):
+        # Keyword tables live in nlp.intent_matcher and are shared with
+        # EgyptianNLP; all intents are compiled into one matcher
+        self.nlp = nlp or EgyptianNLP()
+        # Resolves product queries to catalog items (services.product_search)
+        self.product_search = product_search
+        self.intent_keywords = INTENT_KEYWORDS
+        self.matcher = self.nlp.intent_matcher
     
     def detect_intent(self, text: str) -> Optional[str]:
-        """Detect intent from text"""
+        """Detect the best-scoring intent from text"""
         if not text:
             return None
         
-        text = text.lower()
-        
-        # Check each intent pattern
-        for intent, patterns in self.intent_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, text, re.IGNORECASE):
-                    return intent
-        
-        return None
+        return self.matcher.best(text)
+    
+    def detect_intents(self, text: str) -> List[Dict]:
+        """Detect every matched intent with its score and matched spans"""
+        return self.matcher.match(text)
     
     def extract_intent_params(self, text: str, intent: str) -> Dict:
         """Extract parameters based on detected intent"""
         params = {}
         
+        entities = self.nlp.extract_entities(text)
         if intent == 'order_status':
-            # Extract order ID
-            order_id_pattern = r'#?(\d+)'
-            match = re.search(order_id_pattern, text)
-            if match:
-                params['order_id'] = match.group(1)
+            # Prefer a cued order number ("الاوردر رقم 123", "#123") over any number
+            if entities['order_numbers']:
+                params['order_id'] = entities['order_numbers'][0]
+            else:
+                match = re.search(r'#?(\d+)', text)
+                if match:
+                    params['order_id'] = match.group(1)
+        
+        elif intent == 'shipping':
+            if entities['locations']:
+                params['location'] = entities['locations'][0]
+            if entities['dates']:
+                params['date'] = entities['dates'][0]
         
-        elif intent == 'product_inquiry':
-            # Extract product name (simplified)
+        elif intent in ('product_inquiry', 'price_inquiry', 'availability'):
             params['query'] = text
+            if entities['prices']:
+                params['max_price'] = max(entities['prices'])
+            if self.product_search is not None:
+                params['products'] = self.product_search.search(text, limit=5)
         
         return params
@@ -3,9 +3,31 @@ Egyptian NLP Module
 Handles Egyptian Arabic dialect processing
 """
 
-import re
-from typing import Dict, List
-import nltk
+from typing import Dict, Iterable, List
+
+from nlp.entity_extractor import EntityExtractor
+from nlp.intent_matcher import IntentMatcher
+from nlp.phrase_trie import PhraseTrie
+
+
+# Character folding applied in a single str.translate pass:
+# alef variations -> bare alef, teh marbuta -> heh, diacritics removed
+ARABIC_FOLD_TABLE = str.maketrans(
+    {
+        **{ch: 'ا' for ch in 'إأٱآ'},
+        'ة': 'ه',
+        **{chr(cp): None for cp in range(0x064B, 0x0660)},
+    }
+)
+
+# Short intent names reported by detect_intent_keywords
+KEYWORD_INTENT_ALIASES = {
+    'greeting': 'greeting',
+    'product_inquiry': 'product',
+    'price_inquiry': 'price',
+    'order_status': 'order',
+    'complaint': 'complaint',
+}
 
 
 class EgyptianNLP:
@@ -74,6 +96,36 @@ class EgyptianNLP:
             'جزاك الله خيراً': 'شكراً',
         }
         
+        # Prices, governorates, dates, order numbers and products
+        self.entity_extractor = EntityExtractor()
+        
+        self.compile()
+    
+    def compile(self):
+        """
+        Compile the dialect mappings and expressions into a phrase trie,
+        and the shared intent keyword tables into an intent matcher.
+        
+        Keys and values are folded with the same character table applied to
+        input text, so spelling variants ('ايوه' / 'ايوة') share one entry and
+        lookup happens on already-folded tokens. Call this again after
+        changing ``dialect_mappings`` or ``expressions`` at runtime.
+        """
+        trie = PhraseTrie()
+        for table in (self.dialect_mappings, self.expressions):
+            for phrase, replacement in table.items():
+                trie.add(
+                    phrase.translate(ARABIC_FOLD_TABLE),
+                    replacement.translate(ARABIC_FOLD_TABLE),
+                )
+        self._phrase_trie = trie
+        
+        # Intent keywords match in both raw dialect and processed form
+        self.intent_matcher = IntentMatcher(
+            normalizer=self.process,
+            fold=self._normalize_arabic,
+        )
+        
     def process(self, text: str) -> str:
         """
         Process Egyptian Arabic text and normalize it
@@ -81,80 +133,48 @@ class EgyptianNLP:
         if not text:
             return ""
         
-        # Convert to lowercase
-        text = text.strip()
-        
-        # Remove extra spaces
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Apply dialect mappings
-        processed_text = self._apply_mappings(text)
-        
-        # Normalize Arabic characters
-        processed_text = self._normalize_arabic(processed_text)
-        
-        return processed_text
+        # Fold characters first, then split (which also collapses
+        # whitespace) and replace dialect phrases in a single token walk
+        tokens = text.translate(ARABIC_FOLD_TABLE).split()
+        return ' '.join(self._phrase_trie.replace(tokens))
+    
+    def process_many(self, texts: Iterable[str]) -> List[str]:
+        """Process a batch of messages"""
+        table = ARABIC_FOLD_TABLE
+        replace = self._phrase_trie.replace
+        return [
+            ' '.join(replace(text.translate(table).split())) if text else ""
+            for text in texts
+        ]
     
     def _apply_mappings(self, text: str) -> str:
-        """Apply Egyptian dialect to MSA mappings"""
-        words = text.split()
-        processed_words = []
-        
-        for word in words:
-            # Check if word exists in mappings
-            if word in self.dialect_mappings:
-                processed_words.append(self.dialect_mappings[word])
-            else:
-                processed_words.append(word)
-        
-        return ' '.join(processed_words)
+        """Apply Egyptian dialect to MSA mappings (longest phrase wins)"""
+        tokens = self._normalize_arabic(text).split()
+        return ' '.join(self._phrase_trie.replace(tokens))
     
     def _normalize_arabic(self, text: str) -> str:
-        """Normalize Arabic text"""
-        # Normalize alef variations
-        text = re.sub('[إأٱآا]', 'ا', text)
-        
-        # Normalize teh marbuta
-        text = re.sub('ة', 'ه', text)
-        
-        # Remove diacritics
-        text = re.sub(r'[\u064B-\u065F]', '', text)
-        
-        return text
+        """Normalize alef variations and teh marbuta, remove diacritics"""
+        return text.translate(ARABIC_FOLD_TABLE)
     
-    def extract_entities(self, text: str) -> Dict[str, List[str]]:
-        """Extract named entities from text"""
-        entities = {
-            'products': [],
-            'prices': [],
-            'locations': [],
-            'dates': []
-        }
-        
-        # Extract price mentions
-        price_pattern = r'\d+\s*(جنيه|ج\.م|pounds?|EGP)'
-        prices = re.findall(price_pattern, text, re.IGNORECASE)
-        entities['prices'] = prices
-        
-        return entities
+    def extract_entities(self, text: str) -> Dict[str, List]:
+        """
+        Extract named entities from text as distinct normalized values per
+        kind: products (catalog word), prices (numbers), locations
+        (governorate), dates (ISO) and order_numbers. Use
+        ``entity_extractor.extract`` for the typed spans.
+        """
+        extractor = self.entity_extractor
+        return extractor.group(extractor.extract(text))
+    
+    def extract_entities_many(self, texts: Iterable[str]) -> List[Dict[str, List]]:
+        """Extract entities from a batch of messages"""
+        extractor = self.entity_extractor
+        return [extractor.group(spans) for spans in extractor.extract_many(list(texts))]
     
     def detect_intent_keywords(self, text: str) -> List[str]:
         """Detect intent keywords in text"""
-        intent_keywords = {
-            'greeting': ['مرحبا', 'أهلا', 'السلام', 'صباح', 'مساء'],
-            'product': ['منتج', 'حاجة', 'عايز', 'محتاج', 'بدور'],
-            'price': ['سعر', 'بكام', 'تمن', 'كام'],
-            'order': ['طلب', 'أوردر', 'شحنة'],
-            'complaint': ['مشكلة', 'شكوى', 'زعلان', 'غلط'],
-        }
-        
-        detected = []
-        text_lower = text.lower()
-        
-        for intent, keywords in intent_keywords.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    detected.append(intent)
-                    break
-        
-        return detected
+        matched = {match['intent'] for match in self.intent_matcher.match(text)}
+        return [
+            alias for intent, alias in KEYWORD_INTENT_ALIASES.items()
+            if intent in matched
+        ]
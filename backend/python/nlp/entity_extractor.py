@@ -0,0 +1,417 @@
+"""
+Entity Extractor
+Gazetteer-backed extraction of prices, governorates, relative dates, order
+numbers and product names from Egyptian Arabic chat messages
+"""
+
+import re
+from datetime import date, timedelta
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from nlp.phrase_trie import PhraseTrie
+
+
+# Length-preserving fold: every character maps to exactly one character, so
+# offsets in the folded text are offsets in the original message. Diacritics
+# become tatweel, which is dropped from tokens; Arabic-Indic and Persian
+# digits and separators become ASCII.
+ENTITY_FOLD_TABLE = str.maketrans(
+    {
+        **{ch: 'ا' for ch in 'إأٱآ'},
+        'ة': 'ه',
+        'ى': 'ي',
+        **{chr(cp): 'ـ' for cp in range(0x064B, 0x0660)},
+        'ٰ': 'ـ',
+        **{chr(0x0660 + d): str(d) for d in range(10)},
+        **{chr(0x06F0 + d): str(d) for d in range(10)},
+        '٫': '.',
+        '٬': ',',
+        **{chr(cp): chr(cp + 32) for cp in range(ord('A'), ord('Z') + 1)},
+    }
+)
+# The same table indexed by code point: str.translate looks up a list about
+# twice as fast as a dict, and characters past its end stay unchanged
+_FOLD = [ENTITY_FOLD_TABLE.get(cp, chr(cp)) for cp in range(0x0700)]
+
+# Dates (d/m or d/m/y), numbers with separators, '#', and words
+_TOKEN = re.compile(r'\d{1,2}/\d{1,2}(?:/\d{2,4})?|\d+(?:[.,]\d+)*|#|[^\W\d_]+')
+# The same tokens interleaved with the text between them, so character
+# offsets are running sums of the part lengths
+_SPLIT = re.compile(f'({_TOKEN.pattern})')
+
+# The 27 governorates: canonical name -> spellings, capitals and well-known
+# cities or districts customers name instead of the governorate
+GOVERNORATES: Dict[str, List[str]] = {
+    'القاهرة': ['القاهرة', 'قاهرة', 'cairo', 'مدينة نصر', 'مصر الجديدة', 'المعادي', 'حلوان',
+                'التجمع', 'التجمع الخامس', 'شبرا', 'الزمالك', 'المقطم'],
+    'الجيزة': ['الجيزة', 'جيزة', 'giza', 'الهرم', '6 اكتوبر', 'السادس من اكتوبر',
+               'الشيخ زايد', 'الدقي', 'المهندسين'],
+    'الإسكندرية': ['الإسكندرية', 'اسكندرية', 'إسكندرية', 'الاسكندرية', 'اسكندريه', 'alexandria', 'alex'],
+    'الدقهلية': ['الدقهلية', 'دقهلية', 'المنصورة', 'mansoura'],
+    'الشرقية': ['الشرقية', 'الزقازيق', 'zagazig'],
+    'القليوبية': ['القليوبية', 'قليوبية', 'بنها', 'شبرا الخيمة'],
+    'كفر الشيخ': ['كفر الشيخ', 'kafr el sheikh'],
+    'الغربية': ['الغربية', 'طنطا', 'المحلة', 'المحلة الكبرى', 'tanta'],
+    'المنوفية': ['المنوفية', 'منوفية', 'شبين الكوم'],
+    'البحيرة': ['البحيرة', 'دمنهور'],
+    'الإسماعيلية': ['الإسماعيلية', 'الاسماعيلية', 'اسماعيلية', 'ismailia'],
+    'بورسعيد': ['بورسعيد', 'بور سعيد', 'port said'],
+    'السويس': ['السويس', 'suez'],
+    'دمياط': ['دمياط', 'damietta'],
+    'الفيوم': ['الفيوم', 'fayoum'],
+    'بني سويف': ['بني سويف', 'بنى سويف', 'beni suef'],
+    'المنيا': ['المنيا', 'minya'],
+    'أسيوط': ['أسيوط', 'اسيوط', 'assiut'],
+    'سوهاج': ['سوهاج', 'sohag'],
+    'قنا': ['قنا', 'qena'],
+    'الأقصر': ['الأقصر', 'الاقصر', 'luxor'],
+    'أسوان': ['أسوان', 'اسوان', 'aswan'],
+    'البحر الأحمر': ['البحر الأحمر', 'الغردقة', 'hurghada'],
+    'الوادي الجديد': ['الوادي الجديد', 'الخارجة'],
+    'مطروح': ['مطروح', 'مرسى مطروح', 'marsa matrouh'],
+    'شمال سيناء': ['شمال سيناء', 'العريش'],
+    'جنوب سيناء': ['جنوب سيناء', 'شرم الشيخ', 'شرم', 'sharm'],
+}
+
+# Relative dates: phrase -> ('offset', days) or ('weekday', date.weekday())
+RELATIVE_DATES: Dict[str, Tuple[str, int]] = {
+    **{word: ('offset', 0) for word in ('النهارده', 'النهاردة', 'انهارده', 'النهارداه', 'اليوم', 'الليلة', 'today')},
+    **{word: ('offset', 1) for word in ('بكرة', 'بكره', 'بكرا', 'غدا', 'غداً', 'tomorrow')},
+    **{word: ('offset', 2) for word in ('بعد بكرة', 'بعد بكره', 'بعد بكرا', 'بعد يومين')},
+    **{word: ('offset', -1) for word in ('امبارح', 'إمبارح', 'مبارح', 'امس', 'أمس', 'البارحة', 'yesterday')},
+    **{word: ('offset', -2) for word in ('اول امبارح', 'أول امبارح', 'اول امس')},
+    **{word: ('offset', 7) for word in ('الاسبوع الجاي', 'الأسبوع الجاي', 'الاسبوع القادم', 'بعد اسبوع',
+                                        'next week')},
+    **{word: ('offset', -7) for word in ('الاسبوع اللي فات', 'الأسبوع اللي فات', 'الاسبوع الماضي',
+                                         'last week')},
+    **{word: ('weekday', 5) for word in ('السبت', 'يوم السبت')},
+    **{word: ('weekday', 6) for word in ('الاحد', 'الأحد', 'يوم الحد', 'يوم الاحد')},
+    **{word: ('weekday', 0) for word in ('الاتنين', 'الاثنين', 'يوم الاتنين', 'يوم الاثنين')},
+    **{word: ('weekday', 1) for word in ('الثلاثاء', 'التلاتاء', 'يوم التلات')},
+    **{word: ('weekday', 2) for word in ('الاربعاء', 'الأربعاء', 'يوم الاربع')},
+    **{word: ('weekday', 3) for word in ('الخميس', 'يوم الخميس')},
+    **{word: ('weekday', 4) for word in ('الجمعة', 'يوم الجمعة')},
+}
+
+# Product types: canonical catalog word -> dialect and English spellings.
+# Catalog names are added at runtime with EntityExtractor.add_products.
+PRODUCT_TERMS: Dict[str, List[str]] = {
+    'قميص': ['قميص', 'قمصان', 'shirt'],
+    'تيشرت': ['تيشيرت', 'تيشرت', 'تي شيرت', 'تيشيرتات', 'tshirt', 't shirt'],
+    'بنطال': ['بنطلون', 'بنطلونات', 'بنطال', 'pants', 'jeans'],
+    'فستان': ['فستان', 'فساتين', 'dress'],
+    'بلوزة': ['بلوزة', 'بلوزات', 'blouse'],
+    'جيبة': ['جيبة', 'skirt'],
+    'جاكيت': ['جاكيت', 'جاكت', 'جواكت', 'jacket'],
+    'بالطو': ['بالطو', 'coat'],
+    'حقيبة': ['شنطة', 'شنط', 'حقيبة', 'bag'],
+    'محفظة': ['محفظة', 'wallet'],
+    'حزام': ['حزام', 'belt'],
+    'حذاء': ['جزمة', 'جزم', 'حذاء', 'shoes'],
+    'كوتشي': ['كوتشي', 'كوتشيات', 'sneakers'],
+    'صندل': ['صندل', 'صنادل', 'sandal'],
+    'بيجامة': ['بيجامة', 'بيجامات', 'pajama'],
+    'ترينج': ['ترينج', 'ترنج', 'tracksuit'],
+    'طاقية': ['طاقية', 'كاب', 'cap'],
+    'نضارة': ['نضارة', 'نظارة', 'sunglasses'],
+    'طرحة': ['طرحة'],
+    'شورت': ['شورت', 'shorts'],
+    'هودي': ['هودي', 'hoodie'],
+    'كارديجان': ['كارديجان', 'cardigan'],
+    'بدلة': ['بدلة', 'suit'],
+    'عباية': ['عباية', 'عبايات'],
+}
+
+CURRENCIES = ['جنيه', 'جنيها', 'جنيهات', 'جنية', 'ج', 'جم', 'ج.م', 'egp', 'le', 'l.e', 'pound', 'pounds']
+MULTIPLIERS = {'الف': 1000, 'آلاف': 1000, 'الاف': 1000, 'k': 1000, 'مليون': 1_000_000}
+# Spelled-out amounts that are common in prices ("خمسميه جنيه")
+AMOUNT_WORDS = {
+    'ميه': 100, 'مية': 100, 'ميت': 100, 'ميتين': 200, 'تلتميه': 300, 'ربعميه': 400, 'خمسميه': 500,
+    'ستميه': 600, 'سبعميه': 700, 'تمنميه': 800, 'تسعميه': 900, 'الف': 1000, 'الفين': 2000,
+}
+# Words after which a number is an order number ("الاوردر رقم 12345")
+ORDER_CUES = ['طلب', 'طلبي', 'اوردر', 'أوردر', 'اوردري', 'شحنة', 'رقم', 'نمرة', 'order', 'ord', 'tracking']
+ORDER_MIN_DIGITS = 3
+
+ENTITY_KEYS = {
+    'product': 'products',
+    'price': 'prices',
+    'location': 'locations',
+    'date': 'dates',
+    'order_number': 'order_numbers',
+}
+
+# Proclitics glued to gazetteer words ("لاسكندرية", "بالجيزة", "والجزمة")
+_PREFIXES = ('و', 'ب', 'ف')
+
+
+def fold(text: str) -> str:
+    return text.translate(_FOLD)
+
+
+def _tokens(phrase: str) -> List[str]:
+    return [token.replace('ـ', '') for token in _TOKEN.findall(fold(phrase))]
+
+
+def _forms(tokens: List[str], article: bool = True) -> List[List[str]]:
+    """
+    Other surface forms of a phrase: with or without the article, and with
+    proclitics. ``article=False`` keeps the article as written, for phrases
+    whose bare word means something else ('اليوم' is today, 'يوم' any day)
+    """
+    first = tokens[0]
+    if first.isascii() or len(first) < 3:
+        return []
+    if first.startswith('ال'):
+        bare = first[2:]
+        bases = [first, bare] if len(bare) > 2 and article else [first]
+        firsts = bases + ['لل' + bare]
+    elif article:
+        bases = [first, 'ال' + first]
+        firsts = bases + ['ل' + first, 'لل' + first]
+    else:
+        bases = [first]
+        firsts = bases + ['ل' + first]
+    firsts += [prefix + word for prefix in _PREFIXES for word in bases]
+    return [[word] + tokens[1:] for word in firsts if word != first]
+
+
+def _number(token: str) -> Optional[Union[int, float]]:
+    if ',' in token:
+        head, *groups = token.split(',')
+        # "1,500" groups thousands; "12,5" is a decimal comma
+        token = head + ''.join(groups) if all(len(g.split('.')[0]) == 3 for g in groups) else token.replace(',', '.')
+    try:
+        value = float(token)
+    except ValueError:
+        return None
+    return int(value) if value.is_integer() else value
+
+
+def _is_phone(digits: str) -> bool:
+    return (len(digits) == 11 and digits.startswith('01')) or (len(digits) == 12 and digits.startswith('201'))
+
+
+class Entity:
+    """A typed span of the original message with its normalized value"""
+
+    __slots__ = ('type', 'text', 'value', 'start', 'end')
+
+    def __init__(self, type: str, text: str, value, start: int, end: int):
+        self.type = type
+        self.text = text
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def __repr__(self) -> str:
+        return f"Entity({self.type!r}, {self.text!r}, {self.value!r}, {self.start}, {self.end})"
+
+    def to_dict(self) -> Dict:
+        return {'type': self.type, 'text': self.text, 'value': self.value, 'start': self.start, 'end': self.end}
+
+
+class EntityExtractor:
+    """
+    Extract every entity in a message with one tokenization and one
+    left-to-right walk.
+
+    Governorates, relative dates, product words, order cues and spelled-out
+    amounts share one token trie (with article and proclitic forms
+    generated at compile time), so the cost per message depends on its
+    length rather than on the size of the gazetteers. Numbers are resolved
+    by their neighbours: a following currency makes a price, a preceding
+    order cue or '#' an order number.
+    """
+
+    def __init__(
+        self,
+        locations: Dict[str, List[str]] = None,
+        dates: Dict[str, Tuple[str, int]] = None,
+        products: Dict[str, List[str]] = None,
+    ):
+        self.locations = locations if locations is not None else GOVERNORATES
+        self.dates = dates if dates is not None else RELATIVE_DATES
+        self.products = products if products is not None else PRODUCT_TERMS
+        self.compile()
+
+    def compile(self):
+        """(Re)build the gazetteer trie; catalog names need add_products again"""
+        entries = []
+        for canonical, spellings in self.locations.items():
+            entries.extend((spelling, ('location', canonical)) for spelling in spellings)
+        entries.extend((phrase, ('date', value)) for phrase, value in self.dates.items())
+        for canonical, spellings in self.products.items():
+            entries.extend((spelling, ('product', canonical)) for spelling in spellings)
+        entries.extend((cue, ('order_cue', None)) for cue in ORDER_CUES)
+        entries.extend((word, ('amount', amount)) for word, amount in AMOUNT_WORDS.items())
+
+        trie = PhraseTrie()
+        # Generated forms first, so an exact spelling always wins a collision
+        exact = []
+        for phrase, value in entries:
+            tokens = _tokens(phrase)
+            if tokens:
+                exact.append((tokens, value))
+                # Bare date words are ordinary nouns: 'يوم', 'ليله', 'اتنين', 'جمعه'
+                for form in _forms(tokens, article=value[0] != 'date'):
+                    trie.add(' '.join(form), value)
+        for tokens, value in exact:
+            trie.add(' '.join(tokens), value)
+        self._trie = trie
+
+        currencies = PhraseTrie()
+        for currency in CURRENCIES:
+            currencies.add(' '.join(_tokens(currency)), True)
+        self._currencies = currencies
+        self._multipliers = {fold(word): factor for word, factor in MULTIPLIERS.items()}
+
+    def add_products(self, products: Iterable[Union[str, Dict]]) -> int:
+        """
+        Add catalog names (strings or product dicts with nameAr / name).
+        Deleted or inactive products are skipped; names already added stay
+        until the next ``compile``.
+        """
+        added = 0
+        for product in products:
+            if isinstance(product, dict):
+                if product.get('deleted') or product.get('active') is False:
+                    continue
+                names = [product.get('nameAr'), product.get('name')]
+                value = product.get('nameAr') or product.get('name')
+            else:
+                names, value = [product], product
+            for name in names:
+                tokens = _tokens(name) if name else []
+                if tokens:
+                    self._trie.add(' '.join(tokens), ('product', value))
+                    added += 1
+        return added
+
+    def extract(self, text: str, today: Optional[date] = None) -> List[Entity]:
+        """Typed, non-overlapping entity spans in order of appearance"""
+        if not text:
+            return []
+        folded = text.translate(_FOLD)
+        parts = _SPLIT.split(folded)
+        tokens = parts[1::2]
+        kept = None
+        if 'ـ' in folded:
+            stripped = [token.replace('ـ', '') for token in tokens]
+            kept = [k for k, token in enumerate(stripped) if token]
+            tokens = [stripped[k] for k in kept]
+
+        # Only gazetteer starts, numbers and '#' need a closer look; digits
+        # and '#' are the only token starts that sort below ':'
+        root = self._trie._root
+        candidates = [i for i, token in enumerate(tokens) if token < ':' or token in root]
+        if not candidates:
+            return []
+
+        found = []
+        order_until = -1
+        resume = 0
+        for i in candidates:
+            if i < resume:
+                continue
+            token = tokens[i]
+            if token in root:
+                match = self._trie.longest_match(tokens, i)
+                if match is not None:
+                    end, (kind, value) = match
+                    if kind == 'order_cue':
+                        order_until = end + 1
+                    elif kind == 'amount':
+                        currency = self._currencies.longest_match(tokens, end)
+                        if currency is not None:
+                            end = currency[0]
+                            found.append(('price', value, i, end))
+                    elif kind == 'date':
+                        found.append(('date', self._resolve(value, today), i, end))
+                    else:
+                        found.append((kind, value, i, end))
+                    resume = end
+                    continue
+
+            if token == '#':
+                order_until = i + 1
+            elif '/' in token:
+                value = self._absolute_date(token, today)
+                if value is not None:
+                    found.append(('date', value, i, i + 1))
+            elif token[0] != '#':
+                price = self._price_span(tokens, i)
+                value = _number(token) if price is not None else None
+                if value is not None:
+                    first, end = price
+                    if i + 1 < end and tokens[i + 1] in self._multipliers:
+                        value *= self._multipliers[tokens[i + 1]]
+                    found.append(('price', value, first, end))
+                    resume = end
+                elif i <= order_until and len(token) >= ORDER_MIN_DIGITS and token.isdigit() \
+                        and not _is_phone(token):
+                    found.append(('order_number', token, i, i + 1))
+        if not found:
+            return []
+
+        # Character offsets, only for messages that have entities: token k
+        # is parts[2k + 1], so it starts where parts[2k] ends
+        offsets = list(accumulate(map(len, parts)))
+        entities = []
+        for kind, value, first, end in found:
+            last = end - 1
+            if kept is not None:
+                first, last = kept[first], kept[last]
+            start, stop = offsets[2 * first], offsets[2 * last + 1]
+            entities.append(Entity(kind, text[start:stop], value, start, stop))
+        return entities
+
+    def extract_many(self, texts: Sequence[str], today: Optional[date] = None) -> List[List[Entity]]:
+        """Extract a batch of messages, resolving relative dates against one day"""
+        today = today or date.today()
+        extract = self.extract
+        return [extract(text, today) for text in texts]
+
+    @staticmethod
+    def group(entities: Iterable[Entity]) -> Dict[str, List]:
+        """Distinct values per entity kind, as EgyptianNLP.extract_entities returns them"""
+        grouped = {'products': [], 'prices': [], 'locations': [], 'dates': [], 'order_numbers': []}
+        for entity in entities:
+            values = grouped[ENTITY_KEYS[entity.type]]
+            if entity.value not in values:
+                values.append(entity.value)
+        return grouped
+
+    def _price_span(self, tokens: List[str], i: int) -> Optional[Tuple[int, int]]:
+        """Token span of a price around the number at ``i``: a currency after it
+        (past an optional multiplier) or a currency code before it"""
+        j = i + 1
+        if j < len(tokens) and tokens[j] in self._multipliers:
+            j += 1
+        currency = self._currencies.longest_match(tokens, j)
+        if currency is not None:
+            return i, currency[0]
+        if i and tokens[i - 1] in ('egp', 'le'):
+            return i - 1, j
+        return None
+
+    @staticmethod
+    def _resolve(value: Tuple[str, int], today: Optional[date]) -> str:
+        today = today or date.today()
+        kind, amount = value
+        if kind == 'weekday':
+            amount = (amount - today.weekday()) % 7
+        return (today + timedelta(days=amount)).isoformat()
+
+    @staticmethod
+    def _absolute_date(token: str, today: Optional[date]) -> Optional[str]:
+        today = today or date.today()
+        parts = [int(part) for part in token.split('/')]
+        year = parts[2] if len(parts) == 3 else today.year
+        if year < 100:
+            year += 2000
+        try:
+            return date(year, parts[1], parts[0]).isoformat()
+        except ValueError:
+            return None
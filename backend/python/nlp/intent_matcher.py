@@ -0,0 +1,119 @@
+"""
+Intent Matcher
+Shared intent keyword tables and a single-scan multi-intent matcher
+"""
+
+from typing import Callable, Dict, List, Optional
+
+from nlp.trie_regex import compile_trie
+
+
+# Keyword tables shared by EgyptianIntentHandler and EgyptianNLP.
+# Keywords match as substrings of the folded, lowercased message, the
+# same way the previous per-intent regex alternations did.
+INTENT_KEYWORDS: Dict[str, List[str]] = {
+    'greeting': ['السلام', 'مرحبا', 'أهلا', 'صباح', 'مساء', 'ازيك', 'عامل', 'ايه', 'إيه'],
+    'product_inquiry': ['عايز', 'محتاج', 'عاوز', 'بدور على', 'بدور', 'ابحث عن', 'منتج', 'حاجة'],
+    'order_status': ['طلب', 'أوردر', 'شحنة', 'وين', 'فين', 'وصل', 'متى يصل'],
+    'price_inquiry': ['سعر', 'بكام', 'كام', 'تمن', 'ثمن', 'قد ايه', 'بقد ايه'],
+    'availability': ['متوفر', 'موجود', 'عندكم', 'في المخزون'],
+    'complaint': ['مشكلة', 'شكوى', 'غلط', 'خطأ', 'زعلان', 'مش راضي'],
+    'payment': ['دفع', 'الدفع', 'كاش', 'فيزا', 'فودافون كاش', 'انستاباي'],
+    'shipping': ['توصيل', 'شحن', 'التوصيل', 'الشحن', 'يوصل', 'متى يصل'],
+    'return': ['ارجاع', 'استرجاع', 'استبدال', 'رجوع'],
+    'farewell': ['شكرا', 'مع السلامة', 'باي', 'وداعا', 'تمام كده'],
+}
+
+# Social intents co-occur with almost every request ("ازيك، عايز ...");
+# a lower weight lets the actual request win when both are present.
+INTENT_WEIGHTS: Dict[str, float] = {
+    'greeting': 0.5,
+    'farewell': 0.5,
+}
+
+
+class IntentMatcher:
+    """
+    Match every intent in a message with one regex scan.
+
+    All keywords of all intents are compiled into a single trie-shaped
+    regex, so the cost per message depends on its length rather than on the
+    number of intents. Keywords are folded (and optionally passed through
+    ``normalizer``, e.g. ``EgyptianNLP.process``, so both the dialect and the
+    normalized MSA form match). Matches are leftmost-longest and never
+    overlap, so 'بقد ايه' counts as a price question rather than a greeting.
+    """
+
+    def __init__(
+        self,
+        keywords: Dict[str, List[str]] = None,
+        weights: Dict[str, float] = None,
+        normalizer: Optional[Callable[[str], str]] = None,
+        fold: Optional[Callable[[str], str]] = None,
+    ):
+        self.keywords = keywords if keywords is not None else INTENT_KEYWORDS
+        self.weights = weights if weights is not None else INTENT_WEIGHTS
+        self._fold = fold or (lambda text: text)
+        self._priority = {intent: i for i, intent in enumerate(self.keywords)}
+
+        # keyword form -> [(intent, score)]; one form can serve several
+        # intents ('متى يصل' is both an order and a shipping question)
+        lookup: Dict[str, Dict[str, float]] = {}
+        for intent, words in self.keywords.items():
+            weight = self.weights.get(intent, 1.0)
+            for word in words:
+                folded = self._fold(word.lower())
+                forms = [folded]
+                if normalizer is not None:
+                    forms.append(normalizer(folded))
+                # Keyword length in tokens is the base score of a match.
+                # Both forms share the shorter length, so a message scores
+                # the same before and after normalization ('بقد ايه' and
+                # 'بكام' both become 'بكم' and score 1; 'ازيك' keeps 1 as
+                # 'كيف حالك')
+                score = min(len(form.split()) for form in forms) * weight
+                for form in forms:
+                    if form:
+                        scores = lookup.setdefault(form, {})
+                        scores[intent] = max(score, scores.get(intent, 0.0))
+
+        self._lookup = {form: tuple(scores.items()) for form, scores in lookup.items()}
+        self._pattern = compile_trie(self._lookup)
+
+    def match(self, text: str) -> List[Dict]:
+        """
+        Return every matched intent, best first.
+
+        Each entry is ``{'intent', 'score', 'spans'}`` where spans are
+        ``(start, end, keyword)`` offsets into the folded, lowercased text.
+        """
+        if not text:
+            return []
+
+        text = self._fold(text.lower())
+        lookup = self._lookup
+        results: Dict[str, Dict] = {}
+
+        for m in self._pattern.finditer(text):
+            keyword = m.group()
+            span = (m.start(), m.end(), keyword)
+            for intent, score in lookup[keyword]:
+                entry = results.get(intent)
+                if entry is None:
+                    entry = results[intent] = {'intent': intent, 'score': 0.0, 'spans': []}
+                entry['score'] += score
+                entry['spans'].append(span)
+
+        if len(results) < 2:
+            return list(results.values())
+
+        priority = self._priority
+        return sorted(
+            results.values(),
+            key=lambda entry: (-entry['score'], priority[entry['intent']]),
+        )
+
+    def best(self, text: str) -> Optional[str]:
+        """Return the highest-scoring intent, or None"""
+        matches = self.match(text)
+        return matches[0]['intent'] if matches else None
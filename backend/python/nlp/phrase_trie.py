@@ -0,0 +1,114 @@
+"""
+Phrase Trie
+Token-level trie for longest-match lookup of single and multi-word phrases
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Marks the end of a phrase inside a trie node. Tokens are always strings,
+# so ``None`` can never collide with a real token.
+_END = None
+
+
+class PhraseTrie:
+    """
+    Trie keyed on whitespace-separated tokens.
+
+    Each node is a plain dict mapping the next token to its child node, with
+    the phrase value stored under the ``_END`` key. Lookups walk the token
+    list once from each start position and keep the longest phrase found, so
+    'بقد ايه' wins over 'ايه' when both are present.
+    """
+
+    __slots__ = ('_root', '_size')
+
+    def __init__(self):
+        self._root: Dict[Any, Any] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, phrase: str, value: Any):
+        """Add a phrase (split on whitespace) with its value"""
+        tokens = phrase.split()
+        if not tokens:
+            return
+
+        node = self._root
+        for token in tokens:
+            node = node.setdefault(token, {})
+
+        if _END not in node:
+            self._size += 1
+        node[_END] = value
+
+    def longest_match(self, tokens: Sequence[str], start: int = 0) -> Optional[Tuple[int, Any]]:
+        """Return (end, value) of the longest phrase starting at ``start``"""
+        node = self._root
+        best = None
+        i = start
+        n = len(tokens)
+
+        while i < n:
+            node = node.get(tokens[i])
+            if node is None:
+                break
+            i += 1
+            if _END in node:
+                best = (i, node[_END])
+
+        return best
+
+    def scan(self, tokens: Sequence[str]) -> Iterator[Tuple[int, int, Any]]:
+        """Yield non-overlapping (start, end, value) matches, leftmost-longest"""
+        i = 0
+        n = len(tokens)
+
+        while i < n:
+            match = self.longest_match(tokens, i) if tokens[i] in self._root else None
+            if match is None:
+                i += 1
+                continue
+            end, value = match
+            yield i, end, value
+            i = end
+
+    def replace(self, tokens: Sequence[str]) -> List[str]:
+        """Replace every matched phrase with its value, leaving other tokens as-is"""
+        root = self._root
+        out = []
+        append = out.append
+        i = 0
+        n = len(tokens)
+
+        while i < n:
+            token = tokens[i]
+            node = root.get(token)
+            if node is None:
+                append(token)
+                i += 1
+                continue
+
+            # Walk forward for the longest phrase starting at this token
+            best_end = i + 1 if _END in node else -1
+            best_value = node.get(_END)
+            j = i + 1
+            while j < n:
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                j += 1
+                if _END in node:
+                    best_end = j
+                    best_value = node[_END]
+
+            if best_end < 0:
+                append(token)
+                i += 1
+            else:
+                append(best_value)
+                i = best_end
+
+        return out
@@ -0,0 +1,53 @@
+"""
+Trie Regex
+Compile a keyword list into a single trie-shaped regular expression
+"""
+
+import re
+from typing import Dict, Iterable, Pattern
+
+
+_END = ''
+
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """
+    Build a regex source matching any of ``words``.
+
+    Shared prefixes are factored out ('بكام|بقد ايه' -> 'ب(?:كام|قد\\ ايه)'),
+    so the regex engine rejects a position after one character instead of
+    trying every keyword in turn, and optional suffixes are greedy so the
+    longest keyword wins at each position.
+    """
+    root: Dict = {}
+    for word in words:
+        if not word:
+            continue
+        node = root
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[_END] = True
+
+    return _node_pattern(root) if root else '(?!)'
+
+
+def compile_trie(words: Iterable[str], flags: int = 0) -> Pattern:
+    """Compile ``words`` into a trie regex"""
+    return re.compile(trie_pattern(words), flags)
+
+
+def _node_pattern(node: Dict) -> str:
+    branches = [
+        re.escape(ch) + _node_pattern(child)
+        for ch, child in sorted(node.items())
+        if ch != _END
+    ]
+    if not branches:
+        return ''
+
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if _END in node:
+        if len(branches) == 1 and len(body) > 1:
+            body = '(?:' + body + ')'
+        return body + '?'
+    return body
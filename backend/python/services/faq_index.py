@@ -0,0 +1,403 @@
+"""
+FAQ Index
+In-memory inverted index with BM25 ranking and an optional dense-vector
+mode, persisted as memory-mapped NumPy arrays
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.snapshot import save_snapshot, snapshot_path
+
+
+_WORD = re.compile(r'\w+')
+
+
+class HashingEmbedder:
+    """
+    Offline dense embedder: character n-grams and words hashed into a fixed
+    number of dimensions (crc32, so vectors are stable across processes)
+    and L2-normalized. Any callable mapping a list of normalized texts to an
+    (n, dim) float32 array, e.g. a sentence-transformers model's
+    ``encode``, can be used instead.
+    """
+
+    def __init__(self, dim: int = 256, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        n = self.ngram
+        for row, text in enumerate(texts):
+            for token in text.split():
+                vectors[row, zlib.crc32(token.encode()) % self.dim] += 1.0
+                padded = f'#{token}#'
+                for i in range(max(1, len(padded) - n + 1)):
+                    vectors[row, zlib.crc32(padded[i:i + n].encode()) % self.dim] += 0.5
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class FAQIndex:
+    """
+    BM25 index over FAQ questions.
+
+    The bulk of the index is a read-only CSR segment: ``indptr`` slices
+    ``postings`` (doc numbers) and ``tfs`` per term, and ``doc_len`` holds
+    question lengths. ``save`` writes these arrays as .npy files and
+    ``load`` memory-maps them, so gunicorn workers open the index instantly
+    and share its pages through the OS page cache.
+
+    ``add`` goes to a small in-memory segment and ``remove`` marks a
+    tombstone; both are searched together with the CSR segment, and
+    ``compact`` folds them into a new CSR segment. The BM25 term-frequency
+    part of each posting is precomputed (``impacts``), so a query term
+    costs one gather-add over its postings. As in Lucene, removed questions
+    still count towards document frequencies, and the average question
+    length stays at its last-compaction value, until ``compact``.
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, normalizer: Callable[[str], str], embedder: Optional[Callable] = None):
+        self.normalizer = normalizer
+        self.embedder = embedder
+        self._lock = threading.RLock()
+
+        # Per-document data, indexed by internal doc number
+        self.faq_ids: List[str] = []
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+        self._doc_number: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+
+        # Read-only CSR segment (possibly memory-mapped)
+        self.vocab: Dict[str, int] = {}
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._postings = np.zeros(0, dtype=np.int32)
+        self._tfs = np.zeros(0, dtype=np.float32)
+        self._impacts = np.zeros(0, dtype=np.float32)
+        self._doc_len = np.zeros(0, dtype=np.float32)
+        self._avgdl = 1.0
+        self._vectors: Optional[np.ndarray] = None
+        self._segment_docs = 0
+
+        # Mutable segment for documents added since the last compaction
+        self._delta_postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._delta_len: List[int] = []
+        self._delta_vectors: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return int(self._alive.sum())
+
+    # Building ------------------------------------------------------------
+
+    def add(self, faq_id: str, question: str, answer: str):
+        """Add (or replace) one question/answer pair"""
+        with self._lock:
+            self._add(faq_id, question, answer)
+
+    def _add(self, faq_id: str, question: str, answer: str):
+        if faq_id in self._doc_number:
+            self._remove(faq_id)
+
+        doc = len(self.faq_ids)
+        terms = self._terms(question)
+        self.faq_ids.append(faq_id)
+        self.questions.append(question)
+        self.answers.append(answer)
+        self._doc_number[faq_id] = doc
+        self._alive = np.append(self._alive, True)
+
+        for term, tf in Counter(terms).items():
+            self._delta_postings.setdefault(term, []).append((doc, tf))
+        self._delta_len.append(len(terms))
+        if self.embedder is not None:
+            self._delta_vectors.append(self.embedder([' '.join(terms)])[0])
+
+    def add_many(self, items: List[Dict]):
+        """Add ``{'id', 'question', 'answer'}`` dicts and compact once"""
+        with self._lock:
+            for item in items:
+                self._add(str(item['id']), item['question'], item['answer'])
+            self._compact()
+
+    def remove(self, faq_id: str) -> bool:
+        with self._lock:
+            return self._remove(faq_id)
+
+    def _remove(self, faq_id: str) -> bool:
+        doc = self._doc_number.pop(faq_id, None)
+        if doc is None:
+            return False
+        self._alive[doc] = False
+        return True
+
+    def compact(self):
+        """Merge the mutable segment and drop removed documents"""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive)
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = np.zeros(len(keep), dtype=np.float32)
+        renumber = {int(old): new for new, old in enumerate(keep)}
+
+        for term, entries in self._iter_postings():
+            for doc, tf in entries:
+                new = renumber.get(doc)
+                if new is not None:
+                    postings.setdefault(term, []).append((new, tf))
+        for old, new in renumber.items():
+            lengths[new] = self._length(old)
+
+        vectors = None
+        if self.embedder is not None and len(keep):
+            vectors = np.vstack([self._vector(int(old)) for old in keep]).astype(np.float32)
+
+        self.faq_ids = [self.faq_ids[i] for i in keep]
+        self.questions = [self.questions[i] for i in keep]
+        self.answers = [self.answers[i] for i in keep]
+        self._doc_number = {faq_id: doc for doc, faq_id in enumerate(self.faq_ids)}
+        self._alive = np.ones(len(keep), dtype=bool)
+
+        self.vocab = {term: i for i, term in enumerate(sorted(postings))}
+        indptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        for term, i in self.vocab.items():
+            indptr[i + 1] = len(postings[term])
+        np.cumsum(indptr, out=indptr)
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        tfs = np.empty(indptr[-1], dtype=np.float32)
+        for term, i in self.vocab.items():
+            entries = postings[term]
+            doc_ids[indptr[i]:indptr[i + 1]] = [doc for doc, _ in entries]
+            tfs[indptr[i]:indptr[i + 1]] = [tf for _, tf in entries]
+
+        self._indptr, self._postings, self._tfs, self._doc_len = indptr, doc_ids, tfs, lengths
+        self._avgdl = float(lengths.mean()) if len(lengths) else 1.0
+        self._impacts = self._term_impacts(tfs, lengths[doc_ids])
+        self._vectors = vectors
+        self._segment_docs = len(keep)
+        self._delta_postings, self._delta_len, self._delta_vectors = {}, [], []
+
+    # Searching -----------------------------------------------------------
+
+    def search(self, query: str, k: int = 5, mode: str = 'bm25') -> List[Dict]:
+        """Return the top ``k`` matches as dicts with id, question, answer, score"""
+        terms = self._terms(query)
+        if mode == 'dense' and self.embedder is None:
+            raise ValueError("Dense search needs an embedder")
+
+        with self._lock:
+            if not terms or not len(self.faq_ids):
+                return []
+            scores = self._dense_scores(terms) if mode == 'dense' else self._bm25_scores(terms)
+            scores[~self._alive] = -np.inf
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                {
+                    'id': self.faq_ids[doc],
+                    'question': self.questions[doc],
+                    'answer': self.answers[doc],
+                    'score': float(scores[doc]),
+                }
+                for doc in top
+                if scores[doc] > 0
+            ]
+
+    def _bm25_scores(self, terms: List[str]) -> np.ndarray:
+        n_docs = len(self.faq_ids)
+        scores = np.zeros(n_docs, dtype=np.float32)
+
+        for term, qtf in Counter(terms).items():
+            i = self.vocab.get(term)
+            delta = self._delta_postings.get(term, ())
+            df = len(delta)
+            if i is not None:
+                start, end = self._indptr[i], self._indptr[i + 1]
+                df += end - start
+            if not df:
+                continue
+
+            weight = qtf * math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            if i is not None:
+                scores[self._postings[start:end]] += weight * self._impacts[start:end]
+            if delta:
+                docs = np.array([doc for doc, _ in delta], dtype=np.int32)
+                tfs = np.array([tf for _, tf in delta], dtype=np.float32)
+                lengths = np.array([self._delta_len[doc - self._segment_docs] for doc in docs], dtype=np.float32)
+                scores[docs] += weight * self._term_impacts(tfs, lengths)
+        return scores
+
+    def _term_impacts(self, tfs: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """BM25 term-frequency component, precomputed per posting"""
+        k1, b = self.K1, self.B
+        norm = k1 * (1 - b + b * lengths / self._avgdl)
+        return (tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+
+    def _dense_scores(self, terms: List[str]) -> np.ndarray:
+        query = self.embedder([' '.join(terms)])[0]
+        parts = []
+        if self._vectors is not None:
+            parts.append(self._vectors @ query)
+        if self._delta_vectors:
+            parts.append(np.vstack(self._delta_vectors) @ query)
+        return np.concatenate(parts).astype(np.float32) if parts else np.zeros(0, dtype=np.float32)
+
+    # Persistence ---------------------------------------------------------
+
+    def save(self, directory: str):
+        """
+        Compact and write the index as .npy arrays plus a JSON sidecar,
+        replacing ``directory`` atomically (utils.snapshot)
+        """
+        with self._lock:
+            self._compact()
+            save_snapshot(directory, self._write)
+
+    def _write(self, directory: str):
+        np.save(os.path.join(directory, 'indptr.npy'), self._indptr)
+        np.save(os.path.join(directory, 'postings.npy'), self._postings)
+        np.save(os.path.join(directory, 'tfs.npy'), self._tfs)
+        np.save(os.path.join(directory, 'impacts.npy'), self._impacts)
+        np.save(os.path.join(directory, 'doc_len.npy'), self._doc_len)
+        if self._vectors is not None:
+            np.save(os.path.join(directory, 'vectors.npy'), self._vectors)
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as meta:
+            json.dump({
+                'terms': sorted(self.vocab, key=self.vocab.get),
+                'ids': self.faq_ids,
+                'questions': self.questions,
+                'answers': self.answers,
+            }, meta, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str, normalizer: Callable[[str], str], embedder: Optional[Callable] = None) -> 'FAQIndex':
+        """
+        Open a saved index with its arrays memory-mapped read-only. With an
+        ``embedder`` the index must have been saved with one vector per
+        question (``--dense``); otherwise this raises ValueError.
+        """
+        index = cls(normalizer, embedder)
+        directory = snapshot_path(directory)
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as meta:
+            data = json.load(meta)
+
+        index.vocab = {term: i for i, term in enumerate(data['terms'])}
+        index.faq_ids = data['ids']
+        index.questions = data['questions']
+        index.answers = data['answers']
+        index._doc_number = {faq_id: doc for doc, faq_id in enumerate(index.faq_ids)}
+        index._alive = np.ones(len(index.faq_ids), dtype=bool)
+
+        def array(name):
+            return np.load(os.path.join(directory, name), mmap_mode='r')
+
+        index._indptr = array('indptr.npy')
+        index._postings = array('postings.npy')
+        index._tfs = array('tfs.npy')
+        index._impacts = array('impacts.npy')
+        index._doc_len = array('doc_len.npy')
+        index._avgdl = float(np.mean(index._doc_len)) if len(index._doc_len) else 1.0
+        vectors_path = os.path.join(directory, 'vectors.npy')
+        if embedder is not None and index.faq_ids:
+            if not os.path.exists(vectors_path):
+                raise ValueError(f"FAQ index {directory} has no dense vectors; rebuild it with --dense "
+                                 f"or use FAQ_SEARCH_MODE=bm25")
+            index._vectors = array('vectors.npy')
+            if len(index._vectors) != len(index.faq_ids):
+                raise ValueError(f"FAQ index {directory} has {len(index._vectors)} vectors "
+                                 f"for {len(index.faq_ids)} questions; rebuild it")
+        index._segment_docs = len(index.faq_ids)
+        return index
+
+    # Helpers -------------------------------------------------------------
+
+    def _terms(self, text: str) -> List[str]:
+        # The normalizer folds letters and maps dialect phrases; punctuation
+        # such as "؟" is dropped here so it never becomes part of a term
+        return _WORD.findall(self.normalizer(text))
+
+    def _length(self, doc: int) -> float:
+        if doc < self._segment_docs:
+            return float(self._doc_len[doc])
+        return float(self._delta_len[doc - self._segment_docs])
+
+    def _vector(self, doc: int) -> np.ndarray:
+        if doc < self._segment_docs:
+            return self._vectors[doc]
+        return self._delta_vectors[doc - self._segment_docs]
+
+    def _iter_postings(self):
+        for term, i in self.vocab.items():
+            start, end = self._indptr[i], self._indptr[i + 1]
+            yield term, zip(self._postings[start:end].tolist(), self._tfs[start:end].tolist())
+        yield from self._delta_postings.items()
+
+
+def load_corpus(path: str) -> List[Dict]:
+    """Read Q&A pairs from a JSON list or JSON Lines file"""
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            items = [json.loads(line) for line in f if line.strip()]
+        else:
+            items = json.load(f)
+    return [
+        {'id': str(item.get('id', i)), 'question': item['question'], 'answer': item['answer']}
+        for i, item in enumerate(items)
+    ]
+
+
+def faq_index_from_env(normalizer: Callable[[str], str]) -> FAQIndex:
+    """
+    Open the index configured by the FAQ_* variables: the saved index in
+    FAQ_INDEX_PATH if there is one, otherwise one built from
+    FAQ_CORPUS_PATH (and saved to FAQ_INDEX_PATH for the next start)
+    """
+    embedder = None
+    if os.getenv('FAQ_SEARCH_MODE', 'bm25') == 'dense':
+        embedder = HashingEmbedder(dim=int(os.getenv('FAQ_DENSE_DIM', 256)))
+
+    index_path = os.getenv('FAQ_INDEX_PATH')
+    if index_path and os.path.exists(os.path.join(index_path, 'meta.json')):
+        return FAQIndex.load(index_path, normalizer, embedder)
+
+    index = FAQIndex(normalizer, embedder)
+    corpus_path = os.getenv('FAQ_CORPUS_PATH')
+    if corpus_path and os.path.exists(corpus_path):
+        index.add_many(load_corpus(corpus_path))
+        if index_path:
+            index.save(index_path)
+    return index
+
+
+if __name__ == '__main__':
+    # python -m services.faq_index faq.jsonl data/faq_index [--dense]
+    import argparse
+
+    from nlp.egyptian_nlp import EgyptianNLP
+
+    parser = argparse.ArgumentParser(description="Build a memory-mapped FAQ index")
+    parser.add_argument('corpus', help="JSON or JSONL file of {id, question, answer}")
+    parser.add_argument('output', help="Index directory")
+    parser.add_argument('--dense', action='store_true', help="Also store dense vectors")
+    args = parser.parse_args()
+
+    faq_index = FAQIndex(EgyptianNLP().process, HashingEmbedder() if args.dense else None)
+    faq_index.add_many(load_corpus(args.corpus))
+    faq_index.save(args.output)
+    print(f"Indexed {len(faq_index)} questions, {len(faq_index.vocab)} terms -> {args.output}")
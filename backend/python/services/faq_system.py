@@ -1,6 +1,48 @@
 """FAQ System"""
 
+import os
+
+from chatbot.response_cache import ResponseCache, response_cache_from_env
+from nlp.egyptian_nlp import ARABIC_FOLD_TABLE, EgyptianNLP
+from services.faq_index import FAQIndex, faq_index_from_env
+
+DEFAULT_ANSWER = "شكراً لسؤالك"
+
+
 class FAQSystem:
+    def __init__(self, cache: ResponseCache = None, index: FAQIndex = None, nlp: EgyptianNLP = None):
+        self.cache = cache or response_cache_from_env()
+        self.index = index or faq_index_from_env((nlp or EgyptianNLP()).process)
+        self.search_mode = os.getenv('FAQ_SEARCH_MODE', 'bm25')
+        self.min_score = float(os.getenv('FAQ_MIN_SCORE', 0.0))
+    
     def get_answer(self, question):
-        """Get FAQ answer"""
-        return "شكراً لسؤالك"
+        """Get FAQ answer (cached on the normalized question)"""
+        key = ' '.join(question.translate(ARABIC_FOLD_TABLE).split())
+        return self.cache.get_or_set('faq', key, compute=lambda: self._answer(question))
+    
+    def search(self, question, k=5):
+        """Top ``k`` FAQ entries for a question, best first"""
+        return self.index.search(question, k=k, mode=self.search_mode)
+    
+    def add_faq(self, faq_id, question, answer):
+        """Add or update an FAQ entry"""
+        self.index.add(str(faq_id), question, answer)
+        self.invalidate_cache()
+    
+    def remove_faq(self, faq_id):
+        """Remove an FAQ entry"""
+        removed = self.index.remove(str(faq_id))
+        if removed:
+            self.invalidate_cache()
+        return removed
+    
+    def invalidate_cache(self):
+        """Drop cached answers after FAQ content changes"""
+        self.cache.invalidate('faq')
+    
+    def _answer(self, question):
+        matches = self.search(question, k=1)
+        if matches and matches[0]['score'] > self.min_score:
+            return matches[0]['answer']
+        return DEFAULT_ANSWER
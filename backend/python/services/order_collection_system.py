@@ -1,4 +1,869 @@
-"""Order Collection System"""
+"""
+Order Collection System
+Collects an order over chat (product, size, quantity, governorate, address
+and payment method) with a declarative flow compiled into a transition
+table, compact per-user state and a durable store for open sessions
+"""
+
+import json
+import logging
+import mmap
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from nlp.entity_extractor import EntityExtractor, fold
+from nlp.trie_regex import trie_pattern
+
+logger = logging.getLogger(__name__)
+
+# Steps in the order they are asked. Every step names the extractor that
+# fills its slot; ``opportunistic`` steps are also filled from answers to
+# other questions ("عايز 2 قميص مقاس L" fills three slots at once), and
+# ``skip_for`` lists products the step does not apply to.
+ORDER_FLOW: List[Dict] = [
+    {'slot': 'product', 'label': 'المنتج', 'extract': 'product', 'opportunistic': True,
+     'prompt': 'تحب تطلب إيه؟ اكتب اسم المنتج 🛍️'},
+    {'slot': 'size', 'label': 'المقاس', 'extract': 'size', 'opportunistic': True,
+     'prompt': 'مقاس كام؟ (S / M / L / XL أو رقم المقاس)',
+     'skip_for': ['شنطة', 'حقيبة', 'محفظة', 'نضارة', 'نظارة', 'طاقية', 'كاب', 'طرحة']},
+    {'slot': 'quantity', 'label': 'الكمية', 'extract': 'quantity', 'opportunistic': True,
+     'prompt': 'عايز كام قطعة؟'},
+    {'slot': 'governorate', 'label': 'المحافظة', 'extract': 'governorate', 'opportunistic': True,
+     'prompt': 'هنوصلك في أنهي محافظة؟'},
+    {'slot': 'address', 'label': 'العنوان', 'extract': 'address', 'opportunistic': False,
+     'prompt': 'اكتب العنوان بالتفصيل (المنطقة، الشارع، رقم العمارة والشقة) 📍'},
+    {'slot': 'payment', 'label': 'الدفع', 'extract': 'payment', 'opportunistic': True,
+     'prompt': 'هتدفع إزاي؟ كاش عند الاستلام، فودافون كاش، إنستاباي ولا كارت؟'},
+]
+
+# Verbs that open an order with a product after them ("عايز اطلب 2 قميص")
+# or on their own ("عايز اطلب"), and phrases that open one anywhere
+ORDER_VERBS = ['اطلب', 'أطلب', 'هطلب', 'نطلب', 'اشتري', 'هشتري', 'احجز', 'buy']
+ORDER_PHRASES = ['اعمل اوردر', 'اعمل طلب', 'طلب جديد', 'اوردر جديد', 'order now', 'place order']
+# Words right before an order verb that make it a request ("عايز اطلب ...")
+REQUEST_WORDS = ['عايز', 'عاوز', 'عايزة', 'عاوزة', 'محتاج', 'محتاجة', 'حابب', 'حابة', 'ممكن', 'نفسي',
+                 'want to', 'like to', 'wanna', 'would like to']
+# Words that may follow a standalone order verb ("اطلب لو سمحت")
+ORDER_FILLERS = ['من فضلك', 'لو سمحت', 'لو سمحتي', 'بقى', 'دلوقتي', 'حالا', 'please', 'now']
+# A message asking about something else does not open an order, even when
+# it mentions buying ("عايز اعرف سعر القميص قبل ما اشتري")
+QUESTION_WORDS = ['ازاي', 'إزاي', 'ازى', 'ينفع', 'هل', 'امتى', 'إمتى', 'اعرف', 'أعرف', 'قبل ما',
+                  'بعد ما', 'كيف', 'ايه', 'إيه', 'فين', 'انهي', 'how', 'what', 'where', 'which', 'can i', 'before']
+QUESTION_INTENTS = frozenset({'price_inquiry', 'availability', 'complaint', 'return'})
+CANCEL_PHRASES = ['الغي', 'إلغي', 'الغاء', 'إلغاء', 'كنسل', 'بلاش', 'مش عايز اطلب', 'cancel']
+YES_WORDS = ['ايوه', 'ايوا', 'أيوه', 'اه', 'آه', 'نعم', 'تمام', 'ماشي', 'اكيد', 'أكيد', 'موافق',
+             'اوك', 'اوكي', 'ok', 'okay', 'yes', 'اكد', 'أكد', 'مظبوط', 'صح']
+NO_WORDS = ['لا', 'لأ', 'لاء', 'no', 'مش', 'غلط', 'عدل', 'عدلي', 'تعديل', 'غير', 'اغير']
+# Words naming a slot, for "غير المقاس"
+SLOT_WORDS: Dict[str, List[str]] = {
+    'product': ['المنتج', 'منتج', 'الموديل'],
+    'size': ['المقاس', 'مقاس'],
+    'quantity': ['الكمية', 'كمية', 'العدد', 'عدد'],
+    'governorate': ['المحافظة', 'محافظة', 'المدينة'],
+    'address': ['العنوان', 'عنوان'],
+    'payment': ['الدفع', 'دفع'],
+}
+
+SIZE_TERMS: Dict[str, List[str]] = {
+    'XS': ['xs', 'اكس سمول', 'اكسترا سمول'],
+    'S': ['s', 'سمول', 'small'],
+    'M': ['m', 'ميديم', 'ميديام', 'مديم', 'medium'],
+    'L': ['l', 'لارج', 'large'],
+    'XL': ['xl', 'اكس لارج', 'اكسترا لارج', 'x large'],
+    'XXL': ['xxl', '2xl', 'دبل اكس لارج', '2 اكس لارج', 'اتنين اكس لارج'],
+    'XXXL': ['xxxl', '3xl', '3 اكس لارج', 'تلاتة اكس لارج'],
+}
+SIZE_CUES = ['مقاس', 'مقاسي', 'size', 'نمرة', 'نمرتي']
+QUANTITY_UNITS = ['قطعة', 'قطع', 'حتة', 'حتت', 'pcs', 'pieces', 'pc']
+QUANTITY_WORDS = {
+    'واحد': 1, 'واحدة': 1, 'قطعة واحدة': 1, 'حتة واحدة': 1,
+    'اتنين': 2, 'اثنين': 2, 'قطعتين': 2, 'حتتين': 2,
+    'تلاتة': 3, 'ثلاثة': 3, 'تلات': 3, 'اربعة': 4, 'اربع': 4, 'خمسة': 5, 'خمس': 5,
+}
+MAX_QUANTITY = 50
+PAYMENT_TERMS: Dict[str, List[str]] = {
+    'cash_on_delivery': ['كاش', 'كاش عند الاستلام', 'عند الاستلام', 'الدفع عند الاستلام', 'نقدي', 'cash', 'cod'],
+    'vodafone_cash': ['فودافون كاش', 'فودافون', 'vodafone cash', 'vodafone'],
+    'instapay': ['انستاباي', 'انستا باي', 'instapay'],
+    'card': ['فيزا', 'ماستر كارد', 'كارت', 'بطاقة', 'كريدت', 'visa', 'card'],
+    'fawry': ['فوري', 'fawry'],
+}
+PAYMENT_LABELS = {
+    'cash_on_delivery': 'كاش عند الاستلام',
+    'vodafone_cash': 'فودافون كاش',
+    'instapay': 'إنستاباي',
+    'card': 'كارت',
+    'fawry': 'فوري',
+}
+
+# Version of the serialized session layout
+STATE_VERSION = 1
+_WORD = re.compile(r'\d+|[^\W\d_]+')
+
+
+def _phrases(words: Iterable[str]) -> re.Pattern:
+    """Whole-word, leftmost-longest match of folded ``words``"""
+    return re.compile(r'(?<!\w)(' + trie_pattern({fold(word) for word in words}) + r')(?!\w)')
+
+
+class OrderFlow:
+    """
+    A flow of steps compiled for constant-time transitions.
+
+    Which slots are filled is a bitmask, and ``next_state[mask]`` is the
+    step to ask next (``confirm`` once all are filled), so a turn never
+    walks the steps; the table is built once, for all 2**n masks.
+    """
+
+    def __init__(self, steps: List[Dict] = None):
+        self.steps = steps if steps is not None else ORDER_FLOW
+        self.compile()
+
+    def compile(self):
+        steps = self.steps
+        self.slots: Tuple[str, ...] = tuple(step['slot'] for step in steps)
+        self.index = {slot: i for i, slot in enumerate(self.slots)}
+        self.labels = tuple(step.get('label', step['slot']) for step in steps)
+        self.prompts = tuple(step['prompt'] for step in steps)
+        self.extractors = tuple(step.get('extract', step['slot']) for step in steps)
+        self.full = (1 << len(steps)) - 1
+        self.confirm = len(steps)
+        # Slots filled from any message, as a mask
+        self.opportunistic = sum(1 << i for i, step in enumerate(steps) if step.get('opportunistic'))
+
+        self.next_state = [
+            next((i for i in range(len(steps)) if not mask & (1 << i)), self.confirm)
+            for mask in range(self.full + 1)
+        ]
+        # Steps skipped for some products: (bit, pattern over the folded product)
+        self.skips = tuple(
+            (1 << i, _phrases(step['skip_for'])) for i, step in enumerate(steps) if step.get('skip_for')
+        )
+        # Slot words -> bits to clear; a new product may need a new size too
+        self.edits = {}
+        for slot, words in SLOT_WORDS.items():
+            if slot in self.index:
+                bits = 1 << self.index[slot]
+                if slot == 'product':
+                    bits |= sum(bit for bit, _ in self.skips)
+                for word in words:
+                    self.edits[fold(word)] = bits
+        self.edit_words = _phrases(self.edits)
+
+
+class OrderSession:
+    """One user's open order: the step being asked, filled slots and values"""
+
+    __slots__ = ('state', 'mask', 'values', 'price', 'retries', 'updated')
+
+    def __init__(self, slots: int, state: int = 0, mask: int = 0, values: Optional[List] = None,
+                 price: Optional[float] = None, retries: int = 0, updated: float = 0.0):
+        self.state = state
+        self.mask = mask
+        self.values = values if values is not None else [None] * slots
+        self.price = price
+        self.retries = retries
+        self.updated = updated
+
+    def dumps(self) -> str:
+        """Compact JSON array: ``[version, state, mask, retries, updated, price, *values]``"""
+        return json.dumps(
+            [STATE_VERSION, self.state, self.mask, self.retries, int(self.updated), self.price, *self.values],
+            ensure_ascii=False, separators=(',', ':'),
+        )
+
+    @classmethod
+    def loads(cls, blob: str, slots: int) -> Optional['OrderSession']:
+        data = json.loads(blob)
+        if data[0] != STATE_VERSION or len(data) != 6 + slots:
+            # Saved by a different flow layout; the user starts over
+            return None
+        return cls(slots, data[1], data[2], data[6:], data[5], data[3], float(data[4]))
+
+
+# Stores --------------------------------------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS order_sessions (
+    user_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS order_sessions_updated_at ON order_sessions (updated_at);
+"""
+
+
+class SQLiteOrderStateStore:
+    """Open sessions in a SQLite file shared by the workers of one host"""
+
+    def __init__(self, path: str = 'order_sessions.sqlite3', ttl_seconds: float = 86400):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute('SELECT COUNT(*) FROM order_sessions').fetchone()[0]
+
+    def get(self, user_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT state FROM order_sessions WHERE user_id = ? AND updated_at > ?',
+                (user_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, user_id: str, state: str):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO order_sessions (user_id, state, updated_at) VALUES (?, ?, ?)',
+                (user_id, state, time.time()),
+            )
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                conn.execute('DELETE FROM order_sessions WHERE updated_at <= ?', (time.time() - self.ttl_seconds,))
+            conn.commit()
+
+    def delete(self, user_id: str):
+        with self._lock:
+            conn = self._connection()
+            conn.execute('DELETE FROM order_sessions WHERE user_id = ?', (user_id,))
+            conn.commit()
+
+    def items(self) -> List[Tuple[str, float]]:
+        """``(user_id, updated_at)`` of every open session"""
+        with self._lock:
+            return self._connection().execute(
+                'SELECT user_id, updated_at FROM order_sessions WHERE updated_at > ?',
+                (time.time() - self.ttl_seconds,),
+            ).fetchall()
+
+    def _connection(self) -> sqlite3.Connection:
+        # A connection inherited across fork must not be reused
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            if self.path != ':memory:':
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+
+class RedisOrderStateStore:
+    """Open sessions in Redis, shared by every worker; idle keys expire"""
+
+    def __init__(self, client, prefix: str = 'order_flow:', ttl_seconds: float = 86400):
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*'))
+
+    def get(self, user_id: str) -> Optional[str]:
+        raw = self.client.get(self.prefix + user_id)
+        if raw is None:
+            return None
+        return raw.decode() if isinstance(raw, bytes) else raw
+
+    def set(self, user_id: str, state: str):
+        self.client.set(self.prefix + user_id, state, ex=max(1, int(self.ttl_seconds)))
+
+    def delete(self, user_id: str):
+        self.client.delete(self.prefix + user_id)
+
+    def items(self) -> List[Tuple[str, float]]:
+        """``(user_id, updated_at)`` of every open session; Redis only keeps the expiry, so now"""
+        now = time.time()
+        return [
+            ((key.decode() if isinstance(key, bytes) else key)[len(self.prefix):], now)
+            for key in self.client.scan_iter(match=self.prefix + '*')
+        ]
+
+
+class OpenOrderMarker:
+    """
+    Which users may have an open order, shared by the workers of one host.
+
+    A memory-mapped file of ``slots`` expiry times: every saved turn raises
+    its user's slot to the time the session would expire, so a slot in the
+    past means no user hashed to it has an open order and the store need
+    not be read. Users sharing a slot, and users whose order closed within
+    the TTL, only cost a store read. Every worker that can receive a user's
+    messages must map the same file, which holds for the SQLite store (one
+    host) and for Redis only when all workers run on one host. A new or
+    resized file is seeded from ``seed()``, ``(user_id, updated)`` pairs of
+    the sessions already in the store.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 86400, slots: int = 262_139,
+                 seed: Optional[Callable[[], Iterable[Tuple[str, float]]]] = None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.slots = slots
+        self.seed = seed
+        self._fd = None
+        self._map = None
+        self._table = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def may_be_open(self, user_id: str, now: float) -> bool:
+        return self._open()[self._slot(user_id)] > now
+
+    def mark(self, user_id: str, updated: float):
+        """Keep ``user_id`` marked until its session would expire"""
+        table = self._open()
+        i = self._slot(user_id)
+        expires = min(int(updated + self.ttl_seconds) + 1, 0xFFFFFFFF)
+        if table[i] >= expires:
+            return
+        import fcntl
+        with self._lock:
+            # Workers raise slots under the file lock so none is lowered
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if table[i] < expires:
+                    table[i] = expires
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _slot(self, user_id: str) -> int:
+        # Not hash(): it differs between worker processes. CRC-32 is linear,
+        # so similar IDs collide modulo a power of two; ``slots`` is prime
+        return zlib.crc32(user_id.encode()) % self.slots
+
+    def _open(self) -> memoryview:
+        # flock() does not exclude processes sharing a descriptor, so every
+        # process opens the file itself
+        if self._table is not None and self._pid == os.getpid():
+            return self._table
+        import fcntl
+        with self._lock:
+            if self._table is None or self._pid != os.getpid():
+                size = self.slots * 4
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    fresh = os.fstat(fd).st_size != size
+                    if fresh:
+                        os.ftruncate(fd, 0)
+                        os.ftruncate(fd, size)
+                    mapping = mmap.mmap(fd, size)
+                    table = memoryview(mapping).cast('I')
+                    if fresh and self.seed is not None:
+                        for user_id, updated in self.seed():
+                            i = self._slot(user_id)
+                            table[i] = max(table[i], min(int(updated + self.ttl_seconds) + 1, 0xFFFFFFFF))
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                self._fd, self._map, self._table, self._pid = fd, mapping, table, os.getpid()
+        return self._table
+
+
+# Collection ----------------------------------------------------------------
 
 class OrderCollectionSystem:
-    pass
+    """
+    Collect orders over chat.
+
+    ``handle`` returns the reply while the user has an open order and None
+    otherwise, so it can run before NLP; ``start`` opens an order when the
+    message asks for one, after the intent stage, and the caller falls back
+    to the chatbot when both return None. Every turn is written to
+    ``store`` as a compact JSON array. With ``local_cache`` sessions are
+    also kept in an in-process LRU table, so resuming is one dict lookup;
+    that copy is trusted over the store, so it suits one worker or sticky
+    routing only. ``marker`` (an ``OpenOrderMarker``) lets users without an
+    open order skip the store read.
+
+    A confirmed order is passed to ``on_complete``; if that raises, the
+    session stays at the confirmation step and the user can try again.
+    """
+
+    def __init__(
+        self,
+        nlp=None,
+        product_search=None,
+        store=None,
+        on_complete: Optional[Callable[[Dict], None]] = None,
+        flow: Optional[OrderFlow] = None,
+        ttl_seconds: float = 86400,
+        max_sessions: int = 200_000,
+        max_retries: int = 3,
+        local_cache: bool = True,
+        marker: Optional[OpenOrderMarker] = None,
+        monitoring=None,
+    ):
+        # Shares EgyptianNLP's gazetteer, catalog names included
+        self.extractor = nlp.entity_extractor if nlp is not None else EntityExtractor()
+        self.product_search = product_search
+        self.store = store
+        self.on_complete = on_complete
+        self.flow = flow or OrderFlow()
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_retries = max_retries
+        self.local_cache = local_cache or store is None
+        self.marker = marker
+        self.monitoring = monitoring
+        self.intent_matcher = nlp.intent_matcher if nlp is not None else None
+
+        self._sessions: 'OrderedDict[str, OrderSession]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._extract = tuple(getattr(self, '_extract_' + name) for name in self.flow.extractors)
+        self._product_slot = self.flow.index.get('product')
+        self._stats = {'started': 0, 'completed': 0, 'cancelled': 0, 'abandoned': 0,
+                       'turns': 0, 'store_loads': 0, 'store_skips': 0, 'store_errors': 0, 'submit_errors': 0}
+
+        self._order_verbs = _phrases(ORDER_VERBS)
+        self._order_phrases = _phrases(ORDER_PHRASES)
+        self._questions = _phrases(QUESTION_WORDS)
+        self._fillers = _phrases(ORDER_FILLERS)
+        self._request = re.compile(r'(?<!\w)(?:' + trie_pattern({fold(word) for word in REQUEST_WORDS}) + r')\s*$')
+        self._cancel = _phrases(CANCEL_PHRASES)
+        self._yes = frozenset(fold(word) for word in YES_WORDS)
+        self._no = frozenset(fold(word) for word in NO_WORDS)
+        self._sizes = {fold(term): size for size, terms in SIZE_TERMS.items() for term in terms}
+        self._size_terms = _phrases(self._sizes)
+        self._size_cue = _phrases(SIZE_CUES)
+        self._size_number = re.compile(r'(?:' + trie_pattern({fold(cue) for cue in SIZE_CUES}) + r')\s*(\d{2})(?!\d)')
+        units = trie_pattern({fold(unit) for unit in QUANTITY_UNITS})
+        self._quantity_words = {fold(word): count for word, count in QUANTITY_WORDS.items()}
+        self._quantity_unit = re.compile(r'(?<!\d)(\d{1,3})\s*(?:' + units + r')(?!\w)')
+        self._quantity_named = _phrases(word for word in self._quantity_words if len(word.split()) > 1
+                                        or word.startswith(('قطعت', 'حتت')))
+        self._quantity_before = re.compile(
+            r'(?:^|\s)(\d{1,3}|' + trie_pattern(self._quantity_words) + r')\s*$'
+        )
+        self._payments = {fold(term): method for method, terms in PAYMENT_TERMS.items() for term in terms}
+        self._payment_terms = _phrases(self._payments)
+
+    # Turns ----------------------------------------------------------------
+
+    def handle(self, user_id: str, message: str) -> Optional[str]:
+        """Reply to one message of ``user_id`` in an open order, or None when none is open"""
+        if not user_id or not message:
+            return None
+        user_id = str(user_id)
+        now = time.time()
+        session = self._session(user_id, now)
+        if session is None:
+            return None
+        return self._turn(user_id, session, message, fold(message), now, '')
+
+    def start(self, user_id: str, message: str) -> Optional[str]:
+        """Open an order when ``wants_to_order`` accepts ``message``; the reply, or None"""
+        if not user_id or not message or not self.wants_to_order(message):
+            return None
+        user_id = str(user_id)
+        now = time.time()
+        session = self._session(user_id, now)
+        if session is not None:
+            return self._turn(user_id, session, message, fold(message), now, '')
+        session = OrderSession(len(self.flow.slots), updated=now)
+        self._count('started')
+        return self._turn(user_id, session, message, fold(message), now, 'تمام، هنسجل طلبك 🛍️\n')
+
+    def wants_to_order(self, message: str) -> bool:
+        """
+        Whether ``message`` asks to place an order: an order phrase, or an
+        order verb that is requested ("عايز اطلب ..."), followed by a
+        product ("اطلب 2 قميص") or standing alone ("اطلب لو سمحت"), in a
+        message that is not a question about something else ("عايز اعرف
+        سعر القميص قبل ما اشتري").
+        """
+        folded = fold(message)
+        phrase = self._order_phrases.search(folded)
+        verb = None if phrase else self._order_verbs.search(folded)
+        if not (phrase or verb) or self._cancel.search(folded):
+            return False
+        if '?' in message or '؟' in message or self._questions.search(folded):
+            return False
+        if self.intent_matcher is not None and any(
+            match['intent'] in QUESTION_INTENTS for match in self.intent_matcher.match(message)
+        ):
+            return False
+        if phrase or self._request.search(folded, 0, verb.start()):
+            return True
+        if not _WORD.search(self._fillers.sub(' ', folded[verb.end():])):
+            return True
+        return any(entity.type == 'product' for entity in self.extractor.extract(message))
+
+    def _turn(self, user_id: str, session: OrderSession, message: str, folded: str, now: float,
+              opening: str) -> str:
+        self._stats['turns'] += 1
+        if self._cancel.search(folded):
+            self._close(user_id, 'cancelled')
+            return 'تم إلغاء الطلب. لو حبيت تطلب تاني قولي "عايز اطلب" 👍'
+
+        flow = self.flow
+        if session.state >= flow.confirm:
+            reply = self._confirm_turn(user_id, session, message, folded)
+            if session.state < 0:
+                return reply
+        else:
+            asked = session.state
+            changed = self._fill(session, message, folded, asked, overwrite=False)
+            session.state = flow.next_state[session.mask]
+            if not changed and not opening:
+                session.retries += 1
+                if session.retries >= self.max_retries:
+                    self._close(user_id, 'abandoned')
+                    return 'معلش مش قادر أكمل الطلب 🙏 ممكن تبدأ من جديد بـ "عايز اطلب" أو تكلم خدمة العملاء'
+                reply = 'معلش مفهمتش 🙏 ' + flow.prompts[asked]
+            else:
+                session.retries = 0
+                reply = opening + self._prompt(session)
+        session.updated = now
+        self._save(user_id, session)
+        return reply
+
+    def has_open_order(self, user_id: str) -> bool:
+        return self._session(str(user_id), time.time()) is not None
+
+    def _confirm_turn(self, user_id: str, session: OrderSession, message: str, folded: str) -> str:
+        """Confirmation (and edit) turns: yes submits, new values or slot names edit"""
+        flow = self.flow
+        words = _WORD.findall(folded)
+        if self._fill(session, message, folded, -1, overwrite=True):
+            session.state = flow.next_state[session.mask]
+            return self._prompt(session)
+
+        cleared = 0
+        for match in flow.edit_words.finditer(folded):
+            cleared |= flow.edits[match.group(1)]
+        if cleared:
+            session.mask &= ~cleared
+            for i in range(len(flow.slots)):
+                if cleared & (1 << i):
+                    session.values[i] = None
+            if self._product_slot is not None and cleared & (1 << self._product_slot):
+                session.price = None
+            session.state = flow.next_state[session.mask]
+            return self._prompt(session)
+
+        if any(word in self._yes for word in words) and not any(word in self._no for word in words):
+            if session.state == flow.confirm:
+                return self._submit(user_id, session)
+        if any(word in self._no for word in words):
+            session.state = flow.confirm + 1
+            return 'تحب تغير إيه؟ (' + '، '.join(flow.labels) + ')'
+        if session.state > flow.confirm:
+            return 'اكتب اللي عايز تغيره، مثلاً "غير المقاس" أو "الدفع فودافون كاش"'
+        return self._summary(session) + '\nاكتب "ايوه" للتأكيد أو "لا" للتعديل'
+
+    def _fill(self, session: OrderSession, message: str, folded: str, asked: int, overwrite: bool) -> bool:
+        """Fill slots from one message; the asked slot accepts looser answers"""
+        flow = self.flow
+        entities = self.extractor.extract(message)
+        changed = False
+        for i, extract in enumerate(self._extract):
+            bit = 1 << i
+            if i != asked and not flow.opportunistic & bit:
+                continue
+            if session.mask & bit and not overwrite:
+                continue
+            value = extract(message, folded, entities, i == asked)
+            if value is None or value == session.values[i]:
+                continue
+            session.values[i] = value
+            session.mask |= bit
+            changed = True
+            if i == self._product_slot:
+                self._on_product(session, value)
+        return changed
+
+    def _on_product(self, session: OrderSession, product: str):
+        folded = fold(product)
+        for bit, pattern in self.flow.skips:
+            if pattern.search(folded):
+                session.mask |= bit
+                session.values[bit.bit_length() - 1] = '-'
+            elif session.values[bit.bit_length() - 1] == '-':
+                session.mask &= ~bit
+                session.values[bit.bit_length() - 1] = None
+        hit = self._product_hit(product)
+        session.price = hit.get('price') if hit else None
+
+    def _product_hit(self, product: str) -> Optional[Dict]:
+        if self.product_search is None:
+            return None
+        try:
+            hits = self.product_search.search(product, limit=1)
+        except Exception as e:
+            logger.warning("Product lookup failed for order: %s", e)
+            return None
+        return hits[0] if hits else None
+
+    def _prompt(self, session: OrderSession) -> str:
+        if session.state >= self.flow.confirm:
+            session.state = self.flow.confirm
+            return self._summary(session) + '\nأأكد الطلب؟ (ايوه / لا)'
+        return self.flow.prompts[session.state]
+
+    def _summary(self, session: OrderSession) -> str:
+        lines = ['راجع طلبك:']
+        for label, slot, value in zip(self.flow.labels, self.flow.slots, session.values):
+            if value is None or value == '-':
+                continue
+            if slot == 'payment':
+                value = PAYMENT_LABELS.get(value, value)
+            lines.append(f'• {label}: {value}')
+        total = self._total(session)
+        if total is not None:
+            lines.append(f'• الإجمالي: {total:g} جنيه')
+        return '\n'.join(lines)
+
+    def _total(self, session: OrderSession) -> Optional[float]:
+        quantity = session.values[self.flow.index['quantity']] if 'quantity' in self.flow.index else 1
+        if session.price is None or not quantity:
+            return None
+        return session.price * quantity
+
+    def _submit(self, user_id: str, session: OrderSession) -> str:
+        order = self.to_order(user_id, session)
+        if self.on_complete is not None:
+            try:
+                self.on_complete(order)
+            except Exception as e:
+                self._stats['submit_errors'] += 1
+                logger.error("Could not submit order for %s: %s", user_id, e)
+                return 'حصلت مشكلة وإحنا بنسجل الطلب 🙏 اكتب "ايوه" تاني بعد شوية'
+        self._close(user_id, 'completed')
+        session.state = -1
+        return (f"تم تسجيل طلبك رقم {order['order_id']} ✅\n"
+                "هنكلمك قريب لتأكيد الشحن، وتقدر تتابع الطلب برقمه في أي وقت")
+
+    def to_order(self, user_id: str, session: OrderSession) -> Dict:
+        """
+        Order document for a confirmed session, in the Node ``Order`` shape
+        (``userId``, ``items``, ``total``, ``status``, ``createdAt``) with
+        the collected slots alongside; ``order_id`` becomes its ``_id``
+        """
+        order = {slot: value for slot, value in zip(self.flow.slots, session.values) if value != '-'}
+        quantity = order.get('quantity') or 1
+        hit = self._product_hit(order['product']) if order.get('product') else None
+        order.update(
+            order_id=secrets.token_hex(12),  # a valid ObjectId, like the Node backend's
+            userId=user_id,
+            items=[{
+                'productId': hit.get('id') if hit else None,
+                'quantity': quantity,
+                'price': session.price,
+            }] if order.get('product') else [],
+            total=self._total(session),
+            status='pending',
+            createdAt=datetime.now(timezone.utc),
+            source='chat',
+        )
+        return order
+
+    # Extractors: (message, folded, entities, asked) -> value or None ------
+
+    def _extract_product(self, message, folded, entities, asked):
+        for entity in entities:
+            if entity.type == 'product':
+                return entity.value
+        return None
+
+    def _extract_size(self, message, folded, entities, asked):
+        match = self._size_number.search(folded)
+        if match:
+            return match.group(1)
+        match = self._size_terms.search(folded)
+        # Single letters only as an answer or after "مقاس"
+        if match and (asked or len(match.group(1)) > 1 or self._size_cue.search(folded)):
+            return self._sizes[match.group(1)]
+        if asked:
+            for word in _WORD.findall(folded):
+                if word.isdigit() and 20 <= int(word) <= 60:
+                    return word
+        return None
+
+    def _extract_quantity(self, message, folded, entities, asked):
+        count = None
+        match = self._quantity_unit.search(folded)
+        if match:
+            count = int(match.group(1))
+        else:
+            match = self._quantity_named.search(folded)
+            if match:
+                count = self._quantity_words[match.group(1)]
+        if count is None:
+            # "2 قميص", "اتنين قميص"
+            for entity in entities:
+                if entity.type == 'product':
+                    match = self._quantity_before.search(folded, 0, entity.start)
+                    if match:
+                        count = self._quantity(match.group(1))
+                    break
+        if count is None and asked:
+            words = _WORD.findall(folded)
+            if len(words) <= 3:
+                for word in words:
+                    count = self._quantity(word)
+                    if count is not None:
+                        break
+        if count is None or not 1 <= count <= MAX_QUANTITY:
+            return None
+        return count
+
+    def _quantity(self, word: str) -> Optional[int]:
+        return int(word) if word.isdigit() else self._quantity_words.get(word)
+
+    def _extract_governorate(self, message, folded, entities, asked):
+        for entity in entities:
+            if entity.type == 'location':
+                return entity.value
+        return None
+
+    def _extract_address(self, message, folded, entities, asked):
+        address = ' '.join(message.split())
+        if asked and len(address) >= 8 and len(_WORD.findall(folded)) >= 2:
+            return address[:300]
+        return None
+
+    def _extract_payment(self, message, folded, entities, asked):
+        match = self._payment_terms.search(folded)
+        return self._payments[match.group(1)] if match else None
+
+    # Sessions -------------------------------------------------------------
+
+    def _session(self, user_id: str, now: float) -> Optional[OrderSession]:
+        session = None
+        if self.local_cache:
+            with self._lock:
+                session = self._sessions.get(user_id)
+                if session is not None:
+                    self._sessions.move_to_end(user_id)
+        if session is None and self.store is not None and not self._may_be_open(user_id, now):
+            self._stats['store_skips'] += 1
+        elif session is None and self.store is not None:
+            try:
+                blob = self.store.get(user_id)
+            except Exception as e:
+                self._stats['store_errors'] += 1
+                logger.warning("Order state store unavailable: %s", e)
+                blob = None
+            if blob is not None:
+                session = OrderSession.loads(blob, len(self.flow.slots))
+                self._stats['store_loads'] += 1
+                if session is not None and self.local_cache:
+                    self._remember(user_id, session)
+        if session is not None and now - session.updated > self.ttl_seconds:
+            self._close(user_id, 'abandoned')
+            return None
+        return session
+
+    def _may_be_open(self, user_id: str, now: float) -> bool:
+        if self.marker is None:
+            return True
+        try:
+            return self.marker.may_be_open(user_id, now)
+        except Exception as e:
+            logger.warning("Open order marker unavailable: %s", e)
+            return True
+
+    def _remember(self, user_id: str, session: OrderSession):
+        with self._lock:
+            self._sessions[user_id] = session
+            self._sessions.move_to_end(user_id)
+            while len(self._sessions) > self.max_sessions:
+                # Still in the store, so an evicted session is only slower to resume
+                self._sessions.popitem(last=False)
+
+    def _save(self, user_id: str, session: OrderSession):
+        if self.local_cache:
+            self._remember(user_id, session)
+        if self.store is not None:
+            try:
+                # Marked first, so a worker that finds the marker unset
+                # cannot have missed a saved session
+                if self.marker is not None:
+                    self.marker.mark(user_id, session.updated)
+                self.store.set(user_id, session.dumps())
+            except Exception as e:
+                self._stats['store_errors'] += 1
+                logger.warning("Could not save order state for %s: %s", user_id, e)
+
+    def _close(self, user_id: str, outcome: str):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+        if self.store is not None:
+            try:
+                self.store.delete(user_id)
+            except Exception as e:
+                self._stats['store_errors'] += 1
+                logger.warning("Could not delete order state for %s: %s", user_id, e)
+        self._count(outcome)
+
+    def _count(self, outcome: str):
+        self._stats[outcome] += 1
+        if self.monitoring is not None:
+            self.monitoring.inc('bww_order_flows_total', outcome=outcome)
+
+    def stats(self) -> Dict:
+        return dict(
+            self._stats,
+            open_sessions=len(self._sessions),
+            store=type(self.store).__name__ if self.store is not None else None,
+        )
+
+
+def order_collection_from_env(nlp=None, product_search=None, on_complete=None, monitoring=None,
+                              client=None) -> OrderCollectionSystem:
+    """
+    Build the order flow configured by the ORDER_* variables.
+
+    ``ORDER_STATE_STORE=redis`` keeps open sessions in ``REDIS_URL``,
+    ``sqlite`` (the default) in ``ORDER_STATE_PATH`` and ``memory`` only
+    in-process, where they do not survive a restart. ``ORDER_OPEN_MARKER``
+    is ``auto`` (a marker next to the SQLite store), a marker file path, or
+    ``off``.
+    """
+    ttl_seconds = float(os.getenv('ORDER_SESSION_TTL_SECONDS', 86400))
+    backend = os.getenv('ORDER_STATE_STORE', 'sqlite')
+    marker_path = os.getenv('ORDER_OPEN_MARKER', 'auto')
+    store = None
+    if client is not None or backend == 'redis':
+        if client is None:
+            import redis
+            from utils.config import Config
+            client = redis.Redis.from_url(Config.REDIS_URL)
+        store = RedisOrderStateStore(client, ttl_seconds=ttl_seconds)
+    elif backend == 'sqlite':
+        store = SQLiteOrderStateStore(os.getenv('ORDER_STATE_PATH', 'order_sessions.sqlite3'), ttl_seconds)
+
+    if marker_path == 'auto':
+        # Redis may be shared by workers on several hosts, which one file cannot cover
+        marker_path = store.path + '-open' if isinstance(store, SQLiteOrderStateStore) else 'off'
+    marker = None
+    if store is not None and marker_path not in ('off', ''):
+        marker = OpenOrderMarker(marker_path, ttl_seconds, seed=store.items)
+
+    return OrderCollectionSystem(
+        nlp=nlp,
+        product_search=product_search,
+        store=store,
+        on_complete=on_complete,
+        ttl_seconds=ttl_seconds,
+        max_sessions=int(os.getenv('ORDER_MAX_SESSIONS', 200_000)),
+        local_cache=os.getenv('ORDER_STATE_LOCAL_CACHE', 'false').lower() == 'true',
+        marker=marker,
+        monitoring=monitoring,
+    )
@@ -1,6 +1,294 @@
-"""Order Tracker"""
+"""
+Order Tracker
+In-memory order-status index keyed by order ID and by user, kept current
+by order events and backed by the orders collection for misses
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Orders in these states no longer change, so their entries never expire
+# (a delivered order can still be returned or refunded)
+TERMINAL_STATUSES = frozenset({'cancelled', 'returned', 'refunded'})
+
+# Fields read from the orders collection (written by the Node backend)
+PROJECTION = {'userId': 1, 'status': 1, 'total': 1, 'createdAt': 1, 'updatedAt': 1}
+
 
 class OrderTracker:
-    def track(self, order_id):
-        """Track order status"""
-        return {"status": "processing"}
+    """
+    Order statuses served from memory.
+
+    Order events (``apply_events``) update the index in place, so a lookup
+    does not query the database. Entries for in-flight orders expire after
+    ``ttl_seconds`` and are re-read on the next lookup, which bounds how
+    stale a worker can be when an event went to another worker; unknown
+    order IDs are remembered for the same time. The Node ``Order`` schema
+    has no ``updatedAt``, so a document without one is taken as the state
+    at the time it was read, and only events stamped after that read win
+    over it. Misses and expired entries
+    of one ``track_many`` call are fetched with a single query.
+
+    ``db`` is a ``DatabaseHandler``; without one the tracker only knows
+    the orders it received events for.
+    """
+
+    def __init__(
+        self,
+        db=None,
+        ttl_seconds: float = 15.0,
+        max_orders: int = 200_000,
+        max_batch: int = 100,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.max_orders = max_orders
+        self.max_batch = max_batch
+        self._clock = clock
+
+        self._orders: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._by_user: Dict[str, set] = {}
+        self._expires: Dict[str, float] = {}
+        # Time of the state each entry holds: its last event's timestamp or
+        # when its document was read
+        self._versions: Dict[str, float] = {}
+        self._missing: Dict[str, float] = {}
+        self._users_loaded: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self._stats = {'hits': 0, 'misses': 0, 'db_queries': 0, 'events': 0, 'stale_events': 0}
+
+    # Lookups ---------------------------------------------------------------
+
+    def track(self, order_id: str) -> Optional[Dict]:
+        """Status of one order, or None if it does not exist"""
+        return self.track_many([order_id])[str(order_id)]
+
+    def track_many(self, order_ids: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        """Statuses of up to ``max_batch`` orders as ``{order_id: status or None}``"""
+        ids = list(dict.fromkeys(str(order_id) for order_id in order_ids))
+        if len(ids) > self.max_batch:
+            raise ValueError(f"At most {self.max_batch} order IDs per lookup")
+
+        now = self._clock()
+        found: Dict[str, Optional[Dict]] = {}
+        refresh = []
+        with self._lock:
+            for order_id in ids:
+                entry = self._orders.get(order_id)
+                if self.db is None:
+                    found[order_id] = dict(entry) if entry else None
+                elif entry is None and self._missing.get(order_id, 0) > now:
+                    found[order_id] = None
+                elif entry is None or self._expires.get(order_id, float('inf')) <= now:
+                    refresh.append(order_id)
+                else:
+                    self._orders.move_to_end(order_id)
+                    found[order_id] = dict(entry)
+            self._stats['hits'] += len(ids) - len(refresh)
+            self._stats['misses'] += len(refresh)
+
+        if refresh:
+            found.update(self._refresh(refresh))
+        return {order_id: found[order_id] for order_id in ids}
+
+    def orders_for_user(self, user_id: str) -> List[Dict]:
+        """A user's orders, most recently updated first"""
+        user_id = str(user_id)
+        with self._lock:
+            loaded = self._users_loaded.get(user_id, 0) > self._clock()
+        if self.db is not None and not loaded:
+            from database.database_handler import to_object_id
+
+            query = {'userId': to_object_id(user_id)}
+            read_at = time.time()
+            try:
+                docs = list(self.db.collection('orders').find(query, PROJECTION))
+            except Exception as e:
+                logger.warning("Serving cached orders for user %s: %s", user_id, e)
+            else:
+                with self._lock:
+                    self._stats['db_queries'] += 1
+                    for doc in docs:
+                        self._index_document(doc, read_at)
+                    self._users_loaded[user_id] = self._clock() + self.ttl_seconds
+
+        with self._lock:
+            orders = [dict(self._orders[order_id]) for order_id in self._by_user.get(user_id, ())]
+        return sorted(orders, key=lambda entry: entry['updated_at'], reverse=True)
+
+    # Events ----------------------------------------------------------------
+
+    def apply_event(self, event: Dict) -> bool:
+        return self.apply_events([event]) == 1
+
+    def apply_events(self, events: Iterable[Dict]) -> int:
+        """
+        Update the index from order events and return how many were applied.
+
+        An event is ``{'order_id', 'status', 'user_id', 'total', 'timestamp',
+        'type'}``; only ``order_id`` is required. ``type='deleted'`` removes
+        the order. Events older than the indexed state are ignored, so
+        redelivered or reordered events are harmless.
+        """
+        applied = 0
+        with self._lock:
+            for event in events:
+                order_id = event.get('order_id')
+                if not order_id:
+                    raise ValueError("Order event without order_id")
+                order_id = str(order_id)
+                version = _epoch(event.get('timestamp')) or time.time()
+                self._stats['events'] += 1
+
+                if order_id in self._orders and version < self._versions[order_id]:
+                    self._stats['stale_events'] += 1
+                    continue
+                if event.get('type') == 'deleted':
+                    self._drop(order_id)
+                    self._remember_missing(order_id)
+                else:
+                    fields = {key: event[key] for key in ('status', 'user_id', 'total') if key in event}
+                    if fields.get('user_id') is not None:
+                        fields['user_id'] = str(fields['user_id'])
+                    fields['updated_at'] = version
+                    self._store(order_id, fields, version)
+                applied += 1
+        return applied
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(
+                self._stats,
+                orders=len(self._orders),
+                users=len(self._by_user),
+                in_flight=len(self._expires),
+                hit_rate=self._stats['hits'] / lookups if lookups else 0.0,
+            )
+
+    # Index -----------------------------------------------------------------
+
+    def _refresh(self, order_ids: List[str]) -> Dict[str, Optional[Dict]]:
+        read_at = time.time()
+        try:
+            docs = self.db.get_many('orders', order_ids, projection=PROJECTION)
+        except Exception as e:
+            # Expired entries are still better than an error
+            logger.warning("Serving cached order statuses: %s", e)
+            with self._lock:
+                return {order_id: dict(self._orders[order_id]) if order_id in self._orders else None
+                        for order_id in order_ids}
+
+        found = {}
+        with self._lock:
+            self._stats['db_queries'] += 1
+            for order_id in order_ids:
+                doc = docs.get(order_id)
+                if doc is None:
+                    self._drop(order_id)
+                    self._remember_missing(order_id)
+                else:
+                    self._index_document(doc, read_at)
+                entry = self._orders.get(order_id)
+                found[order_id] = dict(entry) if entry else None
+        return found
+
+    def _index_document(self, doc: Dict, read_at: float):
+        order_id = str(doc['_id'])
+        version = _epoch(doc['updatedAt']) if doc.get('updatedAt') else read_at
+        entry = self._orders.get(order_id)
+        if entry is not None and version < self._versions[order_id]:
+            # An event newer than this read already arrived; keep it
+            version = self._versions[order_id]
+            fields = {}
+        else:
+            fields = {
+                'status': doc.get('status'),
+                'total': doc.get('total'),
+                'updated_at': max(_epoch(doc.get('updatedAt') or doc.get('createdAt')),
+                                  entry['updated_at'] if entry else 0.0),
+            }
+            if doc.get('userId') is not None:
+                fields['user_id'] = str(doc['userId'])
+        self._store(order_id, fields, version)
+
+    def _store(self, order_id: str, fields: Dict, version: float):
+        entry = self._orders.get(order_id)
+        if entry is None:
+            entry = {'order_id': order_id, 'status': None, 'user_id': None, 'total': None, 'updated_at': 0.0}
+            self._orders[order_id] = entry
+        else:
+            self._orders.move_to_end(order_id)
+
+        previous_user = entry['user_id']
+        entry.update(fields)
+        self._versions[order_id] = version
+        if entry['user_id'] != previous_user:
+            self._unlink_user(previous_user, order_id)
+            if entry['user_id'] is not None:
+                self._by_user.setdefault(entry['user_id'], set()).add(order_id)
+
+        self._missing.pop(order_id, None)
+        if entry['status'] in TERMINAL_STATUSES:
+            self._expires.pop(order_id, None)
+        else:
+            self._expires[order_id] = self._clock() + self.ttl_seconds
+
+        while len(self._orders) > self.max_orders:
+            evicted = next(iter(self._orders))
+            user_id = self._orders[evicted]['user_id']
+            self._drop(evicted)
+            # The user's listing is incomplete now; reload it on next use
+            self._users_loaded.pop(user_id, None)
+
+    def _remember_missing(self, order_id: str):
+        now = self._clock()
+        if len(self._missing) >= self.max_orders:
+            self._missing = {key: until for key, until in self._missing.items() if until > now}
+        self._missing[order_id] = now + self.ttl_seconds
+
+    def _drop(self, order_id: str):
+        entry = self._orders.pop(order_id, None)
+        self._expires.pop(order_id, None)
+        self._versions.pop(order_id, None)
+        if entry is not None:
+            self._unlink_user(entry['user_id'], order_id)
+
+    def _unlink_user(self, user_id: Optional[str], order_id: str):
+        orders = self._by_user.get(user_id)
+        if orders is not None:
+            orders.discard(order_id)
+            if not orders:
+                del self._by_user[user_id]
+
+
+def _epoch(value) -> float:
+    """Seconds since the epoch from a number, datetime or ISO-8601 string"""
+    if value is None or value == '':
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        # pymongo returns naive UTC datetimes
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def order_tracker_from_env(db=None) -> OrderTracker:
+    """Tracker configured by the ORDER_TRACKER_* variables"""
+    return OrderTracker(
+        db=db,
+        ttl_seconds=float(os.getenv('ORDER_TRACKER_TTL_SECONDS', 15)),
+        max_orders=int(os.getenv('ORDER_TRACKER_MAX_ORDERS', 200_000)),
+        max_batch=int(os.getenv('ORDER_TRACKER_MAX_BATCH', 100)),
+    )
@@ -0,0 +1,490 @@
+"""
+Product Search
+In-process catalog search for Egyptian Arabic and English queries: an
+inverted index over lightly stemmed, folded terms, character trigrams for
+typos and spelling variants, and a sorted vocabulary for autocomplete
+"""
+
+import bisect
+import heapq
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from nlp.egyptian_nlp import ARABIC_FOLD_TABLE
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r'\w+')
+
+# Folding on top of EgyptianNLP's: alef maksura, tatweel and Arabic-Indic digits
+SEARCH_FOLD_TABLE = str.maketrans({
+    'ى': 'ي',
+    'ـ': None,
+    **{chr(0x0660 + d): str(d) for d in range(10)},
+    **{chr(0x06F0 + d): str(d) for d in range(10)},
+})
+
+# Request words that say nothing about the product (folded forms)
+STOPWORDS = frozenset("""
+    عايز عاوز عايزه عاوزه محتاج محتاجه ابغي اريد نفسي ممكن لو سمحت فيه في عندكم عندك عندكو
+    بكام كام سعر اسعار ايه ماذا ده دي دا دول اللي الي علي من انا احنا هل مش يا عن مع او
+    حاجه حاجات شويه اشوف اعرف عن كده بتاع بتاعه جنيه جنيها ج م
+    i want need the a an for of and or with egp le
+""".split())
+
+# Dialect and loan words mapped to the catalog's vocabulary (folded forms)
+SYNONYMS = {
+    'هدوم': 'ملابس', 'لبس': 'ملابس',
+    'جزمه': 'حذاء', 'جزم': 'حذاء', 'كوتشي': 'حذاء', 'كوتشيات': 'حذاء', 'شوز': 'حذاء',
+    'بنطلون': 'بنطال', 'بناطيل': 'بنطال', 'بنطلونات': 'بنطال',
+    'شنطه': 'حقيبه', 'شنط': 'حقيبه',
+    'تيشيرت': 'تيشرت', 'تشيرت': 'تيشرت', 'فانله': 'تيشرت',
+    'shoes': 'حذاء', 'shoe': 'حذاء', 'sneakers': 'حذاء',
+    'bag': 'حقيبه', 'bags': 'حقيبه', 'pants': 'بنطال', 'trousers': 'بنطال',
+    'tshirt': 'تيشرت', 't-shirt': 'تيشرت',
+}
+
+_PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+_SUFFIXES = ('ها', 'ان', 'ات', 'ون', 'ين', 'يه', 'ه', 'ي')
+
+# Product fields indexed, with their weight
+FIELDS = (('nameAr', 3.0), ('name', 3.0), ('category', 1.5), ('descriptionAr', 0.5), ('description', 0.5))
+
+
+def strip_prefix(word: str) -> str:
+    for prefix in _PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= 2:
+            return word[len(prefix):]
+    if word.startswith('و') and len(word) >= 5:
+        return word[1:]
+    return word
+
+
+def light_stem(word: str) -> str:
+    """
+    Light10-style stemming: one article/conjunction prefix and one suffix,
+    keeping at least three letters so short words (ستان, كتان) survive
+    """
+    if word.isascii():
+        return word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word
+    word = strip_prefix(word)
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def _trigrams(term: str) -> Set[str]:
+    padded = f'#{term}#'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _one_edit(a: str, b: str) -> bool:
+    """Whether ``a`` becomes ``b`` by one insertion, deletion, substitution or adjacent swap"""
+    if abs(len(a) - len(b)) > 1 or a == b:
+        return False
+    i = 0
+    while i < min(len(a), len(b)) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:] or (a[i + 1:i + 2] == b[i:i + 1] and a[i:i + 1] == b[i + 1:i + 2]
+                                          and a[i + 2:] == b[i + 2:])
+    return a[i + 1:] == b[i:] if len(a) > len(b) else a[i:] == b[i + 1:]
+
+
+class ProductSearchIndex:
+    """
+    Products are analyzed into terms: folded (EgyptianNLP's alef, teh
+    marbuta and diacritic folding plus ``SEARCH_FOLD_TABLE``), split into
+    words, stop words dropped, dialect synonyms mapped and light-stemmed.
+    Each term's postings map documents to the weight of the best field it
+    occurs in; ranking is that weight times IDF, scaled by the share of
+    query terms a product matches.
+
+    Query terms missing from the vocabulary are matched to known terms
+    sharing enough character trigrams (typos, spelling variants), and the
+    last word of an autocomplete query is expanded through the sorted
+    vocabulary. Very common terms only rescore candidates found by rarer
+    ones, or contribute their top-weighted postings, so a query costs
+    about the same at any catalog size.
+
+    ``upsert_many`` and ``remove`` update the index in place (ProductSync
+    listeners call ``apply_changes``); with a ``store``, a background
+    thread also follows writes made by other processes.
+    """
+
+    def __init__(self, fold: Optional[Callable[[str], str]] = None, store=None,
+                 refresh_interval: float = 30.0, common_postings: int = 2000, id_field: str = 'id'):
+        self.fold = fold or (lambda text: text.translate(ARABIC_FOLD_TABLE))
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.common_postings = common_postings
+        self.id_field = id_field
+
+        self._docs: Dict[int, Dict] = {}
+        self._doc_ids: Dict[str, int] = {}
+        self._doc_terms: Dict[int, Tuple[str, ...]] = {}
+        self._postings: Dict[str, Dict[int, float]] = {}
+        # The postings' documents again as sets, which intersect faster
+        self._doc_sets: Dict[str, Set[int]] = {}
+        self._ranked: Dict[str, List[int]] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self._vocab: List[str] = []
+        self._next_doc = 0
+        self._lock = threading.RLock()
+        self._watermark = 0.0
+        self._refresher_pid = None
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def products(self) -> List[Dict]:
+        """Indexed products (id, names, price, category, stock)"""
+        with self._lock:
+            return list(self._docs.values())
+
+    # Analysis -------------------------------------------------------------
+
+    def _words(self, text: str) -> List[str]:
+        return _WORD.findall(self.fold(text).translate(SEARCH_FOLD_TABLE).lower())
+
+    def analyze(self, text: str) -> List[str]:
+        """Search terms of ``text``, in order, without repeats"""
+        terms = []
+        for word in self._words(text):
+            term = self._term(word)
+            if term is not None and term not in terms:
+                terms.append(term)
+        return terms
+
+    @staticmethod
+    def _term(word: str) -> Optional[str]:
+        if word in STOPWORDS or word.isdigit() or len(word) < 2:
+            return None
+        return light_stem(SYNONYMS.get(word) or SYNONYMS.get(strip_prefix(word)) or word)
+
+    # Updates --------------------------------------------------------------
+
+    def upsert_many(self, products: Iterable[Dict]) -> int:
+        """Add or replace products; ones marked deleted or inactive are removed"""
+        count = 0
+        with self._lock:
+            for product in products:
+                product_id = product.get(self.id_field, product.get('_id'))
+                if product_id is None:
+                    continue
+                product_id = str(product_id)
+                if product.get('deleted') or product.get('active') is False:
+                    self._remove(product_id)
+                else:
+                    self._upsert(product_id, product)
+                count += 1
+        return count
+
+    def upsert(self, product: Dict):
+        self.upsert_many([product])
+
+    def remove(self, product_id: str):
+        with self._lock:
+            self._remove(str(product_id))
+
+    # ProductSync listener
+    apply_changes = upsert_many
+
+    def _upsert(self, product_id: str, product: Dict):
+        doc = self._doc_ids.get(product_id)
+        if doc is None:
+            doc = self._doc_ids[product_id] = self._next_doc
+            self._next_doc += 1
+        else:
+            self._unindex(doc)
+
+        # In-stock products get a slightly higher weight, so they win ties
+        in_stock = 0.01 if (product.get('stock') or 0) > 0 else 0.0
+        weights: Dict[str, float] = {}
+        for field, weight in FIELDS:
+            value = product.get(field)
+            if not value:
+                continue
+            for term in self.analyze(str(value)):
+                if weights.get(term, 0) < weight + in_stock:
+                    weights[term] = weight + in_stock
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._doc_sets[term] = set()
+                bisect.insort(self._vocab, term)
+                for gram in _trigrams(term):
+                    self._grams.setdefault(gram, set()).add(term)
+            postings[doc] = weight
+            self._doc_sets[term].add(doc)
+            self._ranked.pop(term, None)
+        self._doc_terms[doc] = tuple(weights)
+        self._docs[doc] = {
+            'id': product_id,
+            'name': product.get('name'),
+            'nameAr': product.get('nameAr'),
+            'price': product.get('price'),
+            'category': product.get('category'),
+            'stock': product.get('stock'),
+        }
+
+    def _remove(self, product_id: str):
+        doc = self._doc_ids.pop(product_id, None)
+        if doc is not None:
+            self._unindex(doc)
+            del self._docs[doc]
+
+    def _unindex(self, doc: int):
+        # Terms left without postings stay in the vocabulary and are skipped
+        for term in self._doc_terms.pop(doc, ()):
+            self._postings[term].pop(doc, None)
+            self._doc_sets[term].discard(doc)
+            self._ranked.pop(term, None)
+
+    # Queries --------------------------------------------------------------
+
+    def search(self, query: str, limit: int = 10, fuzzy: bool = True, prefix: bool = False,
+               match_all: bool = False) -> List[Dict]:
+        """
+        Best-matching products for ``query``, each with its ``score``.
+        ``prefix`` treats the last word as incomplete (autocomplete);
+        ``match_all`` drops products missing any of the query's words.
+        """
+        self._start_refresher()
+        partial = None
+        if prefix:
+            # The word being typed is matched as a prefix of known terms
+            words = self._words(query)
+            if words and words[-1] not in STOPWORDS:
+                partial = strip_prefix(words.pop())
+            words = list(dict.fromkeys(term for term in map(self._term, words) if term is not None))
+        else:
+            words = self.analyze(query)
+        if not words and not partial:
+            return []
+
+        with self._lock:
+            total = len(self._docs) or 1
+            # Per query word that matched anything: (postings, boost) of its
+            # exact, fuzzy or completed terms
+            groups = []
+            for word in words:
+                if self._postings.get(word):
+                    variants = [(word, 1.0)]
+                else:
+                    variants = self._fuzzy(word) if fuzzy else []
+                if variants:
+                    groups.append(self._weigh(variants, total))
+            if partial:
+                completions = self._complete(partial)
+                if completions:
+                    groups.append(self._weigh([(term, 1.0 if term == partial else 0.9) for term in completions],
+                                              total))
+            queried = len(words) + (1 if partial else 0)
+            if not groups or (match_all and len(groups) < queried):
+                return []
+
+            # Products matching every word that matched: intersect the
+            # postings' key sets (in C), smallest first
+            doc_sets = sorted((self._doc_set(group) for group in groups), key=len)
+            candidates = doc_sets[0]
+            for doc_set in doc_sets[1:]:
+                candidates = candidates & doc_set
+            if len(candidates) >= limit or match_all:
+                scores = self._score_all(groups, candidates, doc_sets[0], limit)
+                share = (len(groups) / queried) ** 2
+            else:
+                # Too few: rank partial matches too
+                scores = self._score_any(groups)
+                share = 1.0
+            ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [dict(self._docs[doc], score=round(score * share, 3)) for doc, score in ranked]
+
+    def suggest(self, text: str, limit: int = 8) -> List[Dict]:
+        """Autocomplete: products matching ``text`` with its last word as a prefix"""
+        return [
+            {'id': hit.get(self.id_field), 'name': hit.get('name'), 'nameAr': hit.get('nameAr')}
+            for hit in self.search(text, limit=limit, fuzzy=False, prefix=True, match_all=True)
+        ]
+
+    def _weigh(self, variants: List[Tuple[str, float]], total: int) -> List[Tuple[str, Dict[int, float], float]]:
+        # Rarest variant first; boost is similarity times IDF
+        weighted = []
+        for term, similarity in variants:
+            postings = self._postings[term]
+            weighted.append((term, postings, similarity * math.log(1 + total / len(postings))))
+        weighted.sort(key=lambda variant: len(variant[1]))
+        return weighted
+
+    def _doc_set(self, group: List[Tuple[str, Dict[int, float], float]]) -> Set[int]:
+        if len(group) == 1:
+            return self._doc_sets[group[0][0]]
+        return set().union(*(self._doc_sets[term] for term, _, _ in group))
+
+    def _score_all(self, groups: List, candidates, smallest, limit: int) -> Dict[int, float]:
+        """Scores of products matching every group"""
+        if len(groups) == 1:
+            # One word: the answer is among its terms' top-weighted postings
+            scores = {}
+            for term, postings, boost in groups[0]:
+                for doc in self._top(term)[:limit]:
+                    scores[doc] = max(scores.get(doc, 0.0), postings[doc] * boost)
+            return scores
+        if len(candidates) > self.common_postings:
+            # Many full matches: take those the rarest word weighs most
+            term = min(groups, key=lambda group: len(group[0][1]))[0][0]
+            ranked = self._top(term) if len(self._postings[term]) > self.common_postings else self._postings[term]
+            candidates = [doc for doc in ranked if doc in candidates][:self.common_postings // 4]
+        exact = [(postings, boost) for postings, boost in (group[0][1:] for group in groups if len(group) == 1)]
+        variants = [group for group in groups if len(group) > 1]
+        scores = {}
+        for doc in candidates:
+            score = 0.0
+            for postings, boost in exact:
+                score += postings[doc] * boost
+            for group in variants:
+                score += max(postings.get(doc, 0.0) * boost for _, postings, boost in group)
+            scores[doc] = score
+        return scores
+
+    def _score_any(self, groups: List) -> Dict[int, float]:
+        """
+        Scores of products matching any group, scaled by the share of
+        groups they match. A common term only rescores products that
+        rarer terms found, or adds its top-weighted postings.
+        """
+        variants = sorted(
+            ((number, term, postings, boost) for number, group in enumerate(groups)
+             for term, postings, boost in group),
+            key=lambda variant: len(variant[2]),
+        )
+        scores: Dict[int, float] = {}
+        matched: Dict[int, int] = {}
+        for number, term, postings, boost in variants:
+            # A bit per group, so variants of one word count once
+            bit = 1 << number
+            if len(postings) > self.common_postings:
+                docs = [doc for doc in scores if doc in postings] if scores else self._top(term)
+            else:
+                docs = postings
+            for doc in docs:
+                scores[doc] = scores.get(doc, 0.0) + postings[doc] * boost
+                matched[doc] = matched.get(doc, 0) | bit
+        for doc, mask in matched.items():
+            scores[doc] *= (mask.bit_count() / len(groups)) ** 2
+        return scores
+
+    def _top(self, term: str) -> List[int]:
+        """The ``common_postings`` best documents of a term, best first"""
+        ranked = self._ranked.get(term)
+        if ranked is None:
+            postings = self._postings[term]
+            ranked = self._ranked[term] = heapq.nlargest(self.common_postings, postings, key=postings.get)
+        return ranked
+
+    def _fuzzy(self, word: str, limit: int = 3, threshold: float = 0.5) -> List[Tuple[str, float]]:
+        """
+        Known terms close to ``word``: sharing enough character trigrams
+        (Dice coefficient), or one edit away, which catches typos in short
+        words that break most of their trigrams
+        """
+        if len(word) < 3:
+            return []
+        grams = _trigrams(word)
+        overlap = Counter()
+        for gram in grams:
+            overlap.update(self._grams.get(gram, ()))
+        candidates = []
+        for term, shared in overlap.items():
+            if abs(len(term) - len(word)) > 2 or not self._postings[term]:
+                continue
+            similarity = 2 * shared / (len(grams) + len(term))
+            if similarity < 0.8 and _one_edit(word, term):
+                similarity = 0.8
+            if similarity >= threshold:
+                candidates.append((term, similarity))
+        return heapq.nlargest(limit, candidates, key=lambda candidate: candidate[1])
+
+    def _complete(self, partial: str, limit: int = 20) -> List[str]:
+        """Up to ``limit`` of the most frequent known terms starting with ``partial``"""
+        start = bisect.bisect_left(self._vocab, partial)
+        candidates = []
+        for term in self._vocab[start:start + 200]:
+            if not term.startswith(partial):
+                break
+            if self._postings[term]:
+                candidates.append(term)
+        return heapq.nlargest(limit, candidates, key=lambda term: len(self._postings[term]))
+
+    # Following the store ----------------------------------------------------
+
+    def load(self, since: float = 0.0) -> int:
+        """Index products written to the store after ``since``"""
+        count = 0
+        for records, updated_at in self.store.changes(since):
+            count += self.upsert_many(records)
+            self._watermark = max(self._watermark, updated_at)
+        return count
+
+    def refresh(self) -> int:
+        # Re-read a few seconds back: a batch committed late with an
+        # earlier timestamp is not missed, and re-applying is harmless
+        return self.load(max(0.0, self._watermark - 5.0))
+
+    def _start_refresher(self):
+        if self.store is None or not self.refresh_interval or self._refresher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+            threading.Thread(target=self._refresh_loop, name='product-search-refresh', daemon=True).start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Product search refresh failed")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'products': len(self._docs),
+                'terms': sum(1 for postings in self._postings.values() if postings),
+                'trigrams': len(self._grams),
+                'watermark': self._watermark,
+            }
+
+
+def product_search_from_env(nlp=None, product_sync=None) -> ProductSearchIndex:
+    """
+    Index of the synced catalog (PRODUCT_DB_PATH), kept current by
+    ``product_sync``'s runs in this process and by polling the store every
+    PRODUCT_SEARCH_REFRESH_SECONDS for the other workers' runs
+    """
+    store = product_sync.store if product_sync is not None else None
+    index = ProductSearchIndex(
+        fold=nlp._normalize_arabic if nlp is not None else None,
+        store=store,
+        refresh_interval=float(os.getenv('PRODUCT_SEARCH_REFRESH_SECONDS', 30)),
+    )
+    if store is not None:
+        started = time.perf_counter()
+        count = index.load()
+        logger.info("Indexed %d products for search in %.2fs", count, time.perf_counter() - started)
+        product_sync.listeners.append(index.apply_changes)
+        if nlp is not None:
+            # Catalog names become product entities in chat messages
+            nlp.entity_extractor.add_products(index.products())
+            product_sync.listeners.append(nlp.entity_extractor.add_products)
+    return index
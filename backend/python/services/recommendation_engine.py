@@ -1,6 +1,374 @@
-"""Recommendation Engine"""
+"""
+Recommendation Engine
+Item-to-item collaborative filtering over a precomputed, array-backed
+similarity matrix
+"""
+
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from utils.snapshot import save_snapshot, snapshot_path
+
 
 class RecommendationEngine:
-    def get_recommendations(self, user_id, preferences):
+    """
+    Top-N product recommendations from item-item cosine similarity.
+
+    ``build`` turns (user, product, weight) interactions into a sparse
+    item-item matrix offline, keeping the ``neighbors`` most similar items
+    per product, and stores it CSR-style in plain NumPy arrays together
+    with each user's history and the catalog fields used for filtering
+    (price, category, stock). ``save`` writes the arrays as .npy files and
+    ``load`` memory-maps them, so a chat turn is answered from shared pages
+    without a database round-trip.
+
+    A user's score for a candidate is the sum, over the items in their
+    history, of interaction weight times similarity. Users without history
+    get the most popular items. ``record_interaction`` adds live events on
+    top of the snapshot until the next rebuild.
+    """
+
+    RECENT_PER_USER = 50
+
+    def __init__(self):
+        self.item_ids: List[str] = []
+        self.categories: List[str] = []
+        self._item_index: Dict[str, int] = {}
+        self._category_index: Dict[str, int] = {}
+        self._user_index: Dict[str, int] = {}
+
+        # Catalog columns; stock -1 means unknown
+        self.price = np.zeros(0, dtype=np.float32)
+        self.stock = np.zeros(0, dtype=np.int32)
+        self.category = np.zeros(0, dtype=np.int32)
+        self.popular = np.zeros(0, dtype=np.int32)
+
+        # Item-item similarity (CSR rows, most similar first)
+        self.sim_indptr = np.zeros(1, dtype=np.int64)
+        self.sim_indices = np.zeros(0, dtype=np.int32)
+        self.sim_data = np.zeros(0, dtype=np.float32)
+
+        # User histories (CSR rows)
+        self.hist_indptr = np.zeros(1, dtype=np.int64)
+        self.hist_items = np.zeros(0, dtype=np.int32)
+        self.hist_weights = np.zeros(0, dtype=np.float32)
+
+        self._recent: Dict[str, Dict[int, float]] = {}
+        self._similarity = None
+
+    # Queries -------------------------------------------------------------
+
+    def get_recommendations(self, user_id, preferences, limit: int = 10) -> List[Dict]:
         """Get product recommendations"""
-        return []
+        preferences = preferences or {}
+        items, weights = self._history(user_id)
+        if not len(items):
+            return self._popular(preferences, limit, exclude=items)
+
+        candidates, scores = self._score(items, weights)
+        keep = self._filter_mask(candidates, preferences) & ~np.isin(candidates, items)
+        return self._top(candidates[keep], scores[keep], preferences, limit, exclude=items)
+
+    def get_recommendations_batch(
+        self, user_ids: Iterable, preferences: Optional[Dict] = None, limit: int = 10
+    ) -> Dict[str, List[Dict]]:
+        """
+        Recommendations for many users in one sparse product: their
+        histories form a users x items matrix that is multiplied by the
+        similarity matrix once, and the preference filter is evaluated once
+        for the whole catalog.
+        """
+        from scipy import sparse
+
+        preferences = preferences or {}
+        user_ids = list(user_ids)
+        histories = [self._history(user_id) for user_id in user_ids]
+
+        lengths = np.array([len(items) for items, _ in histories], dtype=np.int64)
+        rows = np.repeat(np.arange(len(user_ids)), lengths)
+        cols = np.concatenate([items for items, _ in histories] or [np.zeros(0, np.int32)])
+        vals = np.concatenate([weights for _, weights in histories] or [np.zeros(0, np.float32)])
+        history = sparse.csr_matrix((vals, (rows, cols)), shape=(len(user_ids), len(self.item_ids)))
+        scores = (history @ self.similarity).tocsr()
+
+        allowed = self._filter_mask(np.arange(len(self.item_ids)), preferences)
+        results = {}
+        for row, user_id in enumerate(user_ids):
+            items = histories[row][0]
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            candidates = scores.indices[start:end]
+            keep = allowed[candidates] & ~np.isin(candidates, items)
+            results[user_id] = self._top(
+                candidates[keep], scores.data[start:end][keep], preferences, limit, exclude=items
+            )
+        return results
+
+    def record_interaction(self, user_id, product_id, weight: float = 1.0):
+        """Add a live view/purchase on top of the loaded snapshot"""
+        item = self._item_index.get(str(product_id))
+        if item is None:
+            return
+        recent = self._recent.setdefault(str(user_id), {})
+        recent[item] = recent.pop(item, 0.0) + weight
+        if len(recent) > self.RECENT_PER_USER:
+            del recent[next(iter(recent))]
+
+    @property
+    def similarity(self):
+        """The similarity matrix as a scipy CSR matrix over the stored arrays"""
+        if self._similarity is None:
+            from scipy import sparse
+
+            n = len(self.item_ids)
+            self._similarity = sparse.csr_matrix(
+                (self.sim_data, self.sim_indices, self.sim_indptr), shape=(n, n), copy=False
+            )
+        return self._similarity
+
+    def _history(self, user_id) -> Tuple[np.ndarray, np.ndarray]:
+        user = self._user_index.get(str(user_id))
+        if user is None:
+            items, weights = self.hist_items[:0], self.hist_weights[:0]
+        else:
+            start, end = self.hist_indptr[user], self.hist_indptr[user + 1]
+            items, weights = self.hist_items[start:end], self.hist_weights[start:end]
+
+        recent = self._recent.get(str(user_id))
+        if recent:
+            items = np.concatenate([items, np.fromiter(recent.keys(), np.int32, len(recent))])
+            weights = np.concatenate([weights, np.fromiter(recent.values(), np.float32, len(recent))])
+        return items, weights
+
+    def _score(self, items: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Sum the similarity rows of ``items``, weighted, without a Python loop"""
+        starts = self.sim_indptr[items]
+        lengths = self.sim_indptr[items + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return self.sim_indices[:0], self.sim_data[:0]
+
+        # Positions of every neighbor of every history item in sim_indices
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        positions = offsets + np.arange(total)
+        neighbors = self.sim_indices[positions]
+        contributions = self.sim_data[positions] * np.repeat(weights, lengths)
+
+        candidates, inverse = np.unique(neighbors, return_inverse=True)
+        return candidates, np.bincount(inverse, weights=contributions).astype(np.float32)
+
+    def _filter_mask(self, items: np.ndarray, preferences: Dict) -> np.ndarray:
+        """Vectorized filter for the ``preferences`` dict of the API"""
+        mask = np.ones(len(items), dtype=bool)
+        if not len(items):
+            return mask
+
+        categories = preferences.get('category') or preferences.get('categories')
+        if categories:
+            if isinstance(categories, str):
+                categories = [categories]
+            codes = [self._category_index[c] for c in categories if c in self._category_index]
+            mask &= np.isin(self.category[items], codes)
+        if preferences.get('min_price') is not None:
+            mask &= self.price[items] >= float(preferences['min_price'])
+        if preferences.get('max_price') is not None:
+            mask &= self.price[items] <= float(preferences['max_price'])
+        if preferences.get('in_stock', True):
+            mask &= self.stock[items] != 0
+        if preferences.get('exclude'):
+            excluded = [self._item_index[p] for p in map(str, preferences['exclude']) if p in self._item_index]
+            mask &= ~np.isin(items, excluded)
+        return mask
+
+    def _top(self, candidates, scores, preferences, limit, exclude) -> List[Dict]:
+        if len(candidates) > limit:
+            best = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            best = np.arange(len(candidates))
+        best = best[np.argsort(-scores[best], kind='stable')]
+        results = [
+            {'product_id': self.item_ids[candidates[i]], 'score': float(scores[i])}
+            for i in best
+        ]
+        if len(results) < limit:
+            seen = np.concatenate([exclude, candidates[best]]) if len(results) else exclude
+            results += self._popular(preferences, limit - len(results), exclude=seen)
+        return results
+
+    def _popular(self, preferences: Dict, limit: int, exclude: np.ndarray) -> List[Dict]:
+        """Most popular items passing the filter (cold start and backfill)"""
+        popular = self.popular[self._filter_mask(self.popular, preferences)]
+        if len(exclude):
+            popular = popular[~np.isin(popular, exclude)]
+        return [{'product_id': self.item_ids[i], 'score': 0.0} for i in popular[:limit]]
+
+    # Building ------------------------------------------------------------
+
+    @classmethod
+    def build(
+        cls,
+        interactions: Iterable[Tuple],
+        items: Iterable[Dict],
+        neighbors: int = 50,
+        block_size: int = 4096,
+    ) -> 'RecommendationEngine':
+        """
+        Build from ``(user_id, product_id[, weight])`` interactions and
+        ``{id, price, category, stock}`` catalog dicts. Interactions with
+        products missing from the catalog are ignored.
+        """
+        from scipy import sparse
+
+        engine = cls()
+        engine._set_catalog(list(items))
+
+        users, cols, vals = [], [], []
+        user_index = engine._user_index
+        for interaction in interactions:
+            item = engine._item_index.get(str(interaction[1]))
+            if item is None:
+                continue
+            users.append(user_index.setdefault(str(interaction[0]), len(user_index)))
+            cols.append(item)
+            vals.append(interaction[2] if len(interaction) > 2 else 1.0)
+
+        n_items = len(engine.item_ids)
+        matrix = sparse.csr_matrix(
+            (np.asarray(vals, dtype=np.float32), (np.asarray(users), np.asarray(cols))),
+            shape=(len(user_index), n_items),
+        )
+        matrix.sum_duplicates()
+        engine.hist_indptr = matrix.indptr.astype(np.int64)
+        engine.hist_items = matrix.indices.astype(np.int32)
+        engine.hist_weights = matrix.data.astype(np.float32)
+
+        counts = np.diff(matrix.tocsc().indptr)
+        engine.popular = np.argsort(-counts, kind='stable')[:1000].astype(np.int32)
+        engine.popular = engine.popular[counts[engine.popular] > 0]
+
+        engine._build_similarity(matrix, neighbors, block_size)
+        return engine
+
+    def _build_similarity(self, matrix, neighbors: int, block_size: int):
+        """Cosine similarity between item columns, top ``neighbors`` per row"""
+        from scipy import sparse
+
+        n_items = matrix.shape[1]
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+        norms[norms == 0] = 1.0
+        normalized = (matrix @ sparse.diags(1.0 / norms)).tocsc()
+        transposed = normalized.T.tocsr()
+
+        indptr = [0]
+        indices, data = [], []
+        for start in range(0, n_items, block_size):
+            block = (transposed[start:start + block_size] @ normalized).tocsr()
+            # Drop each item's similarity to itself
+            rows = np.repeat(np.arange(block.shape[0]) + start, np.diff(block.indptr))
+            block.data[block.indices == rows] = 0
+            block.eliminate_zeros()
+            for row in range(block.shape[0]):
+                lo, hi = block.indptr[row], block.indptr[row + 1]
+                cols, sims = block.indices[lo:hi], block.data[lo:hi]
+                if len(sims) > neighbors:
+                    keep = np.argpartition(-sims, neighbors - 1)[:neighbors]
+                    cols, sims = cols[keep], sims[keep]
+                order = np.argsort(-sims, kind='stable')
+                indices.append(cols[order])
+                data.append(sims[order])
+                indptr.append(indptr[-1] + len(order))
+
+        self.sim_indptr = np.asarray(indptr, dtype=np.int64)
+        self.sim_indices = np.concatenate(indices or [np.zeros(0)]).astype(np.int32)
+        self.sim_data = np.concatenate(data or [np.zeros(0)]).astype(np.float32)
+        self._similarity = None
+
+    def _set_catalog(self, items: List[Dict]):
+        self.item_ids = [str(item['id']) for item in items]
+        self._item_index = {item_id: i for i, item_id in enumerate(self.item_ids)}
+        self.categories = sorted({str(item.get('category') or '') for item in items})
+        self._category_index = {c: i for i, c in enumerate(self.categories)}
+        self.price = np.array([item.get('price') or 0 for item in items], dtype=np.float32)
+        self.stock = np.array(
+            [-1 if item.get('stock') is None else item['stock'] for item in items], dtype=np.int32
+        )
+        self.category = np.array(
+            [self._category_index[str(item.get('category') or '')] for item in items], dtype=np.int32
+        )
+
+    # Persistence ---------------------------------------------------------
+
+    ARRAYS = (
+        'price', 'stock', 'category', 'popular',
+        'sim_indptr', 'sim_indices', 'sim_data',
+        'hist_indptr', 'hist_items', 'hist_weights',
+    )
+
+    def save(self, directory: str):
+        """
+        Write the snapshot as .npy arrays plus a JSON sidecar of ids,
+        replacing ``directory`` atomically (utils.snapshot)
+        """
+        save_snapshot(directory, self._write)
+
+    def _write(self, directory: str):
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as meta:
+            json.dump({
+                'items': self.item_ids,
+                'categories': self.categories,
+                'users': sorted(self._user_index, key=self._user_index.get),
+            }, meta, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str) -> 'RecommendationEngine':
+        """Open a snapshot with its arrays memory-mapped read-only"""
+        engine = cls()
+        directory = snapshot_path(directory)
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as meta:
+            data = json.load(meta)
+        engine.item_ids = data['items']
+        engine.categories = data['categories']
+        engine._item_index = {item_id: i for i, item_id in enumerate(engine.item_ids)}
+        engine._category_index = {c: i for i, c in enumerate(engine.categories)}
+        engine._user_index = {user_id: i for i, user_id in enumerate(data['users'])}
+        for name in cls.ARRAYS:
+            setattr(engine, name, np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'))
+        return engine
+
+
+def recommendation_engine_from_env() -> RecommendationEngine:
+    """Load the snapshot in RECOMMENDER_SNAPSHOT_PATH, or an empty engine"""
+    path = os.getenv('RECOMMENDER_SNAPSHOT_PATH')
+    if path and os.path.exists(os.path.join(path, 'meta.json')):
+        return RecommendationEngine.load(path)
+    return RecommendationEngine()
+
+
+if __name__ == '__main__':
+    # python -m services.recommendation_engine interactions.csv products.jsonl data/recommender
+    import argparse
+    import csv
+
+    parser = argparse.ArgumentParser(description="Build a recommendation snapshot")
+    parser.add_argument('interactions', help="CSV of user_id,product_id[,weight]")
+    parser.add_argument('products', help="JSONL of {id, price, category, stock}")
+    parser.add_argument('output', help="Snapshot directory")
+    parser.add_argument('--neighbors', type=int, default=int(os.getenv('RECOMMENDER_NEIGHBORS', 50)))
+    args = parser.parse_args()
+
+    with open(args.products, encoding='utf-8') as f:
+        products = [json.loads(line) for line in f if line.strip()]
+    with open(args.interactions, newline='', encoding='utf-8') as f:
+        rows = [
+            (row[0], row[1], float(row[2]) if len(row) > 2 else 1.0)
+            for row in csv.reader(f) if row
+        ]
+
+    snapshot = RecommendationEngine.build(rows, products, neighbors=args.neighbors)
+    snapshot.save(args.output)
+    print(f"{len(snapshot.item_ids)} products, {len(snapshot._user_index)} users, "
+          f"{len(snapshot.sim_data)} similarities -> {args.output}")
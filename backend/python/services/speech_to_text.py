@@ -1,6 +1,409 @@
-"""Speech to Text Service"""
+"""
+Speech to Text Service
+Streaming decode, voice-activity segmentation and parallel recognition of
+uploaded audio (WhatsApp voice notes, web recordings)
+"""
+
+import io
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+import wave
+import zlib
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from utils.service_registry import import_string
+
+
+SAMPLE_RATE = 16000
+
+BACKENDS = {
+    'speech_recognition': 'services.speech_to_text:SpeechRecognitionBackend',
+    'fake': 'services.speech_to_text:FakeRecognizer',
+}
+
+
+# Decoding ----------------------------------------------------------------
+
+class _Prefixed(io.RawIOBase):
+    """A stream with bytes already read from its head put back in front"""
+
+    def __init__(self, head: bytes, stream: BinaryIO):
+        self._head = head
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if self._head:
+            if size < 0:
+                data, self._head = self._head + self._stream.read(), b''
+                return data
+            data, self._head = self._head[:size], self._head[size:]
+            if len(data) < size:
+                data += self._stream.read(size - len(data))
+            return data
+        return self._stream.read(size)
+
+
+def iter_pcm(audio_file: BinaryIO, sample_rate: int = SAMPLE_RATE, chunk_ms: int = 500) -> Iterator[np.ndarray]:
+    """
+    Decode audio as a stream of mono int16 chunks of ``chunk_ms``.
+
+    WAV is read incrementally with the ``wave`` module; anything else
+    (OGG/Opus voice notes, MP3, M4A) is piped through ffmpeg. Neither path
+    holds the whole file in memory.
+    """
+    head = audio_file.read(12)
+    stream = _Prefixed(head, audio_file)
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        yield from _iter_wav(stream, sample_rate, chunk_ms)
+    else:
+        yield from _iter_ffmpeg(stream, sample_rate, chunk_ms)
+
+
+def _iter_wav(stream: BinaryIO, sample_rate: int, chunk_ms: int) -> Iterator[np.ndarray]:
+    dtypes = {1: np.uint8, 2: np.int16, 4: np.int32}
+    with wave.open(stream, 'rb') as wav:
+        width, channels, rate = wav.getsampwidth(), wav.getnchannels(), wav.getframerate()
+        if width not in dtypes:
+            raise ValueError(f"Unsupported WAV sample width: {width * 8} bits")
+        frames = max(1, rate * chunk_ms // 1000)
+        while True:
+            raw = wav.readframes(frames)
+            if not raw:
+                return
+            samples = np.frombuffer(raw, dtype=dtypes[width]).astype(np.float32)
+            if width == 1:
+                samples = (samples - 128) * 256
+            elif width == 4:
+                samples /= 65536
+            if channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1)
+            if rate != sample_rate:
+                n = int(round(len(samples) * sample_rate / rate))
+                samples = np.interp(np.linspace(0, len(samples) - 1, n), np.arange(len(samples)), samples)
+            yield np.clip(samples, -32768, 32767).astype(np.int16)
+
+
+def _iter_ffmpeg(stream: BinaryIO, sample_rate: int, chunk_ms: int) -> Iterator[np.ndarray]:
+    try:
+        process = subprocess.Popen(
+            ['ffmpeg', '-loglevel', 'error', '-i', 'pipe:0',
+             '-f', 's16le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise ValueError("Only WAV audio can be decoded without ffmpeg")
+
+    def feed():
+        try:
+            while True:
+                block = stream.read(64 * 1024)
+                if not block:
+                    break
+                process.stdin.write(block)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            process.stdin.close()
+
+    feeder = threading.Thread(target=feed, name='ffmpeg-feed', daemon=True)
+    feeder.start()
+    chunk_bytes = sample_rate * chunk_ms // 1000 * 2
+    try:
+        while True:
+            raw = process.stdout.read(chunk_bytes)
+            if not raw:
+                break
+            yield np.frombuffer(raw[:len(raw) - len(raw) % 2], dtype=np.int16)
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+        feeder.join(timeout=1)
+
+
+# Segmentation ------------------------------------------------------------
+
+class VoiceActivitySegmenter:
+    """
+    Energy-based voice activity detection over a stream of PCM chunks.
+
+    Audio is cut into ``frame_ms`` frames; a frame louder than
+    ``threshold_db`` (dBFS) is speech. A segment closes after
+    ``min_silence_ms`` of silence or at ``max_segment_seconds``, keeping
+    ``padding_ms`` of context on both sides, so segments are emitted while
+    the upload is still being decoded and can be recognized independently.
+    Segments shorter than ``min_speech_ms`` (clicks, breaths) are dropped.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = SAMPLE_RATE,
+        frame_ms: int = 30,
+        threshold_db: float = -40.0,
+        min_silence_ms: int = 300,
+        max_segment_seconds: float = 15.0,
+        padding_ms: int = 150,
+        min_speech_ms: int = 120,
+    ):
+        self.sample_rate = sample_rate
+        self.frame = sample_rate * frame_ms // 1000
+        self.threshold = 10 ** (threshold_db / 10) * 32768.0 ** 2
+        self.min_silence_frames = max(1, min_silence_ms // frame_ms)
+        self.max_segment_frames = max(1, int(max_segment_seconds * 1000) // frame_ms)
+        self.padding_frames = padding_ms // frame_ms
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+
+    def segments(self, chunks: Iterator[np.ndarray]) -> Iterator[Tuple[float, float, np.ndarray]]:
+        """Yield ``(start_seconds, end_seconds, pcm)`` for each speech segment"""
+        frame = self.frame
+        pending = np.zeros(0, dtype=np.int16)
+        preroll: deque = deque(maxlen=self.padding_frames or 1)
+        current: List[np.ndarray] = []
+        speech_frames = silence = 0
+        position = start = 0  # in frames
+
+        for chunk in chunks:
+            pending = np.concatenate([pending, chunk]) if len(pending) else chunk
+            usable = len(pending) // frame * frame
+            if not usable:
+                continue
+            frames = pending[:usable].reshape(-1, frame)
+            pending = pending[usable:]
+            energy = np.mean(frames.astype(np.float32) ** 2, axis=1)
+
+            for samples, voiced in zip(frames, energy > self.threshold):
+                if current:
+                    current.append(samples)
+                    if voiced:
+                        speech_frames += 1
+                        silence = 0
+                    else:
+                        silence += 1
+                    if silence >= self.min_silence_frames or len(current) >= self.max_segment_frames:
+                        # Keep padding_frames of the trailing silence
+                        keep = len(current) - max(0, silence - self.padding_frames)
+                        segment = self._emit(current[:keep], start, speech_frames)
+                        if segment:
+                            yield segment
+                        current, speech_frames, silence = [], 0, 0
+                elif voiced:
+                    current = list(preroll) + [samples]
+                    start = position - len(preroll)
+                    speech_frames, silence = 1, 0
+                    preroll.clear()
+                else:
+                    if self.padding_frames:
+                        preroll.append(samples)
+                position += 1
+
+        if current:
+            if len(pending):
+                current.append(pending)
+            segment = self._emit(current, start, speech_frames)
+            if segment:
+                yield segment
+
+    def _emit(self, frames: List[np.ndarray], start: int, speech_frames: int):
+        if speech_frames < self.min_speech_frames:
+            return None
+        pcm = np.concatenate(frames)
+        begin = start * self.frame / self.sample_rate
+        return begin, begin + len(pcm) / self.sample_rate, pcm
+
+
+# Recognizers -------------------------------------------------------------
+
+class SpeechRecognitionBackend:
+    """Recognizer from the SpeechRecognition package (Google Web Speech by default)"""
+
+    def __init__(self, engine: Optional[str] = None):
+        import speech_recognition as sr
+
+        self._sr = sr
+        self.recognizer = sr.Recognizer()
+        self.engine = engine or os.getenv('STT_ENGINE', 'google')
+
+    def __call__(self, pcm: bytes, sample_rate: int, language: str) -> str:
+        audio = self._sr.AudioData(pcm, sample_rate, 2)
+        recognize = getattr(self.recognizer, f'recognize_{self.engine}')
+        try:
+            return recognize(audio, language=language)
+        except self._sr.UnknownValueError:
+            return ""
+
+
+class FakeRecognizer:
+    """
+    Deterministic offline recognizer for tests and benchmarks.
+
+    The transcript is derived from a checksum of the audio, so the same
+    segment always gives the same words. ``setup_seconds`` and
+    ``cpu_seconds_per_audio_second`` simulate model load and CPU-bound
+    decoding time.
+    """
+
+    WORDS = ['عايز', 'اطلب', 'تيشيرت', 'مقاس', 'لارج', 'لونه', 'اسود', 'الشحن', 'امتى', 'شكرا']
+
+    def __init__(self, setup_seconds: float = None, cpu_seconds_per_audio_second: float = None):
+        if setup_seconds is None:
+            setup_seconds = float(os.getenv('STT_FAKE_SETUP_SECONDS', 0))
+        if cpu_seconds_per_audio_second is None:
+            cpu_seconds_per_audio_second = float(os.getenv('STT_FAKE_CPU_FACTOR', 0))
+        self.cpu_factor = cpu_seconds_per_audio_second
+        time.sleep(setup_seconds)
+
+    def __call__(self, pcm: bytes, sample_rate: int, language: str) -> str:
+        duration = len(pcm) / 2 / sample_rate
+        # Burn CPU time (not wall time), like a local model would
+        deadline = time.process_time() + duration * self.cpu_factor
+        while time.process_time() < deadline:
+            pass
+        seed = zlib.crc32(pcm)
+        count = max(1, int(duration * 2))
+        return ' '.join(self.WORDS[(seed >> (i % 28)) % len(self.WORDS)] for i in range(count))
+
+
+_worker_backend = None
+
+
+def _init_worker(backend_path: str):
+    global _worker_backend
+    _worker_backend = import_string(backend_path)()
+
+
+def _recognize(pcm: bytes, sample_rate: int, language: str) -> str:
+    return _worker_backend(pcm, sample_rate, language)
+
+
+class RecognizerPool:
+    """
+    Long-lived recognizers, built once per process.
+
+    With ``processes > 0`` segments are recognized in parallel in spawned
+    worker processes, each building its recognizer once in the pool
+    initializer. ``processes=0`` keeps one recognizer in this process and
+    calls it from ``threads`` threads (for network backends, or tests).
+    The pool is created on first use and recreated after ``fork``.
+    """
+
+    def __init__(self, backend: str = BACKENDS['fake'], processes: int = 2, threads: int = 4):
+        self.backend = BACKENDS.get(backend, backend)
+        self.processes = processes
+        self.threads = threads
+        self._executor: Optional[Executor] = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, pcm: bytes, sample_rate: int, language: str) -> Future:
+        return self.executor.submit(_recognize, pcm, sample_rate, language)
+
+    @property
+    def parallelism(self) -> int:
+        return self.processes or self.threads
+
+    @property
+    def executor(self) -> Executor:
+        pid = os.getpid()
+        if self._executor is not None and self._pid == pid:
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != pid:
+                if self.processes > 0:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_worker,
+                        initargs=(self.backend,),
+                    )
+                else:
+                    _init_worker(self.backend)
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.threads, thread_name_prefix='stt'
+                    )
+                self._pid = pid
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+
+# Service -----------------------------------------------------------------
 
 class SpeechToText:
+    def __init__(
+        self,
+        pool: Optional[RecognizerPool] = None,
+        segmenter: Optional[VoiceActivitySegmenter] = None,
+        sample_rate: int = SAMPLE_RATE,
+        chunk_ms: int = 500,
+    ):
+        self.pool = pool or RecognizerPool()
+        self.segmenter = segmenter or VoiceActivitySegmenter(sample_rate)
+        self.sample_rate = sample_rate
+        self.chunk_ms = chunk_ms
+
     def transcribe(self, audio_file, language):
         """Transcribe audio to text"""
-        return ""
+        return ' '.join(
+            part['text'] for part in self.transcribe_stream(audio_file, language) if part['text']
+        )
+
+    def transcribe_stream(self, audio_file, language) -> Iterator[Dict]:
+        """
+        Yield partial transcripts ``{index, start, end, text}`` in order.
+
+        Segments are submitted to the pool as soon as voice activity
+        detection closes them, and each partial is yielded as soon as it
+        and every earlier one are done. At most twice the pool's
+        parallelism is in flight, so a long upload is never fully buffered.
+        """
+        pending: deque = deque()
+        max_pending = self.pool.parallelism * 2
+        chunks = iter_pcm(audio_file, self.sample_rate, self.chunk_ms)
+
+        for index, (start, end, pcm) in enumerate(self.segmenter.segments(chunks)):
+            future = self.pool.submit(pcm.tobytes(), self.sample_rate, language)
+            pending.append((index, start, end, future))
+            while pending and (pending[0][3].done() or len(pending) > max_pending):
+                yield self._partial(*pending.popleft())
+
+        while pending:
+            yield self._partial(*pending.popleft())
+
+    @staticmethod
+    def _partial(index: int, start: float, end: float, future: Future) -> Dict:
+        return {
+            'index': index,
+            'start': round(start, 3),
+            'end': round(end, 3),
+            'text': future.result(),
+        }
+
+
+def speech_to_text_from_env() -> SpeechToText:
+    """Build the service configured by the STT_* variables"""
+    return SpeechToText(
+        pool=RecognizerPool(
+            backend=os.getenv('STT_BACKEND', 'speech_recognition'),
+            processes=int(os.getenv('STT_PROCESSES', 2)),
+            threads=int(os.getenv('STT_THREADS', 4)),
+        ),
+        segmenter=VoiceActivitySegmenter(
+            threshold_db=float(os.getenv('STT_VAD_THRESHOLD_DB', -40)),
+            min_silence_ms=int(os.getenv('STT_MIN_SILENCE_MS', 300)),
+            max_segment_seconds=float(os.getenv('STT_MAX_SEGMENT_SECONDS', 15)),
+        ),
+        chunk_ms=int(os.getenv('STT_CHUNK_MS', 500)),
+    )
@@ -0,0 +1,53 @@
+"""
+Inference Batcher Tests
+Batched generation with a tiny randomly initialized causal LM on CPU
+"""
+
+import threading
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+from benchmarks.bench_inference_batcher import tiny_model
+from chatbot.inference_batcher import MicroBatcher, TransformerGenerator
+
+WORDS = [f'w{i}' for i in range(60)]
+
+
+@pytest.fixture(scope='module')
+def generator():
+    model, tokenizer = tiny_model([' '.join(WORDS) + ' user: bot:'])
+    return TransformerGenerator(model, tokenizer, max_new_tokens=6, max_input_tokens=16)
+
+
+def test_batched_generation_matches_unbatched(generator):
+    prompts = ['w1 bot:', 'w2 w3 w4 w5 bot:', 'user: w9 w8 w7 w6 w5 w4 w3 bot:']
+    assert generator(prompts) == [generator([prompt])[0] for prompt in prompts]
+
+
+def test_long_prompt_keeps_the_latest_turns(generator):
+    history = ' '.join(WORDS[:40]) + ' bot:'
+    latest = ' '.join(history.split()[-16:])
+    inputs = generator.tokenizer([history], truncation=True, max_length=16)
+    assert generator.tokenizer.decode(inputs['input_ids'][0]).split()[-1] == 'bot:'
+    assert generator([history]) == generator([latest])
+
+
+def test_micro_batcher_resolves_each_caller(generator):
+    prompts = [' '.join(WORDS[i:i + 1 + i % 7]) + ' bot:' for i in range(12)]
+    expected = [generator([prompt])[0] for prompt in prompts]
+    batcher = MicroBatcher(generator, max_batch_size=4, max_wait_ms=20)
+    results = [None] * len(prompts)
+
+    def client(i):
+        results[i] = batcher.submit(prompts[i]).result(timeout=60)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(len(prompts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == expected
+    assert batcher.stats()['batches'] < len(prompts)
@@ -0,0 +1,24 @@
+"""
+Performance Regression Gate
+The benchmarks.regression suite against this machine's baseline; skipped
+until one is recorded with ``python -m benchmarks.regression --save``
+(REGRESSION_BASELINE chooses the path)
+"""
+
+import pytest
+
+from benchmarks import regression
+
+
+def test_no_performance_regressions():
+    baseline = regression.load_baseline(regression.DEFAULT_BASELINE)
+    if baseline is None:
+        pytest.skip(f"no baseline for this machine at {regression.DEFAULT_BASELINE}; record one with --save")
+    stages = [name for name in baseline['stages'] if name in regression.STAGES]
+    # Same corpus, passes and traced messages as the baseline; failing
+    # stages are measured again before they count
+    _, regressions = regression.check(baseline, stages)
+    assert not regressions, '\n'.join(
+        f"{stage} {metric}: {before:.1f} -> {current:.1f} ({change * 100:+.0f}% worse, {allowed * 100:.0f}% allowed)"
+        for stage, metric, before, current, change, allowed in regressions
+    )
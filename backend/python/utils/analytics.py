@@ -1,8 +1,381 @@
-"""Analytics"""
+"""
+Analytics
+Chat events are appended to an in-process buffer and flushed in batches by
+a background thread to an append-only columnar store with per-day rollups
+"""
+
+import atexit
+import collections
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Raw event columns, one append-only file each per segment
+COLUMNS = {
+    'ts': np.float64,
+    'user': np.uint64,
+    'intent': np.uint16,
+    'channel': np.uint8,
+    'language': np.uint8,
+    'message_len': np.uint32,
+    'response_len': np.uint32,
+    'latency_ms': np.float32,
+}
+
+# Distinct users are estimated from the smallest hashes (exact below this)
+USER_SKETCH_SIZE = 4096
+
+UNKNOWN = ''
+
+
+def _local_timezone(name: str):
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(name)
+    except Exception:
+        logger.warning("Unknown timezone %r, using UTC for analytics", name)
+        return timezone.utc
+
+
+def _user_hash(user_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=8).digest(), 'little')
+
+
+class _Segment:
+    """
+    One process's events for one day: a directory of column files and a
+    ``rollup.npz`` with event counts and latency sums by (hour, intent,
+    channel), rewritten atomically after every flush. Segments are never
+    shared between processes, so gunicorn workers write without locking.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.names = {'intent': [], 'channel': [], 'language': []}
+        self.codes = {kind: {} for kind in self.names}
+        self.counts = np.zeros((24, 0, 0), dtype=np.int64)
+        self.latency = np.zeros((24, 0, 0), dtype=np.float64)
+        self.users = np.zeros(0, dtype=np.uint64)
+        self.events = 0
+        self._files = {name: open(os.path.join(path, f'{name}.bin'), 'ab') for name in COLUMNS}
+
+    def code(self, kind: str, value: Optional[str]) -> int:
+        value = UNKNOWN if value is None else str(value)
+        codes = self.codes[kind]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.names[kind])
+            self.names[kind].append(value)
+        return code
+
+    def append(self, columns: Dict[str, np.ndarray], hours: np.ndarray):
+        for name, dtype in COLUMNS.items():
+            columns[name].astype(dtype, copy=False).tofile(self._files[name])
+            self._files[name].flush()
+
+        shape = (24, len(self.names['intent']), len(self.names['channel']))
+        if self.counts.shape != shape:
+            self.counts = _grow(self.counts, shape)
+            self.latency = _grow(self.latency, shape)
+        flat = (hours * shape[1] + columns['intent']) * shape[2] + columns['channel']
+        size = self.counts.size
+        self.counts += np.bincount(flat, minlength=size).reshape(shape)
+        self.latency += np.bincount(flat, weights=columns['latency_ms'], minlength=size).reshape(shape)
+        self.users = np.union1d(self.users, columns['user'])[:USER_SKETCH_SIZE]
+        self.events += len(hours)
+        self._write_rollup()
+
+    def _write_rollup(self):
+        target = os.path.join(self.path, 'rollup.npz')
+        tmp = target + '.tmp.npz'
+        np.savez(
+            tmp,
+            counts=self.counts,
+            latency=self.latency,
+            users=self.users,
+            intents=np.array(self.names['intent'], dtype=str),
+            channels=np.array(self.names['channel'], dtype=str),
+            languages=np.array(self.names['language'], dtype=str),
+        )
+        os.replace(tmp, target)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+
+
+def _grow(array: np.ndarray, shape) -> np.ndarray:
+    grown = np.zeros(shape, dtype=array.dtype)
+    grown[:, :array.shape[1], :array.shape[2]] = array
+    return grown
+
 
 class Analytics:
-    def track_message(self, user_id, message, response):
-        pass
-    
-    def get_report(self, start_date, end_date):
-        return {}
+    """
+    Chat analytics.
+
+    ``track_message`` only appends a tuple to a bounded in-memory buffer
+    (events are dropped and counted when it is full); a daemon thread,
+    started lazily in each process, flushes the buffer every
+    ``flush_interval`` seconds into ``root/<YYYY-MM-DD>/<segment>/``.
+    Reports sum the per-segment rollups of the requested days, so their
+    cost depends on the number of days, not the number of events. Days
+    and hours are in ``tz`` (Africa/Cairo by default).
+    """
+
+    def __init__(
+        self,
+        root: str = './data/analytics',
+        capacity: int = 100_000,
+        flush_interval: float = 1.0,
+        tz: str = 'Africa/Cairo',
+    ):
+        self.root = root
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.tz = _local_timezone(tz)
+
+        self._buffer = collections.deque()
+        self._segments: Dict[str, _Segment] = {}
+        self._rollups: Dict[str, tuple] = {}
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+
+        self.dropped = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+
+    # Producer side --------------------------------------------------------
+
+    def track_message(self, user_id, message, response, intent=None, channel='web',
+                      language='ar', latency_ms=0.0):
+        """Record one chat exchange; never blocks on I/O"""
+        if self._pid != os.getpid():
+            self.start()
+        if len(self._buffer) >= self.capacity:
+            self.dropped += 1
+            return
+        self._buffer.append((time.time(), user_id, intent, channel, language,
+                             len(message or ''), len(response or ''), latency_ms))
+
+    def start(self):
+        """Start the flusher thread (once per process)"""
+        pid = os.getpid()
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # Forked: the parent's buffer, open segments and a flush
+                # lock it may have been holding are its own
+                self._buffer.clear()
+                self._segments = {}
+                self._flush_lock = threading.Lock()
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='analytics-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Analytics flush failed")
+
+    # Flushing -------------------------------------------------------------
+
+    def flush(self) -> int:
+        """Write buffered events to the store; returns how many were written"""
+        with self._flush_lock:
+            count = len(self._buffer)
+            if not count:
+                return 0
+            start = time.perf_counter()
+            popleft = self._buffer.popleft
+            events = [popleft() for _ in range(count)]
+
+            ts = np.fromiter((e[0] for e in events), dtype=np.float64, count=count)
+            local = ts + self._utc_offsets(ts)
+            days = (local // 86400).astype(np.int64)
+            hours = ((local % 86400) // 3600).astype(np.int64)
+
+            for day in np.unique(days):
+                rows = np.flatnonzero(days == day)
+                segment = self._segment(date.fromordinal(int(day) + date(1970, 1, 1).toordinal()))
+                picked = [events[i] for i in rows]
+                columns = {
+                    'ts': ts[rows],
+                    'user': np.fromiter((_user_hash(e[1]) for e in picked), dtype=np.uint64, count=len(rows)),
+                    'intent': np.fromiter((segment.code('intent', e[2]) for e in picked), dtype=np.int64, count=len(rows)),
+                    'channel': np.fromiter((segment.code('channel', e[3]) for e in picked), dtype=np.int64, count=len(rows)),
+                    'language': np.fromiter((segment.code('language', e[4]) for e in picked), dtype=np.int64, count=len(rows)),
+                    'message_len': np.fromiter((e[5] for e in picked), dtype=np.uint32, count=len(rows)),
+                    'response_len': np.fromiter((e[6] for e in picked), dtype=np.uint32, count=len(rows)),
+                    'latency_ms': np.fromiter((e[7] or 0.0 for e in picked), dtype=np.float64, count=len(rows)),
+                }
+                segment.append(columns, hours[rows])
+
+            # Keep only the newest day's segment open
+            newest = max(self._segments)
+            for day in [d for d in self._segments if d != newest]:
+                self._segments.pop(day).close()
+
+            self.flushed += count
+            self.flushes += 1
+            self.last_flush_seconds = time.perf_counter() - start
+            return count
+
+    def _utc_offsets(self, ts: np.ndarray) -> np.ndarray:
+        first = datetime.fromtimestamp(ts.min(), self.tz).utcoffset().total_seconds()
+        last = datetime.fromtimestamp(ts.max(), self.tz).utcoffset().total_seconds()
+        if first == last:
+            return np.full(len(ts), first)
+        # The batch spans a DST change
+        return np.array([datetime.fromtimestamp(t, self.tz).utcoffset().total_seconds() for t in ts])
+
+    def _segment(self, day: date) -> _Segment:
+        key = day.isoformat()
+        segment = self._segments.get(key)
+        if segment is None:
+            name = f'{socket.gethostname()}-{os.getpid()}-{int(time.time() * 1000)}'
+            segment = self._segments[key] = _Segment(os.path.join(self.root, key, name))
+        return segment
+
+    # Reading --------------------------------------------------------------
+
+    def get_report(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict:
+        """
+        Message counts by day, hour, intent and channel, average latency by
+        intent and distinct users for ``start_date``..``end_date``
+        (inclusive, YYYY-MM-DD; the last 30 days by default).
+        """
+        self.flush()
+        end = date.fromisoformat(end_date) if end_date else datetime.now(self.tz).date()
+        start = date.fromisoformat(start_date) if start_date else end - timedelta(days=29)
+        if start > end:
+            raise ValueError("start_date is after end_date")
+
+        by_day = {}
+        by_hour = np.zeros(24, dtype=np.int64)
+        by_intent = collections.Counter()
+        by_channel = collections.Counter()
+        latency_by_intent = collections.Counter()
+        users = []
+        total_latency = 0.0
+
+        day = start
+        while day <= end:
+            count = 0
+            for rollup in self._day_rollups(day.isoformat()):
+                counts, latency = rollup['counts'], rollup['latency']
+                count += int(counts.sum())
+                by_hour += counts.sum(axis=(1, 2))
+                for name, n, ms in zip(rollup['intents'], counts.sum(axis=(0, 2)), latency.sum(axis=(0, 2))):
+                    by_intent[name or 'unknown'] += int(n)
+                    latency_by_intent[name or 'unknown'] += float(ms)
+                for name, n in zip(rollup['channels'], counts.sum(axis=(0, 1))):
+                    by_channel[name or 'unknown'] += int(n)
+                total_latency += float(latency.sum())
+                users.append(rollup['users'])
+            by_day[day.isoformat()] = count
+            day += timedelta(days=1)
+
+        total = sum(by_day.values())
+        return {
+            'start_date': start.isoformat(),
+            'end_date': end.isoformat(),
+            'total_messages': total,
+            'unique_users': _distinct(users),
+            'avg_latency_ms': total_latency / total if total else 0.0,
+            'by_day': by_day,
+            'by_hour': by_hour.tolist(),
+            'by_intent': dict(by_intent.most_common()),
+            'by_channel': dict(by_channel.most_common()),
+            'avg_latency_ms_by_intent': {
+                name: latency_by_intent[name] / n for name, n in by_intent.items() if n
+            },
+        }
+
+    def _day_rollups(self, day: str) -> List[Dict]:
+        directory = os.path.join(self.root, day)
+        if not os.path.isdir(directory):
+            return []
+        rollups = []
+        for entry in os.scandir(directory):
+            path = os.path.join(entry.path, 'rollup.npz')
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            cached = self._rollups.get(path)
+            if cached is None or cached[0] != mtime:
+                if len(self._rollups) > 10_000:
+                    self._rollups.clear()
+                with np.load(path) as data:
+                    rollup = {key: data[key] for key in data.files}
+                for key in ('intents', 'channels', 'languages'):
+                    rollup[key] = rollup[key].tolist()
+                cached = self._rollups[path] = (mtime, rollup)
+            rollups.append(cached[1])
+        return rollups
+
+    def events(self, day: str) -> Dict[str, np.ndarray]:
+        """Raw event columns of one day (all segments), for ad-hoc analysis"""
+        self.flush()
+        directory = os.path.join(self.root, day)
+        parts = {name: [] for name in COLUMNS}
+        if os.path.isdir(directory):
+            for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+                columns = {name: np.fromfile(os.path.join(entry.path, f'{name}.bin'), dtype=dtype)
+                           for name, dtype in COLUMNS.items()}
+                # A crash mid-flush can leave some columns longer than others
+                rows = min(len(column) for column in columns.values())
+                for name, column in columns.items():
+                    parts[name].append(column[:rows])
+        return {name: np.concatenate(arrays) if arrays else np.zeros(0, dtype=COLUMNS[name])
+                for name, arrays in parts.items()}
+
+    def stats(self) -> Dict:
+        return {
+            'buffered': len(self._buffer),
+            'dropped': self.dropped,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'last_flush_seconds': self.last_flush_seconds,
+        }
+
+
+def _distinct(sketches: List[np.ndarray]) -> int:
+    """Distinct count from per-segment K-minimum-values sketches"""
+    if not sketches:
+        return 0
+    merged = np.sort(np.concatenate(sketches))
+    merged = merged[np.concatenate(([True], merged[1:] != merged[:-1]))]
+    if len(merged) < USER_SKETCH_SIZE:
+        return int(len(merged))
+    kth = float(merged[USER_SKETCH_SIZE - 1]) / 2.0 ** 64
+    return int((USER_SKETCH_SIZE - 1) / kth)
+
+
+def analytics_from_env() -> Analytics:
+    """Analytics configured by the ANALYTICS_* variables"""
+    return Analytics(
+        root=os.getenv('ANALYTICS_PATH', './data/analytics'),
+        capacity=int(os.getenv('ANALYTICS_BUFFER_SIZE', 100_000)),
+        flush_interval=float(os.getenv('ANALYTICS_FLUSH_SECONDS', 1.0)),
+        tz=os.getenv('TIMEZONE', 'Africa/Cairo'),
+    )
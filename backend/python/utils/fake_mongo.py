@@ -0,0 +1,238 @@
+"""
+Fake Mongo
+In-process stand-in for the subset of the pymongo client used by
+DatabaseHandler, so it can run in tests and benchmarks without a server
+"""
+
+import copy
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class FakeMongoClient:
+    """
+    Thread-safe in-memory client with a simulated connection pool.
+
+    Every operation checks a "connection" out of a pool of ``maxPoolSize``
+    and reports ``connection_check_out_started`` / ``connection_checked_out``
+    / ``connection_checked_in`` to the ``event_listeners``, like pymongo, so
+    pool metrics can be tested. ``latency`` adds a simulated round-trip time
+    per operation.
+    """
+
+    def __init__(self, uri: str = 'mongodb://fake/bww', maxPoolSize: int = 100,
+                 event_listeners: List = (), latency: float = 0.0, **kwargs):
+        self.default_database = uri.rsplit('/', 1)[-1].split('?')[0] or 'test'
+        self.latency = latency
+        self.listeners = list(event_listeners)
+        self.round_trips = 0
+        self._pool = threading.BoundedSemaphore(maxPoolSize)
+        self._databases: Dict[str, 'FakeDatabase'] = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, name: str) -> 'FakeDatabase':
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = FakeDatabase(self, name)
+            return self._databases[name]
+
+    def get_database(self, name: Optional[str] = None) -> 'FakeDatabase':
+        return self[name or self.default_database]
+
+    def get_default_database(self) -> 'FakeDatabase':
+        return self[self.default_database]
+
+    def close(self):
+        pass
+
+    def _round_trip(self, fn, *args):
+        event = SimpleNamespace(address=('fake', 27017))
+        for listener in self.listeners:
+            listener.connection_check_out_started(event)
+        self._pool.acquire()
+        for listener in self.listeners:
+            listener.connection_checked_out(event)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            with self._lock:
+                self.round_trips += 1
+                return fn(*args)
+        finally:
+            self._pool.release()
+            for listener in self.listeners:
+                listener.connection_checked_in(event)
+
+
+class FakeDatabase:
+    def __init__(self, client: FakeMongoClient, name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, 'FakeCollection'] = {}
+
+    def __getitem__(self, name: str) -> 'FakeCollection':
+        with self.client._lock:
+            if name not in self._collections:
+                self._collections[name] = FakeCollection(self.client, name)
+            return self._collections[name]
+
+    get_collection = __getitem__
+
+
+class FakeCollection:
+    """Documents keyed by ``_id``; filters support equality and ``$in``"""
+
+    def __init__(self, client: FakeMongoClient, name: str):
+        self.client = client
+        self.name = name
+        self._docs: Dict[Any, Dict] = {}
+        self._next_id = 0
+
+    # Reads ----------------------------------------------------------------
+
+    def find(self, filter: Optional[Dict] = None, projection: Optional[Dict] = None) -> Iterator[Dict]:
+        docs = self.client._round_trip(self._find, filter or {})
+        return iter([_project(doc, projection) for doc in docs])
+
+    def find_one(self, filter: Optional[Dict] = None, projection: Optional[Dict] = None) -> Optional[Dict]:
+        docs = self.client._round_trip(self._find, filter or {}, 1)
+        return _project(docs[0], projection) if docs else None
+
+    def count_documents(self, filter: Dict) -> int:
+        return len(self.client._round_trip(self._find, filter))
+
+    # Writes ---------------------------------------------------------------
+
+    def insert_one(self, document: Dict):
+        return SimpleNamespace(inserted_id=self.client._round_trip(self._insert, document))
+
+    def insert_many(self, documents: List[Dict], ordered: bool = True):
+        ids = self.client._round_trip(lambda: [self._insert(doc) for doc in documents])
+        return SimpleNamespace(inserted_ids=ids)
+
+    def replace_one(self, filter: Dict, replacement: Dict, upsert: bool = False):
+        return self.client._round_trip(self._replace, filter, replacement, upsert)
+
+    def update_one(self, filter: Dict, update: Dict, upsert: bool = False):
+        return self.client._round_trip(self._update, filter, update, upsert)
+
+    def delete_one(self, filter: Dict):
+        return self.client._round_trip(self._delete, filter, 1)
+
+    def delete_many(self, filter: Dict):
+        return self.client._round_trip(self._delete, filter, None)
+
+    def bulk_write(self, requests: List, ordered: bool = True):
+        """Apply pymongo ReplaceOne / UpdateOne / DeleteOne requests"""
+        def apply():
+            result = SimpleNamespace(matched_count=0, modified_count=0, upserted_count=0,
+                                     deleted_count=0, inserted_count=0)
+            for request in requests:
+                kind = type(request).__name__
+                if kind in ('ReplaceOne', 'UpdateOne'):
+                    apply_one = self._replace if kind == 'ReplaceOne' else self._update
+                    outcome = apply_one(request._filter, request._doc, request._upsert)
+                    result.matched_count += outcome.matched_count
+                    result.modified_count += outcome.modified_count
+                    result.upserted_count += outcome.upserted_id is not None
+                elif kind == 'DeleteOne':
+                    result.deleted_count += self._delete(request._filter, 1).deleted_count
+                elif kind == 'InsertOne':
+                    self._insert(request._doc)
+                    result.inserted_count += 1
+                else:
+                    raise TypeError(f"Unsupported bulk request: {kind}")
+            return result
+
+        return self.client._round_trip(apply)
+
+    def create_index(self, keys, **kwargs) -> str:
+        return str(keys)
+
+    # Implementation (called with the client lock held) ---------------------
+
+    def _find(self, filter: Dict, limit: Optional[int] = None) -> List[Dict]:
+        ids = filter.get('_id')
+        if ids is not None and not isinstance(ids, dict):
+            candidates = [self._docs[ids]] if ids in self._docs else []
+        elif isinstance(ids, dict) and '$in' in ids:
+            candidates = [self._docs[i] for i in ids['$in'] if i in self._docs]
+        else:
+            candidates = self._docs.values()
+        matches = []
+        for doc in candidates:
+            if _matches(doc, filter):
+                matches.append(copy.deepcopy(doc))
+                if limit and len(matches) >= limit:
+                    break
+        return matches
+
+    def _insert(self, document: Dict):
+        doc = copy.deepcopy(document)
+        if '_id' not in doc:
+            self._next_id += 1
+            doc['_id'] = f'{self._next_id:024x}'
+        if doc['_id'] in self._docs:
+            raise KeyError(f"Duplicate key: {doc['_id']}")
+        self._docs[doc['_id']] = doc
+        document.setdefault('_id', doc['_id'])
+        return doc['_id']
+
+    def _replace(self, filter: Dict, replacement: Dict, upsert: bool):
+        found = self._find(filter, 1)
+        if found:
+            doc = dict(copy.deepcopy(replacement), _id=found[0]['_id'])
+            modified = self._docs[doc['_id']] != doc
+            self._docs[doc['_id']] = doc
+            return SimpleNamespace(matched_count=1, modified_count=int(modified), upserted_id=None)
+        if not upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+        doc = dict(copy.deepcopy(replacement))
+        if '_id' in filter and not isinstance(filter['_id'], dict):
+            doc['_id'] = filter['_id']
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=self._insert(doc))
+
+    def _update(self, filter: Dict, update: Dict, upsert: bool):
+        found = self._find(filter, 1)
+        if not found and not upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+        doc = found[0] if found else {k: v for k, v in filter.items() if not isinstance(v, dict)}
+        before = copy.deepcopy(doc)
+        for key, value in update.get('$set', {}).items():
+            doc[key] = copy.deepcopy(value)
+        for key, value in update.get('$inc', {}).items():
+            doc[key] = doc.get(key, 0) + value
+        for key in update.get('$unset', {}):
+            doc.pop(key, None)
+        if found:
+            self._docs[doc['_id']] = doc
+            return SimpleNamespace(matched_count=1, modified_count=int(doc != before), upserted_id=None)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=self._insert(doc))
+
+    def _delete(self, filter: Dict, limit: Optional[int]):
+        found = self._find(filter, limit)
+        for doc in found:
+            del self._docs[doc['_id']]
+        return SimpleNamespace(deleted_count=len(found))
+
+
+def _matches(doc: Dict, filter: Dict) -> bool:
+    for key, expected in filter.items():
+        value = doc.get(key)
+        if isinstance(expected, dict) and '$in' in expected:
+            if value not in expected['$in']:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+def _project(doc: Dict, projection: Optional[Dict]) -> Dict:
+    if not projection:
+        return doc
+    included = {key for key, flag in projection.items() if flag}
+    if included:
+        return {key: value for key, value in doc.items() if key in included or key == '_id'}
+    return {key: value for key, value in doc.items() if key not in projection}
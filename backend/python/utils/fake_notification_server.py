@@ -0,0 +1,168 @@
+"""
+Fake Notification Server
+Local HTTP server imitating the WhatsApp Cloud, Messenger (including Graph
+batch requests) and Twilio message endpoints, with per-channel rate
+limits, latency and failure injection, so the notification dispatcher can
+be tested and benchmarked offline
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+ROUTES = [
+    ('whatsapp', re.compile(r'^/[^/]+/messages$')),
+    ('messenger', re.compile(r'^/me/messages$')),
+    ('messenger_batch', re.compile(r'^/?$')),
+    ('sms', re.compile(r'^/2010-04-01/Accounts/[^/]+/Messages\.json$')),
+]
+
+
+class _Limiter:
+    """Server-side token bucket; answers whether one message may pass"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class FakeNotificationServer:
+    """
+    ``rates`` maps a channel (whatsapp, messenger, sms) to the messages per
+    second it accepts, with a one-second burst; messages over the limit get
+    HTTP 429 with Retry-After. ``latency`` delays every response and
+    ``failure_rate`` answers that fraction of messages with HTTP 503.
+    Accepted message timestamps are kept per channel in ``accepted``.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None, latency: float = 0.0,
+                 failure_rate: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        self.rates = rates or {}
+        self.limiters = {channel: _Limiter(rate, rate) for channel, rate in self.rates.items()}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.accepted: Dict[str, List[float]] = {}
+        self.rejected: Dict[str, int] = {}
+        self.failed: Dict[str, int] = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-notification-server', daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def max_per_second(self, channel: str) -> int:
+        """Most messages accepted in any one-second window"""
+        stamps = sorted(self.accepted.get(channel, []))
+        best, start = 0, 0
+        for end, stamp in enumerate(stamps):
+            while stamp - stamps[start] >= 1.0:
+                start += 1
+            best = max(best, end - start + 1)
+        return best
+
+    # One message --------------------------------------------------------
+
+    def _message(self, channel: str):
+        """Status for one message on ``channel``: 200, 429 or 503"""
+        limiter = self.limiters.get(channel)
+        if limiter is not None and not limiter.allow():
+            with self._lock:
+                self.rejected[channel] = self.rejected.get(channel, 0) + 1
+            return 429
+        if self.failure_rate and random.random() < self.failure_rate:
+            with self._lock:
+                self.failed[channel] = self.failed.get(channel, 0) + 1
+            return 503
+        with self._lock:
+            self.accepted.setdefault(channel, []).append(time.monotonic())
+            count = len(self.accepted[channel])
+        return 200, f'{channel}-{count}'
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                route = next((name for name, pattern in ROUTES if pattern.match(self.path.split('?')[0])), None)
+                if route is None:
+                    return self._reply(404, {'error': 'unknown endpoint'})
+                if route == 'messenger_batch':
+                    return self._batch(body)
+
+                channel = 'messenger' if route == 'messenger' else route
+                result = server._message(channel)
+                if result == 429:
+                    return self._reply(429, {'error': 'rate limited'}, {'Retry-After': '1'})
+                if result == 503:
+                    return self._reply(503, {'error': 'temporarily unavailable'})
+                message_id = result[1]
+                if channel == 'whatsapp':
+                    return self._reply(200, {'messages': [{'id': message_id}]})
+                if channel == 'sms':
+                    return self._reply(201, {'sid': message_id, 'status': 'queued'})
+                return self._reply(200, {'message_id': message_id})
+
+            def _batch(self, body: bytes):
+                form = parse_qs(body.decode())
+                items = []
+                for _ in json.loads(form.get('batch', ['[]'])[0]):
+                    result = server._message('messenger')
+                    if isinstance(result, tuple):
+                        items.append({'code': 200, 'body': json.dumps({'message_id': result[1]})})
+                    else:
+                        items.append({'code': result, 'body': json.dumps({'error': 'rate limited'})})
+                self._reply(200, items)
+
+            def _reply(self, status: int, payload, headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
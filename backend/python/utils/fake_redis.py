@@ -0,0 +1,231 @@
+"""
+Fake Redis
+In-process stand-in for the subset of the redis-py client used by the
+shared backends, so they can run in tests and benchmarks without a server
+"""
+
+import fnmatch
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class FakeRedis:
+    """Thread-safe in-memory implementation of the redis-py calls we use"""
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    # Keys -----------------------------------------------------------------
+
+    def _alive(self, key: str) -> bool:
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+            return False
+        return key in self._data
+
+    def exists(self, key: str) -> int:
+        with self._lock:
+            return int(self._alive(key))
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            removed = 0
+            for key in keys:
+                if self._alive(key):
+                    removed += 1
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+            return removed
+
+    def expire(self, key: str, seconds: float) -> bool:
+        with self._lock:
+            if not self._alive(key):
+                return False
+            self._expires[key] = time.time() + seconds
+            return True
+
+    def ttl(self, key: str) -> int:
+        with self._lock:
+            if not self._alive(key):
+                return -2
+            deadline = self._expires.get(key)
+            return -1 if deadline is None else max(0, int(deadline - time.time()))
+
+    def keys(self, pattern: str = '*') -> List[str]:
+        with self._lock:
+            return [key for key in list(self._data) if self._alive(key) and fnmatch.fnmatchcase(key, pattern)]
+
+    def scan_iter(self, match: str = '*', count: int = None) -> Iterator[str]:
+        return iter(self.keys(match))
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+
+    # Strings --------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._data.get(key) if self._alive(key) else None
+
+    def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        with self._lock:
+            return [self._data.get(key) if self._alive(key) else None for key in keys]
+
+    def set(self, key: str, value: Any, ex: Optional[float] = None, nx: bool = False) -> Optional[bool]:
+        with self._lock:
+            if nx and self._alive(key):
+                return None
+            self._data[key] = _encode(value)
+            if ex is not None:
+                self._expires[key] = time.time() + ex
+            else:
+                self._expires.pop(key, None)
+            return True
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        with self._lock:
+            value = int(self._data.get(key, 0)) if self._alive(key) else 0
+            value += amount
+            self._data[key] = str(value).encode()
+            return value
+
+    # Lists ----------------------------------------------------------------
+
+    def rpush(self, key: str, *values: Any) -> int:
+        with self._lock:
+            if not self._alive(key) or not isinstance(self._data[key], list):
+                self._data[key] = []
+            items = self._data[key]
+            items.extend(_encode(value) for value in values)
+            return len(items)
+
+    def lrange(self, key: str, start: int, end: int) -> List[bytes]:
+        with self._lock:
+            if not self._alive(key):
+                return []
+            items = self._data[key]
+            end = len(items) if end == -1 else end + 1
+            return list(items[start:end])
+
+    def ltrim(self, key: str, start: int, end: int) -> bool:
+        with self._lock:
+            if self._alive(key):
+                items = self._data[key]
+                end = len(items) if end == -1 else end + 1
+                if start < 0:
+                    start = max(0, len(items) + start)
+                self._data[key] = items[start:end]
+            return True
+
+    def llen(self, key: str) -> int:
+        with self._lock:
+            return len(self._data[key]) if self._alive(key) else 0
+
+    # Hashes ---------------------------------------------------------------
+
+    def hset(self, key: str, field: str = None, value: Any = None, mapping: Dict = None) -> int:
+        with self._lock:
+            fields = self._data.get(key) if self._alive(key) else None
+            if not isinstance(fields, dict):
+                fields = self._data[key] = {}
+            updates = dict(mapping or {})
+            if field is not None:
+                updates[field] = value
+            added = sum(1 for name in updates if name not in fields)
+            fields.update({name: _encode(val) for name, val in updates.items()})
+            return added
+
+    def hget(self, key: str, field: str) -> Optional[bytes]:
+        with self._lock:
+            return self._data[key].get(field) if self._alive(key) else None
+
+    def hgetall(self, key: str) -> Dict[str, bytes]:
+        with self._lock:
+            return dict(self._data[key]) if self._alive(key) else {}
+
+    def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        with self._lock:
+            fields = self._data.get(key) if self._alive(key) else None
+            if not isinstance(fields, dict):
+                fields = self._data[key] = {}
+            value = int(fields.get(field, 0)) + amount
+            fields[field] = str(value).encode()
+            return value
+
+    # Sorted sets ----------------------------------------------------------
+
+    def zadd(self, key: str, mapping: Dict[str, float]) -> int:
+        with self._lock:
+            members = self._data.get(key) if self._alive(key) else None
+            if not isinstance(members, dict):
+                members = self._data[key] = {}
+            added = sum(1 for member in mapping if member not in members)
+            members.update({member: float(score) for member, score in mapping.items()})
+            return added
+
+    def zrem(self, key: str, *members: str) -> int:
+        with self._lock:
+            scores = self._data[key] if self._alive(key) else {}
+            return sum(1 for member in members if scores.pop(member, None) is not None)
+
+    def zremrangebyscore(self, key: str, min: float, max: float) -> int:
+        with self._lock:
+            if not self._alive(key):
+                return 0
+            scores = self._data[key]
+            expired = [member for member, score in scores.items() if min <= score <= max]
+            for member in expired:
+                del scores[member]
+            return len(expired)
+
+    def zcard(self, key: str) -> int:
+        with self._lock:
+            return len(self._data[key]) if self._alive(key) else 0
+
+    # Pipelines ------------------------------------------------------------
+
+    def pipeline(self, transaction: bool = True) -> 'FakePipeline':
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Buffers calls and runs them under the client lock on ``execute``"""
+
+    def __init__(self, client: FakeRedis):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name: str):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._calls.clear()
+
+    def execute(self) -> List[Any]:
+        with self._client._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._calls]
+        self._calls.clear()
+        return results
+
+
+def _encode(value: Any) -> bytes:
+    """Store values as bytes, like a real Redis client returns them"""
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
@@ -1,6 +1,260 @@
-"""Logging Setup"""
+"""
+Logging Setup
+Non-blocking structured logging: request threads hand records to a bounded
+queue and a background listener formats and writes them, as JSON lines
+carrying the request context (request ID, user, intent, elapsed time)
+"""
+
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+# Fields of the current request or job, attached to every record logged
+# while they are set
+_context: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar('log_context', default=None)
+
+CONTEXT_FIELDS = ('request_id', 'user_id', 'intent', 'channel', 'endpoint')
+
+_handler: Optional['LazyQueueHandler'] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+@contextmanager
+def log_context(**fields) -> Iterator[Dict]:
+    """
+    Attach ``fields`` to records logged inside the block, on top of any
+    outer context. The yielded dict may be updated in place, e.g. once the
+    intent is known, without affecting the outer context.
+    """
+    parent = _context.get()
+    context = dict(parent, **fields) if parent else fields
+    context.setdefault('started', time.time())
+    token = _context.set(context)
+    try:
+        yield context
+    finally:
+        _context.reset(token)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current log context onto the record (on the caller's thread)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _context.get()
+        record.context = dict(context) if context else None
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Throttles repeated records at ``level`` and above. Records are grouped
+    by logger, level and unformatted message, so lazily formatted calls
+    (``logger.error("Error: %s", e)``) with different arguments count as
+    repeats. Each group passes ``burst`` records per ``window`` seconds,
+    then one in ``sample_every`` (0: none); the next record that passes
+    carries the number suppressed before it.
+    """
+
+    def __init__(self, burst: int = 10, window: float = 60.0, sample_every: int = 100,
+                 level: int = logging.WARNING, max_keys: int = 10_000):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.sample_every = sample_every
+        self.level = level
+        self.max_keys = max_keys
+        # key -> [window start, count, suppressed since last passed]
+        self._groups: Dict[tuple, List] = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = record.created
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                if len(self._groups) >= self.max_keys:
+                    self._groups.clear()
+                group = self._groups[key] = [now, 0, 0]
+            elif now - group[0] >= self.window:
+                group[0], group[1] = now, 0
+            group[1] += 1
+            over = group[1] - self.burst
+            if over > 0 and not (self.sample_every and over % self.sample_every == 0):
+                group[2] += 1
+                self.suppressed += 1
+                return False
+            record.suppressed = group[2]
+            group[2] = 0
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records without formatting them; the listener thread does the
+    formatting, so a log call costs the request thread its filters and a
+    put on a ``queue.SimpleQueue``. Arguments are formatted
+    later, so they should not be mutated after logging. Beyond ``maxsize``
+    pending records, new ones are dropped and counted rather than blocking
+    the caller.
+    """
+
+    def __init__(self, maxsize: int = 10_000):
+        super().__init__(queue.SimpleQueue())
+        self.maxsize = maxsize
+        self.dropped = 0
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # No handler lock: the queue is thread-safe
+        if not self.filter(record):
+            return False
+        self.enqueue(record)
+        return True
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+        else:
+            self.queue.put_nowait(record)
 
-def setup_logging():
-    logging.basicConfig(level=logging.INFO)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the request context flattened in"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        context = getattr(record, 'context', None)
+        if context:
+            for field in CONTEXT_FIELDS:
+                if context.get(field) is not None:
+                    entry[field] = context[field]
+            started = context.get('started')
+            if started is not None:
+                entry['elapsed_ms'] = round((record.created - started) * 1000, 2)
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Plain lines for local development, with the request ID when known"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(request)s%(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        context = getattr(record, 'context', None)
+        record.request = f"[{context['request_id']}] " if context and context.get('request_id') else ''
+        text = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            text += f' ({record.suppressed} similar suppressed)'
+        return text
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None,
+                  stream=None, queue_size: Optional[int] = None,
+                  rate_limit: Optional[RateLimitFilter] = None) -> logging.Logger:
+    """
+    Route the root logger through a bounded queue to a listener thread
+    writing to ``stream`` (stderr). ``fmt`` is json or text; defaults come
+    from LOG_LEVEL, LOG_FORMAT and the LOG_* throttling settings. Calling
+    it again replaces the previous setup.
+    """
+    global _handler, _listener
+    level = (level or os.getenv('LOG_LEVEL', 'info')).upper()
+    fmt = fmt or os.getenv('LOG_FORMAT', 'json')
+    queue_size = queue_size or int(os.getenv('LOG_QUEUE_SIZE', 10_000))
+    if rate_limit is None:
+        rate_limit = RateLimitFilter(
+            burst=int(os.getenv('LOG_RATE_BURST', 10)),
+            window=float(os.getenv('LOG_RATE_WINDOW_SECONDS', 60)),
+            sample_every=int(os.getenv('LOG_SAMPLE_EVERY', 100)),
+        )
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+    with _setup_lock:
+        _stop_listener()
+        handler = LazyQueueHandler(queue_size)
+        # Throttle first so suppressed records cost no context copy
+        handler.addFilter(rate_limit)
+        handler.addFilter(ContextFilter())
+        root = logging.getLogger()
+        for existing in root.handlers[:]:
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level)
+        _handler = handler
+        _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+        _listener.start()
     return logging.getLogger(__name__)
+
+
+def logging_stats() -> Dict:
+    if _handler is None:
+        return {}
+    throttle = next((f for f in _handler.filters if isinstance(f, RateLimitFilter)), None)
+    return {
+        'queued': _handler.queue.qsize(),
+        'dropped': _handler.dropped,
+        'suppressed': throttle.suppressed if throttle else 0,
+    }
+
+
+def flush_logging():
+    """Write everything queued so far (stops and restarts the listener)"""
+    with _setup_lock:
+        if _listener is not None:
+            _stop_listener()
+            _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def _after_fork():
+    # The listener thread does not survive a fork; give the child a fresh
+    # queue (records the parent had not written yet stay with the parent)
+    global _setup_lock
+    _setup_lock = threading.Lock()
+    if _handler is None or _listener is None:
+        return
+    _handler.queue = _listener.queue = queue.SimpleQueue()
+    _listener._thread = None
+    _listener.start()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(_stop_listener)
@@ -1,5 +1,407 @@
-"""Monitoring"""
+"""
+Monitoring
+Low-overhead request and stage metrics (histograms, counters, in-flight
+gauges) in the Prometheus text format, aggregated across worker processes,
+with sampled stack profiles of slow requests
+"""
+
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help); metrics recorded under other names get a generic help
+METRICS = {
+    'bww_http_request_seconds': ('histogram', 'HTTP request latency by endpoint and status'),
+    'bww_http_requests_in_flight': ('gauge', 'HTTP requests being served'),
+    'bww_stage_seconds': ('histogram', 'Latency of pipeline stages'),
+    'bww_stage_in_flight': ('gauge', 'Pipeline stages running'),
+    'bww_chat_messages_total': ('counter', 'Chat messages by intent and channel'),
+    'bww_errors_total': ('counter', 'Errors by component'),
+    'bww_slow_requests_total': ('counter', 'Requests slower than the profiling threshold'),
+    'bww_rate_limited_total': ('counter', 'Requests rejected with 429 by limit scope'),
+    'bww_coalesced_requests_total': ('counter', 'Requests answered by an identical in-flight request'),
+    'bww_order_flows_total': ('counter', 'Chat order flows by outcome'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels) -> Labels:
+    """Sorted, stringified label pairs; hot paths key on the raw pairs"""
+    return tuple(sorted((key, '' if value is None else str(value)) for key, value in labels))
+
+
+class _Timer:
+    """Context manager (and decorator) timing one stage into a histogram"""
+
+    __slots__ = ('monitoring', 'name', 'labels', 'started')
+
+    def __init__(self, monitoring: 'Monitoring', name: str, labels: Labels):
+        self.monitoring = monitoring
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        monitoring = self.monitoring
+        if monitoring._pid != os.getpid():
+            monitoring._start()
+        key = ('bww_stage_in_flight', self.labels)
+        with monitoring._lock:
+            monitoring._gauges[key] = monitoring._gauges.get(key, 0) + 1
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        monitoring = self.monitoring
+        key = ('bww_stage_in_flight', self.labels)
+        with monitoring._lock:
+            monitoring._gauges[key] -= 1
+            monitoring._record(self.name, self.labels, elapsed)
+        return False
+
+    def __call__(self, fn):
+        def timed(*args, **kwargs):
+            with _Timer(self.monitoring, self.name, self.labels):
+                return fn(*args, **kwargs)
+        timed.__name__ = getattr(fn, '__name__', 'timed')
+        timed.__doc__ = getattr(fn, '__doc__', None)
+        return timed
+
 
 class Monitoring:
+    """
+    Metrics registry for one process.
+
+    Updates are plain in-memory increments under a lock. With
+    ``directory`` set, a background thread writes this process's values to
+    ``<directory>/<pid>.json`` every ``snapshot_interval`` seconds and
+    ``render()`` sums every worker's file, so any gunicorn worker can
+    answer ``/metrics`` for all of them. Counters and histograms of exited
+    workers are kept (Prometheus counters must not go down); their gauges
+    are dropped. Clear the directory when deploying.
+
+    With ``slow_ms`` set, a watchdog thread samples the Python stack of
+    every request that has been running longer than ``slow_ms`` (for a
+    ``profile_rate`` fraction of requests), so fast requests cost nothing;
+    the folded stacks of slow requests are kept in ``slow_requests`` and
+    written to ``profile_dir``.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        snapshot_interval: float = 1.0,
+        slow_ms: float = 0.0,
+        profile_rate: float = 1.0,
+        sample_interval: float = 0.005,
+        profile_dir: Optional[str] = None,
+        max_profiles: int = 50,
+    ):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.slow_ms = slow_ms
+        self.profile_rate = profile_rate
+        self.sample_interval = sample_interval
+        self.profile_dir = profile_dir
+        self.slow_requests = deque(maxlen=max_profiles)
+
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self._active: Dict[int, List] = {}
+        self._requests = 0
+        self._pid = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    # Recording ------------------------------------------------------------
+
+    def stage(self, name: str, **labels) -> _Timer:
+        """``with monitoring.stage('nlp'):`` or ``@monitoring.stage('nlp')``"""
+        labels['stage'] = name
+        return _Timer(self, 'bww_stage_seconds', tuple(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(labels.items()))] = value
+
+    def add_gauge(self, name: str, delta: float, **labels):
+        self._gauge_add(name, tuple(labels.items()), delta)
+
+    def observe(self, name: str, seconds: float, **labels):
+        with self._lock:
+            self._record(name, tuple(labels.items()), seconds)
+
     def log_error(self, component, error):
-        pass
+        """Count an error (callers log the message themselves)"""
+        self.inc('bww_errors_total', component=component)
+
+    def _record(self, name: str, labels: Labels, seconds: float):
+        # Caller holds the lock
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+        histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def _gauge_add(self, name: str, labels: Labels, delta: float):
+        key = (name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    # Requests -------------------------------------------------------------
+
+    def request_started(self, endpoint: str):
+        """Start timing a request on this thread; pass the result to ``request_finished``"""
+        if self._pid != os.getpid():
+            self._start()
+        self._gauge_add('bww_http_requests_in_flight', (('endpoint', endpoint),), 1)
+        thread_id = threading.get_ident()
+        started = time.perf_counter()
+        self._requests += 1
+        # Every n-th request is eligible for profiling
+        profiled = (self.slow_ms > 0 and self.profile_rate > 0
+                    and self._requests % max(1, round(1 / self.profile_rate)) == 0)
+        entry = [endpoint, started, Counter() if profiled else None]
+        if thread_id not in self._active:
+            self._active[thread_id] = entry
+        return thread_id, entry
+
+    def request_finished(self, token, status: int = 200):
+        thread_id, (endpoint, started, stacks) = token
+        elapsed = time.perf_counter() - started
+        if self._active.get(thread_id) is token[1]:
+            del self._active[thread_id]
+        with self._lock:
+            self._gauges[('bww_http_requests_in_flight', (('endpoint', endpoint),))] -= 1
+            self._record('bww_http_request_seconds', (('endpoint', endpoint), ('status', status)), elapsed)
+        if self.slow_ms and elapsed * 1000 >= self.slow_ms:
+            self.inc('bww_slow_requests_total', endpoint=endpoint)
+            if stacks:
+                self._save_profile(endpoint, elapsed, stacks)
+
+    def _save_profile(self, endpoint: str, elapsed: float, stacks: Counter):
+        profile = {
+            'endpoint': endpoint,
+            'duration_ms': round(elapsed * 1000, 1),
+            'finished_at': time.time(),
+            'samples': sum(stacks.values()),
+            'stacks': stacks.most_common(20),
+        }
+        self.slow_requests.append(profile)
+        leaf = ';'.join(stacks.most_common(1)[0][0].split(';')[-6:])
+        logger.warning("Slow request %s took %s ms; hottest stack: ...;%s", endpoint, profile['duration_ms'], leaf)
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = f"{int(profile['finished_at'] * 1000)}-{endpoint.replace('/', '_')}-{int(elapsed * 1000)}ms.folded"
+            # Folded stacks, the input format of flamegraph.pl and speedscope
+            with open(os.path.join(self.profile_dir, name), 'w') as f:
+                for stack, count in stacks.items():
+                    f.write(f'{stack} {count}\n')
+
+    def _watchdog(self):
+        threshold = self.slow_ms / 1000
+        while True:
+            time.sleep(self.sample_interval)
+            now = time.perf_counter()
+            slow = [(thread_id, entry[2]) for thread_id, entry in list(self._active.items())
+                    if entry[2] is not None and now - entry[1] >= threshold]
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for thread_id, stacks in slow:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[_fold(frame)] += 1
+
+    # Background threads ---------------------------------------------------
+
+    def _after_fork(self):
+        # Values recorded by the parent belong to its file, its locks may
+        # have been held at fork time and its threads did not survive
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._counters, self._gauges, self._histograms = {}, {}, {}
+        self._active = {}
+        self._pid = None
+
+    def _start(self):
+        pid = os.getpid()
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._snapshot_loop, name='metrics-snapshot', daemon=True).start()
+            atexit.register(self._final_snapshot)
+        if self.slow_ms > 0:
+            threading.Thread(target=self._watchdog, name='slow-request-profiler', daemon=True).start()
+
+    def _snapshot_loop(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            try:
+                self._write_snapshot()
+            except OSError:
+                logger.exception("Writing metrics snapshot failed")
+
+    def _final_snapshot(self):
+        try:
+            self._write_snapshot()
+        except OSError:
+            pass
+
+    def _write_snapshot(self):
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.replace(tmp, path)
+
+    def _snapshot(self) -> Dict:
+        with self._lock:
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+            histograms = [(key, list(values)) for key, values in self._histograms.items()]
+        return {
+            'pid': os.getpid(),
+            'counters': [[name, _labels(labels), value] for (name, labels), value in counters],
+            'gauges': [[name, _labels(labels), value] for (name, labels), value in gauges],
+            'histograms': [[name, _labels(labels), values] for (name, labels), values in histograms],
+        }
+
+    # Exposition -----------------------------------------------------------
+
+    def collect(self) -> Dict:
+        """Values of this process plus, with a directory, every other worker's"""
+        if self._pid != os.getpid():
+            self._start()
+        snapshots = [self._snapshot()]
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                pid = int(os.path.basename(path).split('.')[0])
+                if pid == os.getpid():
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if not _alive(pid):
+                    snapshot['gauges'] = []
+                snapshots.append(snapshot)
+
+        merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+        for snapshot in snapshots:
+            for kind in ('counters', 'gauges'):
+                for name, labels, value in snapshot[kind]:
+                    key = (name, tuple(map(tuple, labels)))
+                    merged[kind][key] = merged[kind].get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = merged['histograms'].setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+        return merged
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        merged = self.collect()
+        families: Dict[str, List[str]] = {}
+
+        for kind in ('counters', 'gauges'):
+            for (name, labels), value in sorted(merged[kind].items()):
+                families.setdefault(name, []).append(f'{name}{_format_labels(labels)} {_number(value)}')
+
+        for (name, labels), values in sorted(merged['histograms'].items()):
+            lines = families.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), values[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {_number(cumulative)}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {values[-1]!r}')
+            lines.append(f'{name}_count{_format_labels(labels)} {_number(cumulative)}')
+
+        out = []
+        for name in sorted(families):
+            kind, help_text = METRICS.get(name, (_guess_type(name, merged), name.replace('_', ' ')))
+            out.append(f'# HELP {name} {help_text}')
+            out.append(f'# TYPE {name} {kind}')
+            out.extend(families[name])
+        return '\n'.join(out) + '\n'
+
+
+def _fold(frame) -> str:
+    """``file:function`` frames from the outermost call, separated by ';'"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        f'{key}="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _guess_type(name: str, merged: Dict) -> str:
+    if any(key[0] == name for key in merged['histograms']):
+        return 'histogram'
+    if any(key[0] == name for key in merged['gauges']):
+        return 'gauge'
+    return 'counter'
+
+
+def monitoring_from_env() -> Monitoring:
+    """Monitoring configured by the MONITORING_* variables"""
+    return Monitoring(
+        directory=os.getenv('MONITORING_DIR') or None,
+        snapshot_interval=float(os.getenv('MONITORING_SNAPSHOT_SECONDS', 1.0)),
+        slow_ms=float(os.getenv('MONITORING_SLOW_REQUEST_MS', 0)),
+        profile_rate=float(os.getenv('MONITORING_PROFILE_RATE', 1.0)),
+        profile_dir=os.getenv('MONITORING_PROFILE_DIR') or None,
+    )
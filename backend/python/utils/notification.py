@@ -1,5 +1,493 @@
-"""Notification Service"""
+"""
+Notification Service
+Asynchronous, rate-limited dispatcher for WhatsApp, Messenger and SMS
+messages with per-channel connection pools, provider batching and retries
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# (ok, provider message id or error, retryable, retry-after seconds)
+Outcome = Tuple[bool, Optional[str], bool, Optional[float]]
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+FINAL_STATUSES = ('sent', 'failed')
+
+
+class DeliveryError(Exception):
+    """A message that was not sent: failed for good, or still pending at the timeout"""
+
+    def __init__(self, message_id: str, record: Optional[Dict]):
+        self.message_id = message_id
+        self.record = record
+        status = record['status'] if record else 'unknown'
+        error = record.get('error') if record else None
+        super().__init__(f"Notification {message_id} {status}: {error}")
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``burst``; asyncio only"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate / 10)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    async def acquire(self, count: int = 1):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # A batch larger than the burst waits for the burst and overdraws
+            need = min(count, self.burst)
+            if self.tokens >= need:
+                self.tokens -= count
+                return
+            await asyncio.sleep((need - self.tokens) / self.rate)
+
+    def penalize(self, seconds: float):
+        """The provider asked us to back off: stop issuing tokens for a while"""
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class Provider:
+    """
+    One channel's API. ``build`` turns a batch of messages into one HTTP
+    request and ``outcomes`` maps the response back to one ``Outcome`` per
+    message. ``max_batch`` > 1 means the API accepts several messages per
+    call; ``rate`` is messages per second.
+    """
+
+    channel = ''
+    max_batch = 1
+
+    def __init__(self, base_url: str, rate: float, burst: Optional[float] = None,
+                 concurrency: int = 10, timeout: float = 10.0):
+        self.base_url = base_url.rstrip('/')
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def build(self, batch: List[Dict]) -> Dict:
+        raise NotImplementedError
+
+    def outcomes(self, response: httpx.Response, batch: List[Dict]) -> List[Outcome]:
+        """Default for single-message APIs: the HTTP status decides"""
+        if response.is_success:
+            try:
+                message_id = self.message_id(response)
+            except ValueError:
+                message_id = None
+            return [(True, message_id, False, None)]
+        retryable = response.status_code in RETRYABLE_STATUS
+        return [(False, f'HTTP {response.status_code}: {response.text[:200]}', retryable, _retry_after(response))]
+
+    def message_id(self, response: httpx.Response) -> Optional[str]:
+        return None
+
+
+class WhatsAppProvider(Provider):
+    """WhatsApp Cloud API; one message per call"""
+
+    channel = 'whatsapp'
+
+    def __init__(self, phone_number_id: str, access_token: str,
+                 base_url: str = 'https://graph.facebook.com/v18.0', rate: float = 80, **kwargs):
+        super().__init__(base_url, rate, **kwargs)
+        self.phone_number_id = phone_number_id
+        self.access_token = access_token
+
+    def build(self, batch):
+        message = batch[0]
+        return {
+            'method': 'POST',
+            'url': f'/{self.phone_number_id}/messages',
+            'headers': {'Authorization': f'Bearer {self.access_token}'},
+            'json': {
+                'messaging_product': 'whatsapp',
+                'to': message['recipient'],
+                'type': 'text',
+                'text': {'body': message['text']},
+            },
+        }
+
+    def message_id(self, response):
+        return ((response.json().get('messages') or [{}])[0]).get('id')
+
+
+class MessengerProvider(Provider):
+    """
+    Messenger Send API, coalesced into Graph API batch requests of up to 50.
+    Replies go out as ``RESPONSE`` messages; messages queued with
+    ``update=True`` (proactive order updates, which may fall outside the
+    24-hour window) carry the ``MESSAGE_TAG`` ``tag``.
+    """
+
+    channel = 'messenger'
+    max_batch = 50
+
+    def __init__(self, page_access_token: str, base_url: str = 'https://graph.facebook.com/v18.0',
+                 rate: float = 40, tag: str = 'POST_PURCHASE_UPDATE', **kwargs):
+        super().__init__(base_url, rate, **kwargs)
+        self.page_access_token = page_access_token
+        self.tag = tag
+
+    def build(self, batch):
+        requests = [
+            {
+                'method': 'POST',
+                'relative_url': 'me/messages',
+                'body': urlencode({
+                    'recipient': json.dumps({'id': message['recipient']}),
+                    'message': json.dumps({'text': message['text']}, ensure_ascii=False),
+                    **({'messaging_type': 'MESSAGE_TAG', 'tag': self.tag} if message.get('update')
+                       else {'messaging_type': 'RESPONSE'}),
+                }),
+            }
+            for message in batch
+        ]
+        return {
+            'method': 'POST',
+            'url': '/',
+            'data': {'access_token': self.page_access_token, 'batch': json.dumps(requests)},
+        }
+
+    def outcomes(self, response, batch):
+        if not response.is_success:
+            return super().outcomes(response, batch) * len(batch)
+        results = []
+        for item in response.json():
+            code = (item or {}).get('code', 500)
+            body = (item or {}).get('body') or '{}'
+            if 200 <= code < 300:
+                results.append((True, json.loads(body).get('message_id'), False, None))
+            else:
+                results.append((False, f'HTTP {code}: {body[:200]}', code in RETRYABLE_STATUS, None))
+        return results
+
+
+class TwilioSMSProvider(Provider):
+    """Twilio Programmable Messaging; one message per call"""
+
+    channel = 'sms'
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str,
+                 base_url: str = 'https://api.twilio.com', rate: float = 10, **kwargs):
+        super().__init__(base_url, rate, **kwargs)
+        self.account_sid = account_sid
+        self.auth = (account_sid, auth_token)
+        self.from_number = from_number
+
+    def build(self, batch):
+        message = batch[0]
+        return {
+            'method': 'POST',
+            'url': f'/2010-04-01/Accounts/{self.account_sid}/Messages.json',
+            'auth': self.auth,
+            'data': {'To': message['recipient'], 'From': self.from_number, 'Body': message['text']},
+        }
+
+    def message_id(self, response):
+        return response.json().get('sid')
+
 
 class NotificationService:
-    def send(self, message, recipient):
-        pass
+    """
+    Sends messages without blocking the caller.
+
+    ``send`` and ``send_many`` queue messages and return their IDs. An
+    event loop on a background thread (started lazily in each process)
+    runs one worker per channel: it coalesces queued messages into batches
+    of up to the provider's ``max_batch``, waits on the provider's token
+    bucket and sends over that channel's pooled ``httpx.AsyncClient``
+    with at most ``concurrency`` requests in flight. Transport errors,
+    429s and 5xx responses are retried with full-jitter exponential
+    backoff (and the provider's Retry-After); other failures are final.
+
+    ``delivery`` and ``wait`` report each message's status (queued, sent,
+    failed), attempts and provider message ID; ``confirm`` waits for one
+    message and raises ``DeliveryError`` unless it was sent.
+    """
+
+    def __init__(
+        self,
+        providers: Iterable[Provider] = (),
+        max_attempts: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        linger: float = 0.005,
+        max_records: int = 100_000,
+        monitoring=None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.providers: Dict[str, Provider] = {provider.channel: provider for provider in providers}
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.linger = linger
+        self.max_records = max_records
+        self.monitoring = monitoring
+        self.transport = transport
+
+        self._records: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._done = threading.Condition()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._pid = None
+        self._ids = itertools.count()
+        self._prefix = uuid.uuid4().hex[:8]
+
+        self.counts = {'queued': 0, 'sent': 0, 'failed': 0, 'retries': 0, 'requests': 0}
+
+    # Producer side --------------------------------------------------------
+
+    def send(self, message: str, recipient: str, channel: Optional[str] = None, **extra) -> str:
+        """
+        Queue one message and return its ID. ``recipient`` may carry the
+        channel as a prefix, like the chat user IDs: ``whatsapp:2010...``.
+        """
+        return self.send_many([dict(extra, text=message, recipient=recipient, channel=channel)])[0]
+
+    def send_many(self, messages: Iterable[Dict]) -> List[str]:
+        """Queue ``{'text', 'recipient', 'channel'}`` dicts; returns their IDs"""
+        self._start()
+        # Validate the whole batch first: a record remembered but never
+        # enqueued would stay 'queued' and block eviction for good
+        routed = []
+        for message in messages:
+            channel, recipient = message.get('channel'), str(message['recipient'])
+            if channel is None and ':' in recipient:
+                channel, recipient = recipient.split(':', 1)
+            if channel == 'facebook':
+                channel = 'messenger'
+            if channel not in self.providers:
+                raise ValueError(f"No notification provider for channel {channel!r}")
+            routed.append((message, channel, recipient))
+
+        by_channel: Dict[str, List[Dict]] = {}
+        ids = []
+        now = time.time()
+        with self._done:
+            for message, channel, recipient in routed:
+                record = dict(
+                    message,
+                    id=f'{self._prefix}-{next(self._ids)}',
+                    channel=channel,
+                    recipient=recipient,
+                    status='queued',
+                    attempts=0,
+                    provider_id=None,
+                    error=None,
+                    queued_at=now,
+                    finished_at=None,
+                )
+                self._remember(record)
+                by_channel.setdefault(channel, []).append(record)
+                ids.append(record['id'])
+            self.counts['queued'] += len(ids)
+        for channel, records in by_channel.items():
+            self._loop.call_soon_threadsafe(self._enqueue, channel, records)
+        return ids
+
+    def supports(self, channel: str) -> bool:
+        return channel in self.providers
+
+    def delivery(self, message_id: str) -> Optional[Dict]:
+        with self._done:
+            record = self._records.get(message_id)
+            return _public(record) if record else None
+
+    def wait(self, message_ids: Iterable[str], timeout: Optional[float] = None) -> Dict[str, Dict]:
+        """Block until the messages are sent or failed (or ``timeout``)"""
+        ids = list(message_ids)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._done:
+            while True:
+                pending = [i for i in ids if i in self._records and self._records[i]['status'] not in FINAL_STATUSES]
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not pending or (remaining is not None and remaining <= 0):
+                    break
+                self._done.wait(remaining)
+            return {i: _public(self._records[i]) for i in ids if i in self._records}
+
+    def confirm(self, message_id: str, timeout: Optional[float] = None) -> Dict:
+        """Block until the message is sent; raises DeliveryError if it failed or is still pending"""
+        record = self.wait([message_id], timeout=timeout).get(message_id)
+        if record is None or record['status'] != 'sent':
+            raise DeliveryError(message_id, record)
+        return record
+
+    def stats(self) -> Dict:
+        with self._done:
+            queued = {channel: queue.qsize() for channel, queue in self._queues.items()}
+            return dict(self.counts, backlog=queued, channels=sorted(self.providers))
+
+    def _remember(self, record: Dict):
+        self._records[record['id']] = record
+        # Forget the oldest finished deliveries beyond max_records
+        while len(self._records) > self.max_records:
+            oldest = next(iter(self._records.values()))
+            if oldest['status'] not in FINAL_STATUSES:
+                break
+            self._records.popitem(last=False)
+
+    # Event loop -----------------------------------------------------------
+
+    def _start(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            # After a fork the parent's loop thread and sockets are not ours
+            self._loop = asyncio.new_event_loop()
+            self._queues, self._buckets, self._clients = {}, {}, {}
+            ready = threading.Event()
+            threading.Thread(target=self._run_loop, args=(ready,), name='notification-dispatcher', daemon=True).start()
+            ready.wait()
+            self._pid = pid
+
+    def _run_loop(self, ready: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        for channel, provider in self.providers.items():
+            self._queues[channel] = asyncio.Queue()
+            limits = httpx.Limits(max_connections=provider.concurrency,
+                                  max_keepalive_connections=provider.concurrency)
+            self._clients[channel] = httpx.AsyncClient(
+                base_url=provider.base_url, limits=limits, timeout=provider.timeout, transport=self.transport,
+            )
+            self._loop.create_task(self._channel_worker(provider))
+        ready.set()
+        self._loop.run_forever()
+
+    def _enqueue(self, channel: str, records: List[Dict]):
+        queue = self._queues[channel]
+        for record in records:
+            queue.put_nowait(record)
+
+    async def _channel_worker(self, provider: Provider):
+        queue = self._queues[provider.channel]
+        bucket = self._buckets[provider.channel] = TokenBucket(provider.rate, provider.burst)
+        slots = asyncio.Semaphore(provider.concurrency)
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.linger
+            while len(batch) < provider.max_batch:
+                try:
+                    batch.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+            await bucket.acquire(len(batch))
+            await slots.acquire()
+            task = loop.create_task(self._deliver(provider, batch))
+            task.add_done_callback(lambda _: slots.release())
+
+    async def _deliver(self, provider: Provider, batch: List[Dict]):
+        self.counts['requests'] += 1
+        try:
+            response = await self._clients[provider.channel].request(**provider.build(batch))
+            outcomes = provider.outcomes(response, batch)
+        except httpx.HTTPError as e:
+            outcomes = [(False, f'{type(e).__name__}: {e}', True, None)] * len(batch)
+        except Exception as e:
+            logger.exception("Notification provider %s failed", provider.channel)
+            outcomes = [(False, f'{type(e).__name__}: {e}', False, None)] * len(batch)
+
+        now = time.time()
+        retry_after = max((o[3] or 0 for o in outcomes), default=0)
+        if retry_after:
+            self._buckets[provider.channel].penalize(retry_after)
+        finished = []
+        with self._done:
+            for record, (ok, detail, retryable, after) in zip(batch, outcomes):
+                record['attempts'] += 1
+                if ok:
+                    record.update(status='sent', provider_id=detail, error=None, finished_at=now)
+                    finished.append(record)
+                elif retryable and record['attempts'] < self.max_attempts:
+                    record['error'] = detail
+                    self.counts['retries'] += 1
+                    # Full jitter: uniform in [0, min(max, base * 2^attempt)]
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** record['attempts']))
+                    asyncio.get_running_loop().call_later(
+                        max(delay, after or 0), self._queues[provider.channel].put_nowait, record
+                    )
+                else:
+                    record.update(status='failed', error=detail, finished_at=now)
+                    finished.append(record)
+                    logger.warning("Notification %s to %s failed: %s", record['id'], provider.channel, detail)
+            for record in finished:
+                self.counts[record['status']] += 1
+            if finished:
+                self._done.notify_all()
+
+        if self.monitoring is not None:
+            for record in finished:
+                self.monitoring.inc('bww_notifications_total', channel=provider.channel, status=record['status'])
+
+
+def _public(record: Dict) -> Dict:
+    return {key: value for key, value in record.items() if key != 'text'}
+
+
+def notification_service_from_env(monitoring=None) -> NotificationService:
+    """Providers for the channels whose credentials are set"""
+    graph_url = os.getenv('GRAPH_API_URL', 'https://graph.facebook.com/v18.0')
+    concurrency = int(os.getenv('NOTIFY_CONCURRENCY', 10))
+    providers = []
+    if os.getenv('WHATSAPP_ACCESS_TOKEN'):
+        providers.append(WhatsAppProvider(
+            os.getenv('WHATSAPP_PHONE_NUMBER_ID', ''), os.getenv('WHATSAPP_ACCESS_TOKEN'),
+            base_url=graph_url, rate=float(os.getenv('NOTIFY_WHATSAPP_RATE', 80)), concurrency=concurrency,
+        ))
+    if os.getenv('FACEBOOK_PAGE_ACCESS_TOKEN'):
+        providers.append(MessengerProvider(
+            os.getenv('FACEBOOK_PAGE_ACCESS_TOKEN'),
+            base_url=graph_url, rate=float(os.getenv('NOTIFY_MESSENGER_RATE', 40)), concurrency=concurrency,
+        ))
+    if os.getenv('TWILIO_ACCOUNT_SID'):
+        providers.append(TwilioSMSProvider(
+            os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN', ''), os.getenv('TWILIO_PHONE_NUMBER', ''),
+            base_url=os.getenv('TWILIO_API_URL', 'https://api.twilio.com'),
+            rate=float(os.getenv('NOTIFY_SMS_RATE', 10)), concurrency=concurrency,
+        ))
+    return NotificationService(
+        providers,
+        max_attempts=int(os.getenv('NOTIFY_MAX_ATTEMPTS', 5)),
+        monitoring=monitoring,
+    )
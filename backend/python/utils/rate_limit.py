@@ -0,0 +1,298 @@
+"""
+Rate Limiting
+Token-bucket limits per user and per client IP, with an in-process or
+shared Redis store, and single-flight coalescing of identical concurrent
+requests
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (allowed, retry_after seconds, remaining tokens, burst)
+Decision = Tuple[bool, float, int, int]
+
+
+class LocalRateLimitStore:
+    """
+    Token buckets for one process.
+
+    Each bucket is stored as a single number, its theoretical arrival time
+    (GCRA): a request is allowed when it would land no more than
+    ``burst / rate`` seconds ahead of now, which is exactly a bucket of
+    ``burst`` tokens refilled at ``rate`` per second. Keys are kept in LRU
+    order and capped at ``max_keys``; dropping an idle key loses nothing,
+    since an idle bucket is a full one.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._tats: 'OrderedDict[str, float]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+    def hit(self, key: str, rate: float, burst: int) -> Decision:
+        interval = 1.0 / rate
+        window = burst * interval
+        now = time.monotonic()
+        with self._lock:
+            tat = max(self._tats.get(key, now), now) + interval
+            ahead = tat - now
+            if ahead > window:
+                return False, ahead - window, 0, burst
+            self._tats[key] = tat
+            self._tats.move_to_end(key)
+            if len(self._tats) > self.max_keys:
+                self._tats.popitem(last=False)
+        return True, 0.0, int((window - ahead) / interval), burst
+
+
+class RedisRateLimitStore:
+    """
+    Token buckets shared by every worker through Redis.
+
+    The same GCRA arrival time is kept as integer milliseconds and advanced
+    with INCRBY, which is atomic, so concurrent workers never hand out the
+    same token; a rejected request gives its increment back. An idle
+    bucket's stale time is reset with a plain SET, where two racing workers
+    can each let one extra request through.
+    """
+
+    def __init__(self, client, prefix: str = 'ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*'))
+
+    def hit(self, key: str, rate: float, burst: int) -> Decision:
+        key = self.prefix + key
+        interval = max(1, int(1000 / rate))
+        window = burst * interval
+        now = int(time.time() * 1000)
+        expire = max(1, math.ceil(window / 1000))
+        pipe = self.client.pipeline(transaction=False)
+        pipe.incr(key, interval)
+        pipe.expire(key, expire)
+        tat = int(pipe.execute()[0])
+        if tat < now + interval:
+            tat = now + interval
+            self.client.set(key, tat, ex=expire)
+        ahead = tat - now
+        if ahead > window:
+            self.client.incr(key, -interval)
+            return False, (ahead - window) / 1000, 0, burst
+        return True, 0.0, (window - ahead) // interval, burst
+
+
+class RateLimiter:
+    """
+    Per-IP and per-user token buckets for the API.
+
+    ``check`` charges the client's IP bucket first and then, when the
+    request names a user, that user's bucket, so one abusive client is
+    throttled however many user IDs it makes up, and one noisy user is
+    throttled behind a shared NAT without starving the other users there.
+    Paths in ``exempt`` (health, metrics, the Meta webhooks, whose requests
+    all come from Meta's servers, and the signed order events feed) are
+    never limited; the integrations limit webhook senders with
+    ``allow_user`` instead, after dropping redelivered messages.
+    """
+
+    def __init__(
+        self,
+        store=None,
+        user_rate: float = 2.0,
+        user_burst: int = 20,
+        ip_rate: float = 20.0,
+        ip_burst: int = 100,
+        exempt: Iterable[str] = (
+            '/', '/metrics', '/api/webhook/facebook', '/api/webhook/whatsapp', '/api/orders/events',
+        ),
+        trust_proxy: bool = False,
+        proxy_hops: int = 1,
+        enabled: bool = True,
+        monitoring=None,
+    ):
+        self.store = store or LocalRateLimitStore()
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.exempt = frozenset(exempt)
+        self.trust_proxy = trust_proxy
+        self.proxy_hops = max(1, proxy_hops)
+        self.enabled = enabled
+        self.monitoring = monitoring
+        self._counts = {'allowed': 0, 'limited_ip': 0, 'limited_user': 0, 'store_errors': 0}
+
+    def applies(self, path: str) -> bool:
+        return self.enabled and path not in self.exempt
+
+    def client_ip(self, remote_addr: Optional[str], forwarded_for: Optional[str] = None,
+                  real_ip: Optional[str] = None) -> str:
+        """
+        The client address. Behind ``proxy_hops`` trusted proxies it is the
+        X-Forwarded-For entry the outermost one appended (entries before it
+        are whatever the client sent), else the proxy's X-Real-IP.
+        """
+        if self.trust_proxy:
+            hops = [hop.strip() for hop in (forwarded_for or '').split(',') if hop.strip()]
+            if hops:
+                return hops[-min(self.proxy_hops, len(hops))]
+            if real_ip:
+                return real_ip.strip()
+        return remote_addr or 'unknown'
+
+    def check(self, user_id: Optional[str], ip: str) -> Decision:
+        """Charge one request to ``ip`` and ``user_id``; the tighter result wins"""
+        decision = self._hit('ip:' + ip, self.ip_rate, self.ip_burst, 'ip')
+        if decision[0] and user_id:
+            user = self._hit('user:' + str(user_id), self.user_rate, self.user_burst, 'user')
+            if not user[0] or user[2] < decision[2]:
+                decision = user
+        if decision[0]:
+            self._counts['allowed'] += 1
+        return decision
+
+    def allow_user(self, user_id: str) -> bool:
+        """Charge one message to a user (webhook senders, which have no client IP)"""
+        if not self.enabled:
+            return True
+        return self._hit('user:' + str(user_id), self.user_rate, self.user_burst, 'user')[0]
+
+    def _hit(self, key: str, rate: float, burst: int, scope: str) -> Decision:
+        try:
+            decision = self.store.hit(key, rate, burst)
+        except Exception as e:
+            # A store outage must not take the API down with it: fail open
+            self._counts['store_errors'] += 1
+            logger.warning("Rate limit store unavailable: %s", e)
+            return True, 0.0, burst, burst
+        if not decision[0]:
+            self._counts['limited_' + scope] += 1
+            if self.monitoring is not None:
+                self.monitoring.inc('bww_rate_limited_total', scope=scope)
+        return decision
+
+    def stats(self) -> Dict:
+        return {
+            'store': type(self.store).__name__,
+            'keys': len(self.store),
+            'user_limit': f'{self.user_rate:g}/s, burst {self.user_burst}',
+            'ip_limit': f'{self.ip_rate:g}/s, burst {self.ip_burst}',
+            **self._counts,
+        }
+
+
+def retry_after_header(retry_after: float) -> str:
+    """Retry-After takes whole seconds; round up so clients never retry early"""
+    return str(max(1, math.ceil(retry_after)))
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls.
+
+    The first caller for a key runs ``fn``; callers arriving while it runs
+    wait for and share its result (or exception) instead of repeating the
+    work. Nothing is cached: once the call returns, the next caller runs
+    ``fn`` again. A follower that waits longer than ``timeout`` runs ``fn``
+    itself rather than hang on a stuck leader.
+    """
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                self.timeouts += 1
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict:
+        calls = self.leaders + self.shared
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'shared': self.shared,
+            'shared_rate': self.shared / calls if calls else 0.0,
+            'timeouts': self.timeouts,
+        }
+
+
+def rate_limiter_from_env(monitoring=None, client=None) -> RateLimiter:
+    """
+    Build the limiter configured by the RATE_LIMIT_* variables.
+
+    ``RATE_LIMIT_STORE=redis`` shares buckets across workers through
+    ``REDIS_URL``; the default ``local`` keeps them per process, so each of
+    N workers allows up to N times the configured rate.
+    """
+    store = None
+    if client is not None or os.getenv('RATE_LIMIT_STORE', 'local') == 'redis':
+        if client is None:
+            import redis
+            from utils.config import Config
+            client = redis.Redis.from_url(Config.REDIS_URL)
+        store = RedisRateLimitStore(client)
+    else:
+        store = LocalRateLimitStore(max_keys=int(os.getenv('RATE_LIMIT_MAX_KEYS', 100_000)))
+
+    return RateLimiter(
+        store=store,
+        user_rate=float(os.getenv('RATE_LIMIT_USER_RATE', 2)),
+        user_burst=int(os.getenv('RATE_LIMIT_USER_BURST', 20)),
+        ip_rate=float(os.getenv('RATE_LIMIT_IP_RATE', 20)),
+        ip_burst=int(os.getenv('RATE_LIMIT_IP_BURST', 100)),
+        trust_proxy=os.getenv('RATE_LIMIT_TRUST_PROXY', 'false').lower() == 'true',
+        proxy_hops=int(os.getenv('RATE_LIMIT_PROXY_HOPS', 1)),
+        enabled=os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true',
+        monitoring=monitoring,
+    )
@@ -0,0 +1,120 @@
+"""
+Service Registry
+Lazy, on-first-use construction of API services with optional pre-fork warmup
+"""
+
+import gc
+import importlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+
+Factory = Union[str, Callable[[], Any]]
+
+
+class ServiceRegistry:
+    """
+    Registry of named services built on first use.
+
+    A factory is either a callable or a ``'module.path:ClassName'`` string;
+    string factories defer the module import itself until the service is
+    first requested, so heavy dependencies stay out of worker startup.
+
+    For gunicorn ``--preload``, call ``warmup()`` in the master process:
+    every service is built (and its own ``warmup()`` hook, if any, run to
+    load model weights) once before fork, and the workers share those pages
+    copy-on-write. ``timings`` records import time, construction time and
+    RSS growth per service either way.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Factory] = {}
+        self._instances: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def register(self, name: str, factory: Factory):
+        """Register a service factory under ``name``"""
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """Return the service, building it on first use"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            # Another thread may have built it while we waited
+            instance = self._instances.get(name)
+            if instance is None:
+                instance = self._instances[name] = self._build(name)
+            return instance
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    @property
+    def names(self):
+        return list(self._factories)
+
+    def warmup(self, names: Optional[Iterable[str]] = None, freeze: bool = True) -> Dict[str, Dict[str, float]]:
+        """
+        Build services eagerly (all of them by default).
+
+        With ``freeze`` the surviving objects are moved to the permanent GC
+        generation, so garbage collections in forked workers do not touch
+        (and copy) the pages holding them.
+        """
+        for name in names if names is not None else self.names:
+            service = self.get(name)
+            hook = getattr(service, 'warmup', None)
+            if callable(hook):
+                start = time.perf_counter()
+                hook()
+                self.timings[name]['warmup_seconds'] = time.perf_counter() - start
+        if freeze:
+            gc.collect()
+            gc.freeze()
+        return self.timings
+
+    def _build(self, name: str) -> Any:
+        factory = self._factories.get(name)
+        if factory is None:
+            raise KeyError(f"Unknown service: {name}")
+
+        rss_before = current_rss()
+        start = time.perf_counter()
+
+        if isinstance(factory, str):
+            factory = import_string(factory)
+        imported = time.perf_counter()
+
+        instance = factory()
+        built = time.perf_counter()
+
+        self.timings[name] = {
+            'import_seconds': imported - start,
+            'init_seconds': built - imported,
+            'rss_delta_bytes': current_rss() - rss_before,
+        }
+        return instance
+
+
+def import_string(path: str) -> Any:
+    """Import and return ``attr`` from a ``'module.path:attr'`` string"""
+    module_path, _, attr = path.partition(':')
+    return getattr(importlib.import_module(module_path), attr)
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (0 if unavailable)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
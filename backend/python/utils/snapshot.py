@@ -0,0 +1,75 @@
+"""
+Snapshot Directories
+Atomic replacement of on-disk snapshots (.npy arrays plus JSON sidecars)
+that other processes may have memory-mapped
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+def save_snapshot(directory: str, write: Callable[[str], None], keep: int = 2) -> str:
+    """
+    Write a snapshot with ``write(path)`` into a fresh directory next to
+    ``directory``, then point ``directory`` (a symlink) at it with one
+    ``os.replace``.
+
+    Files are never rewritten in place, so a process that memory-mapped
+    the previous snapshot keeps reading it intact, and one that opens
+    ``directory`` sees either the old snapshot or the new one, never a
+    half-written file. Workers saving at the same time each write their
+    own directory; the last replace wins. The ``keep`` newest snapshots
+    stay on disk for readers still opening an older one.
+    """
+    directory = os.path.abspath(directory)
+    parent, name = os.path.split(directory)
+    os.makedirs(parent, exist_ok=True)
+    target = tempfile.mkdtemp(prefix=f'{name}.', suffix='.snapshot', dir=parent)
+    try:
+        write(target)
+    except BaseException:
+        shutil.rmtree(target, ignore_errors=True)
+        raise
+
+    link = os.path.join(parent, f'.{name}.{uuid.uuid4().hex}.link')
+    os.symlink(os.path.basename(target), link)
+    if os.path.isdir(directory) and not os.path.islink(directory):
+        # A snapshot written in place by an older version: move it aside
+        # (open memory maps survive the rename and the delete)
+        legacy = f'{target}.legacy'
+        try:
+            os.rename(directory, legacy)
+        except FileNotFoundError:
+            pass  # another worker moved it first
+        else:
+            shutil.rmtree(legacy, ignore_errors=True)
+    os.replace(link, directory)
+    _prune(parent, name, keep, current=target)
+    return target
+
+
+def snapshot_path(directory: str) -> str:
+    """
+    The snapshot ``directory`` points at right now; loaders read every file
+    from here so they never mix two snapshots
+    """
+    return os.path.realpath(directory)
+
+
+def _prune(parent: str, name: str, keep: int, current: str):
+    live = os.path.realpath(os.path.join(parent, name))
+    snapshots = []
+    for entry in os.scandir(parent):
+        if entry.name.startswith(f'{name}.') and entry.name.endswith('.snapshot') and entry.is_dir():
+            snapshots.append((entry.stat().st_mtime, entry.path))
+    snapshots.sort(reverse=True)
+    for _, path in snapshots[max(1, keep):]:
+        if path not in (live, current):
+            shutil.rmtree(path, ignore_errors=True)
+            logger.debug("Removed old snapshot %s", path)